@@ -0,0 +1,529 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+"""Tests for the monthly activity cubes"""
+
+import random
+import re
+import sys
+import unittest
+
+from datetime import datetime, timedelta
+
+if not '..' in sys.path:
+    sys.path.insert(0, '../..')
+
+import MySQLdb
+
+from vizgrimoire.cube.activity_cube import ITSActivityCube, MLSActivityCube, SCMActivityCube
+from vizgrimoire.ITS import ITS
+from vizgrimoire.metrics.its_metrics import Closed, Opened
+from vizgrimoire.metrics.metrics_filter import MetricFilters
+from vizgrimoire.metrics.mls_metrics import EmailsSent
+from vizgrimoire.metrics.query_builder import DSQuery, ITSQuery, MLSQuery, SCMQuery, SCRQuery
+from vizgrimoire.metrics.scm_metrics import Commits, Lines
+from vizgrimoire.metrics.scr_metrics import Submitted
+from utils import FakeConnection, FakeCursor
+
+DB_CUBE_TEST = 'cp_cube_GrimoireLibTests'
+DB_CUBE_SCR_TEST = 'cp_cube_scr_GrimoireLibTests'
+
+
+def fake_query_builder(query_builder, cursor):
+    class FakeQuery(query_builder):
+        def __SetDBChannel__(self, user=None, password=None, database=None,
+                             host="127.0.0.1", port=3306, group=None):
+            return FakeConnection(cursor)
+    return FakeQuery("user", "", "db", "db_identities")
+
+
+def get_cube(cube_class, dbcon):
+    cube = cube_class(dbcon)
+    cube.company = True
+    cube.first_date = datetime(2012, 6, 3)
+    cube.last_date = datetime(2013, 8, 20, 10, 0, 0)
+    DSQuery.activity_cubes = {dbcon.database: cube}
+    return cube
+
+
+class TestCubeQueries(unittest.TestCase):
+
+    def setUp(self):
+        DSQuery.db_conn_pool = {}
+        ITS.set_backend("bugzilla")
+        self.cursor = FakeCursor([("FROM people", ["id"], [])])
+        self.filters = MetricFilters("month", "'2013-01-01'", "'2013-07-01'")
+
+    def tearDown(self):
+        DSQuery.db_conn_pool = {}
+        DSQuery.set_activity_cubes(False)
+
+    def _get_sql(self, metric_class, query_builder, filters, evolutionary = True):
+        dbcon = fake_query_builder(query_builder, self.cursor)
+        self.cube = get_cube(query_builder.activity_cube, dbcon)
+        return metric_class(dbcon, filters)._get_sql(evolutionary)
+
+    def test_global(self):
+        sql = self._get_sql(Commits, SCMQuery, self.filters)
+        self.assertEqual("SELECT YEAR(s.date)*12+MONTH(s.date) AS month, " +
+                         "CONVERT(sum(s.commits),SIGNED) as commits " +
+                         "FROM cube_scm_activity s WHERE s.date>='2013-01-01' AND " +
+                         "s.date<'2013-07-01' AND s.commits IS NOT NULL " +
+                         "GROUP BY  YEAR(s.date),MONTH(s.date) " +
+                         "ORDER BY YEAR(s.date),MONTH(s.date)", sql)
+        sql = self._get_sql(Lines, SCMQuery, self.filters, False)
+        self.assertTrue("sum(s.added_lines) as added_lines" in sql)
+        self.assertTrue("s.removed_lines IS NOT NULL" in sql)
+
+    def test_company(self):
+        self.filters.type_analysis = ["company", "'Org'"]
+        sql = self._get_sql(Commits, SCMQuery, self.filters)
+        self.assertTrue("FROM cube_scm_activity s" in sql)
+        self.assertTrue("db_identities.organizations org" in sql)
+        self.assertTrue("org.id = s.org_id" in sql)
+        self.assertTrue("org.name = 'Org'" in sql)
+        for table in ["pup", "enr", "scmlog"]:
+            self.assertFalse(table in sql)
+
+        # People with several organizations at the same time
+        self.cube.company = False
+        sql = Commits(self.cube.db, self.filters)._get_sql(True)
+        self.assertTrue("scmlog" in sql)
+
+    def test_all_repositories(self):
+        self.filters.type_analysis = ["repository", None]
+        sql = self._get_sql(Opened, ITSQuery, self.filters, False)
+        self.assertTrue("CONVERT(sum(i.opened),SIGNED) as opened FROM " in sql)
+        self.assertTrue("trackers t" in sql)
+        self.assertTrue("i.tracker_id = t.id" in sql)
+        self.assertTrue("ORDER BY opened DESC" in sql)
+
+    def test_not_covered(self):
+        filters = [MetricFilters("week", "'2013-01-01'", "'2013-07-01'"),
+                   MetricFilters("month", "'2013-01-01'", "'2013-07-01'", people_out = ["bot"]),
+                   MetricFilters("month", "'2013-01-01'", "'2013-07-01'", global_filter = ["repository", "'A'"]),
+                   MetricFilters("month", "'2013-01-01'", "'2013-07-01'", ["company,,country", "'A',,'B'"]),
+                   MetricFilters("month", "'2013-01-01'", "'2013-07-01'", ["domain", None]),
+                   # Activity before and after the dates in their months
+                   MetricFilters("month", "'2012-07-15'", "'2013-07-01'"),
+                   MetricFilters("month", "'2013-01-01'", "'2013-08-15'")]
+        for mfilter in filters:
+            self.assertTrue("scmlog" in self._get_sql(Commits, SCMQuery, mfilter))
+
+    def test_months_dates(self):
+        # No activity after enddate
+        mfilter = MetricFilters("month", "'2012-06-03'", "'2013-08-21'")
+        sql = self._get_sql(Commits, SCMQuery, mfilter)
+        self.assertTrue("s.date>='2012-06-01' AND s.date<'2013-09-01'" in sql)
+
+    def test_closed(self):
+        # Tickets closed are counted once for several months
+        self.assertTrue("cube_its_activity" in self._get_sql(Closed, ITSQuery, self.filters))
+        self.assertFalse("cube_its_activity" in self._get_sql(Closed, ITSQuery, self.filters, False))
+        for period in ["quarter", "year"]:
+            mfilter = MetricFilters(period, "'2013-01-01'", "'2013-07-01'")
+            self.assertFalse("cube_its_activity" in self._get_sql(Closed, ITSQuery, mfilter))
+        self.filters.type_analysis = ["company", None]
+        self.assertFalse("cube_its_activity" in self._get_sql(Closed, ITSQuery, self.filters))
+
+        self.filters.type_analysis = None
+        self.filters.closed_condition = "new_value='FIXED'"
+        self.assertFalse("cube_its_activity" in self._get_sql(Closed, ITSQuery, self.filters))
+
+    def test_commits(self):
+        # Revisions in several repositories are one commit
+        self.filters.type_analysis = ["repository", "'repo1'"]
+        sql = self._get_sql(Commits, SCMQuery, self.filters)
+        self.assertTrue("CONVERT(sum(s.commits_by_repository),SIGNED) as commits" in sql)
+        self.filters.type_analysis = ["project", "'p1'"]
+        self.assertEqual(None, self.cube._get_measure("commits", self.filters, True))
+        self.assertEqual("added_lines",
+                         self.cube._get_measure("added_lines", self.filters, True).column)
+
+    def test_sent(self):
+        sql = self._get_sql(EmailsSent, MLSQuery, self.filters)
+        self.assertTrue("CONVERT(sum(m.sent),SIGNED) as sent" in sql)
+        self.filters.type_analysis = ["repository", "'list1'"]
+        sql = self._get_sql(EmailsSent, MLSQuery, self.filters)
+        self.assertTrue("CONVERT(sum(m.sent_by_list),SIGNED) as sent" in sql)
+        self.assertTrue("m.mailing_list_url = 'list1'" in sql)
+
+    def test_no_cubes(self):
+        dbcon = fake_query_builder(SCMQuery, self.cursor)
+        self.assertEqual(None, dbcon.GetSQLCube(["commits"], self.filters, True))
+        self.assertTrue("scmlog" in Commits(dbcon, self.filters)._get_sql(True))
+
+
+class RefreshCursor(FakeCursor):
+    """Cursor with the cube state and the sources ids"""
+
+    def __init__(self):
+        FakeCursor.__init__(self)
+        self.state = {}
+        self.last_ids = {"s.id": 10, "cl.id": 20}
+        self.totals = {"s.id": 10, "cl.id": 20}
+        # month and number of new rows in it
+        self.new_months = []
+        self.checksum = 1
+
+    def execute(self, sql):
+        self.responses = []
+        if sql.startswith("REPLACE INTO cube_state"):
+            (name, value) = re.search("VALUES \('[^']*', '([^']*)', '(.*)'\)$", sql).groups()
+            self.state[name] = value
+        elif sql.startswith("SELECT name, value FROM cube_state"):
+            self.responses = [("", ["name", "value"], self.state.items())]
+        elif sql.startswith("CHECKSUM TABLE"):
+            self.responses = [("", ["Table", "Checksum"], [("pup", self.checksum), ("enr", 2)])]
+        elif "AS overlaps" in sql:
+            self.responses = [("", ["overlaps"], [(0,)])]
+        elif "AS first_date" in sql:
+            self.responses = [("", ["first_date", "last_date"],
+                               [(datetime(2013, 1, 5), datetime(2013, 6, 20))])]
+        elif "AS last_id" in sql:
+            id_field = re.search("MAX\(([^)]+)\)", sql).group(1)
+            self.responses = [("", ["total", "last_id"],
+                               [(self.totals[id_field], self.last_ids[id_field])])]
+        elif "AS month_id, COUNT(*) AS total" in sql:
+            self.responses = [("", ["month_id", "total"], self.new_months)]
+        FakeCursor.execute(self, sql)
+
+
+class TestCubeRefresh(unittest.TestCase):
+
+    def setUp(self):
+        DSQuery.db_conn_pool = {}
+        self.cursor = RefreshCursor()
+        self.dbcon = fake_query_builder(SCMQuery, self.cursor)
+
+    def tearDown(self):
+        DSQuery.db_conn_pool = {}
+
+    def _refresh(self):
+        self.cursor.queries = []
+        return SCMActivityCube(self.dbcon).refresh()
+
+    def _get_queries(self, start):
+        return [q for q in self.cursor.queries if q.startswith(start)]
+
+    def test_incremental(self):
+        self.assertEqual(None, self._refresh())
+        self.assertEqual(1, len(self._get_queries("DROP TABLE IF EXISTS cube_scm_activity")))
+        inserts = self._get_queries("INSERT INTO cube_scm_activity")
+        self.assertEqual(1, len(inserts))
+        self.assertFalse(" IN (" in inserts[0])
+        self.assertEqual("10", self.cursor.state["commits:last_id"])
+        self.assertEqual("20", self.cursor.state["added_lines:last_id"])
+        self.assertEqual("10", self.cursor.state["commits:total"])
+
+        # Nothing new
+        self.assertEqual(0, len(self._refresh()))
+        self.assertEqual([], self._get_queries("INSERT"))
+        self.assertEqual([], self._get_queries("DROP"))
+
+        # New commits in two months
+        self.cursor.last_ids["s.id"] = 12
+        self.cursor.totals["s.id"] = 12
+        self.cursor.new_months = [(24160, 1), (24157, 1)]
+        self.assertEqual([24157, 24160], sorted(self._refresh()))
+        new_rows = [q for q in self.cursor.queries if "AS month_id, COUNT(*)" in q]
+        self.assertTrue("s.id > 10 AND s.id <= 12" in new_rows[0])
+        self.assertEqual(["DELETE FROM cube_scm_activity WHERE month_id IN (24157,24160)"],
+                         self._get_queries("DELETE"))
+        insert = self._get_queries("INSERT INTO cube_scm_activity")[0]
+        # All the measures are computed for the months
+        self.assertEqual(4, insert.count("YEAR(s.author_date)*12+MONTH(s.author_date) IN (24157,24160)"))
+        self.assertEqual("12", self.cursor.state["commits:last_id"])
+
+    def test_removed_rows(self):
+        self._refresh()
+        # Rows of a repository removed, and one new row
+        self.cursor.totals["s.id"] = 7
+        self.cursor.last_ids["s.id"] = 11
+        self.cursor.new_months = [(24160, 1)]
+        self.assertEqual(None, self._refresh())
+        self.assertEqual([], self._get_queries("DROP"))
+        self.assertEqual(["DELETE FROM cube_scm_activity"], self._get_queries("DELETE"))
+        self.assertFalse(" IN (" in self._get_queries("INSERT INTO cube_scm_activity")[0])
+        self.assertEqual("7", self.cursor.state["commits:total"])
+        # Incremental again
+        self.assertEqual(0, len(self._refresh()))
+
+    def test_identities_changed(self):
+        self._refresh()
+        self.cursor.checksum = 5
+        self.assertEqual(None, self._refresh())
+        self.assertEqual(1, len(self._get_queries("DROP TABLE IF EXISTS cube_scm_activity")))
+
+
+def fill_identities(cursor, rnd):
+    """People with uuids, organizations and enrollments without overlaps"""
+    cursor.execute("CREATE TABLE people_uidentities (people_id VARCHAR(64), uuid VARCHAR(128))")
+    cursor.execute("CREATE TABLE organizations (id INT PRIMARY KEY, name VARCHAR(64))")
+    cursor.execute("CREATE TABLE enrollments (id INT AUTO_INCREMENT PRIMARY KEY, " +
+                   "uuid VARCHAR(128), organization_id INT, start DATETIME, end DATETIME)")
+    for (org_id, name) in [(1, "OrgA"), (2, "OrgB"), (3, "OrgC")]:
+        cursor.execute("INSERT INTO organizations VALUES (%i, '%s')" % (org_id, name))
+    for person in range(0, 12):
+        for people_id in [str(person), "e%i@example.com" % person]:
+            cursor.execute("INSERT INTO people_uidentities VALUES ('%s', 'uuid%i')" %
+                           (people_id, person % 8))
+    for uuid in range(0, 6):
+        cursor.execute("INSERT INTO enrollments (uuid, organization_id, start, end) VALUES " +
+                       "('uuid%i', 1, '1900-01-01', '2013-04-01')" % uuid)
+        cursor.execute("INSERT INTO enrollments (uuid, organization_id, start, end) VALUES " +
+                       "('uuid%i', 2, '2013-04-01', '2100-01-01')" % uuid)
+    cursor.execute("INSERT INTO enrollments (uuid, organization_id, start, end) VALUES " +
+                   "('uuid6', 3, '1900-01-01', '2100-01-01')")
+
+
+def fill_projects(cursor):
+    cursor.execute("CREATE TABLE projects (project_id INT, id VARCHAR(32), title VARCHAR(32))")
+    cursor.execute("CREATE TABLE project_repositories (project_id INT, " +
+                   "data_source VARCHAR(32), repository_name VARCHAR(255))")
+    cursor.execute("CREATE TABLE project_children (project_id INT, subproject_id INT)")
+    cursor.execute("INSERT INTO projects VALUES (1, 'p1', 'p1'), (2, 'p2', 'p2')")
+    for (project_id, data_source, name) in [(1, "scm", "uri0"), (1, "scm", "uri1"), (2, "scm", "uri2"),
+                                            (1, "its", "tracker0"), (2, "its", "tracker1"),
+                                            (1, "scr", "review0"), (2, "scr", "review1")]:
+        cursor.execute("INSERT INTO project_repositories VALUES (%i, '%s', '%s')" %
+                       (project_id, data_source, name))
+
+
+def random_date(rnd):
+    """Dates in 2013, and some of them before and after"""
+    start = datetime(2012, 11, 1)
+    return start + timedelta(seconds = rnd.randint(0, 500 * 86400))
+
+
+def add_commits(cursor, rnd, first, ncommits):
+    for commit in range(first, first + ncommits):
+        date = random_date(rnd)
+        message = rnd.choice(["fix", "cvs2svn import", "add"])
+        cursor.execute("INSERT INTO scmlog VALUES (%i, 'rev%i', %i, %i, '%s', '%s', %i, '%s')" %
+                       (commit, commit, rnd.randint(0, 11), rnd.randint(0, 11),
+                        date, date, rnd.randint(0, 2), message))
+        if rnd.random() < 0.9:
+            cursor.execute("INSERT INTO actions (commit_id) VALUES (%i)" % commit)
+            cursor.execute("INSERT INTO actions (commit_id) VALUES (%i)" % commit)
+        if rnd.random() < 0.8:
+            cursor.execute("INSERT INTO commits_lines (commit_id, added, removed) VALUES (%i, %i, %i)" %
+                           (commit, rnd.randint(0, 100), rnd.randint(0, 50)))
+
+
+def fill_scm(cursor, rnd):
+    cursor.execute("CREATE TABLE repositories (id INT PRIMARY KEY, name VARCHAR(64), uri VARCHAR(255))")
+    cursor.execute("CREATE TABLE scmlog (id INT PRIMARY KEY, rev VARCHAR(40), author_id INT, " +
+                   "committer_id INT, author_date DATETIME, date DATETIME, repository_id INT, " +
+                   "message TEXT)")
+    cursor.execute("CREATE TABLE actions (id INT AUTO_INCREMENT PRIMARY KEY, commit_id INT)")
+    cursor.execute("CREATE TABLE commits_lines (id INT AUTO_INCREMENT PRIMARY KEY, " +
+                   "commit_id INT, added INT, removed INT)")
+    for repo in range(0, 3):
+        cursor.execute("INSERT INTO repositories VALUES (%i, 'repo%i', 'uri%i')" % (repo, repo, repo))
+    add_commits(cursor, rnd, 1, 300)
+
+
+def add_issues(cursor, rnd, first, nissues, gerrit = False):
+    change = first * 10
+    for issue in range(first, first + nissues):
+        submitted = random_date(rnd)
+        cursor.execute("INSERT INTO issues VALUES (%i, %i, '%i', %i, '%s', 'NEW')" %
+                       (issue, rnd.randint(0, 1), issue, rnd.randint(0, 11), submitted))
+        if gerrit:
+            cursor.execute("INSERT INTO issues_ext_gerrit VALUES (%i, '%s')" % (issue, submitted))
+        date = submitted
+        for i in range(0, rnd.randint(0, 4)):
+            date += timedelta(seconds = rnd.randint(0, 40 * 86400))
+            if gerrit:
+                field = "Upload"
+                value = rnd.choice(["1", "2"])
+            else:
+                field = "Status"
+                value = rnd.choice(["RESOLVED", "CLOSED", "NEW"])
+            cursor.execute("INSERT INTO changes VALUES (%i, %i, '%s', '%s', '%s', %i, '%s')" %
+                           (change, issue, field, value, value, rnd.randint(0, 11), date))
+            change += 1
+
+
+def create_issues_tables(cursor, trackers):
+    cursor.execute("CREATE TABLE trackers (id INT PRIMARY KEY, url VARCHAR(255))")
+    cursor.execute("CREATE TABLE issues (id INT PRIMARY KEY, tracker_id INT, issue VARCHAR(32), " +
+                   "submitted_by INT, submitted_on DATETIME, status VARCHAR(32))")
+    cursor.execute("CREATE TABLE changes (id INT PRIMARY KEY, issue_id INT, field VARCHAR(32), " +
+                   "old_value VARCHAR(32), new_value VARCHAR(32), changed_by INT, changed_on DATETIME)")
+    for (tracker_id, url) in enumerate(trackers):
+        cursor.execute("INSERT INTO trackers VALUES (%i, '%s')" % (tracker_id, url))
+
+
+def fill_mls(cursor, rnd):
+    cursor.execute("CREATE TABLE mailing_lists (mailing_list_url VARCHAR(255))")
+    cursor.execute("CREATE TABLE messages (message_ID VARCHAR(64), mailing_list_url VARCHAR(255), " +
+                   "first_date DATETIME, is_response_of VARCHAR(64))")
+    cursor.execute("CREATE TABLE messages_people (type_of_recipient VARCHAR(32), " +
+                   "message_id VARCHAR(64), email_address VARCHAR(64))")
+    cursor.execute("INSERT INTO mailing_lists VALUES ('list0'), ('list1')")
+    for message in range(0, 200):
+        date = random_date(rnd)
+        lists = [rnd.choice(["list0", "list1"])]
+        # Sent to both lists
+        if rnd.random() < 0.2: lists = ["list0", "list1"]
+        for url in lists:
+            cursor.execute("INSERT INTO messages VALUES ('<m%i>', '%s', '%s', NULL)" %
+                           (message, url, date))
+        if rnd.random() < 0.9:
+            cursor.execute("INSERT INTO messages_people VALUES ('From', '<m%i>', 'e%i@example.com')" %
+                           (message, rnd.randint(0, 11)))
+
+
+class TestCubeDatabase(unittest.TestCase):
+    """Metrics from the cubes and the raw tables in local fixture databases"""
+
+    @classmethod
+    def setUpClass(cls):
+        try:
+            db = MySQLdb.connect(user='root', passwd='', host='127.0.0.1', port=3306)
+        except MySQLdb.Error:
+            raise unittest.SkipTest("MySQL server not available")
+        cursor = db.cursor()
+        rnd = random.Random(1)
+        for dbname in [DB_CUBE_TEST, DB_CUBE_SCR_TEST]:
+            cursor.execute("DROP DATABASE IF EXISTS " + dbname)
+            cursor.execute("CREATE DATABASE " + dbname + " CHARACTER SET utf8")
+        cursor.execute("USE " + DB_CUBE_TEST)
+        fill_identities(cursor, rnd)
+        fill_projects(cursor)
+        fill_scm(cursor, rnd)
+        create_issues_tables(cursor, ["tracker0", "tracker1"])
+        add_issues(cursor, rnd, 1, 150)
+        fill_mls(cursor, rnd)
+
+        cursor.execute("USE " + DB_CUBE_SCR_TEST)
+        cursor.execute("CREATE TABLE people_uidentities SELECT * FROM %s.people_uidentities" % DB_CUBE_TEST)
+        create_issues_tables(cursor, ["review0", "review1"])
+        cursor.execute("CREATE TABLE issues_ext_gerrit (issue_id INT, mod_date DATETIME)")
+        add_issues(cursor, rnd, 1, 150, True)
+        db.commit()
+        db.close()
+        ITS.set_backend("bugzilla")
+
+    @classmethod
+    def tearDownClass(cls):
+        DSQuery.db_conn_pool = {}
+        DSQuery.set_activity_cubes(False)
+        dbcon = SCMQuery("root", "", DB_CUBE_TEST, DB_CUBE_TEST)
+        dbcon.ExecuteQuery("DROP DATABASE " + DB_CUBE_SCR_TEST)
+        dbcon.ExecuteQuery("DROP DATABASE " + DB_CUBE_TEST)
+        DSQuery.db_conn_pool = {}
+
+    def setUp(self):
+        DSQuery.db_conn_pool = {}
+        DSQuery.set_activity_cubes(False)
+
+    def tearDown(self):
+        DSQuery.db_conn_pool = {}
+        DSQuery.set_activity_cubes(False)
+
+    def _get_dbcon(self, query_builder, cube):
+        DSQuery.set_activity_cubes(cube)
+        database = DB_CUBE_TEST
+        if query_builder == SCRQuery: database = DB_CUBE_SCR_TEST
+        return query_builder("root", "", database, DB_CUBE_TEST, DB_CUBE_TEST)
+
+    def _get_values(self, metric_class, query_builder, mfilter, cube):
+        dbcon = self._get_dbcon(query_builder, cube)
+        metric = metric_class(dbcon, mfilter)
+        cube_sql = metric._get_sql(True)
+        if cube:
+            self.assertTrue(DSQuery.activity_cubes[dbcon.database] is not None)
+            self.assertTrue("cube_" in cube_sql)
+        return (metric.get_ts(), metric.get_agg())
+
+    def _check(self, metric_class, query_builder, type_analysis, cube_agg = True):
+        for (startdate, enddate) in [("'2013-01-01'", "'2014-01-01'"),
+                                     ("'2012-01-01'", "'2020-05-17'")]:
+            for period in ["month", "year"]:
+                mfilter = MetricFilters(period, startdate, enddate, type_analysis)
+                expected = self._get_values(metric_class, query_builder, mfilter, False)
+                values = self._get_values(metric_class, query_builder, mfilter, True)
+                self.assertEqual(expected, values)
+
+    def _check_filters(self, metric_class, query_builder, repository, company, project = True):
+        self._check(metric_class, query_builder, None)
+        self._check(metric_class, query_builder, ["repository", repository])
+        self._check(metric_class, query_builder, ["repository", None])
+        if company:
+            self._check(metric_class, query_builder, ["company", company])
+            self._check(metric_class, query_builder, ["company", None])
+        if project:
+            self._check(metric_class, query_builder, ["project", "'p1'"])
+            self._check(metric_class, query_builder, ["project", None])
+
+    def test_scm(self):
+        self._check_filters(Commits, SCMQuery, "'repo0'", "'OrgA'", False)
+        self._check_filters(Lines, SCMQuery, "'repo1'", "'OrgB'")
+
+        # New commits in the months already in the cube and in new months
+        db = MySQLdb.connect(user='root', passwd='', host='127.0.0.1', port=3306, db=DB_CUBE_TEST)
+        add_commits(db.cursor(), random.Random(2), 1000, 20)
+        db.commit()
+        db.close()
+        dbcon = self._get_dbcon(SCMQuery, True)
+        self.assertEqual(0, len(SCMActivityCube(dbcon).refresh()))
+        self._check_filters(Commits, SCMQuery, "'repo0'", "'OrgA'", False)
+
+        # Commits of a repository in a fork
+        db = MySQLdb.connect(user='root', passwd='', host='127.0.0.1', port=3306, db=DB_CUBE_TEST)
+        cursor = db.cursor()
+        cursor.execute("INSERT INTO scmlog SELECT id + 5000, rev, author_id, committer_id, " +
+                       "author_date, date, 2, message FROM scmlog WHERE repository_id = 0")
+        cursor.execute("INSERT INTO actions (commit_id) SELECT id FROM scmlog WHERE id > 5000")
+        db.commit()
+        db.close()
+        self._check_filters(Commits, SCMQuery, "'repo2'", "'OrgA'", False)
+
+        # Commits of a repository removed
+        db = MySQLdb.connect(user='root', passwd='', host='127.0.0.1', port=3306, db=DB_CUBE_TEST)
+        db.cursor().execute("DELETE FROM scmlog WHERE repository_id = 2")
+        db.commit()
+        db.close()
+        self.assertEqual(None, SCMActivityCube(dbcon).refresh())
+        self._check_filters(Commits, SCMQuery, "'repo0'", "'OrgA'", False)
+
+    def test_its(self):
+        self._check_filters(Opened, ITSQuery, "'tracker0'", "'OrgC'")
+        # Only the time series of closed tickets is from the cube
+        for type_analysis in [None, ["repository", None], ["project", "'p2'"]]:
+            mfilter = MetricFilters("month", "'2013-01-01'", "'2014-01-01'", type_analysis)
+            expected = Closed(self._get_dbcon(ITSQuery, False), mfilter).get_ts()
+            self.assertEqual(expected, self._get_values(Closed, ITSQuery, mfilter, True)[0])
+
+    def test_mls(self):
+        self._check(EmailsSent, MLSQuery, None)
+        self._check(EmailsSent, MLSQuery, ["company", "'OrgB'"])
+        self._check(EmailsSent, MLSQuery, ["company", None])
+        self._check(EmailsSent, MLSQuery, ["repository", "'list0'"])
+        self._check(EmailsSent, MLSQuery, ["repository", None])
+
+    def test_scr(self):
+        self._check_filters(Submitted, SCRQuery, "review0", "OrgA")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details. 
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+"""Tests for the JSON files written for the reports"""
+
+import copy
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+if not '..' in sys.path:
+    sys.path.insert(0, '../..')
+
+from datetime import datetime
+from decimal import Decimal
+
+from vizgrimoire.GrimoireUtils import createJSON, removeDecimals, roundDecimals, \
+    convertDatetime, convertCombinedFiltersName
+
+
+def legacyCreateJSON(data, filepath):
+    """ Previous implementation of createJSON, used as reference """
+    checked_data = convertDatetime(roundDecimals(removeDecimals(data)))
+    checked_data = convertCombinedFiltersName(checked_data)
+    json_data = json.dumps(checked_data, sort_keys=True)
+    json_data = json_data.replace('NaN','"NA"')
+    jsonfile = open(filepath, 'w')
+    jsonfile.write(json_data)
+    jsonfile.close()
+
+
+def random_value(rnd):
+    return rnd.choice([rnd.randint(0, 1000), 10**12 + rnd.randint(0, 1000),
+                       Decimal(rnd.randint(0, 10**6)) / 1000, rnd.random() * 100,
+                       float('nan'), None])
+
+def people_evol(rnd, npeople, nperiods):
+    """ people2 all items evolutionary data """
+    data = {"name": ["person %i" % i for i in range(0, npeople)],
+            "id": [i for i in range(0, nperiods)],
+            "month": [24000 + i for i in range(0, nperiods)],
+            "date": ["Jan %i" % (2000 + i) for i in range(0, nperiods)]}
+    for metric in ["commits", "authors", "lines_added", "avg_files"]:
+        data[metric] = [[random_value(rnd) for i in range(0, nperiods)]
+                        for person in range(0, npeople)]
+    return data
+
+
+class TestCreateJSON(unittest.TestCase):
+
+    def setUp(self):
+        self.destdir = tempfile.mkdtemp(prefix='create-json_')
+
+    def tearDown(self):
+        shutil.rmtree(self.destdir)
+
+    def compare(self, data):
+        legacy_file = os.path.join(self.destdir, "legacy.json")
+        new_file = os.path.join(self.destdir, "new.json")
+        legacyCreateJSON(copy.deepcopy(data), legacy_file)
+        createJSON(copy.deepcopy(data), new_file)
+        legacy_json = open(legacy_file).read()
+        new_json = open(new_file).read()
+        self.assertEqual(legacy_json, new_json)
+        return new_json
+
+    def test_agg(self):
+        data = {"commits": Decimal("1234"), "authors": 12, "avg_commits": 1.123456789,
+                "ratio": float('nan'), "first_date": datetime(2013, 1, 2, 3, 4, 5),
+                "url": u"http://www.example.com/ñ", "commits_365": 5L,
+                "percentage_commits_365": -25, "name": None, "ok": True}
+        json_data = self.compare(data)
+        self.assertTrue('"ratio": "NA"' in json_data)
+        self.assertTrue('"avg_commits": 1.12,' in json_data)
+
+    def test_evol(self):
+        rnd = random.Random(1783)
+        data = people_evol(rnd, 1, 30)
+        for metric in ["commits", "authors"]: data[metric] = data[metric][0]
+        self.compare(data)
+
+    def test_top(self):
+        data = {"authors.": {"id": [1, 2], "authors": ["a", u"b\xe9"],
+                             "commits": [Decimal(10), Decimal("3.3333333")]},
+                "authors.last month": {"id": 1, "authors": "a", "commits": 2.5}}
+        self.compare(data)
+
+    def test_combined_filter(self):
+        data = {"CONCAT(org.name,'_',cou.name)": ["a_b", "c_d"], "commits": [1, 2]}
+        json_data = self.compare(data)
+        self.assertTrue('"filter_type": "CONCAT' in json_data)
+
+    def test_lists(self):
+        self.compare([u"repo1", "repo2"])
+        self.compare([])
+        self.compare({})
+        self.compare([[1, 2.22222222], [Decimal("3.5"), float('nan')]])
+
+    def test_people_evol(self):
+        rnd = random.Random(2015)
+        self.compare(people_evol(rnd, 50, 40))
+
+    def test_benchmark(self):
+        """ Large people2 all items evolutionary dict """
+        rnd = random.Random(2015)
+        data = people_evol(rnd, 500, 120)
+        times = {}
+        for (name, create) in [("legacy", legacyCreateJSON), ("new", createJSON)]:
+            data_copy = copy.deepcopy(data)
+            start = time.time()
+            create(data_copy, os.path.join(self.destdir, name + ".json"))
+            times[name] = time.time() - start
+        self.assertEqual(open(os.path.join(self.destdir, "legacy.json")).read(),
+                         open(os.path.join(self.destdir, "new.json")).read())
+        self.assertTrue(times["new"] < times["legacy"],
+                        "createJSON %.2fs, previous %.2fs" % (times["new"], times["legacy"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,482 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+"""Tests for the incremental regeneration of the evolutionary JSON files"""
+
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import unittest
+
+from datetime import datetime, timedelta
+from sets import Set
+
+if not '..' in sys.path:
+    sys.path.insert(0, '../..')
+
+from vizgrimoire.data_source import DataSource
+from vizgrimoire.ITS import ITS
+from vizgrimoire.filter import Filter
+from vizgrimoire.GrimoireUtils import completePeriodIds, createJSON
+from vizgrimoire.incremental import IncrementalReport
+from vizgrimoire.metrics.metrics import Metrics
+from vizgrimoire.metrics.metrics_filter import MetricFilters
+from vizgrimoire.metrics.query_builder import DSQuery, ITSQuery, SCRQuery
+from vizgrimoire.report import Report
+import vizgrimoire.metrics.its_metrics as its_metrics
+from utils import FakeConnection, FakeCursor
+
+
+class EventsCursor(FakeCursor):
+    """Cursor with a table of events (id, date, repo)"""
+
+    def __init__(self, events):
+        FakeCursor.__init__(self)
+        self.events = events
+        self.checksum = 1
+
+    def _select(self, sql):
+        start = max([datetime.strptime(d, "%Y-%m-%d") for d in
+                     re.findall("e.date>='([^']+)'", sql)])
+        end = datetime.strptime(re.search("e.date<'([^']+)'", sql).group(1), "%Y-%m-%d")
+        repo = re.search("e.repo = '(\w+)'", sql)
+        return [e for e in self.events if start <= e[1] < end and
+                (repo is None or e[2] == repo.group(1))]
+
+    def execute(self, sql):
+        self.responses = []
+        if sql.startswith("CHECKSUM TABLE"):
+            self.responses = [("", ["Table", "Checksum"], [("pup", self.checksum), ("enr", 2)])]
+        elif "AS last_id" in sql:
+            self.responses = [("", ["total", "last_id"],
+                               [(len(self.events), max([e[0] for e in self.events]))])]
+        elif "AS last_date" in sql:
+            last = {}
+            for e in self._select(sql):
+                last[e[2]] = max(last.get(e[2], e[1]), e[1])
+            last = [(repo, date.strftime("%Y-%m-%d")) for (repo, date) in sorted(last.items())]
+            if "r.name" in sql:
+                self.responses = [("", ["name", "last_date"], last)]
+            else:
+                self.responses = [("", ["last_date"], [(date,) for (repo, date) in last])]
+        elif sql.startswith("SELECT id FROM people"):
+            self.responses = [("", ["id"], [])]
+        elif "AS first_date" in sql:
+            last_id = int(re.search("e.id > (\d+)", sql).group(1))
+            dates = [e[1] for e in self.events if e[0] > last_id]
+            first_date = None
+            if len(dates) > 0: first_date = min(dates)
+            self.responses = [("", ["total", "first_date"], [(len(dates), first_date)])]
+        elif sql.startswith("SELECT") and "e.date" in sql:
+            aliases = re.findall("COUNT\(e.id\) AS (\w+)", sql)
+            events = self._select(sql)
+            if "AS month" in sql:
+                months = {}
+                for e in events:
+                    month = e[1].year * 12 + e[1].month
+                    months[month] = months.get(month, 0) + 1
+                rows = [tuple([month] + [count] * len(aliases))
+                        for (month, count) in sorted(months.items())]
+                if "WITH ROLLUP" in sql and len(rows) > 0:
+                    rows.append(tuple([None] + [len(events)] * len(aliases)))
+                self.responses = [("", ["month"] + aliases, rows)]
+            else:
+                self.responses = [("", aliases, [tuple([len(events)] * len(aliases))])]
+        FakeCursor.execute(self, sql)
+
+
+def fake_events_query(cursor, query_builder = DSQuery):
+    class EventsQuery(query_builder):
+        watermarks = [(["events e"], [], "e.id", ["e.date"])]
+
+        def __SetDBChannel__(self, user=None, password=None, database=None,
+                             host="127.0.0.1", port=3306, group=None):
+            return FakeConnection(cursor)
+    return EventsQuery("user", "", "db", "db_identities")
+
+
+class Events(Metrics):
+    """Events in each period"""
+
+    id = "events"
+    name = "Events"
+    desc = "Number of events"
+
+    def _get_sql(self, evolutionary):
+        fields = Set(["COUNT(e.id) AS events"])
+        tables = Set(["events e"])
+        filters = Set([])
+        if self.filters.type_analysis is not None:
+            filters.add("e.repo = " + self.filters.type_analysis[1])
+        return self.db.BuildQuery(self.filters.period, self.filters.startdate,
+                                  self.filters.enddate, "e.date", fields,
+                                  tables, filters, evolutionary)
+
+
+class Accumulated(Events):
+    """Events until the end of each period"""
+
+    id = "accumulated"
+    name = "Accumulated events"
+    desc = "Number of events since the start"
+
+    def _get_sql(self, evolutionary):
+        return Events._get_sql(self, evolutionary).replace("AS events", "AS accumulated")
+
+    def get_ts(self):
+        ts = completePeriodIds(self.db.ExecuteQuery(self._get_sql(True)), self.filters.period,
+                               self.filters.startdate, self.filters.enddate)
+        total = 0
+        for (i, value) in enumerate(ts["accumulated"]):
+            total += value
+            ts["accumulated"][i] = total
+        return ts
+
+
+class LastDate(Events):
+    """Date of the last event"""
+
+    id = "last_date"
+    name = "Last event"
+    desc = "Date of the last event"
+
+    def get_agg(self):
+        fields = Set(["DATE_FORMAT(MAX(e.date),'%Y-%m-%d') AS last_date"])
+        tables = Set(["events e"])
+        filters = Set([])
+        type_analysis = self.filters.type_analysis
+        if type_analysis is not None and type_analysis[1] is not None:
+            filters.add("e.repo = " + type_analysis[1])
+        query = self.db.BuildQuery(self.filters.period, self.filters.startdate,
+                                   self.filters.enddate, "e.date", fields,
+                                   tables, filters, False, type_analysis)
+        return self.db.ExecuteQuery(query)
+
+
+class EventsDS(DataSource):
+    _metrics_set = []
+
+    @staticmethod
+    def get_name():
+        return "test"
+
+    @staticmethod
+    def get_metrics_core_ts():
+        return ["events", "accumulated"]
+
+    @staticmethod
+    def get_metrics_core_reports():
+        return []
+
+    @staticmethod
+    def get_metrics_core_agg():
+        return ["events"]
+
+    @staticmethod
+    def get_metrics_core_trends():
+        return []
+
+    @staticmethod
+    def get_query_builder():
+        return DSQuery
+
+
+def random_events(rnd, first, nevents, start, days, repos = ["r1", "r2"]):
+    return [(first + i, start + timedelta(seconds=rnd.randint(0, days * 86400)),
+             rnd.choice(repos)) for i in range(0, nevents)]
+
+
+class TestIncremental(unittest.TestCase):
+
+    def setUp(self):
+        DSQuery.db_conn_pool = {}
+        self.automator = Report._automator
+        Report._automator = {'r': {'reports': ''}, 'generic': {}}
+        self.destdir = tempfile.mkdtemp()
+        self.fulldir = tempfile.mkdtemp()
+        rnd = random.Random(1)
+        self.cursor = EventsCursor(random_events(rnd, 1, 500, datetime(2013, 1, 1), 240))
+        self.dbcon = fake_events_query(self.cursor)
+        EventsDS.set_metrics_set(EventsDS, [Events(self.dbcon), Accumulated(self.dbcon)])
+
+    def tearDown(self):
+        DSQuery.db_conn_pool = {}
+        DataSource.set_incremental(None)
+        Report._automator = self.automator
+        shutil.rmtree(self.destdir)
+        shutil.rmtree(self.fulldir)
+
+    def _create(self, destdir, enddate, filter_ = None, period = "month"):
+        """evolutionary JSON, with the incremental manager of destdir"""
+        if destdir is not None:
+            self.incremental = IncrementalReport(destdir)
+            DataSource.set_incremental(self.incremental)
+        else:
+            destdir = self.fulldir
+            DataSource.set_incremental(None)
+        self.cursor.queries = []
+        data = EventsDS.get_metrics_data(period, "'2013-01-01'", enddate, None, filter_, True)
+        filename = EventsDS().get_evolutionary_filename(filter_)
+        createJSON(data, os.path.join(destdir, filename))
+        evol_file = open(os.path.join(destdir, filename))
+        content = evol_file.read()
+        evol_file.close()
+        return content
+
+    def _get_starts(self, alias):
+        """Start dates of the periods of the time series queries of alias"""
+        return [max(re.findall("e.date>='([^']+)'", q)) for q in self.cursor.queries
+                if "AS " + alias in q and "AS month" in q]
+
+    def test_same_files(self):
+        rnd = random.Random(2)
+        self._create(self.destdir, "'2013-08-15'")
+        self.assertEqual(1, self.incremental.full)
+
+        # New events, one of them in an old month
+        self.cursor.events += random_events(rnd, 501, 50, datetime(2013, 8, 10), 40)
+        self.cursor.events.append((551, datetime(2013, 5, 20), "r1"))
+        content = self._create(self.destdir, "'2013-09-20'")
+        self.assertEqual(1, self.incremental.spliced)
+        self.assertEqual(["2013-05-01"], self._get_starts("events"))
+        self.assertEqual(["2013-01-01"], self._get_starts("accumulated"))
+        # The startdate is kept in the other conditions
+        for query in self.cursor.queries:
+            if "AS month" in query: self.assertTrue("e.date>='2013-01-01'" in query)
+        self.assertEqual(self._create(None, "'2013-09-20'"), content)
+
+        # Without new data only the last incomplete period
+        content = self._create(self.destdir, "'2013-09-20'")
+        self.assertEqual(1, self.incremental.spliced)
+        self.assertEqual(["2013-09-01"], self._get_starts("events"))
+        self.assertEqual(self._create(None, "'2013-09-20'"), content)
+
+    def test_filter_item(self):
+        filter_ = Filter("repository", "r1")
+        self._create(self.destdir, "'2013-08-15'", filter_)
+        self.cursor.events += random_events(random.Random(3), 501, 30, datetime(2013, 8, 1), 40)
+        content = self._create(self.destdir, "'2013-10-01'", filter_)
+        self.assertEqual(1, self.incremental.spliced)
+        self.assertEqual(self._create(None, "'2013-10-01'", filter_), content)
+        self.assertTrue(os.path.isfile(os.path.join(self.destdir, "incremental",
+                                                    "r1-test-rep-evolutionary.json")))
+
+    def test_full_rebuild(self):
+        self._create(self.destdir, "'2013-08-15'")
+        # Identities changed
+        self.cursor.checksum = 2
+        self._create(self.destdir, "'2013-08-15'")
+        self.assertEqual(1, self.incremental.full)
+
+        # Removed rows
+        self.cursor.events = self.cursor.events[1:]
+        self._create(self.destdir, "'2013-08-15'")
+        self.assertEqual(1, self.incremental.full)
+
+        # Manifest without the evolutionary file
+        os.remove(os.path.join(self.destdir, "test-evolutionary.json"))
+        content = self._create(self.destdir, "'2013-08-15'")
+        self.assertEqual(1, self.incremental.full)
+        self.assertEqual(self._create(None, "'2013-08-15'"), content)
+
+        # New start of the time series
+        manifest = self.incremental.read_manifest("test-evolutionary.json")
+        manifest["startdate"] = "'2012-01-01'"
+        self.assertEqual(None, self.incremental.get_since(self.dbcon, manifest,
+                         self.incremental.read_manifest("test-evolutionary.json")))
+
+    def test_scr(self):
+        """ The repository of the events is updated in place, as the status
+            of the reviews, so the old periods of r1 change """
+        scr_dbcon = fake_events_query(self.cursor, SCRQuery)
+        filter_ = Filter("repository", "r1")
+        for dbcon in [self.dbcon, scr_dbcon]:
+            EventsDS.set_metrics_set(EventsDS, [Events(dbcon), Accumulated(dbcon)])
+            self._create(self.destdir, "'2013-08-15'", filter_)
+            events = list(self.cursor.events)
+            self.cursor.events = [(e[0], e[1], "r2") for e in self.cursor.events[0:100]] + \
+                self.cursor.events[100:]
+            self.cursor.events.append((501, datetime(2013, 8, 20), "r1"))
+            content = self._create(self.destdir, "'2013-09-01'", filter_)
+            full_content = self._create(None, "'2013-09-01'", filter_)
+            if dbcon is self.dbcon:
+                # Spliced with the old values of r1
+                self.assertEqual(1, self.incremental.spliced)
+                self.assertNotEqual(full_content, content)
+            else:
+                self.assertEqual(1, self.incremental.full)
+                self.assertEqual(full_content, content)
+            self.cursor.events = events
+            shutil.rmtree(os.path.join(self.destdir, "incremental"))
+
+    def test_period_start(self):
+        date = datetime(2013, 8, 15, 10, 20)
+        self.assertEqual(datetime(2013, 8, 12), IncrementalReport.get_period_start(date, "week"))
+        self.assertEqual(datetime(2013, 8, 1), IncrementalReport.get_period_start(date, "month"))
+        self.assertEqual(datetime(2013, 7, 1), IncrementalReport.get_period_start(date, "quarter"))
+        self.assertEqual(datetime(2013, 8, 15), IncrementalReport.get_period_start(date, "day"))
+
+
+class TestUnchangedItems(unittest.TestCase):
+
+    repos = ["r1", "r2", "r3", "r4"]
+
+    def setUp(self):
+        DSQuery.db_conn_pool = {}
+        self.automator = Report._automator
+        Report._automator = {'r': {'reports': ''}, 'generic': {}}
+        self.destdir = tempfile.mkdtemp()
+        self.fulldir = tempfile.mkdtemp()
+        rnd = random.Random(4)
+        # Only old activity in r3 and r4
+        events = random_events(rnd, 1, 200, datetime(2010, 1, 1), 300, self.repos)
+        events += random_events(rnd, 201, 200, datetime(2013, 1, 1), 200, ["r1", "r2"])
+        self.cursor = EventsCursor(events)
+        dbcon = fake_events_query(self.cursor)
+        EventsDS.set_metrics_set(EventsDS, [Events(dbcon), LastDate(dbcon)])
+        self.filter_ = Filter("repository")
+
+    def tearDown(self):
+        DSQuery.db_conn_pool = {}
+        DataSource.set_incremental(None)
+        Report._automator = self.automator
+        shutil.rmtree(self.destdir)
+        shutil.rmtree(self.fulldir)
+
+    def _create_items(self, enddate, destdir = None, failed = []):
+        """Files of the repositories not skipped as in create_filter_report"""
+        if destdir is None:
+            destdir = self.destdir
+            self.incremental = IncrementalReport(destdir)
+            DataSource.set_incremental(self.incremental)
+        else:
+            DataSource.set_incremental(None)
+        self.cursor.queries = []
+        unchanged = EventsDS.get_unchanged_items(self.filter_, "month", "'2010-01-01'",
+                                                 enddate, None)
+        for repo in self.repos:
+            if repo in unchanged or repo in failed: continue
+            filter_item = Filter("repository", repo)
+            for (evol, filename) in [(True, filter_item.get_evolutionary_filename(EventsDS())),
+                                     (False, filter_item.get_static_filename(EventsDS()))]:
+                data = EventsDS.get_metrics_data("month", "'2010-01-01'", enddate, None,
+                                                 filter_item, evol)
+                createJSON(data, os.path.join(destdir, filename))
+        if len(failed) == 0:
+            # The report fails once all the items are processed
+            EventsDS.save_items_activity(self.filter_)
+        return sorted(unchanged)
+
+    def _read(self, destdir, filename):
+        json_file = open(os.path.join(destdir, filename))
+        content = json_file.read()
+        json_file.close()
+        return content
+
+    def test_new_commits(self):
+        self.assertEqual([], self._create_items("'2013-08-10'"))
+        # New activity in r1 and in the dormant r4
+        self.cursor.events += [(401, datetime(2013, 8, 12), "r1"),
+                               (402, datetime(2013, 8, 15), "r4")]
+        self.assertEqual(["r3"], self._create_items("'2013-08-20'"))
+        self.assertEqual(1, self.incremental.skipped_items)
+        # The last dates of all the items in one query
+        self.assertEqual(1, len([q for q in self.cursor.queries if "AS last_date" in q
+                                 and "r.name" in q]))
+
+        # The files of r3 are the same than in a full run
+        self._create_items("'2013-08-20'", self.fulldir)
+        for filename in ["r3-test-rep-evolutionary.json", "r3-test-rep-static.json"]:
+            self.assertEqual(self._read(self.fulldir, filename),
+                             self._read(self.destdir, filename))
+
+        # r2 has activity in the windows of the trends
+        self.assertEqual(["r3"], self._create_items("'2013-08-25'"))
+
+    def test_changes(self):
+        self._create_items("'2013-08-10'")
+        # New month in the time series
+        self.assertEqual([], self._create_items("'2013-09-02'"))
+        # Rows added with old dates
+        self.cursor.events.append((401, datetime(2010, 5, 1), "r2"))
+        self.assertEqual([], self._create_items("'2013-09-10'"))
+        self.assertEqual(["r3", "r4"], self._create_items("'2013-09-12'"))
+        # Identities changed
+        self.cursor.checksum = 2
+        self.assertEqual([], self._create_items("'2013-09-14'"))
+        # Files removed
+        os.remove(os.path.join(self.destdir, "r3-test-rep-static.json"))
+        self.assertEqual(["r4"], self._create_items("'2013-09-16'"))
+
+    def test_failed_items(self):
+        self._create_items("'2013-08-10'")
+        # New month in the time series, the files of r3 are not created
+        # and the activity of the previous run is kept
+        self.assertEqual([], self._create_items("'2013-09-02'", failed = ["r3"]))
+        self.assertEqual([], self._create_items("'2013-09-10'"))
+        self.assertEqual(["r3", "r4"], self._create_items("'2013-09-12'"))
+
+    def test_not_incremental(self):
+        self.assertEqual([], self._create_items("'2013-08-10'", self.fulldir))
+        self.assertEqual([], [q for q in self.cursor.queries if "AS last_date" in q
+                              and "r.name" in q])
+
+
+class TestITSItemsLastDate(unittest.TestCase):
+    """Last activity of the ITS items, from the issues and their changes"""
+
+    def setUp(self):
+        DSQuery.db_conn_pool = {}
+        self.metrics_set = ITS.get_metrics_set(ITS)
+        self.cursor = FakeCursor([
+            ("MAX\(i.submitted_on\)", ["name", "last_date"],
+             [("org1", "2013-05-01"), ("org2", "2012-01-10")]),
+            ("MAX\(ch.changed_on\)", ["name", "last_date"],
+             [("org1", "2013-03-01"), ("org2", "2013-07-02"), ("org3", "2011-01-01")])])
+        class FakeITSQuery(ITSQuery):
+            def __SetDBChannel__(query, user=None, password=None, database=None,
+                                 host="127.0.0.1", port=3306, group=None):
+                return FakeConnection(self.cursor)
+        dbcon = FakeITSQuery("user", "", "db", "db_identities")
+        filters = MetricFilters("month", "'2010-01-01'", "'2014-01-01'")
+        ITS.set_metrics_set(ITS, [its_metrics.EndOfActivity(dbcon, filters)])
+
+    def tearDown(self):
+        DSQuery.db_conn_pool = {}
+        ITS.set_metrics_set(ITS, self.metrics_set)
+
+    def test_last_date(self):
+        self.cursor.queries = []
+        last_dates = ITS.get_items_last_date(Filter("company"), "'2010-01-01'",
+                                             "'2014-01-01'", "db_identities")
+        self.assertEqual({"org1": "2013-05-01", "org2": "2013-07-02", "org3": "2011-01-01"},
+                         last_dates)
+        queries = [q for q in self.cursor.queries if "as last_date" in q]
+        self.assertEqual(2, len(queries))
+        for query in queries:
+            self.assertTrue("GROUP BY org.name" in query)
+        # Changes of the people of each organization
+        self.assertTrue("ch.changed_by = pup.people_id" in queries[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
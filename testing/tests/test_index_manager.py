@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+"""Tests for the indexes needed by the queries of each data source"""
+
+import re
+import sys
+import unittest
+
+if not '..' in sys.path:
+    sys.path.insert(0, '../..')
+
+import MySQLdb
+
+from vizgrimoire.metrics.query_builder import DSQuery, IndexManager, MLSQuery, SCMQuery
+from utils import FakeConnection, FakeCursor
+
+DB_INDEXES_TEST = 'cp_indexes_GrimoireLibTests'
+
+
+class SchemaCursor(FakeCursor):
+    """Cursor with the information_schema of a database, creating indexes"""
+
+    def __init__(self, columns, indexes):
+        FakeCursor.__init__(self)
+        # {table: [columns]}, {(table, index): [columns]}
+        self.columns = columns
+        self.indexes = indexes
+
+    def execute(self, sql):
+        if "information_schema.columns" in sql:
+            rows = [(table, column) for (table, columns) in self.columns.items()
+                    for column in columns]
+            self.responses = [("", ["table_name", "column_name"], rows)]
+        elif "information_schema.statistics" in sql:
+            rows = [(table, index, column) for ((table, index), columns) in self.indexes.items()
+                    for column in columns]
+            self.responses = [("", ["table_name", "index_name", "column_name"], rows)]
+        elif sql.startswith("EXPLAIN"):
+            (table, column) = re.search("FROM (\w+) ORDER BY (\w+)", sql).groups()
+            indexed = [index for ((t, index), columns) in self.indexes.items()
+                       if t == table and columns[0] == column]
+            extra = "Using index" if indexed else "Using filesort"
+            self.responses = [("", ["table", "key", "Extra"], [(table, None, extra)])]
+        elif sql.startswith("CREATE INDEX"):
+            (index, table, columns) = re.match("CREATE INDEX (\w+) ON (\w+) \((.*)\)", sql).groups()
+            self.indexes[(table, index)] = columns.split(", ")
+            self.responses = []
+        FakeCursor.execute(self, sql)
+
+
+def fake_query_builder(query_builder, cursor, database = "db"):
+    class FakeQuery(query_builder):
+        def __SetDBChannel__(self, user=None, password=None, database=None,
+                             host="127.0.0.1", port=3306, group=None):
+            return FakeConnection(cursor)
+    return FakeQuery("user", "", database, "db_identities")
+
+
+def scm_schema():
+    columns = {"scmlog": ["id", "author_id", "author_date"],
+               "actions": ["id", "commit_id"],
+               "people_uidentities": ["people_id", "uuid"]}
+    indexes = {("scmlog", "PRIMARY"): ["id"],
+               ("actions", "commit_people"): ["commit_id", "id"]}
+    return (columns, indexes)
+
+
+class TestIndexManager(unittest.TestCase):
+
+    def setUp(self):
+        DSQuery.db_conn_pool = {}
+
+    def tearDown(self):
+        DSQuery.db_conn_pool = {}
+        DSQuery.set_index_manager(None)
+
+    def _get_status(self, manager):
+        return dict([((index["table"], tuple(index["columns"])), index["status"])
+                     for index in manager.get_report()])
+
+    def test_create_missing(self):
+        cursor = SchemaCursor(*scm_schema())
+        manager = IndexManager()
+        DSQuery.set_index_manager(manager)
+        fake_query_builder(SCMQuery, cursor)
+
+        status = self._get_status(manager)
+        self.assertEqual("created", status[("scmlog", ("author_date", "author_id"))])
+        # The leftmost columns of an existing index
+        self.assertEqual("present", status[("actions", ("commit_id",))])
+        self.assertEqual("not found", status[("commits_lines", ("commit_id",))])
+        self.assertEqual("created", status[("people_uidentities", ("people_id",))])
+
+        creates = [q for q in cursor.queries if q.startswith("CREATE INDEX")]
+        self.assertEqual(["CREATE INDEX scmlog_author_date_author_id_idx ON scmlog (author_date, author_id)",
+                          "CREATE INDEX people_uidentities_people_id_idx ON people_uidentities (people_id)"],
+                         creates)
+        created = manager.get_report()[0]
+        self.assertEqual("Using filesort", created["plan_before"][0]["Extra"])
+        self.assertEqual("Using index", created["plan_after"][0]["Extra"])
+
+    def test_schema_read_once(self):
+        cursor = SchemaCursor(*scm_schema())
+        DSQuery.set_index_manager(IndexManager())
+        fake_query_builder(SCMQuery, cursor)
+        fake_query_builder(SCMQuery, cursor)
+        fake_query_builder(MLSQuery, cursor)
+        schema = [q for q in cursor.queries if "information_schema" in q]
+        self.assertEqual(2, len(schema))
+        self.assertEqual(2, len([q for q in cursor.queries if q.startswith("CREATE INDEX")]))
+
+        fake_query_builder(SCMQuery, cursor, "other_db")
+        schema = [q for q in cursor.queries if "information_schema" in q]
+        self.assertEqual(4, len(schema))
+
+    def test_only_report(self):
+        cursor = SchemaCursor(*scm_schema())
+        manager = IndexManager(create = False)
+        DSQuery.set_index_manager(manager)
+        fake_query_builder(SCMQuery, cursor)
+        self.assertEqual("missing", self._get_status(manager)[("scmlog", ("author_date", "author_id"))])
+        self.assertEqual([], [q for q in cursor.queries if not q.startswith("SET")
+                              and "information_schema" not in q])
+
+    def test_no_manager(self):
+        cursor = SchemaCursor(*scm_schema())
+        fake_query_builder(SCMQuery, cursor)
+        self.assertEqual(["SET NAMES 'utf8'"], list(set(cursor.queries)))
+
+
+class TestIndexManagerDatabase(unittest.TestCase):
+    """Indexes created in a local fixture database"""
+
+    @classmethod
+    def setUpClass(cls):
+        try:
+            db = MySQLdb.connect(user='root', passwd='', host='127.0.0.1', port=3306)
+        except MySQLdb.Error:
+            raise unittest.SkipTest("MySQL server not available")
+        cursor = db.cursor()
+        cursor.execute("DROP DATABASE IF EXISTS " + DB_INDEXES_TEST)
+        cursor.execute("CREATE DATABASE " + DB_INDEXES_TEST + " CHARACTER SET utf8")
+        cursor.execute("USE " + DB_INDEXES_TEST)
+        cursor.execute("CREATE TABLE scmlog (id INT PRIMARY KEY, author_id INT, " +
+                       "author_date DATETIME)")
+        cursor.execute("CREATE TABLE actions (id INT PRIMARY KEY, commit_id INT, " +
+                       "INDEX commit_id (commit_id))")
+        db.commit()
+        db.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        DSQuery.db_conn_pool = {}
+        dbcon = SCMQuery("root", "", DB_INDEXES_TEST, DB_INDEXES_TEST)
+        dbcon.ExecuteQuery("DROP DATABASE " + DB_INDEXES_TEST)
+        DSQuery.db_conn_pool = {}
+        DSQuery.set_index_manager(None)
+
+    def test_ensure_indexes(self):
+        DSQuery.db_conn_pool = {}
+        manager = IndexManager()
+        DSQuery.set_index_manager(manager)
+        SCMQuery("root", "", DB_INDEXES_TEST, DB_INDEXES_TEST)
+        status = dict([(index["table"] + "." + ",".join(index["columns"]), index["status"])
+                       for index in manager.get_report()])
+        self.assertEqual("created", status["scmlog.author_date,author_id"])
+        self.assertEqual("present", status["actions.commit_id"])
+
+        # A new manager finds the created indexes
+        manager = IndexManager()
+        DSQuery.set_index_manager(manager)
+        SCMQuery("root", "", DB_INDEXES_TEST, DB_INDEXES_TEST)
+        self.assertEqual(["present", "present", "not found", "not found"],
+                         [index["status"] for index in manager.get_report()])
+
+
+if __name__ == '__main__':
+    unittest.main()
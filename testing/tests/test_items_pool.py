@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details. 
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+"""Tests for the pool of processes used in filter reports"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+if not '..' in sys.path:
+    sys.path.insert(0, '../..')
+
+from vizgrimoire.items_pool import ItemsPool
+# Loaded before forking the workers, as in report_tool
+from vizgrimoire.report import Report
+
+from utils import benchmark
+
+# Synthetic repository set. Each item waits as the queries of a
+# filter item wait for the database server.
+REPOSITORIES = ["repo-%03d" % i for i in range(0, 32)]
+ITEM_TIME = 0.1
+
+
+class TestItemsPool(unittest.TestCase):
+
+    def setUp(self):
+        self.destdir = tempfile.mkdtemp(prefix='items-pool_')
+
+    def tearDown(self):
+        shutil.rmtree(self.destdir)
+
+    def test_ordered_results(self):
+        items = [str(i) for i in range(0, 50)]
+        results = ItemsPool.map(lambda item: int(item) * 2, items, 4)
+        self.assertEqual([i * 2 for i in range(0, 50)], results)
+
+    def test_files_from_workers(self):
+        destdir = self.destdir
+        def create_item_report(item):
+            f = open(os.path.join(destdir, item + ".json"), "w")
+            f.write(item)
+            f.close()
+            return os.getpid()
+        pids = ItemsPool.map(create_item_report, REPOSITORIES, 4)
+        self.assertEqual(sorted([item + ".json" for item in REPOSITORIES]),
+                         sorted(os.listdir(destdir)))
+        self.assertTrue(os.getpid() not in pids)
+
+    def test_failed_items(self):
+        def create_item_report(item):
+            if item == "repo-003": raise Exception("Wrong item")
+            if item == "repo-007": sys.exit(1)
+            return item
+        # With workers the report fails once all the items are processed
+        destdir = self.destdir
+        def create_item_file(item):
+            open(os.path.join(destdir, item), "w").close()
+            return create_item_report(item)
+        try:
+            ItemsPool.map(create_item_file, REPOSITORIES[0:10], 4)
+            self.fail("Failed items not reported")
+        except Exception, e:
+            self.assertEqual("Reports for 2 items failed: repo-003, repo-007", str(e))
+        self.assertEqual(REPOSITORIES[0:10], sorted(os.listdir(destdir)))
+        # Without workers the errors stop the report
+        self.assertRaises(Exception, ItemsPool.map, create_item_report,
+                          REPOSITORIES[0:5], 1)
+        self.assertRaises(SystemExit, ItemsPool.map, create_item_report,
+                          REPOSITORIES[5:10], 1)
+        def interrupt(item):
+            raise KeyboardInterrupt
+        self.assertRaises(KeyboardInterrupt, ItemsPool.map, interrupt,
+                          REPOSITORIES[0:2], 1)
+
+    def test_concurrency(self):
+        """ Items running at the same time up to 8 workers """
+        destdir = self.destdir
+        def create_item_report(item):
+            marker = os.path.join(destdir, item + ".running")
+            open(marker, "w").close()
+            time.sleep(ITEM_TIME)
+            # Items running at the same time
+            running = len([f for f in os.listdir(destdir) if f.endswith(".running")])
+            os.remove(marker)
+            return running
+
+        for jobs in [1, 2, 4, 8]:
+            peak = max(ItemsPool.map(create_item_report, REPOSITORIES[0:16], jobs))
+            if jobs == 1: self.assertEqual(1, peak)
+            else: self.assertTrue(1 < peak <= jobs,
+                                  "Items at the same time with %i workers: %i" % (jobs, peak))
+
+    @benchmark
+    def test_scaling(self):
+        """ Wall time of the repository set up to 8 workers """
+        def create_item_report(item):
+            time.sleep(ITEM_TIME)
+            return item
+
+        times = {}
+        for jobs in [1, 2, 4, 8]:
+            start = time.time()
+            ItemsPool.map(create_item_report, REPOSITORIES, jobs)
+            times[jobs] = time.time() - start
+        for jobs in [2, 4, 8]:
+            speedup = times[1] / times[jobs]
+            self.assertTrue(speedup > jobs * 0.6,
+                            "%i items: %.2fs with 1 worker, %.2fs with %i workers (x%.1f)" %
+                            (len(REPOSITORIES), times[1], times[jobs], jobs, speedup))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+"""Tests for the evaluation of shared metrics from several threads"""
+
+import random
+import re
+import sys
+import threading
+import time
+import unittest
+import zlib
+
+if not '..' in sys.path:
+    sys.path.insert(0, '../..')
+
+from vizgrimoire.SCM import SCM
+from vizgrimoire.SCR import SCR
+from vizgrimoire.metrics.metrics_filter import MetricFilters
+from vizgrimoire.metrics.query_builder import DSQuery, SCMQuery, SCRQuery
+from vizgrimoire.metrics.scm_metrics import Authors, Commits, People
+from vizgrimoire.metrics.scr_metrics import Abandoned, Merged, Pending, Submitted
+from utils import FakeConnection, FakeCursor
+
+NTHREADS = 16
+EVALUATIONS = 40
+
+
+class TextCursor(FakeCursor):
+    """Cursor returning values that depend on the text of the query, so
+    queries built with other filters get other values. It records when
+    it is used from two threads at the same time."""
+
+    def __init__(self):
+        FakeCursor.__init__(self)
+        self.lock = threading.Lock()
+        self.overlaps = 0
+
+    def execute(self, sql):
+        if not self.lock.acquire(False):
+            self.overlaps += 1
+            self.lock.acquire()
+        try:
+            if sql.startswith("SELECT"):
+                # Let other threads run in the middle of the evaluation
+                time.sleep(0.001)
+                (fields, rest) = DSQuery._split_select(sql)
+                columns = [re.search("(?:^|\\s+as\\s+|\\.)(\\w+)$", field,
+                                     re.IGNORECASE).group(1) for field in fields]
+                months = [None]
+                if "GROUP BY" in rest: months = range(0, 3)
+                rows = []
+                for month in months:
+                    row = []
+                    for column in columns:
+                        if column == "month": row.append(24157 + month)
+                        else: row.append(abs(zlib.crc32(str((sql, column, month)))) % 1000)
+                    rows.append(tuple(row))
+                self.responses = [("", columns, rows)]
+            FakeCursor.execute(self, sql)
+        finally:
+            self.lock.release()
+
+
+class TextChannel(object):
+    """New TextCursor for each connection"""
+
+    cursors = []
+
+    def __SetDBChannel__(self, user=None, password=None, database=None,
+                         host="127.0.0.1", port=3306, group=None):
+        cursor = TextCursor()
+        TextChannel.cursors.append(cursor)
+        return FakeConnection(cursor)
+
+
+class TextQuery(TextChannel, SCMQuery):
+    pass
+
+
+class TextSCRQuery(TextChannel, SCRQuery):
+    pass
+
+
+def random_filters(rnd):
+    start = rnd.choice(["'2012-01-01'", "'2012-06-01'", "'2013-01-01'"])
+    end = rnd.choice(["'2014-01-01'", "'2014-03-01'"])
+    type_analysis = rnd.choice([None, ["repository", "'repo1'"], ["repository", "'repo2'"],
+                                ["company", "'company1'"]])
+    return MetricFilters("month", start, end, type_analysis)
+
+
+class TestMetricEvaluate(unittest.TestCase):
+
+    def setUp(self):
+        DSQuery.db_conn_pool = {}
+        TextChannel.cursors = []
+        self.dbcon = TextQuery("user", "", "db", "db_identities")
+        self.filters = MetricFilters("month", "'2010-01-01'", "'2014-01-01'")
+        self.metrics_set = SCM.get_metrics_set(SCM)
+        self.scr_metrics_set = SCR.get_metrics_set(SCR)
+
+    def tearDown(self):
+        DSQuery.db_conn_pool = {}
+        SCM.set_metrics_set(SCM, self.metrics_set)
+        SCR.set_metrics_set(SCR, self.scr_metrics_set)
+
+    def _expected(self, metric_class, filters, kind, dbcon = None):
+        """ Value from a metric created for the filters """
+        if dbcon is None: dbcon = self.dbcon
+        metric = metric_class(dbcon, filters)
+        if kind == "ts": return metric.get_ts()
+        if kind == "agg": return metric.get_agg()
+        return metric.get_trends_days(filters.enddate, [7,30,365])
+
+    def test_evaluate(self):
+        commits = Commits(self.dbcon, self.filters)
+        filters = MetricFilters("month", "'2013-01-01'", "'2014-01-01'", ["repository", "'repo1'"])
+        for kind in ["ts", "agg", "trends"]:
+            self.assertEqual(self._expected(Commits, filters, kind),
+                             commits.evaluate(filters, kind))
+        self.assertTrue(commits.filters is self.filters)
+        self.assertEqual("'2010-01-01'", commits.filters.startdate)
+        self.assertEqual(None, commits.filters.type_analysis)
+        self.assertRaises(ValueError, commits.evaluate, filters, "unknown")
+
+    def test_shared_metric(self):
+        """ People uses the authors metric of the data source """
+        authors = Authors(self.dbcon, self.filters)
+        SCM.set_metrics_set(SCM, [authors])
+        people = People(self.dbcon, self.filters)
+        filters = MetricFilters("month", "'2013-01-01'", "'2014-01-01'", ["repository", "'repo1'"])
+        people.evaluate(filters, "agg")
+        self.assertTrue(authors.filters is self.filters)
+
+    def test_metric_of_metrics(self):
+        """ Pending uses the submitted, merged and abandoned metrics of SCR
+            from many threads with different filters """
+        dbcon = TextSCRQuery("user", "", "scr_db", "db_identities")
+        metrics = [Submitted(dbcon, self.filters), Merged(dbcon, self.filters),
+                   Abandoned(dbcon, self.filters)]
+        SCR.set_metrics_set(SCR, metrics)
+        pending = Pending(dbcon, self.filters)
+        results = []
+        def evaluate(seed):
+            rnd = random.Random(seed)
+            try:
+                for i in range(0, EVALUATIONS / 4):
+                    filters = random_filters(rnd)
+                    kind = rnd.choice(["ts", "agg"])
+                    results.append((filters, kind, pending.evaluate(filters, kind)))
+            except Exception, e:
+                results.append(e)
+        threads = [threading.Thread(target=evaluate, args=(seed,))
+                   for seed in range(0, NTHREADS)]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+
+        self.assertEqual(NTHREADS * EVALUATIONS / 4, len(results))
+        for result in results:
+            self.assertTrue(isinstance(result, tuple), str(result))
+            (filters, kind, value) = result
+            self.assertEqual(self._expected(Pending, filters, kind, dbcon), value)
+        for metric in metrics + [pending]:
+            self.assertTrue(metric.filters is self.filters)
+
+    def test_threads(self):
+        """ One metric evaluated from many threads with different filters """
+        commits = Commits(self.dbcon, self.filters)
+        main_cursor = self.dbcon.cursor
+        main_cursor.queries = []
+        results = []
+        def evaluate(seed):
+            rnd = random.Random(seed)
+            try:
+                for i in range(0, EVALUATIONS):
+                    filters = random_filters(rnd)
+                    kind = rnd.choice(["ts", "agg", "trends"])
+                    results.append((filters, kind, commits.evaluate(filters, kind)))
+            except Exception, e:
+                results.append(e)
+        threads = [threading.Thread(target=evaluate, args=(seed,))
+                   for seed in range(0, NTHREADS)]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+
+        # Each thread with its own connection
+        self.assertEqual([], main_cursor.queries)
+        self.assertEqual(NTHREADS * EVALUATIONS, len(results))
+        for result in results:
+            self.assertTrue(isinstance(result, tuple), str(result))
+            (filters, kind, value) = result
+            self.assertEqual(self._expected(Commits, filters, kind), value)
+        self.assertTrue(commits.filters is self.filters)
+        self.assertEqual("'2010-01-01'", commits.filters.startdate)
+        for cursor in TextChannel.cursors:
+            self.assertEqual(0, cursor.overlaps)
+
+
+if __name__ == '__main__':
+    unittest.main()
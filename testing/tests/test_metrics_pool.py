@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+"""Tests for the pool of threads running the metrics queries"""
+
+import inspect
+import re
+import sys
+import threading
+import time
+import unittest
+import zlib
+
+if not '..' in sys.path:
+    sys.path.insert(0, '../..')
+
+import MySQLdb
+
+from vizgrimoire.ITS import ITS
+from vizgrimoire.MLS import MLS
+from vizgrimoire.SCM import SCM
+from vizgrimoire.SCR import SCR
+from vizgrimoire.metrics.metrics import Metrics
+from vizgrimoire.metrics.metrics_filter import MetricFilters
+from vizgrimoire.metrics.query_builder import DSQuery, ITSQuery, MLSQuery, SCMQuery, \
+    SCRQuery
+from vizgrimoire.metrics.scm_metrics import Actions, Authors, Branches, Commits, \
+    Committers, Files, Lines, Repositories
+from vizgrimoire.metrics.scr_metrics import Abandoned, Merged, Pending, Submitted
+from vizgrimoire.metrics_pool import MetricsPool
+from vizgrimoire.query_profile import QueryProfile
+from vizgrimoire.report import Report
+import vizgrimoire.metrics.its_metrics as its_metrics
+import vizgrimoire.metrics.mls_metrics as mls_metrics
+import vizgrimoire.metrics.scm_metrics as scm_metrics
+from utils import FakeConnection, FakeCursor
+
+DB_SCM_TEST = 'jenkins_scm_vizr_1783'
+DB_ITS_TEST = 'jenkins_its_vizr_1783'
+DB_MLS_TEST = 'jenkins_mls_vizr_1783'
+DB_IDENTITIES_TEST = 'jenkins_scm_vizr_1783'
+
+SCM_METRICS = [Commits, Authors, Committers, Branches, Repositories, Files,
+               Actions, Lines]
+
+# Time the server needs for each query
+QUERY_TIME = 0.05
+
+
+class DelayCursor(FakeCursor):
+    """Cursor waiting QUERY_TIME for each query, as for the server, and
+    returning values that depend on the text of the query. It records
+    when it is used from two threads at the same time, and the peak of
+    queries running at the same time in all the cursors."""
+
+    running = 0
+    peak = 0
+    _running_lock = threading.Lock()
+
+    def __init__(self):
+        FakeCursor.__init__(self)
+        self.lock = threading.Lock()
+        self.overlaps = 0
+
+    def execute(self, sql):
+        if not self.lock.acquire(False):
+            self.overlaps += 1
+            self.lock.acquire()
+        try:
+            if sql.startswith("SELECT"):
+                DelayCursor._update_running(1)
+                time.sleep(QUERY_TIME)
+                DelayCursor._update_running(-1)
+                (fields, rest) = DSQuery._split_select(sql)
+                columns = [re.search("(?:^|\\s+as\\s+|\\.)(\\w+)$", field,
+                                     re.IGNORECASE).group(1) for field in fields]
+                months = [None]
+                if "GROUP BY" in rest: months = range(0, 3)
+                rows = []
+                for month in months:
+                    row = []
+                    for column in columns:
+                        if column == "month": row.append(24157 + month)
+                        else: row.append(abs(zlib.crc32(str((sql, column, month)))) % 1000)
+                    rows.append(tuple(row))
+                self.responses = [("", columns, rows)]
+            FakeCursor.execute(self, sql)
+        finally:
+            self.lock.release()
+
+    @staticmethod
+    def _update_running(change):
+        DelayCursor._running_lock.acquire()
+        DelayCursor.running += change
+        DelayCursor.peak = max(DelayCursor.peak, DelayCursor.running)
+        DelayCursor._running_lock.release()
+
+
+class DelayChannel(object):
+    """New DelayCursor for each connection"""
+
+    cursors = []
+
+    def __SetDBChannel__(self, user=None, password=None, database=None,
+                         host="127.0.0.1", port=3306, group=None):
+        cursor = DelayCursor()
+        DelayChannel.cursors.append(cursor)
+        return FakeConnection(cursor)
+
+
+class DelayQuery(DelayChannel, SCMQuery):
+    pass
+
+
+class DelaySCRQuery(DelayChannel, SCRQuery):
+    pass
+
+
+class TestMetricsPool(unittest.TestCase):
+
+    def setUp(self):
+        DSQuery.db_conn_pool = {}
+        MetricsPool.reset()
+
+    def tearDown(self):
+        DSQuery.db_conn_pool = {}
+        MetricsPool.reset()
+
+    def test_ordered_results(self):
+        calls = [lambda i=i: i * 2 for i in range(0, 50)]
+        self.assertEqual([i * 2 for i in range(0, 50)], MetricsPool.map(calls, jobs=4))
+
+    def test_exception(self):
+        def fail():
+            raise NotImplementedError
+        self.assertRaises(NotImplementedError, MetricsPool.map,
+                          [lambda: 1, fail, lambda: 2], None, 4)
+
+    def test_thread_connections(self):
+        DelayChannel.cursors = []
+        dbcon = DelayQuery("user", "", "db", "db_identities")
+        calls = [lambda: (dbcon.ExecuteQuery("SELECT COUNT(*) AS n FROM t"),
+                          dbcon.cursor) for i in range(0, 8)]
+        results = MetricsPool.map(calls, jobs=4)
+        cursors = set([cursor for (result, cursor) in results])
+        self.assertEqual(4, len(cursors))
+        self.assertTrue(dbcon.cursor not in cursors)
+        for cursor in DelayChannel.cursors:
+            self.assertEqual(0, cursor.overlaps)
+        # Workers are reused
+        MetricsPool.map(calls, jobs=4)
+        self.assertEqual(len(cursors), len(DelayChannel.cursors) - 2)
+
+    def test_profile_data_source(self):
+        dbcon = DelayQuery("user", "", "db", "db_identities")
+        profile = QueryProfile()
+        DSQuery.set_query_profile(profile)
+        try:
+            calls = [lambda: dbcon.ExecuteQuery("SELECT COUNT(*) AS n FROM t")
+                     for i in range(0, 4)]
+            MetricsPool.map(calls, SCM, 4)
+            MetricsPool.map(calls, None, 4)
+        finally:
+            DSQuery.set_query_profile(None)
+        report = profile.get_report()
+        self.assertEqual(["db", "scm"],
+                         sorted([ds["data_source"] for ds in report["by_data_source"]]))
+
+
+class TestMetricsData(unittest.TestCase):
+    """Data of a data source with the queries run in threads"""
+
+    def setUp(self):
+        DSQuery.db_conn_pool = {}
+        MetricsPool.reset()
+        DelayChannel.cursors = []
+        self.automator = Report._automator
+        Report._automator = {'r': {'reports': ''}, 'generic': {}}
+        self.metrics_set = SCM.get_metrics_set(SCM)
+        dbcon = DelayQuery("user", "", "db", "db_identities")
+        filters = MetricFilters("month", "'2013-01-01'", "'2013-04-01'")
+        SCM.set_metrics_set(SCM, [metric(dbcon, filters.copy()) for metric in SCM_METRICS])
+
+    def tearDown(self):
+        DSQuery.db_conn_pool = {}
+        MetricsPool.reset()
+        DSQuery.set_query_profile(None)
+        Report._automator = self.automator
+        SCM.set_metrics_set(SCM, self.metrics_set)
+
+    def _get_data(self, evol, jobs):
+        """ Data and the peak of queries running at the same time """
+        MetricsPool.set_jobs(jobs)
+        DelayCursor.peak = 0
+        try:
+            data = SCM.get_metrics_data("month", "'2013-01-01'", "'2013-04-01'",
+                                        None, None, evol)
+            return (data, DelayCursor.peak)
+        finally:
+            MetricsPool.set_jobs(1)
+
+    def test_same_data(self):
+        for evol in [True, False]:
+            (expected, seq_peak) = self._get_data(evol, 1)
+            (data, pool_peak) = self._get_data(evol, 4)
+            self.assertTrue(len(data) > 0)
+            self.assertEqual(expected, data)
+            self.assertEqual(1, seq_peak)
+            # Queries run at the same time
+            self.assertTrue(1 < pool_peak <= 4, "Queries at the same time: %i" % pool_peak)
+        for cursor in DelayChannel.cursors:
+            self.assertEqual(0, cursor.overlaps)
+
+    def test_profile(self):
+        profile = QueryProfile()
+        DSQuery.set_query_profile(profile)
+        self._get_data(False, 1)
+        expected = profile.get_report()
+        profile.reset()
+        self._get_data(False, 4)
+        report = profile.get_report()
+        self.assertEqual(expected["total"]["count"], report["total"]["count"])
+        self.assertEqual(["scm"], [ds["data_source"] for ds in report["by_data_source"]])
+
+
+class TestPendingTrends(unittest.TestCase):
+    """Trends of Pending and of the SCR metrics it uses, run in threads"""
+
+    metrics = "submitted,merged,abandoned,pending"
+
+    def setUp(self):
+        DSQuery.db_conn_pool = {}
+        MetricsPool.reset()
+        DelayChannel.cursors = []
+        self.automator = Report._automator
+        Report._automator = {'r': {'reports': '', 'scr_metrics_agg': self.metrics,
+                                   'scr_metrics_trends': self.metrics},
+                             'generic': {}}
+        self.metrics_set = SCR.get_metrics_set(SCR)
+        dbcon = DelaySCRQuery("user", "", "db", "db_identities")
+        self.filters = MetricFilters("month", "'2013-01-01'", "'2014-01-01'")
+        SCR.set_metrics_set(SCR, [metric(dbcon, self.filters) for metric in
+                                  [Submitted, Merged, Abandoned, Pending]])
+
+    def tearDown(self):
+        DSQuery.db_conn_pool = {}
+        MetricsPool.reset()
+        Report._automator = self.automator
+        SCR.set_metrics_set(SCR, self.metrics_set)
+
+    def _get_data(self, jobs):
+        MetricsPool.set_jobs(jobs)
+        try:
+            return SCR.get_metrics_data("month", "'2013-01-01'", "'2014-01-01'",
+                                        None, None, False)
+        finally:
+            MetricsPool.set_jobs(1)
+
+    def test_same_trends(self):
+        expected = self._get_data(1)
+        self.assertTrue("pending_30" in expected and "submitted_30" in expected)
+        for i in range(0, 3):
+            self.assertEqual(expected, self._get_data(4))
+        for metric in SCR.get_metrics_set(SCR):
+            self.assertTrue(metric.filters is self.filters)
+        for cursor in DelayChannel.cursors:
+            self.assertEqual(0, cursor.overlaps)
+
+
+class TestMetricsPoolDump(unittest.TestCase):
+    """Latency of the data of each data source in the testing dumps,
+    running the queries in sequence and in threads"""
+
+    data_sources = [(SCM, scm_metrics, SCMQuery, DB_SCM_TEST),
+                    (ITS, its_metrics, ITSQuery, DB_ITS_TEST),
+                    (MLS, mls_metrics, MLSQuery, DB_MLS_TEST)]
+    jobs = 4
+
+    @classmethod
+    def setUpClass(cls):
+        DSQuery.db_conn_pool = {}
+        try:
+            MySQLdb.connect(user="root", passwd="", db=DB_SCM_TEST)
+        except MySQLdb.Error:
+            raise unittest.SkipTest("MySQL testing dumps not available")
+        cls.automator = Report._automator
+        Report._automator = {'r': {'reports': ''}, 'generic': {}}
+        ITS.set_backend("bugzilla")
+
+    @classmethod
+    def tearDownClass(cls):
+        DSQuery.db_conn_pool = {}
+        MetricsPool.reset()
+        Report._automator = cls.automator
+
+    def _set_metrics(self, ds, module, query_builder, database):
+        """ All the metrics of the data source, as in Report """
+        dbcon = query_builder("root", "", database, DB_IDENTITIES_TEST)
+        filters = MetricFilters("month", "'2010-01-01'", "'2014-01-01'")
+        metrics = []
+        for (name, metric_class) in inspect.getmembers(module, inspect.isclass):
+            if not issubclass(metric_class, Metrics) or metric_class.data_source != ds:
+                continue
+            metrics.append(metric_class(dbcon, filters.copy()))
+        ds.set_metrics_set(ds, metrics)
+
+    def _get_data(self, ds, evol, jobs):
+        MetricsPool.set_jobs(jobs)
+        try:
+            start = time.time()
+            data = ds.get_metrics_data("month", "'2010-01-01'", "'2014-01-01'",
+                                       DB_IDENTITIES_TEST, None, evol)
+            return (data, time.time() - start)
+        finally:
+            MetricsPool.set_jobs(1)
+
+    def test_latency(self):
+        for (ds, module, query_builder, database) in self.data_sources:
+            metrics_set = ds.get_metrics_set(ds)
+            try:
+                self._set_metrics(ds, module, query_builder, database)
+                for evol in [False, True]:
+                    (expected, seq_time) = self._get_data(ds, evol, 1)
+                    (data, pool_time) = self._get_data(ds, evol, self.jobs)
+                    self.assertEqual(expected, data)
+                    sys.stderr.write("\n%s evol=%s: %.3fs in sequence, %.3fs with %i threads" %
+                                     (ds.get_name(), evol, seq_time, pool_time, self.jobs))
+            finally:
+                ds.set_metrics_set(ds, metrics_set)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details. 
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+"""Tests for trends computed with one conditional aggregation query"""
+
+import sys
+import unittest
+
+if not '..' in sys.path:
+    sys.path.insert(0, '../..')
+
+from vizgrimoire.metrics.metrics_filter import MetricFilters
+from vizgrimoire.metrics.query_builder import DSQuery, SCMQuery, ITSQuery
+from vizgrimoire.metrics.scm_metrics import Commits, Authors
+from vizgrimoire.metrics.its_metrics import Opened
+from utils import FakeConnection, FakeCursor
+
+DAYS = [7, 30, 365]
+TRENDS_COLUMNS = ["last_7", "prev_7", "last_30", "prev_30", "last_365", "prev_365"]
+
+
+def fake_query_builder(query_builder, cursor):
+    class FakeQuery(query_builder):
+        def __SetDBChannel__(self, user=None, password=None, database=None,
+                             host="127.0.0.1", port=3306, group=None):
+            return FakeConnection(cursor)
+    return FakeQuery("user", "", "db", "db_identities")
+
+
+class TestGetSQLTrends(unittest.TestCase):
+
+    def test_count_distinct(self):
+        sql = "SELECT count(distinct(s.rev)) as commits FROM scmlog s" + \
+              " WHERE  s.author_date >='2013-01-01' AND  s.author_date <'2014-01-01'"
+        windows = [("last_7", "'2013-12-25'", "'2014-01-01'")]
+        expected = "SELECT count(DISTINCT CASE WHEN  s.author_date >='2013-12-25'" + \
+                   " AND  s.author_date <'2014-01-01' THEN (s.rev) END) AS last_7" + \
+                   " FROM scmlog s WHERE  s.author_date >='2013-01-01'" + \
+                   " AND  s.author_date <'2014-01-01'"
+        self.assertEqual(expected, DSQuery.GetSQLTrends(sql, "'2013-01-01'", "'2014-01-01'",
+                                                         "commits", windows))
+
+    def test_group_by(self):
+        sql = "SELECT org.name, count(distinct(pup.uuid)) as authors FROM scmlog s" + \
+              " WHERE s.author_date>='2013-01-01' AND s.author_date<'2014-01-01'" + \
+              " GROUP BY org.name ORDER BY authors DESC,org.name"
+        windows = [("last_7", "'2013-12-25'", "'2014-01-01'")]
+        res = DSQuery.GetSQLTrends(sql, "'2013-01-01'", "'2014-01-01'", "authors", windows)
+        self.assertTrue(res.startswith("SELECT org.name, count(DISTINCT CASE"))
+        self.assertTrue(res.endswith(" GROUP BY org.name"))
+
+    def test_not_supported(self):
+        # Average can not be computed with conditional aggregation
+        sql = "SELECT avg(x) as avg_x FROM t WHERE d>='2013-01-01' AND d<'2014-01-01'"
+        self.assertEqual(None, DSQuery.GetSQLTrends(sql, "'2013-01-01'", "'2014-01-01'",
+                                                     "avg_x", []))
+
+
+class TestTrendsQueries(unittest.TestCase):
+
+    def setUp(self):
+        DSQuery.db_conn_pool = {}
+
+    def tearDown(self):
+        DSQuery.db_conn_pool = {}
+
+    def check_metric(self, metric_class, query_builder):
+        cursor = FakeCursor([("AS last_7", TRENDS_COLUMNS, [(10, 8, 40, 30, 400, 500)]),
+                             ("as " + metric_class.id, [metric_class.id], [(10,)])])
+        dbcon = fake_query_builder(query_builder, cursor)
+        filters = MetricFilters("month", "'2012-01-01'", "'2014-01-01'")
+        metric = metric_class(dbcon, filters)
+
+        cursor.queries = []
+        trends = metric.get_trends_days("'2014-01-01'", DAYS)
+        self.assertEqual(1, len(cursor.queries))
+
+        cursor.queries = []
+        for days in DAYS: metric.get_trends("'2014-01-01'", days)
+        self.assertEqual(6, len(cursor.queries))
+
+        self.assertEqual(3, len(trends))
+        self.assertEqual(10, trends[0][metric.id + "_7"])
+        self.assertEqual(2, trends[0]["diff_net" + metric.id + "_7"])
+        self.assertEqual(25, trends[0]["percentage_" + metric.id + "_7"])
+        self.assertEqual(-100, trends[2]["diff_net" + metric.id + "_365"])
+
+    def test_scm_commits(self):
+        self.check_metric(Commits, SCMQuery)
+
+    def test_scm_authors(self):
+        self.check_metric(Authors, SCMQuery)
+
+    def test_its_opened(self):
+        self.check_metric(Opened, ITSQuery)
+
+
+if __name__ == "__main__":
+    unittest.main()
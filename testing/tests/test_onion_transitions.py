@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+"""Tests for the onion transitions study with batched people data"""
+
+import re
+import sys
+import unittest
+
+if not '..' in sys.path:
+    sys.path.insert(0, '../..')
+
+from vizgrimoire.analysis.onion_transitions import OnionTransitions
+from vizgrimoire.metrics.metrics_filter import MetricFilters
+from vizgrimoire.metrics.query_builder import DSQuery, SCMQuery, ITSQuery
+from utils import FakeConnection, FakeCursor
+
+NPEOPLE = 40
+
+
+class FakeDataSource(object):
+    def __init__(self, name):
+        self.name = name
+
+    def get_name(self):
+        return self.name
+
+
+def activity(past):
+    """Activity of each person, reversed in the past period"""
+    values = {}
+    for i in range(0, NPEOPLE):
+        if past: values["uuid%i" % i] = i + 1
+        else: values["uuid%i" % i] = NPEOPLE - i
+    return values
+
+
+class ActivityCursor(FakeCursor):
+    """Cursor returning the people activity for the period in the query"""
+
+    def __init__(self, field):
+        FakeCursor.__init__(self)
+        self.field = field
+
+    def execute(self, sql):
+        values = activity(">='2013-01-01'" in sql.replace(" ", ""))
+        uuids = re.findall("'(uuid\d+)'", sql)
+        if "total" in sql:
+            rows = [(sum(values.values()),)]
+            self.responses = [("", ["total"], rows)]
+        elif "count" not in sql.lower():
+            # Two identities for each person, the first one is used
+            rows = []
+            for uuid in uuids:
+                rows.append((uuid, "Name " + uuid, uuid + "@example.com"))
+                rows.append((uuid, "Name " + uuid, "Other"))
+            if "profiles" in sql: columns = ["uid", "name", "affiliation"]
+            else: columns = ["uid", "name", "email"]
+            self.responses = [("", columns, rows)]
+        else:
+            if len(uuids) == 0: uuids = values.keys()
+            rows = [(uuid, values[uuid]) for uuid in uuids]
+            rows.sort(key=lambda row: -row[1])
+            self.responses = [("", ["uid", self.field], rows)]
+        FakeCursor.execute(self, sql)
+
+
+def fake_query_builder(query_builder, cursor):
+    class FakeQuery(query_builder):
+        def __SetDBChannel__(self, user=None, password=None, database=None,
+                             host="127.0.0.1", port=3306, group=None):
+            return FakeConnection(cursor)
+    return FakeQuery("user", "", "db", "db_identities")
+
+
+class TestOnionTransitions(unittest.TestCase):
+
+    def setUp(self):
+        DSQuery.db_conn_pool = {}
+
+    def tearDown(self):
+        DSQuery.db_conn_pool = {}
+
+    def _get_study(self, query_builder, field):
+        self.cursor = ActivityCursor(field)
+        dbcon = fake_query_builder(query_builder, self.cursor)
+        filters = MetricFilters("month", "'2014-01-01'", "'2015-01-01'")
+        self.cursor.queries = []
+        return OnionTransitions(dbcon, filters)
+
+    def test_scm(self):
+        study = self._get_study(SCMQuery, "commits")
+        result = study.get_agg(FakeDataSource("scm"))
+
+        # Two queries for each period and two for all the people data
+        self.assertEqual(6, len(self.cursor.queries))
+        current = activity(False)
+        self.assertTrue(len(result["core"]["name"]) > 0)
+        for group in result:
+            self.assertEqual(set(["name", "email", "commits"]),
+                             set(result[group].keys()))
+            for i in range(0, len(result[group]["name"])):
+                uuid = result[group]["email"][i].split("@")[0]
+                self.assertEqual("Name " + uuid, result[group]["name"][i])
+                self.assertEqual(current[uuid], result[group]["commits"][i])
+
+    def test_its(self):
+        study = self._get_study(ITSQuery, "opened")
+        result = study.get_agg(FakeDataSource("its"))
+
+        self.assertEqual(6, len(self.cursor.queries))
+        # Past core people not in the current core go down
+        self.assertTrue(len(result["down_reg"]["name"]) > 0)
+        for group in result:
+            self.assertEqual(set(["name", "affiliation", "opened"]),
+                             set(result[group].keys()))
+            for affiliation in result[group]["affiliation"]:
+                self.assertTrue(affiliation.endswith("@example.com"))
+
+    def test_people_cache(self):
+        study = self._get_study(ITSQuery, "opened")
+        people = ["uuid%i" % i for i in range(0, NPEOPLE)] + ["uuid_none"]
+        ds = FakeDataSource("its")
+
+        data = study._get_people_info(people, "'2014-01-01'", "'2015-01-01'", ds)
+        self.assertEqual(2, len(self.cursor.queries))
+        self.assertEqual(NPEOPLE, data["uuid0"]["opened"])
+        self.assertEqual({"name": None, "affiliation": None, "opened": 0},
+                         data["uuid_none"])
+
+        # Already retrieved people are not queried again
+        info = study._get_person_info("uuid1", "'2014-01-01'", "'2015-01-01'", ds)
+        self.assertEqual(2, len(self.cursor.queries))
+        self.assertEqual("Name uuid1", info["name"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details. 
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+"""Tests for people identifiers"""
+
+import re
+import sys
+import unittest
+
+if not '..' in sys.path:
+    sys.path.insert(0, '../..')
+
+import vizgrimoire.GrimoireSQL as GrimoireSQL
+import vizgrimoire.People as People
+from utils import FakeCursor
+
+COLUMNS = ["uuid", "name", "email", "country", "affiliation"]
+
+
+class IdentitiesCursor(FakeCursor):
+    """Cursor returning the profiles of the uuids in the query.
+
+    People with an odd number have two enrollments and people
+    with a number multiple of 10 do not exist.
+    """
+
+    def execute(self, sql):
+        rows = []
+        for uuid in re.findall("'(uuid\d+)'", sql):
+            number = int(uuid[4:])
+            if number % 10 == 0: continue
+            rows.append((uuid, "Name %i" % number, None, "Spain", "Org A"))
+            if number % 2 == 1:
+                rows.append((uuid, "Name %i" % number, None, "Spain", "Org B"))
+        self.responses = [("profiles", COLUMNS, rows)]
+        FakeCursor.execute(self, sql)
+
+
+class TestPersonIdentifiers(unittest.TestCase):
+
+    def setUp(self):
+        self.cursor = IdentitiesCursor()
+        GrimoireSQL.cursor = self.cursor
+        GrimoireSQL.dbname = "identities"
+
+    def tearDown(self):
+        GrimoireSQL.cursor = None
+        GrimoireSQL.dbname = None
+
+    def test_same_as_single_queries(self):
+        uuids = ["uuid%i" % i for i in range(1, 31)]
+        people = People.GetPersonIdentifiersBulk("identities", uuids, 7)
+        for uuid in uuids:
+            self.assertEqual(People.GetPersonIdentifiers("identities", uuid), people[uuid])
+        self.assertEqual("Name 2", people["uuid2"]["name"])
+        self.assertEqual(["Org A", "Org B"], people["uuid3"]["affiliation"])
+        self.assertEqual([], people["uuid10"]["name"])
+
+    def test_queries_per_chunk(self):
+        uuids = ["uuid%i" % i for i in range(0, 2500)]
+        people = People.GetPersonIdentifiersBulk("identities", uuids, 1000)
+        self.assertEqual(2500, len(people))
+        self.assertEqual(3, len(self.cursor.queries))
+
+    def test_one_person(self):
+        people = People.GetPersonIdentifiersBulk("identities", ["uuid4"])
+        self.assertEqual({"uuid4": {"uuid": "uuid4", "name": "Name 4", "email": None,
+                                    "country": "Spain", "affiliation": "Org A"}},
+                         people)
+        self.assertEqual({}, People.GetPersonIdentifiersBulk("identities", []))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details. 
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+"""Tests for the completion of time series periods"""
+
+import calendar
+import copy
+import random
+import sys
+import unittest
+
+if not '..' in sys.path:
+    sys.path.insert(0, '../..')
+
+from datetime import datetime, timedelta
+from dateutil.relativedelta import relativedelta
+
+import MySQLdb
+
+from vizgrimoire.GrimoireUtils import completePeriodIds, createTimeSeries, \
+    checkListArray, cleanNaN, date2Week
+from vizgrimoire.metrics.query_builder import DSQuery
+
+
+# Previous implementation of the periods completion, used as reference
+
+def legacyCompletePeriodIdsYears(ts_data, start, end):
+    data_vars = ts_data.keys()
+    new_ts_data =  createTimeSeries(ts_data)
+    checkListArray(ts_data)
+    start_year = start.year * 12
+    years = end.year - start.year
+    for i in range(0, years+1):
+        if (start_year+(i*12) in ts_data['year']) is False:
+            for key in (data_vars):
+                new_ts_data[key].append(0)
+            new_ts_data['year'].pop()
+            new_ts_data['year'].append(start_year+(i*12))
+        else:
+            index = ts_data['year'].index(start_year+(i*12))
+            for key in (data_vars):
+                new_ts_data[key].append(ts_data[key][index])
+        current =  start + relativedelta(years=i)
+        timestamp = calendar.timegm(current.timetuple())
+        new_ts_data['unixtime'].append(unicode(timestamp))
+        new_ts_data['id'].append(i)
+        new_ts_data['date'].append(datetime.strftime(current, "%b %Y"))
+    return new_ts_data
+
+def legacyCompletePeriodIdsMonths(ts_data, start, end):
+    data_vars = ts_data.keys()
+    new_ts_data =  createTimeSeries(ts_data)
+    checkListArray(ts_data)
+    start_month = start.year*12 + start.month
+    end_month = end.year*12 + end.month
+    months = end_month - start_month
+    start = start - timedelta(days=(start.day-1))
+    for i in range(0, months+1):
+        if (start_month+i in ts_data['month']) is False:
+            for key in (data_vars):
+                new_ts_data[key].append(0)
+            new_ts_data['month'].pop()
+            new_ts_data['month'].append(start_month+i)
+        else:
+            index = ts_data['month'].index(start_month+i)
+            for key in (data_vars):
+                new_ts_data[key].append(ts_data[key][index])
+        current =  start + relativedelta(months=i)
+        timestamp = calendar.timegm(current.timetuple())
+        new_ts_data['unixtime'].append(unicode(timestamp))
+        new_ts_data['id'].append(i)
+        new_ts_data['date'].append(datetime.strftime(current, "%b %Y"))
+    return new_ts_data
+
+def legacyCompletePeriodIdsWeeks(ts_data, start, end):
+    data_vars = ts_data.keys()
+    new_ts_data =  createTimeSeries(ts_data)
+    checkListArray(ts_data)
+    dayweek = start.isocalendar()[2]
+    new_week = start - relativedelta(days=dayweek-1)
+    i = 0
+    while (new_week <= end):
+        new_week_txt = date2Week(new_week)
+        if (int(new_week_txt) in ts_data['week']) is False:
+            for key in (data_vars):
+                new_ts_data[key].append(0)
+            new_ts_data['week'].pop()
+            new_ts_data['week'].append(int(new_week_txt))
+        else:
+            index = ts_data['week'].index(int(new_week_txt))
+            for key in (data_vars):
+                new_ts_data[key].append(ts_data[key][index])
+            new_ts_data['week'].pop()
+            new_ts_data['week'].append(ts_data['week'][index])
+        timestamp = calendar.timegm(new_week.timetuple())
+        new_ts_data['unixtime'].append(unicode(timestamp))
+        new_ts_data['id'].append(i)
+        i += 1
+        new_ts_data['date'].append(datetime.strftime(new_week, "%b %Y"))
+        new_week = new_week + relativedelta(weeks=1)
+    return new_ts_data
+
+def legacyCompletePeriodIds(ts_data, period, startdate, enddate):
+    if "id" in ts_data: return ts_data
+    if len(ts_data.keys()) == 0: return ts_data
+    new_ts_data = ts_data
+    start = datetime.strptime(startdate.replace("'", ""), "%Y-%m-%d")
+    end = datetime.strptime(enddate.replace("'", ""), "%Y-%m-%d")
+    end = end - timedelta(days=1)
+    if period == "week":
+        new_ts_data = legacyCompletePeriodIdsWeeks(ts_data, start, end)
+    elif period == "month":
+        new_ts_data = legacyCompletePeriodIdsMonths(ts_data, start, end)
+    elif period == "year":
+        new_ts_data = legacyCompletePeriodIdsYears(ts_data, start, end)
+    return cleanNaN(new_ts_data)
+
+
+def period_key(period, date):
+    """ Value of the period field for date, as GetSQLPeriod returns it """
+    if period == "year": return date.year * 12
+    elif period == "month": return date.year * 12 + date.month
+    elif period == "week": return int(date2Week(date))
+    elif period == "quarter": return date.year * 4 + (date.month - 1) / 3 + 1
+    elif period == "day": return calendar.timegm(date.timetuple())
+
+
+def random_series(rnd, period, start, end):
+    """ Sparse series with some periods outside the range of dates """
+    days = (end - start).days
+    keys = []
+    for i in range(0, rnd.randint(0, 40)):
+        date = start + timedelta(days=rnd.randint(-60, days + 60))
+        key = period_key(period, date)
+        if key not in keys: keys.append(key)
+    keys.sort()
+    if period == "day": ts_data = {"unixtime": keys}
+    else: ts_data = {period: keys}
+    for metric in ["commits", "authors", "ratio"]:
+        values = []
+        for key in keys:
+            value = rnd.choice([rnd.randint(0, 1000), rnd.random(), float('nan')])
+            values.append(value)
+        ts_data[metric] = values
+    return ts_data
+
+
+class TestCompletePeriodIds(unittest.TestCase):
+
+    def random_dates(self, rnd, max_days):
+        start = datetime(2000, 1, 1) + timedelta(days=rnd.randint(0, 5000))
+        end = start + timedelta(days=rnd.randint(1, max_days))
+        return ("'" + start.strftime("%Y-%m-%d") + "'",
+                "'" + end.strftime("%Y-%m-%d") + "'")
+
+    def test_same_as_legacy(self):
+        rnd = random.Random(1783)
+        for period in ["week", "month", "year"]:
+            for i in range(0, 200):
+                (startdate, enddate) = self.random_dates(rnd, 3000)
+                start = datetime.strptime(startdate, "'%Y-%m-%d'")
+                end = datetime.strptime(enddate, "'%Y-%m-%d'")
+                ts_data = random_series(rnd, period, start, end)
+                expected = legacyCompletePeriodIds(copy.deepcopy(ts_data), period,
+                                                   startdate, enddate)
+                result = completePeriodIds(ts_data, period, startdate, enddate)
+                self.assertEqual(expected, result)
+
+    def test_single_row(self):
+        ts_data = {"month": 24159, "commits": 5}
+        result = completePeriodIds(ts_data, "month", "'2013-01-01'", "'2013-06-01'")
+        self.assertEqual([24157, 24158, 24159, 24160, 24161], result["month"])
+        self.assertEqual([0, 0, 5, 0, 0], result["commits"])
+        self.assertEqual("Mar 2013", result["date"][2])
+
+    def test_quarters(self):
+        ts_data = {"quarter": [8053, 8055], "commits": [3, 7]}
+        result = completePeriodIds(ts_data, "quarter", "'2013-01-15'", "'2014-01-01'")
+        self.assertEqual([8053, 8054, 8055, 8056], result["quarter"])
+        self.assertEqual([3, 0, 7, 0], result["commits"])
+        self.assertEqual(["Jan 2013", "Apr 2013", "Jul 2013", "Oct 2013"],
+                         result["date"])
+        self.assertEqual([0, 1, 2, 3], result["id"])
+
+    def test_days(self):
+        day = calendar.timegm(datetime(2014, 2, 27).timetuple())
+        ts_data = {"unixtime": [day], "commits": [4]}
+        result = completePeriodIds(ts_data, "day", "'2014-02-26'", "'2014-03-02'")
+        self.assertEqual([0, 4, 0, 0], result["commits"])
+        self.assertEqual([unicode(day + i * 86400) for i in range(-1, 3)],
+                         result["unixtime"])
+        self.assertEqual("01 Mar 2014", result["date"][3])
+
+    def test_random_days_and_quarters(self):
+        rnd = random.Random(2015)
+        for period in ["day", "quarter"]:
+            for i in range(0, 100):
+                (startdate, enddate) = self.random_dates(rnd, 800)
+                start = datetime.strptime(startdate, "'%Y-%m-%d'")
+                end = datetime.strptime(enddate, "'%Y-%m-%d'")
+                ts_data = random_series(rnd, period, start, end)
+                field = "unixtime" if period == "day" else period
+                data = dict(zip(ts_data[field], ts_data["commits"]))
+                result = completePeriodIds(ts_data, period, startdate, enddate)
+                keys = result[field]
+                if period == "day": keys = [int(key) for key in keys]
+                # All periods, sorted and without gaps
+                self.assertEqual(keys[0], period_key(period, start))
+                self.assertEqual(keys[-1], period_key(period, end - timedelta(days=1)))
+                self.assertEqual(range(0, len(keys)), result["id"])
+                if period == "day":
+                    self.assertEqual(range(keys[0], keys[-1] + 86400, 86400), keys)
+                else:
+                    self.assertEqual(range(keys[0], keys[-1] + 1), keys)
+                for (key, value) in zip(keys, result["commits"]):
+                    expected = data.get(key, 0)
+                    if isinstance(expected, float) and expected != expected: expected = 0
+                    self.assertEqual(expected, value)
+
+
+
+class TestDayPeriods(unittest.TestCase):
+    """Days from the database in a session with a time zone not in UTC"""
+
+    def setUp(self):
+        try:
+            self.db = MySQLdb.connect(user='root', passwd='', host='127.0.0.1', port=3306)
+        except MySQLdb.Error:
+            raise unittest.SkipTest("MySQL server not available")
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_time_zones(self):
+        sql = DSQuery.GetSQLPeriod("day", "t.date", "COUNT(*) AS commits",
+                                   "(SELECT CAST('2014-02-27 23:30:00' AS DATETIME) AS date) t",
+                                   "", "'2014-02-26'", "'2014-03-02'")
+        cursor = self.db.cursor()
+        for time_zone in ["'+00:00'", "'+05:30'", "'-08:00'"]:
+            cursor.execute("SET time_zone = " + time_zone)
+            cursor.execute(sql)
+            (day, commits) = cursor.fetchone()
+            ts_data = {"unixtime": [int(day)], "commits": [int(commits)]}
+            result = completePeriodIds(ts_data, "day", "'2014-02-26'", "'2014-03-02'")
+            self.assertEqual([0, 1, 0, 0], result["commits"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+"""Tests for the time to merge and close pull requests series"""
+
+import datetime
+import random
+import re
+import sys
+import time
+import unittest
+
+if not '..' in sys.path:
+    sys.path.insert(0, '../..')
+
+import numpy as np
+
+from vizgrimoire.datahandlers.data_handler import DHESAPeriods
+from vizgrimoire.metrics.metrics_filter import MetricFilters
+from vizgrimoire.metrics.pullpo_metrics import TimeToClose, TimeToMerge
+from vizgrimoire.metrics.query_builder import DSQuery, PullpoQuery
+from utils import FakeConnection, FakeCursor, benchmark
+
+
+def pull_requests(seed, npulls):
+    """Synthetic pull_requests table: (created_at, merged_at, closed_at)"""
+    rnd = random.Random(seed)
+    start = datetime.datetime(2013, 1, 1)
+    pulls = []
+    for i in range(0, npulls):
+        created = start + datetime.timedelta(seconds=rnd.randint(0, 730 * 86400))
+        closed = created + datetime.timedelta(seconds=rnd.randint(60, 40 * 86400))
+        merged = None
+        if rnd.random() < 0.7: merged = closed
+        pulls.append((created, merged, closed))
+    return pulls
+
+
+class PullRequestsCursor(FakeCursor):
+    """Cursor running the time to queries in the synthetic table"""
+
+    def __init__(self, pulls):
+        FakeCursor.__init__(self)
+        self.pulls = pulls
+
+    def execute(self, sql):
+        if not sql.startswith("SELECT"):
+            return FakeCursor.execute(self, sql)
+        (fields, rest) = DSQuery._split_select(sql)
+        (field, start, end) = re.search("(\w+)>='([^']+)' AND \w+<'([^']+)'", rest).groups()
+        column = {"created_at": 0, "merged_at": 1, "closed_at": 2}[field]
+        start = datetime.datetime.strptime(start[0:10], "%Y-%m-%d")
+        end = datetime.datetime.strptime(end[0:10], "%Y-%m-%d")
+        columns = [re.search("as (\w+)$", f).group(1) for f in fields]
+        rows = []
+        for pull in self.pulls:
+            date = pull[column]
+            if date is None or date < start or date >= end: continue
+            row = []
+            for f in fields:
+                if f.startswith("TIMESTAMPDIFF"):
+                    row.append(int((date - pull[0]).total_seconds()))
+                else:
+                    row.append(date.strftime("%Y-%m-%d %H:%M:%S"))
+            rows.append(tuple(row))
+        self.responses = [("", columns, rows)]
+        FakeCursor.execute(self, sql)
+
+
+def fake_pullpo_query(cursor):
+    class FakeQuery(PullpoQuery):
+        def __SetDBChannel__(self, user=None, password=None, database=None,
+                             host="127.0.0.1", port=3306, group=None):
+            return FakeConnection(cursor)
+    return FakeQuery("user", "", "db", "db_identities")
+
+
+class TestDHESAPeriods(unittest.TestCase):
+
+    def test_statistics(self):
+        rnd = random.Random(1)
+        periods = [rnd.randint(0, 4) for i in range(0, 200)]
+        values = [rnd.randint(0, 1000) for i in range(0, 200)]
+        # Period 2 is empty
+        periods = [p if p != 2 else 3 for p in periods]
+        stats_data = DHESAPeriods(periods, values, 6)
+
+        self.assertEqual([0, 0], [stats_data.data["count"][i] for i in [2, 5]])
+        for i in range(0, 6):
+            period_values = [v for (p, v) in zip(periods, values) if p == i]
+            if len(period_values) == 0:
+                self.assertEqual(0, stats_data.data["median"][i])
+                continue
+            self.assertEqual(len(period_values), stats_data.data["count"][i])
+            self.assertEqual(min(period_values), stats_data.data["min"][i])
+            self.assertEqual(max(period_values), stats_data.data["max"][i])
+            self.assertAlmostEqual(np.mean(period_values), stats_data.data["mean"][i])
+            self.assertAlmostEqual(np.median(period_values), stats_data.data["median"][i])
+            self.assertAlmostEqual(np.percentile(period_values, 25),
+                                   stats_data.data["percentile25"][i])
+            self.assertAlmostEqual(np.percentile(period_values, 75),
+                                   stats_data.data["percentile75"][i])
+
+    def test_empty(self):
+        stats_data = DHESAPeriods([], [], 3)
+        self.assertEqual([0, 0, 0], stats_data.data["count"])
+        self.assertEqual([0, 0, 0], stats_data.data["mean"])
+
+
+class TestTimeToSeries(unittest.TestCase):
+
+    def setUp(self):
+        DSQuery.db_conn_pool = {}
+
+    def tearDown(self):
+        DSQuery.db_conn_pool = {}
+
+    def _check_series(self, metric_class, pulls, period, startdate, enddate):
+        cursor = PullRequestsCursor(pulls)
+        dbcon = fake_pullpo_query(cursor)
+        filters = MetricFilters(period, startdate, enddate)
+        metric = metric_class(dbcon, filters)
+        actionto = {TimeToMerge: "merged", TimeToClose: "closed"}[metric_class]
+
+        cursor.queries = []
+        start = time.time()
+        expected = dbcon.GetTimeToTimeSeriesDataByPeriod(filters, actionto)
+        loop_time = time.time() - start
+        nqueries = len(cursor.queries)
+
+        cursor.queries = []
+        start = time.time()
+        ts = metric.get_ts()
+        single_time = time.time() - start
+
+        self.assertEqual(expected, ts)
+        self.assertEqual(1, len(cursor.queries))
+        return (nqueries, loop_time, single_time)
+
+    def test_merge(self):
+        self._check_series(TimeToMerge, pull_requests(1, 500), "month",
+                           "'2013-01-01'", "'2015-01-01'")
+
+    def test_close_weeks(self):
+        self._check_series(TimeToClose, pull_requests(2, 500), "week",
+                           "'2013-03-01'", "'2013-09-01'")
+
+    def test_single_pull_request(self):
+        # Periods with one pull request have no statistics as in GetTimeToAgg
+        pulls = pull_requests(3, 1)
+        (created, merged, closed) = pulls[0]
+        startdate = "'%s'" % created.strftime("%Y-%m-01")
+        self._check_series(TimeToClose, pulls, "month", startdate, "'2016-01-01'")
+
+    @benchmark
+    def test_benchmark(self):
+        (nqueries, loop_time, single_time) = self._check_series(
+            TimeToMerge, pull_requests(4, 5000), "week", "'2013-01-01'", "'2015-01-01'")
+        self.assertTrue(nqueries > 100)
+        self.assertTrue(single_time < loop_time,
+                        "Time to merge series, %i queries: %.3f s, single query: %.3f s" %
+                        (nqueries, loop_time, single_time))
+
+
+if __name__ == '__main__':
+    unittest.main()
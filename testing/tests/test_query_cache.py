@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details. 
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+"""Tests for the persistent query cache"""
+
+import shutil
+import sys
+import tempfile
+import unittest
+
+if not '..' in sys.path:
+    sys.path.insert(0, '../..')
+
+from vizgrimoire.metrics.metrics_filter import MetricFilters
+from vizgrimoire.metrics.query_builder import DSQuery, SCMQuery
+from vizgrimoire.metrics.scm_metrics import Commits
+from vizgrimoire.query_cache import QueryCache
+from utils import FakeConnection, FakeCursor
+
+DB_SCM_TEST = 'cp_cvsanaly_GrimoireLibTests'
+DB_IDENTITIES_TEST = 'cp_sortinghat_GrimoireLibTests'
+
+
+def watermark_responses(last_commit, checksum = 1, total = 900):
+    return [("information_schema", ["table_name", "update_time"],
+             [("actions", None), ("people", None), ("people_uidentities", None),
+              ("scmlog", None)]),
+            ("MAX\(id\) FROM", ["COUNT(*)", "MAX(id)"], [(total, last_commit)]),
+            ("CHECKSUM TABLE", ["Table", "Checksum"], [("people_uidentities", checksum)])]
+
+
+class FakeSCMQuery(SCMQuery):
+    """SCMQuery using a fake connection instead of MySQL"""
+
+    cursor_used = None
+
+    def __SetDBChannel__(self, user=None, password=None, database=None,
+                         host="127.0.0.1", port=3306, group=None):
+        return FakeConnection(FakeSCMQuery.cursor_used)
+
+
+class TestQueryCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp(prefix='query-cache_')
+        self.cursor = FakeCursor(watermark_responses(1000) +
+                                 [("AS commits", ["commits"], [(42,)])])
+        FakeSCMQuery.cursor_used = self.cursor
+        DSQuery.db_conn_pool = {}
+        DSQuery.set_query_cache(QueryCache(self.cache_dir))
+        self.dbcon = FakeSCMQuery("user", "", DB_SCM_TEST, DB_IDENTITIES_TEST)
+        self.filters = MetricFilters("month", "'2013-01-01'", "'2014-01-01'")
+
+    def tearDown(self):
+        DSQuery.set_query_cache(None)
+        DSQuery.db_conn_pool = {}
+        shutil.rmtree(self.cache_dir)
+
+    def test_second_run_no_queries(self):
+        commits = Commits(self.dbcon, self.filters)
+        first = commits.get_agg()
+        self.assertEqual({'commits': 42}, first)
+
+        self.cursor.queries = []
+        second = commits.get_agg()
+        self.assertEqual([], self.cursor.queries)
+        self.assertEqual(first, second)
+        self.assertEqual({'hits': 1, 'misses': 1},
+                         DSQuery.get_query_cache().get_stats())
+
+    def test_cache_between_runs(self):
+        Commits(self.dbcon, self.filters).get_agg()
+
+        # A new run over the same database: only watermarks are read
+        DSQuery.set_query_cache(QueryCache(self.cache_dir))
+        self.cursor.queries = []
+        result = Commits(self.dbcon, self.filters).get_agg()
+        self.assertEqual({'commits': 42}, result)
+        for query in self.cursor.queries:
+            self.assertTrue("information_schema" in query or "MAX(id)" in query or
+                            "CHECKSUM TABLE " + DB_SCM_TEST + ".people_uidentities" in query)
+
+    def test_new_data_invalidates(self):
+        Commits(self.dbcon, self.filters).get_agg()
+
+        self.cursor.responses = watermark_responses(1001) + \
+            [("AS commits", ["commits"], [(43,)])]
+        DSQuery.set_query_cache(QueryCache(self.cache_dir))
+        result = Commits(self.dbcon, self.filters).get_agg()
+        self.assertEqual({'commits': 43}, result)
+        self.assertEqual({'hits': 0, 'misses': 1},
+                         DSQuery.get_query_cache().get_stats())
+
+    def test_removed_rows(self):
+        Commits(self.dbcon, self.filters).get_agg()
+
+        # Commits removed with the same last one
+        self.cursor.responses = watermark_responses(1000, 1, 850) + \
+            [("AS commits", ["commits"], [(40,)])]
+        DSQuery.get_query_cache().invalidate()
+        result = Commits(self.dbcon, self.filters).get_agg()
+        self.assertEqual({'commits': 40}, result)
+        self.assertEqual({'hits': 0, 'misses': 2},
+                         DSQuery.get_query_cache().get_stats())
+
+    def test_identities_changed(self):
+        Commits(self.dbcon, self.filters).get_agg()
+
+        # People mapped to other uuids
+        self.cursor.responses = watermark_responses(1000, 2) + \
+            [("AS commits", ["commits"], [(43,)])]
+        DSQuery.set_query_cache(QueryCache(self.cache_dir))
+        result = Commits(self.dbcon, self.filters).get_agg()
+        self.assertEqual({'commits': 43}, result)
+
+    def test_unknown_changes(self):
+        # people has no update_time nor watermark
+        sql = "SELECT COUNT(*) AS people FROM people"
+        self.dbcon.ExecuteQuery(sql)
+        self.cursor.queries = []
+        self.dbcon.ExecuteQuery(sql)
+        self.assertEqual([sql], self.cursor.queries)
+        self.assertEqual({'hits': 0, 'misses': 0},
+                         DSQuery.get_query_cache().get_stats())
+
+    def test_volatile_queries(self):
+        sql = "SELECT COUNT(*) AS commits FROM scmlog WHERE author_date < NOW()"
+        self.dbcon.ExecuteQuery(sql)
+        self.cursor.queries = []
+        self.dbcon.ExecuteQuery(sql)
+        self.assertEqual([sql], self.cursor.queries)
+
+
+if __name__ == "__main__":
+    unittest.main()
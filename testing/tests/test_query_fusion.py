@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+"""Tests for the fusion of the queries of several metrics"""
+
+import re
+import sys
+import unittest
+
+if not '..' in sys.path:
+    sys.path.insert(0, '../..')
+
+import MySQLdb
+
+from vizgrimoire.metrics.metrics import Metrics
+from vizgrimoire.metrics.metrics_filter import MetricFilters
+from vizgrimoire.metrics.query_builder import DSQuery, SCMQuery
+from vizgrimoire.metrics.scm_metrics import Actions, Authors, Branches, Commits, \
+    Committers, Files, Lines, Repositories
+from utils import FakeConnection, FakeCursor
+
+DB_SCM_TEST = 'jenkins_scm_vizr_1783'
+
+SCM_METRICS = [Commits, Authors, Committers, Branches, Repositories, Files,
+               Actions, Lines]
+
+
+class AggregateCursor(FakeCursor):
+    """Cursor returning a value for each column that depends only on the
+    column alias, the item and the period of the row"""
+
+    NMONTHS = 3
+    ITEMS = ["repo1", "repo2"]
+
+    def execute(self, sql):
+        if not sql.startswith("SELECT"):
+            return FakeCursor.execute(self, sql)
+        (fields, rest) = DSQuery._split_select(sql)
+        columns = []
+        for field in fields:
+            alias = re.search("(?:\\s+as\\s+|\\.)(\\w+)$", field, re.IGNORECASE)
+            columns.append(alias.group(1))
+        rows = [(None, None)]
+        if "GROUP BY" in rest:
+            rows = []
+            items = [None]
+            if "r.name" in rest: items = AggregateCursor.ITEMS
+            for item in items:
+                for month in range(0, AggregateCursor.NMONTHS):
+                    if "month" not in columns and month > 0: continue
+                    rows.append((item, 24157 + month))
+        values = []
+        for (item, month) in rows:
+            row = []
+            for column in columns:
+                if column == "name": row.append(item)
+                elif column == "month": row.append(month)
+                else: row.append(sum([ord(c) for c in str((column, item, month))]))
+            values.append(tuple(row))
+        self.responses = [("", columns, values)]
+        FakeCursor.execute(self, sql)
+
+
+def fake_query_builder(query_builder, cursor):
+    class FakeQuery(query_builder):
+        def __SetDBChannel__(self, user=None, password=None, database=None,
+                             host="127.0.0.1", port=3306, group=None):
+            return FakeConnection(cursor)
+    return FakeQuery("user", "", "db", "db_identities")
+
+
+def unfused_data(metrics, evolutionary):
+    data = {}
+    for metric in metrics:
+        if evolutionary: data[metric.id] = metric.get_ts()
+        else: data[metric.id] = metric.get_agg()
+    return data
+
+
+class TestFusionSQL(unittest.TestCase):
+
+    def test_signature(self):
+        first = DSQuery.GetSQLFusionParts(
+            "SELECT count(distinct(a.id)) as actions FROM actions a , scmlog s " +
+            "WHERE s.date >= '2013-01-01' AND a.commit_id = s.id")
+        second = DSQuery.GetSQLFusionParts(
+            "SELECT  sum(a.lines) AS lines FROM scmlog s, actions a " +
+            "WHERE a.commit_id = s.id and s.date >= '2013-01-01'")
+        self.assertEqual(first[0], second[0])
+        self.assertEqual(["count(distinct(a.id)) as actions"], first[1])
+        self.assertEqual("lines", DSQuery.GetSQLFieldAlias(second[1][0]))
+
+        sql = DSQuery.GetSQLFused(first[0], first[1] + second[1], first[2], first[3])
+        self.assertEqual("SELECT count(distinct(a.id)) as actions, sum(a.lines) AS lines " +
+                         "FROM actions a , scmlog s WHERE s.date >= '2013-01-01' AND " +
+                         "a.commit_id = s.id", sql)
+
+    def test_not_supported(self):
+        for sql in ["SELECT count(id) as total FROM scmlog LIMIT 10",
+                    "SELECT count(id) FROM scmlog",
+                    "SELECT id, count(id) as total FROM scmlog",
+                    "SELECT name, count(id) as total FROM t GROUP BY name HAVING total > 1",
+                    "UPDATE scmlog SET id = 1"]:
+            self.assertEqual(None, DSQuery.GetSQLFusionParts(sql))
+
+        # OR conditions are not reordered
+        first = DSQuery.GetSQLFusionParts("SELECT count(id) as a FROM t WHERE x = 1 AND y = 1 OR z = 1")
+        second = DSQuery.GetSQLFusionParts("SELECT count(id) as b FROM t WHERE y = 1 AND x = 1 OR z = 1")
+        self.assertNotEqual(first[0], second[0])
+
+
+class TestFusedMetrics(unittest.TestCase):
+
+    def setUp(self):
+        DSQuery.db_conn_pool = {}
+        self.cursor = AggregateCursor()
+        self.dbcon = fake_query_builder(SCMQuery, self.cursor)
+
+    def tearDown(self):
+        DSQuery.db_conn_pool = {}
+
+    def _get_metrics(self, type_analysis):
+        filters = MetricFilters("month", "'2013-01-01'", "'2013-04-01'", type_analysis)
+        return [metric(self.dbcon, filters) for metric in SCM_METRICS]
+
+    def _check_fused(self, type_analysis, evolutionary):
+        metrics = self._get_metrics(type_analysis)
+        self.cursor.queries = []
+        fused = Metrics.get_fused_data(metrics, evolutionary)
+
+        # branches, files and actions use the same tables
+        self.assertEqual(["actions", "branches", "files"], sorted(fused.keys()))
+        self.assertEqual(1, len(self.cursor.queries))
+        expected = unfused_data(metrics, evolutionary)
+        for metric_id in fused:
+            self.assertEqual(expected[metric_id], fused[metric_id])
+        return fused
+
+    def test_agg(self):
+        fused = self._check_fused(None, False)
+        self.assertEqual(["files"], fused["files"].keys())
+
+    def test_ts(self):
+        fused = self._check_fused(None, True)
+        self.assertEqual(3, len(fused["branches"]["branches"]))
+
+    def test_all_items(self):
+        self._check_fused(["repository", None], False)
+        fused = self._check_fused(["repository", None], True)
+        self.assertEqual(AggregateCursor.ITEMS, fused["actions"]["name"])
+
+    def test_different_filters(self):
+        metrics = self._get_metrics(None)
+        metrics[3].filters = metrics[3].filters.copy()
+        metrics[3].filters.startdate = "'2012-01-01'"
+        fused = Metrics.get_fused_data(metrics, False)
+        self.assertEqual(["actions", "files"], sorted(fused.keys()))
+
+
+class TestFusedMetricsDump(unittest.TestCase):
+    """Fused and not fused values in the SCM testing dump"""
+
+    @classmethod
+    def setUpClass(cls):
+        DSQuery.db_conn_pool = {}
+        try:
+            cls.dbcon = SCMQuery("root", "", DB_SCM_TEST, DB_SCM_TEST)
+        except MySQLdb.Error:
+            raise unittest.SkipTest("MySQL testing dumps not available")
+
+    @classmethod
+    def tearDownClass(cls):
+        DSQuery.db_conn_pool = {}
+
+    def _check(self, type_analysis, evolutionary):
+        filters = MetricFilters("month", "'2012-01-01'", "'2013-01-01'", type_analysis)
+        metrics = [metric(self.dbcon, filters) for metric in SCM_METRICS]
+        fused = Metrics.get_fused_data(metrics, evolutionary)
+        self.assertTrue(len(fused) > 1)
+        expected = unfused_data(metrics, evolutionary)
+        for metric_id in fused:
+            if type_analysis is not None and not evolutionary:
+                # Items are not sorted by the metric in fused queries
+                order = lambda data: sorted(zip(*[data[key] for key in sorted(data)]))
+                self.assertEqual(order(expected[metric_id]), order(fused[metric_id]))
+            else:
+                self.assertEqual(expected[metric_id], fused[metric_id])
+
+    def test_agg(self):
+        self._check(None, False)
+
+    def test_ts(self):
+        self._check(None, True)
+
+    def test_all_items(self):
+        self._check(["repository", None], False)
+        self._check(["repository", None], True)
+
+
+if __name__ == '__main__':
+    unittest.main()
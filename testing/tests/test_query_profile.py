@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+"""Tests for the profile of the SQL queries"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+if not '..' in sys.path:
+    sys.path.insert(0, '../..')
+
+import vizgrimoire.GrimoireSQL as GrimoireSQL
+from vizgrimoire.metrics.metrics_filter import MetricFilters
+from vizgrimoire.metrics.query_builder import DSQuery, SCMQuery
+from vizgrimoire.metrics.scm_metrics import Commits
+from vizgrimoire.query_profile import QueryProfile
+from utils import FakeConnection, FakeCursor
+
+
+class FakeSCMQuery(SCMQuery):
+    """SCMQuery using a fake connection instead of MySQL"""
+
+    cursor_used = None
+
+    def __SetDBChannel__(self, user=None, password=None, database=None,
+                         host="127.0.0.1", port=3306, group=None):
+        return FakeConnection(FakeSCMQuery.cursor_used)
+
+
+class TestQueryProfile(unittest.TestCase):
+
+    def setUp(self):
+        self.cursor = FakeCursor([("EXPLAIN", ["id", "table", "rows"], [(1, "scmlog", 1000)]),
+                                  ("AS month", ["month", "commits"], [(24160, 1), (24161, 2)]),
+                                  ("AS commits", ["commits"], [(42,)])])
+        FakeSCMQuery.cursor_used = self.cursor
+        DSQuery.db_conn_pool = {}
+        self.profile = QueryProfile()
+        DSQuery.set_query_profile(self.profile)
+        self.dbcon = FakeSCMQuery("user", "", "db", "db_identities")
+
+    def tearDown(self):
+        DSQuery.set_query_profile(None)
+        DSQuery.db_conn_pool = {}
+        GrimoireSQL.cursor = None
+
+    def _get_fingerprint(self, report, text):
+        for fingerprint in report["by_fingerprint"]:
+            if text in fingerprint["fingerprint"]: return fingerprint
+        return None
+
+    def test_fingerprint(self):
+        first = QueryProfile.fingerprint("SELECT  count(id)\n FROM scmlog WHERE date >= '2013-01-01' AND id IN (1, 2, 3)")
+        second = QueryProfile.fingerprint("SELECT count(id) FROM scmlog WHERE date >= 'it''s' AND id IN (4,5)")
+        self.assertEqual("SELECT count(id) FROM scmlog WHERE date >= ? AND id IN (?+)", first)
+        self.assertEqual(first, second)
+        # Numbers in identifiers are kept
+        self.assertEqual("SELECT t1.id FROM db2.t1 LIMIT ?",
+                         QueryProfile.fingerprint("SELECT t1.id FROM db2.t1 LIMIT 10"))
+
+    def test_metric_queries(self):
+        filters = MetricFilters("month", "'2013-01-01'", "'2014-01-01'",
+                                ["repository", "'repo1'"])
+        commits = Commits(self.dbcon, filters)
+        commits.get_agg()
+        filters.startdate = "'2012-01-01'"
+        commits.get_agg()
+        commits.get_ts()
+
+        report = self.profile.get_report()
+        agg = self._get_fingerprint(report, "as commits FROM")
+        self.assertEqual(2, agg["count"])
+        self.assertEqual(2, agg["rows"])
+        self.assertEqual(["Commits"], agg["classes"])
+        self.assertEqual(["scm"], agg["data_sources"])
+        self.assertEqual(["repository,'repo1'"], agg["type_analysis"])
+        self.assertEqual(2, self._get_fingerprint(report, "AS month")["rows"])
+        self.assertEqual(["scm"], [ds["data_source"] for ds in report["by_data_source"]])
+        self.assertEqual(["Commits"], [c["class"] for c in report["by_class"]])
+        self.assertEqual(3, report["total"]["count"])
+
+    def test_functions_queries(self):
+        GrimoireSQL.cursor = self.cursor
+        GrimoireSQL.dbname = "db"
+        GrimoireSQL.ExecuteQuery("SELECT 1 AS commits FROM scmlog")
+        report = self.profile.get_report()
+        self.assertEqual(["test_query_profile:test_functions_queries"],
+                         report["by_fingerprint"][0]["classes"])
+        self.assertEqual("db", report["by_fingerprint"][0]["data_sources"][0])
+
+    def test_explain(self):
+        self.profile.explain_threshold = 0
+        commits = Commits(self.dbcon, MetricFilters("month", "'2013-01-01'", "'2014-01-01'"))
+        commits.get_agg()
+        commits.get_agg()
+        self.dbcon.ExecuteQuery("SET @a = 1")
+
+        # Only once for each fingerprint and only for SELECT statements
+        explains = [q for q in self.cursor.queries if q.startswith("EXPLAIN")]
+        self.assertEqual(1, len(explains))
+        agg = self._get_fingerprint(self.profile.get_report(), "as commits FROM")
+        self.assertEqual([{"id": 1, "table": "scmlog", "rows": 1000}], agg["explain"])
+
+    def test_merge_and_write(self):
+        commits = Commits(self.dbcon, MetricFilters("month", "'2013-01-01'", "'2014-01-01'"))
+        commits.get_agg()
+        # Profile from a worker process
+        worker = QueryProfile()
+        DSQuery.set_query_profile(worker)
+        commits.get_agg()
+        commits.get_ts()
+        self.profile.merge(worker.get_data())
+
+        destdir = tempfile.mkdtemp(prefix='query-profile_')
+        try:
+            path = os.path.join(destdir, "query-profile.json")
+            self.profile.write(path)
+            report = json.load(open(path))
+        finally:
+            shutil.rmtree(destdir)
+        self.assertEqual(3, report["total"]["count"])
+        self.assertEqual(2, len(report["by_fingerprint"]))
+        self.assertEqual(2, self._get_fingerprint(report, "as commits FROM")["count"])
+
+
+if __name__ == '__main__':
+    unittest.main()
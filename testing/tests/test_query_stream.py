@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+"""Tests for the metrics computed from streamed rows"""
+
+import datetime
+import os
+import random
+import resource
+import sys
+import time
+import unittest
+
+if not '..' in sys.path:
+    sys.path.insert(0, '../..')
+
+from decimal import Decimal
+
+from vizgrimoire.analysis.its_states import TicketsStates
+from vizgrimoire.GrimoireUtils import medianAndAvgByPeriod, completePeriodIds
+from vizgrimoire.metrics.metrics_filter import MetricFilters
+from vizgrimoire.metrics.query_builder import DSQuery, ITSQuery, SCRQuery
+from vizgrimoire.metrics.scr_metrics import TimeToReview
+from utils import FakeConnection, FakeCursor, benchmark
+
+STATES = ["NEW", "ASSIGNED", "RESOLVED"]
+START = 1356998400 # 2013-01-01
+
+
+def fake_query_builder(query_builder, cursor):
+    class FakeQuery(query_builder):
+        def __SetDBChannel__(self, user=None, password=None, database=None,
+                             host="127.0.0.1", port=3306, group=None):
+            return FakeConnection(cursor)
+    return FakeQuery("user", "", "db", "db_identities")
+
+
+class IssuesLogCursor(object):
+    """Cursor generating the rows of an issues log when they are fetched"""
+
+    def __init__(self, nrows):
+        self.nrows = nrows
+        self.description = None
+        self.rowcount = 0
+        self._next = 0
+
+    def _row(self, i):
+        step = (365 * 24 * 3600) / self.nrows
+        return (i % 5000, STATES[(i / 5000) % 3], START + i * step)
+
+    def execute(self, sql):
+        self.description = [("issue_id",), ("status",), ("udate",)]
+        self.rowcount = self.nrows
+        self._next = 0
+
+    def fetchmany(self, size):
+        end = min(self._next + size, self.nrows)
+        rows = [self._row(i) for i in range(self._next, end)]
+        self._next = end
+        return rows
+
+    def fetchall(self):
+        return self.fetchmany(self.nrows)
+
+    def fetchone(self):
+        return self.fetchmany(1)[0]
+
+    def close(self):
+        pass
+
+
+def legacy_get_backlog(study, states, backend_type):
+    """get_backlog with all the issues log in memory"""
+    data = {study.filters.period : [study.filters.startdate, study.filters.enddate]}
+    data = completePeriodIds(data, study.filters.period,
+                             study.filters.startdate, study.filters.enddate)
+    tickets_states = {}
+    current_status = {}
+    for state in states:
+        current_status[state] = 0
+        data[state] = []
+
+    query = study.__get_sql_issues_states__(backend_type)
+    issues_log = study.db.ExecuteQuery(query)
+
+    periods = list(data['unixtime'][1:])
+    last_date = int(time.mktime(datetime.datetime.strptime(
+                    study.filters.enddate, "'%Y-%m-%d'").timetuple()))
+    periods.append(last_date)
+    end_period = int(periods.pop(0))
+
+    for i in range(len(issues_log['issue_id'])):
+        issue_id = issues_log['issue_id'][i]
+        issue_state = issues_log['status'][i]
+        issue_date = int(issues_log['udate'][i])
+        while issue_date >= end_period:
+            end_period = int(periods.pop(0))
+            for state, count in current_status.items():
+                data[state].append(count)
+        if issue_id not in tickets_states:
+            tickets_states[issue_id] = issue_state
+        elif tickets_states[issue_id] != issue_state:
+            old_state = tickets_states[issue_id]
+            if old_state in states:
+                current_status[old_state] -= 1
+            tickets_states[issue_id] = issue_state
+        else:
+            continue
+        if issue_state in states:
+            current_status[issue_state] += 1
+
+    for state, count in current_status.items():
+        data[state].append(count)
+    while periods:
+        periods.pop(0)
+        for state in states:
+            data[state].append(data[state][-1])
+    return data
+
+
+def peak_memory(function, *args):
+    """Increase of the max RSS, in KB, when running function in a child"""
+    (read_fd, write_fd) = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        try:
+            start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            function(*args)
+            end = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            os.write(write_fd, str(end - start))
+        finally:
+            os._exit(0)
+    os.close(write_fd)
+    result = os.read(read_fd, 100)
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+    return int(result)
+
+
+class TestExecuteQueryStream(unittest.TestCase):
+
+    def setUp(self):
+        DSQuery.db_conn_pool = {}
+
+    def tearDown(self):
+        DSQuery.db_conn_pool = {}
+
+    def test_chunks(self):
+        rows = [(i, "name%i" % i) for i in range(0, 25)]
+        cursor = FakeCursor([("SELECT", ["id", "name"], rows)])
+        dbcon = fake_query_builder(SCRQuery, cursor)
+
+        chunks = list(dbcon.ExecuteQueryStream("SELECT id, name FROM t", 10))
+        self.assertEqual([10, 10, 5], [len(chunk["id"]) for chunk in chunks])
+        self.assertEqual(range(0, 25), sum([chunk["id"] for chunk in chunks], []))
+        self.assertEqual("name24", chunks[-1]["name"][-1])
+
+        cursor.responses = [("SELECT", ["id"], [])]
+        self.assertEqual([], list(dbcon.ExecuteQueryStream("SELECT id FROM t")))
+
+
+class TestTimeToReview(unittest.TestCase):
+
+    def setUp(self):
+        DSQuery.db_conn_pool = {}
+        rnd = random.Random(1)
+        self.rows = []
+        for i in range(0, 500):
+            changed_on = datetime.datetime(2013, 1, 1) + datetime.timedelta(hours=i * 17)
+            self.rows.append((Decimal(rnd.randint(0, 1000)) / 100, changed_on))
+        cursor = FakeCursor([("FROM people", ["id"], []),
+                             ("revtime", ["revtime", "changed_on"], self.rows)])
+        filters = MetricFilters("month", "'2013-01-01'", "'2014-01-01'")
+        self.metric = TimeToReview(fake_query_builder(SCRQuery, cursor), filters)
+        DSQuery.stream_chunk_size = 64
+
+    def tearDown(self):
+        DSQuery.db_conn_pool = {}
+        DSQuery.stream_chunk_size = 10000
+
+    def test_agg(self):
+        from numpy import median, average
+        values = [float(row[0]) for row in self.rows]
+        data = self.metric.get_agg()
+        self.assertAlmostEqual(median(values), data["review_time_days_median"])
+        self.assertAlmostEqual(average(values), data["review_time_days_avg"])
+
+    def test_ts(self):
+        legacy = medianAndAvgByPeriod("month", [row[1] for row in self.rows],
+                                      [row[0] for row in self.rows])
+        data = self.metric.get_ts()
+        self.assertEqual(12, len(data["review_time_days_median"]))
+        self.assertEqual(legacy["median"], data["review_time_days_median"])
+        self.assertEqual(legacy["avg"], data["review_time_days_avg"])
+
+
+class TestBacklog(unittest.TestCase):
+
+    def setUp(self):
+        DSQuery.db_conn_pool = {}
+
+    def tearDown(self):
+        DSQuery.db_conn_pool = {}
+
+    def _get_study(self, nrows):
+        dbcon = fake_query_builder(ITSQuery, IssuesLogCursor(nrows))
+        filters = MetricFilters("month", "'2013-01-01'", "'2014-01-01'")
+        return TicketsStates(dbcon, filters)
+
+    def test_backlog(self):
+        study = self._get_study(50000)
+        self.assertEqual(legacy_get_backlog(study, STATES, "bugzilla"),
+                         study.get_backlog(STATES, "bugzilla"))
+
+    @benchmark
+    def test_memory(self):
+        # tracemalloc is not available in Python 2, the max RSS is used
+        nrows = 1000000
+        legacy = peak_memory(legacy_get_backlog, self._get_study(nrows), STATES, "bugzilla")
+        stream = peak_memory(self._get_study(nrows).get_backlog, STATES, "bugzilla")
+        self.assertTrue(stream * 4 < legacy,
+                        "%i rows: max RSS increase %i KB loading all rows, %i KB streaming" %
+                        (nrows, legacy, stream))
+
+
+if __name__ == '__main__':
+    unittest.main()
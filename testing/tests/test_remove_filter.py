@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+"""Tests for the removal of the data of a filter item"""
+
+import sys
+import unittest
+
+if not '..' in sys.path:
+    sys.path.insert(0, '../..')
+
+import MySQLdb
+
+import vizgrimoire.GrimoireSQL as GrimoireSQL
+from vizgrimoire.GrimoireSQL import DeleteStaged, DropStage, ExecuteQuery, StageIds
+from vizgrimoire.filter import Filter
+from vizgrimoire.SCM import SCM
+from utils import FakeCursor, set_db_channel
+
+DB_REMOVE_TEST = 'cp_remove_GrimoireLibTests'
+
+SCM_SCHEMA = [
+    "CREATE TABLE repositories (id INT PRIMARY KEY, uri VARCHAR(255))",
+    "CREATE TABLE people (id INT PRIMARY KEY, name VARCHAR(255))",
+    "CREATE TABLE people_upeople (people_id INT, upeople_id INT)",
+    "CREATE TABLE scmlog (id INT PRIMARY KEY, repository_id INT, committer_id INT, author_id INT)",
+    "CREATE TABLE actions (id INT PRIMARY KEY, commit_id INT)",
+    "CREATE TABLE file_copies (id INT PRIMARY KEY, action_id INT)",
+    "CREATE TABLE commits_lines (id INT PRIMARY KEY, commit_id INT)",
+    "CREATE TABLE file_links (id INT PRIMARY KEY, commit_id INT)",
+    "CREATE TABLE tags (id INT PRIMARY KEY, name VARCHAR(255))",
+    "CREATE TABLE tag_revisions (id INT PRIMARY KEY, tag_id INT, commit_id INT)",
+    "CREATE TABLE files (id INT PRIMARY KEY, repository_id INT)",
+    "CREATE TABLE file_types (id INT PRIMARY KEY, file_id INT)"
+]
+
+NCOMMITS = 120 # commits in each repository
+
+
+def scm_fixture():
+    """Two repositories with the same structure of data"""
+    rows = []
+    rows.append("INSERT INTO repositories VALUES (1, 'repo1'), (2, 'repo2')")
+    # people 1 and 2 only in repo1, 3 only in repo2 and 4 in both
+    for people_id in range(1, 5):
+        rows.append("INSERT INTO people VALUES (%i, 'p%i')" % (people_id, people_id))
+        rows.append("INSERT INTO people_upeople VALUES (%i, %i)" % (people_id, people_id))
+    for repo in [1, 2]:
+        if repo == 1: authors = [1, 2]
+        else: authors = [3, 3]
+        for i in range(0, NCOMMITS):
+            commit = repo * 1000 + i
+            rows.append("INSERT INTO scmlog VALUES (%i, %i, 4, %i)" %
+                        (commit, repo, authors[i % 2]))
+            rows.append("INSERT INTO actions VALUES (%i, %i)" % (commit, commit))
+            rows.append("INSERT INTO file_copies VALUES (%i, %i)" % (commit, commit))
+            rows.append("INSERT INTO commits_lines VALUES (%i, %i)" % (commit, commit))
+            rows.append("INSERT INTO file_links VALUES (%i, %i)" % (commit, commit))
+            rows.append("INSERT INTO files VALUES (%i, %i)" % (commit, repo))
+            rows.append("INSERT INTO file_types VALUES (%i, %i)" % (commit, commit))
+        # One tag with two revisions
+        rows.append("INSERT INTO tags VALUES (%i, 'tag%i')" % (repo, repo))
+        rows.append("INSERT INTO tag_revisions VALUES (%i, %i, %i)" % (repo * 10, repo, repo * 1000))
+        rows.append("INSERT INTO tag_revisions VALUES (%i, %i, %i)" % (repo * 10 + 1, repo, repo * 1000 + 1))
+    return rows
+
+
+class TestDeleteStaged(unittest.TestCase):
+
+    def setUp(self):
+        self.cursor = FakeCursor([("DELETE", ["id"], [(1,), (2,)])])
+        GrimoireSQL.cursor = self.cursor
+        GrimoireSQL.dbname = "db"
+
+    def tearDown(self):
+        GrimoireSQL.cursor = None
+        GrimoireSQL.dbname = None
+
+    def test_batches(self):
+        deletes = ["DELETE a FROM a JOIN stage t ON a.id = t.id WHERE %(batch)s",
+                   "DELETE b FROM b JOIN stage t ON b.id = t.id WHERE %(batch)s"]
+        removed = DeleteStaged("test", "stage", 12, deletes, 5)
+
+        # Three transactions with two deletes each
+        self.assertEqual(12, removed)
+        self.assertEqual(12, len(self.cursor.queries))
+        self.assertEqual(3, self.cursor.queries.count("START TRANSACTION"))
+        self.assertEqual(3, self.cursor.queries.count("COMMIT"))
+        self.assertTrue(self.cursor.queries[1].endswith("t.pos > 0 AND t.pos <= 5"))
+        self.assertTrue(self.cursor.queries[-2].endswith("t.pos > 10 AND t.pos <= 12"))
+
+    def test_rollback(self):
+        deletes = ["DELETE a FROM a JOIN stage t ON a.id = t.id WHERE %(batch)s"]
+        def execute(sql):
+            FakeCursor.execute(self.cursor, sql)
+            if sql.startswith("DELETE"): raise MySQLdb.OperationalError()
+        self.cursor.execute = execute
+
+        self.assertRaises(MySQLdb.OperationalError,
+                          DeleteStaged, "test", "stage", 12, deletes, 5)
+        self.assertEqual("ROLLBACK", self.cursor.queries[-1])
+
+    def test_statements_scm(self):
+        # Number of statements does not depend on the number of commits
+        self.cursor.responses = [("FROM repositories", ["id"], [(1,)]),
+                                 ("INSERT INTO tmp_remove_people", [], [()] * 2),
+                                 ("INSERT INTO tmp_remove_scmlog", [], [()] * 12000),
+                                 ("INSERT INTO tmp_remove_files", [], [()] * 3)]
+        SCM.remove_filter_data(Filter("repository", "repo1"))
+        deletes = [q for q in self.cursor.queries if q.strip().startswith("DELETE")]
+        # 2 people, 6 * 3 commits and 2 files deletes, and the repository
+        self.assertEqual(23, len(deletes))
+
+
+class TestRemoveFilterData(unittest.TestCase):
+    """Row counts in a local fixture database after removing a repository"""
+
+    @classmethod
+    def setUpClass(cls):
+        try:
+            db = MySQLdb.connect(user='root', passwd='', host='127.0.0.1', port=3306)
+        except MySQLdb.Error:
+            raise unittest.SkipTest("MySQL server not available")
+        cursor = db.cursor()
+        cursor.execute("DROP DATABASE IF EXISTS " + DB_REMOVE_TEST)
+        cursor.execute("CREATE DATABASE " + DB_REMOVE_TEST + " CHARACTER SET utf8")
+        db.close()
+        set_db_channel(database=DB_REMOVE_TEST)
+        for q in SCM_SCHEMA + scm_fixture():
+            ExecuteQuery(q)
+        ExecuteQuery("COMMIT")
+
+    @classmethod
+    def tearDownClass(cls):
+        ExecuteQuery("DROP DATABASE " + DB_REMOVE_TEST)
+
+    def _count(self, table):
+        return ExecuteQuery("SELECT COUNT(*) AS total FROM " + table)['total']
+
+    def test_stage_ids(self):
+        # Auto increment values are 1, 4, 7... in multi master clusters
+        ExecuteQuery("SET SESSION auto_increment_increment = 3")
+        try:
+            total = StageIds("tmp_test_stage", "SELECT id FROM scmlog")
+            positions = ExecuteQuery("SELECT pos FROM tmp_test_stage")['pos']
+            self.assertEqual(range(1, total + 1), sorted(positions))
+        finally:
+            ExecuteQuery("SET SESSION auto_increment_increment = 1")
+            DropStage("tmp_test_stage")
+
+    def test_remove_repository(self):
+        tables = ["repositories", "scmlog", "actions", "file_copies", "commits_lines",
+                  "file_links", "files", "file_types", "tags", "tag_revisions"]
+        before = dict([(table, self._count(table)) for table in tables])
+        self.assertEqual(2 * NCOMMITS, before["scmlog"])
+        self.assertEqual(4, self._count("people"))
+
+        GrimoireSQL.DELETE_BATCH_SIZE = 50
+        try:
+            SCM.remove_filter_data(Filter("repository", "repo1"))
+        finally:
+            GrimoireSQL.DELETE_BATCH_SIZE = 5000
+
+        # Only the data of repo2 is kept
+        for table in tables:
+            self.assertEqual(before[table] / 2, self._count(table))
+        self.assertEqual(0, self._count("scmlog WHERE repository_id=1"))
+        self.assertEqual(0, self._count("tag_revisions WHERE tag_id=1"))
+        # People from repo2 and people in both repositories are kept
+        self.assertEqual([3, 4], sorted(ExecuteQuery("SELECT id FROM people")['id']))
+        self.assertEqual(2, self._count("people_upeople"))
+
+
+if __name__ == '__main__':
+    unittest.main()
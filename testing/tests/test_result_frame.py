@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+"""Tests for columnar query results"""
+
+import random
+import sys
+import time
+import unittest
+
+if not '..' in sys.path:
+    sys.path.insert(0, '../..')
+
+from decimal import Decimal
+
+import numpy
+
+from vizgrimoire.GrimoireUtils import fill_and_order_items
+from vizgrimoire.metrics.metrics import Metrics
+from vizgrimoire.metrics.query_builder import DSQuery
+from vizgrimoire.result_frame import ResultFrame
+from utils import FakeCursor, benchmark
+
+# name, MySQL type code
+DESCRIPTION = [("name", 253), ("month", 8), ("commits", 8), ("avg", 246)]
+
+
+def legacy_fetch_result(cursor, sql):
+    result = {}
+    cursor.execute(sql)
+    columns = cursor.description
+    for column in columns:
+        result[column[0]] = []
+    for value in cursor.fetchall():
+        for (index,column) in enumerate(value):
+            result[columns[index][0]].append(column)
+    return result
+
+
+def legacy_convert_group_to_ts(data, id_field):
+    ts = {}
+    fields = data.keys()
+    fields.remove(id_field)
+    id_fields = list(set(data[id_field]))
+    ts[id_field] = id_fields
+    for field in fields:
+        ts[field]  = []
+        for id in id_fields:
+            ts[field].append([])
+    for i in range(0, len(data[id_field])):
+        item = data[id_field][i]
+        pos = id_fields.index(item)
+        for field in fields:
+            ts[field][pos].append(data[field][i])
+    return ts
+
+
+def group_rows(rnd, nrows, nitems):
+    rows = []
+    for i in range(0, nrows):
+        rows.append(("item%i" % rnd.randint(0, nitems - 1), 24000 + i % 120,
+                     rnd.randint(0, 100), Decimal(rnd.randint(0, 100)) / 4))
+    return rows
+
+
+def frame_cursor(rows):
+    cursor = FakeCursor([("", [column for (column, type_code) in DESCRIPTION], rows)])
+    # FakeCursor has no type codes
+    execute = cursor.execute
+    def execute_typed(sql):
+        execute(sql)
+        cursor.description = [(column, type_code, None, None, None, None, True)
+                              for (column, type_code) in DESCRIPTION]
+    cursor.execute = execute_typed
+    return cursor
+
+
+def sorted_ts(ts, id_field):
+    """ts items in the same order"""
+    order = sorted(range(0, len(ts[id_field])), key=lambda i: ts[id_field][i])
+    return dict([(field, [ts[field][i] for i in order]) for field in ts])
+
+
+class TestResultFrame(unittest.TestCase):
+
+    def test_types(self):
+        rows = [("a", 1, 3, Decimal("1.5")), ("b", None, 4, Decimal("2"))]
+        frame = ResultFrame.from_rows(DESCRIPTION, rows)
+        self.assertEqual(numpy.int64, frame.array("commits").dtype)
+        self.assertEqual([Decimal("1.5"), Decimal("2")], frame["avg"])
+        # NULL values
+        self.assertEqual(object, frame.array("month").dtype)
+        self.assertEqual([1, None], frame["month"])
+        self.assertEqual(2, len(frame))
+
+        frame = ResultFrame.from_rows([("avg", 5)], [(1.5,), (2.5,)])
+        self.assertEqual(numpy.float64, frame.array("avg").dtype)
+
+        # Unsigned BIGINT values out of the int64 range
+        frame = ResultFrame.from_rows([("id", 8)], [(1,), (2**64 - 1,)])
+        self.assertEqual(object, frame.array("id").dtype)
+        self.assertEqual([1, 2**64 - 1], frame["id"])
+
+    def test_no_query(self):
+        cursor = FakeCursor()
+        frame = DSQuery.execute_cursor_frame(cursor, "db", None)
+        self.assertEqual([], frame.keys())
+        self.assertEqual(0, len(frame))
+        self.assertEqual({}, frame.tolist())
+        self.assertEqual([], cursor.queries)
+
+    def test_tolist(self):
+        rnd = random.Random(1)
+        for nrows in [0, 1, 2, 100]:
+            rows = group_rows(rnd, nrows, 10)
+            frame = DSQuery.execute_cursor_frame(frame_cursor(rows), "db", "SELECT")
+            result = DSQuery.execute_cursor_query(frame_cursor(rows), "db", "SELECT")
+            self.assertEqual(result, frame.tolist())
+            self.assertEqual(set(result.keys()), set(frame.keys()))
+
+    def test_fetch_result(self):
+        rows = group_rows(random.Random(2), 50, 5)
+        self.assertEqual(legacy_fetch_result(frame_cursor(rows), "SELECT"),
+                         DSQuery._fetch_result(frame_cursor(rows), "SELECT"))
+
+    def test_convert_group_to_ts(self):
+        rnd = random.Random(3)
+        for (nrows, nitems) in [(0, 1), (1, 1), (30, 3), (500, 40)]:
+            rows = group_rows(rnd, nrows, nitems)
+            data = legacy_fetch_result(frame_cursor(rows), "SELECT")
+            expected = sorted_ts(legacy_convert_group_to_ts(data, "name"), "name")
+            frame = DSQuery.execute_cursor_frame(frame_cursor(rows), "db", "SELECT")
+            self.assertEqual(expected, sorted_ts(Metrics._convert_group_to_ts(frame, "name"), "name"))
+            data = legacy_fetch_result(frame_cursor(rows), "SELECT")
+            self.assertEqual(expected, sorted_ts(Metrics._convert_group_to_ts(data, "name"), "name"))
+
+    def test_fill_and_order_items(self):
+        data = {"name": ["b", "a", "c"], "commits": [2, 1, 3]}
+        items = ["a", "b", "c", "d"]
+        data = fill_and_order_items(items, data, "name")
+        self.assertEqual({"name": items, "commits": [1, 2, 3, 0]}, data)
+
+    @benchmark
+    def test_benchmark(self):
+        nrows = 1000000
+        rows = group_rows(random.Random(4), nrows, 200)
+
+        start = time.time()
+        data = legacy_fetch_result(frame_cursor(rows), "SELECT")
+        legacy_ts = legacy_convert_group_to_ts(data, "name")
+        legacy_time = time.time() - start
+
+        start = time.time()
+        frame = DSQuery.execute_cursor_frame(frame_cursor(rows), "db", "SELECT")
+        ts = Metrics._convert_group_to_ts(frame, "name")
+        frame_time = time.time() - start
+
+        self.assertEqual(len(legacy_ts["name"]), len(ts["name"]))
+        self.assertTrue(frame_time < legacy_time, "%i rows: dict of lists %.2fs, frame %.2fs" %
+                        (nrows, legacy_time, frame_time))
+
+
+if __name__ == '__main__':
+    unittest.main()
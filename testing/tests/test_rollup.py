@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+"""Tests for time series and aggregated values from ROLLUP queries"""
+
+import random
+import re
+import sys
+import unittest
+
+if not '..' in sys.path:
+    sys.path.insert(0, '../..')
+
+import MySQLdb
+
+from vizgrimoire.metrics.metrics import Metrics
+from vizgrimoire.metrics.metrics_filter import MetricFilters
+from vizgrimoire.metrics.mls_metrics import EmailsSenders
+from vizgrimoire.metrics.query_builder import DSQuery, SCMQuery, MLSQuery
+from vizgrimoire.metrics.scm_metrics import Authors, Commits
+from utils import FakeConnection, FakeCursor
+
+DB_ROLLUP_TEST = 'cp_rollup_GrimoireLibTests'
+
+
+def activity(seed):
+    """(month, person) for each action, the same people in several months"""
+    rnd = random.Random(seed)
+    return [(24157 + rnd.randint(0, 5), "uuid%i" % rnd.randint(0, 20))
+            for i in range(0, 300)]
+
+
+class DistinctCursor(FakeCursor):
+    """Cursor computing count(distinct) of people for the activity"""
+
+    def __init__(self, activity):
+        FakeCursor.__init__(self)
+        self.activity = activity
+
+    def execute(self, sql):
+        if not sql.startswith("SELECT"):
+            return FakeCursor.execute(self, sql)
+        alias = re.search("count\(distinct\(pup.uuid\)\) as (\w+)", sql).group(1)
+        months = sorted(set([month for (month, uuid) in self.activity]))
+        if "GROUP BY" in sql:
+            rows = []
+            for month in months:
+                people = set([uuid for (m, uuid) in self.activity if m == month])
+                rows.append((month, len(people)))
+            if "WITH ROLLUP" in sql:
+                rows.append((None, len(set([uuid for (m, uuid) in self.activity]))))
+            self.responses = [("", ["month", alias], rows)]
+        else:
+            rows = [(len(set([uuid for (m, uuid) in self.activity])),)]
+            self.responses = [("", [alias], rows)]
+        FakeCursor.execute(self, sql)
+
+
+def fake_query_builder(query_builder, cursor):
+    class FakeQuery(query_builder):
+        def __SetDBChannel__(self, user=None, password=None, database=None,
+                             host="127.0.0.1", port=3306, group=None):
+            return FakeConnection(cursor)
+    return FakeQuery("user", "", "db", "db_identities")
+
+
+class TestRollupSQL(unittest.TestCase):
+
+    def test_rollup(self):
+        sql = ("SELECT YEAR(s.date)*12+MONTH(s.date) AS month, count(distinct(pup.uuid)) as authors " +
+               "FROM scmlog s WHERE s.date >= '2013-01-01' GROUP BY YEAR(s.date),MONTH(s.date) " +
+               "ORDER BY YEAR(s.date),MONTH(s.date)")
+        (rollup, period) = DSQuery.GetSQLRollup(sql)
+        self.assertEqual("month", period)
+        self.assertEqual("SELECT YEAR(s.date)*12+MONTH(s.date) AS month, count(distinct(pup.uuid)) as authors " +
+                         "FROM scmlog s WHERE s.date >= '2013-01-01' " +
+                         "GROUP BY YEAR(s.date)*12+MONTH(s.date) WITH ROLLUP", rollup)
+        self.assertEqual("SELECT count(distinct(pup.uuid)) as authors FROM scmlog s " +
+                         "WHERE s.date >= '2013-01-01'", DSQuery.GetSQLRollupTotal(sql))
+
+    def test_not_supported(self):
+        for sql in ["SELECT count(id) as total FROM scmlog",
+                    # All items
+                    "SELECT YEAR(d) AS year, r.name, count(id) as total FROM t GROUP BY r.name, YEAR(d)",
+                    "SELECT YEAR(d) AS year, count(id) as total FROM t GROUP BY YEAR(d) LIMIT 10"]:
+            self.assertEqual(None, DSQuery.GetSQLRollup(sql))
+
+    def test_split_rollup(self):
+        result = {"month": [1, 2, None], "authors": [3, 4, 5]}
+        self.assertEqual(({"month": [1, 2], "authors": [3, 4]}, {"authors": 5}),
+                         DSQuery.split_rollup(result, "month"))
+        # Values for only one row as ExecuteQuery
+        result = {"month": [1, None], "authors": [3, 3]}
+        self.assertEqual(({"month": 1, "authors": 3}, {"authors": 3}),
+                         DSQuery.split_rollup(result, "month"))
+        result = {"month": [], "authors": []}
+        self.assertEqual((result, None), DSQuery.split_rollup(result, "month"))
+
+
+class TestRollupMetrics(unittest.TestCase):
+
+    def setUp(self):
+        DSQuery.db_conn_pool = {}
+        self.filters = MetricFilters("month", "'2013-01-01'", "'2013-07-01'")
+
+    def tearDown(self):
+        DSQuery.db_conn_pool = {}
+
+    def _check_distinct(self, query_builder, metric_class, field):
+        cursor = DistinctCursor(activity(1))
+        metric = metric_class(fake_query_builder(query_builder, cursor), self.filters)
+        cursor.queries = []
+        rollup_aggs = {}
+        ts = Metrics.get_fused_data([metric], True, rollup_aggs)[metric.id]
+        self.assertEqual(1, len(cursor.queries))
+        agg = Metrics.get_fused_data([metric], False, rollup_aggs)[metric.id]
+        # The aggregated value is not queried again
+        self.assertEqual(1, len(cursor.queries))
+        self.assertEqual({}, rollup_aggs)
+
+        # Distinct people in all the months is not the sum of the months
+        self.assertTrue(agg[field] < sum(ts[field]))
+        self.assertEqual(metric.get_agg(), agg)
+        self.assertEqual(metric.get_ts(), ts)
+        self.assertEqual(3, len(cursor.queries))
+
+    def test_authors(self):
+        self._check_distinct(SCMQuery, Authors, "authors")
+
+    def test_senders(self):
+        self._check_distinct(MLSQuery, EmailsSenders, "senders")
+
+    def test_other_filters(self):
+        cursor = DistinctCursor(activity(2))
+        metric = Authors(fake_query_builder(SCMQuery, cursor), self.filters)
+        rollup_aggs = {}
+        Metrics.get_fused_data([metric], True, rollup_aggs)
+        metric.filters = MetricFilters("month", "'2013-02-01'", "'2013-07-01'")
+        cursor.queries = []
+        self.assertEqual({}, Metrics.get_fused_data([metric], False, rollup_aggs))
+        metric.get_agg()
+        self.assertEqual(1, len(cursor.queries))
+        self.assertEqual(1, len(rollup_aggs))
+
+    def test_get_agg(self):
+        """ get_agg, as in evaluate, always runs the query """
+        cursor = DistinctCursor(activity(1))
+        metric = Authors(fake_query_builder(SCMQuery, cursor), self.filters)
+        rollup_aggs = {}
+        Metrics.get_fused_data([metric], True, rollup_aggs)
+        cursor.queries = []
+        metric.evaluate(self.filters, "agg")
+        self.assertEqual(1, len(cursor.queries))
+        self.assertEqual(1, len(rollup_aggs))
+
+
+class TestRollupDatabase(unittest.TestCase):
+    """ROLLUP and separated queries in a local fixture database"""
+
+    @classmethod
+    def setUpClass(cls):
+        try:
+            db = MySQLdb.connect(user='root', passwd='', host='127.0.0.1', port=3306)
+        except MySQLdb.Error:
+            raise unittest.SkipTest("MySQL server not available")
+        cursor = db.cursor()
+        cursor.execute("DROP DATABASE IF EXISTS " + DB_ROLLUP_TEST)
+        cursor.execute("CREATE DATABASE " + DB_ROLLUP_TEST + " CHARACTER SET utf8")
+        cursor.execute("USE " + DB_ROLLUP_TEST)
+        cursor.execute("CREATE TABLE scmlog (id INT PRIMARY KEY, rev VARCHAR(40), " +
+                       "author_id INT, committer_id INT, author_date DATETIME)")
+        cursor.execute("CREATE TABLE actions (id INT PRIMARY KEY, commit_id INT)")
+        cursor.execute("CREATE TABLE people_uidentities (people_id INT, uuid VARCHAR(40))")
+        for person in range(0, 21):
+            cursor.execute("INSERT INTO people_uidentities VALUES (%i, 'uuid%i')" %
+                           (person, person / 2))
+        for (i, (month, uuid)) in enumerate(activity(3)):
+            date = "2013-%02i-15" % (month - 24157 + 1)
+            person = int(uuid[4:])
+            cursor.execute("INSERT INTO scmlog VALUES (%i, 'rev%i', %i, %i, '%s')" %
+                           (i, i, person, person, date))
+            cursor.execute("INSERT INTO actions VALUES (%i, %i)" % (i, i))
+        db.commit()
+        db.close()
+        DSQuery.db_conn_pool = {}
+        cls.dbcon = SCMQuery("root", "", DB_ROLLUP_TEST, DB_ROLLUP_TEST)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.dbcon.ExecuteQuery("DROP DATABASE " + DB_ROLLUP_TEST)
+        DSQuery.db_conn_pool = {}
+
+    def test_rollup(self):
+        filters = MetricFilters("month", "'2013-01-01'", "'2014-01-01'")
+        metrics = [Authors(self.dbcon, filters), Commits(self.dbcon, filters)]
+        expected = [(metric.get_ts(), metric.get_agg()) for metric in metrics]
+
+        rollup_aggs = {}
+        ts = Metrics.get_fused_data(metrics, True, rollup_aggs)
+        self.assertEqual(len(metrics), len(rollup_aggs))
+        agg = Metrics.get_fused_data(metrics, False, rollup_aggs)
+        for (metric, (metric_ts, metric_agg)) in zip(metrics, expected):
+            self.assertEqual(metric_ts, ts[metric.id])
+            self.assertEqual(metric_agg, agg[metric.id])
+        self.assertTrue(expected[0][1]["authors"] < sum(expected[0][0]["authors"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
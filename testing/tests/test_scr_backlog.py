@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+"""Tests for the backlogs of reviews replaying their events"""
+
+import calendar
+import random
+import sys
+import unittest
+
+from datetime import datetime, timedelta
+
+if not '..' in sys.path:
+    sys.path.insert(0, '../..')
+
+import MySQLdb
+
+from vizgrimoire.GrimoireUtils import BacklogSweep
+from vizgrimoire.metrics.metrics_filter import MetricFilters
+from vizgrimoire.metrics.query_builder import DSQuery, SCRQuery
+from vizgrimoire.metrics.scr_metrics import Pending, PatchesWaitingForReviewer, \
+    ReviewsWaitingForReviewerTS
+from utils import FakeConnection, FakeCursor
+
+DB_SCR_TEST = 'jenkins_scr_vizr_1783'
+DB_IDENTITIES_TEST = 'jenkins_scm_vizr_1783'
+
+START = datetime(2013, 1, 1)
+REPOSITORIES = ["repo1", "repo2", "repo3"]
+
+
+def gerrit(seed, nissues):
+    """Synthetic issues (id, url, submitted_on, status, mod_date) and
+    changes (id, issue_id, old_value, changed_on, field, new_value)"""
+    rnd = random.Random(seed)
+    date = lambda days: START + timedelta(seconds=rnd.randint(0, days * 86400))
+    issues = []
+    changes = []
+    for issue_id in range(1, nissues + 1):
+        submitted = date(300)
+        status = rnd.choice(["NEW", "NEW", "MERGED", "ABANDONED"])
+        mod_date = submitted + timedelta(days=rnd.randint(0, 90))
+        issues.append((issue_id, rnd.choice(REPOSITORIES), submitted, status, mod_date))
+        changed_on = submitted
+        for patchset in range(1, rnd.randint(1, 4) + 1):
+            for i in range(0, rnd.randint(1, 4)):
+                changed_on += timedelta(hours=rnd.randint(1, 200))
+                field = rnd.choice(["Upload", "Code-Review", "CRVW", "Verified"])
+                new_value = str(rnd.choice([-2, -1, 1, 2]))
+                changes.append([None, issue_id, str(patchset), changed_on, field, new_value])
+        if rnd.random() < 0.1:
+            changes.append([None, issue_id, "None", changed_on, "status", "MERGED"])
+    # Change ids in date order but a few
+    changes.sort(key = lambda change: change[3])
+    for (i, change) in enumerate(changes): change[0] = i + 1
+    return (issues, [tuple(change) for change in changes])
+
+
+class GerritCursor(FakeCursor):
+    """Cursor returning the events of the synthetic reviews"""
+
+    def __init__(self, issues, changes, startdate, enddate):
+        FakeCursor.__init__(self)
+        start = datetime.strptime(startdate, "'%Y-%m-%d'")
+        end = datetime.strptime(enddate, "'%Y-%m-%d'")
+        universe = [issue for issue in issues if start <= issue[2] < end]
+        ids = set([issue[0] for issue in universe])
+
+        closed = [(issue[0], issue[4]) for issue in universe
+                  if issue[3] in ("MERGED", "ABANDONED")]
+        patchsets = {}
+        for (id, issue_id, old_value, changed_on, field, new_value) in changes:
+            if issue_id not in ids or old_value in ("", "None"): continue
+            key = (issue_id, int(old_value))
+            reviewed = field in ("Code-Review", "Verified") and new_value in ("-1", "-2")
+            (first, was_reviewed) = patchsets.get(key, (changed_on, 0))
+            patchsets[key] = (min(first, changed_on), max(was_reviewed, int(reviewed)))
+        new_issues = set([issue[0] for issue in issues if issue[3] == "NEW"])
+        waiting = [(id, issue_id, old_value, changed_on,
+                    int(field in ("CRVW", "Code-Review", "Verified", "VRIF")
+                        and new_value in ("1", "2")))
+                   for (id, issue_id, old_value, changed_on, field, new_value) in changes
+                   if issue_id in new_issues and changed_on < end]
+
+        self.responses = [
+            ("FROM people", ["id"], []),
+            ("closed_on", ["issue_id", "closed_on"], closed),
+            ("as reviewed", ["issue_id", "patchset", "changed_on", "reviewed"],
+             [(key[0], key[1], first, reviewed)
+              for (key, (first, reviewed)) in patchsets.items()]),
+            ("as waiting", ["id", "issue_id", "patchset", "changed_on", "waiting"], waiting),
+            # get_group_field only uses t.url for SCRQuery, not subclasses
+            ("r.name", ["name", "issue_id", "submitted_on"],
+             [(issue[1], issue[0], issue[2]) for issue in universe]),
+            ("as submitted_on", ["issue_id", "submitted_on"],
+             [(issue[0], issue[2]) for issue in universe])]
+
+
+def fake_scr_query(cursor):
+    class FakeQuery(SCRQuery):
+        def __SetDBChannel__(self, user=None, password=None, database=None,
+                             host="127.0.0.1", port=3306, group=None):
+            return FakeConnection(cursor)
+    return FakeQuery("user", "", "db", "db_identities")
+
+
+def month_cutoffs(startdate, enddate):
+    start = datetime.strptime(startdate, "'%Y-%m-%d'")
+    end = datetime.strptime(enddate, "'%Y-%m-%d'")
+    cutoffs = []
+    for month in range(start.year * 12 + start.month, end.year * 12 + end.month + 1):
+        year = (month - 1) / 12
+        month = month - year * 12
+        cutoffs.append(datetime(year, month, calendar.monthrange(year, month)[1]))
+    return cutoffs
+
+
+def waiting_reviews(issues, changes, startdate, enddate, cutoff, reviewers):
+    """Reviews pending by repository as in ReviewsWaitingForReviewerTS._get_pending"""
+    start = datetime.strptime(startdate, "'%Y-%m-%d'")
+    end = datetime.strptime(enddate, "'%Y-%m-%d'")
+    pending = {}
+    for (issue_id, url, submitted, status, mod_date) in issues:
+        if not (start <= submitted < end and submitted <= cutoff): continue
+        if status in ("MERGED", "ABANDONED") and mod_date <= cutoff: continue
+        if reviewers:
+            patchsets = [int(c[2]) for c in changes if c[1] == issue_id and
+                         c[2] not in ("", "None") and c[3] <= cutoff]
+            if patchsets and [c for c in changes if c[1] == issue_id and
+                              c[2] == str(max(patchsets)) and
+                              c[4] in ("Code-Review", "Verified") and
+                              c[5] in ("-1", "-2")]:
+                continue
+        pending[url] = pending.get(url, 0) + 1
+    return pending
+
+
+class TestBacklogSweep(unittest.TestCase):
+
+    def test_backlog(self):
+        rnd = random.Random(1)
+        events = [(rnd.randint(0, 100), rnd.randint(0, 20), rnd.choice(["open", "blocked"]),
+                   rnd.random() < 0.5) for i in range(0, 500)]
+        groups = dict([(key, [key % 3, key % 2 + 10]) for key in range(0, 21)])
+        counters = {"open": lambda key, state: bool(state.get("open")),
+                    "free": lambda key, state: bool(state.get("open") and not state.get("blocked"))}
+        sweep = BacklogSweep(counters)
+        group_sweep = BacklogSweep(counters, groups)
+        for event in events:
+            sweep.add(*event)
+            group_sweep.add(*event)
+        dates = range(-10, 110, 10)
+
+        for include_date in [True, False]:
+            backlog = sweep.get_backlog(dates, include_date)
+            group_backlog = group_sweep.get_backlog(dates, include_date)
+            for (i, date) in enumerate(dates):
+                states = {}
+                for (event_date, key, field, value) in sorted(events, key=lambda e: e[0]):
+                    if event_date < date or (include_date and event_date == date):
+                        states.setdefault(key, {})[field] = value
+                for name in counters:
+                    keys = [key for key in states if counters[name](key, states[key])]
+                    self.assertEqual(len(keys), backlog[name][i])
+                    for group in group_backlog[name]:
+                        self.assertEqual(len([key for key in keys if group in groups[key]]),
+                                         group_backlog[name][group][i])
+
+    def test_no_events(self):
+        sweep = BacklogSweep({"open": lambda key, state: True})
+        self.assertEqual({"open": [0, 0]}, sweep.get_backlog([1, 2]))
+
+
+class TestReviewsBacklog(unittest.TestCase):
+
+    def setUp(self):
+        DSQuery.db_conn_pool = {}
+        (self.issues, self.changes) = gerrit(1, 150)
+
+    def tearDown(self):
+        DSQuery.db_conn_pool = {}
+
+    def _get_metric(self, metric_class, period, startdate, enddate, type_analysis = None):
+        self.cursor = GerritCursor(self.issues, self.changes, startdate, enddate)
+        filters = MetricFilters(period, startdate, enddate, type_analysis)
+        metric = metric_class(fake_scr_query(self.cursor), filters)
+        self.cursor.queries = []
+        return metric
+
+    def test_reviews_waiting(self):
+        (startdate, enddate) = ("'2013-02-01'", "'2014-01-01'")
+        metric = self._get_metric(ReviewsWaitingForReviewerTS, "month", startdate, enddate)
+        ts = metric.get_ts()
+        self.assertEqual(3, len(self.cursor.queries))
+
+        cutoffs = month_cutoffs(startdate, enddate)
+        self.assertEqual(range(24158, 24158 + len(cutoffs)), ts["month"])
+        for (name, reviewers) in [("ReviewsWaiting_ts", False),
+                                  ("ReviewsWaitingForReviewer_ts", True)]:
+            expected = [sum(waiting_reviews(self.issues, self.changes, startdate,
+                                            enddate, cutoff, reviewers).values())
+                        for cutoff in cutoffs]
+            self.assertEqual(expected, ts[name])
+        self.assertTrue(max(ts["ReviewsWaitingForReviewer_ts"]) > 0)
+        self.assertTrue(ts["ReviewsWaitingForReviewer_ts"] != ts["ReviewsWaiting_ts"])
+
+    def test_reviews_waiting_all_items(self):
+        (startdate, enddate) = ("'2013-01-01'", "'2013-07-01'")
+        metric = self._get_metric(ReviewsWaitingForReviewerTS, "month", startdate,
+                                  enddate, ["repository", None])
+        ts = metric.get_ts()
+        self.assertEqual(3, len(self.cursor.queries))
+        self.assertEqual(REPOSITORIES, ts["name"])
+        # As _get_ts_all, completePeriodIds ignores the end month
+        self.assertEqual(6, len(ts["month"]))
+        for (i, cutoff) in enumerate(month_cutoffs(startdate, enddate)):
+            for (name, reviewers) in [("ReviewsWaiting_ts", False),
+                                      ("ReviewsWaitingForReviewer_ts", True)]:
+                expected = waiting_reviews(self.issues, self.changes, startdate,
+                                           enddate, cutoff, reviewers)
+                for (pos, url) in enumerate(REPOSITORIES):
+                    self.assertEqual(expected.get(url, 0), ts[name][pos][i])
+
+    def test_pending(self):
+        (startdate, enddate) = ("'2013-01-01'", "'2013-11-01'")
+        metric = self._get_metric(Pending, "week", startdate, enddate)
+        backlog = metric.get_ts_backlog()
+        self.assertEqual(3, len(self.cursor.queries))
+        self.assertEqual(len(backlog["week"]), len(backlog["pending"]))
+
+        ends = [datetime.utcfromtimestamp(int(t)) for t in backlog["unixtime"][1:]]
+        ends.append(datetime(2013, 11, 1))
+        for (i, end) in enumerate(ends):
+            expected = [issue for issue in self.issues if issue[2] < end and
+                        not (issue[3] != "NEW" and issue[4] < end)]
+            self.assertEqual(len(expected), backlog["pending"][i])
+
+    def test_patches_waiting(self):
+        (startdate, enddate) = ("'2013-01-01'", "'2014-06-01'")
+        metric = self._get_metric(PatchesWaitingForReviewer, "month", startdate, enddate)
+        backlog = metric.get_ts_backlog()
+        self.assertEqual(1, len(self.cursor.queries))
+
+        ends = [datetime.utcfromtimestamp(int(t)) for t in backlog["unixtime"][1:]]
+        ends.append(datetime(2014, 6, 1))
+        new_issues = [issue[0] for issue in self.issues if issue[3] == "NEW"]
+        for (i, end) in enumerate(ends):
+            last_changes = {}
+            for change in self.changes:
+                if change[1] in new_issues and change[3] < end:
+                    last_changes[(change[1], change[2])] = change
+            expected = [c for c in last_changes.values() if
+                        c[4] in ("Code-Review", "CRVW", "Verified") and c[5] in ("1", "2")]
+            self.assertEqual(len(expected), backlog["WaitingForReviewer"][i])
+        self.assertTrue(backlog["WaitingForReviewer"][-1] > 0)
+
+
+class TestReviewsBacklogDump(unittest.TestCase):
+    """Backlogs and the queries for each period in the Gerrit testing dump"""
+
+    @classmethod
+    def setUpClass(cls):
+        DSQuery.db_conn_pool = {}
+        try:
+            cls.dbcon = SCRQuery("root", "", DB_SCR_TEST, DB_IDENTITIES_TEST)
+        except MySQLdb.Error:
+            raise unittest.SkipTest("MySQL testing dumps not available")
+
+    @classmethod
+    def tearDownClass(cls):
+        DSQuery.db_conn_pool = {}
+
+    def test_reviews_waiting(self):
+        filters = MetricFilters("month", "'2012-01-01'", "'2013-06-01'")
+        metric = ReviewsWaitingForReviewerTS(self.dbcon, filters)
+        self.assertEqual(metric.get_ts_by_month(), metric.get_ts())
+
+    def test_reviews_waiting_all_items(self):
+        filters = MetricFilters("month", "'2012-01-01'", "'2013-06-01'", ["repository", None])
+        metric = ReviewsWaitingForReviewerTS(self.dbcon, filters)
+        by_month = metric.get_ts_by_month()
+        ts = metric.get_ts()
+        self.assertEqual(sorted(by_month["url"]), ts["url"])
+        for name in ["ReviewsWaiting_ts", "ReviewsWaitingForReviewer_ts"]:
+            self.assertEqual(dict(zip(by_month["url"], by_month[name])),
+                             dict(zip(ts["url"], ts[name])))
+
+    def test_pending(self):
+        filters = MetricFilters("month", "'2012-01-01'", "'2013-06-01'")
+        backlog = Pending(self.dbcon, filters).get_ts_backlog()
+        ends = [datetime.utcfromtimestamp(int(t)) for t in backlog["unixtime"][1:]]
+        ends.append(datetime(2013, 6, 1))
+        for (i, end) in enumerate(ends):
+            end = end.strftime("'%Y-%m-%d'")
+            q = """SELECT COUNT(DISTINCT(i.id)) as pending FROM issues i
+                   WHERE i.submitted_on >= %s AND i.submitted_on < %s
+                   AND i.id NOT IN (SELECT i.id FROM issues i, issues_ext_gerrit ie
+                                    WHERE i.id = ie.issue_id AND mod_date < %s
+                                    AND (status='MERGED' OR status='ABANDONED'))
+                """ % (filters.startdate, end, end)
+            self.assertEqual(self.dbcon.ExecuteQuery(q)["pending"], backlog["pending"][i])
+
+    def test_patches_waiting(self):
+        filters = MetricFilters("month", "'2012-01-01'", "'2020-01-01'")
+        backlog = PatchesWaitingForReviewer(self.dbcon, filters).get_ts_backlog()
+        filters = MetricFilters("month", "'1900-01-01'", "'2020-01-01'")
+        agg = PatchesWaitingForReviewer(self.dbcon, filters).get_agg()
+        self.assertEqual(agg["WaitingForReviewer"], backlog["WaitingForReviewer"][-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
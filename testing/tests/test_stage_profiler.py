@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+"""Tests for the profiler of the report stages"""
+
+import os
+import pstats
+import shutil
+import signal
+import sys
+import tempfile
+import time
+import unittest
+
+if not '..' in sys.path:
+    sys.path.insert(0, '../..')
+
+from vizgrimoire.stage_profiler import StageProfiler
+
+
+def burn_cpu(seconds):
+    end = time.time() + seconds
+    total = 0
+    while time.time() < end:
+        total += sum(range(100))
+    return total
+
+def wait_db(seconds):
+    time.sleep(seconds)
+
+def allocate(size_mb):
+    data = " " * (size_mb * 1024 * 1024)
+    # Memory in use while the stack is sampled
+    burn_cpu(0.1)
+    return len(data)
+
+def memory_stage(profiler):
+    profiler.run("memory", allocate, 64)
+    return profiler.run("cpu", burn_cpu, 0.1)
+
+def filters_stage(profiler):
+    burn_cpu(0.1)
+    return profiler.run("scm filter repository", burn_cpu, 0.2)
+
+
+class TestStageProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp(prefix='profile_')
+        self.profiler = StageProfiler(os.path.join(self.profile_dir, "profile"))
+
+    def tearDown(self):
+        shutil.rmtree(self.profile_dir)
+
+    def _get_path(self, name):
+        return os.path.join(self.profile_dir, "profile", name)
+
+    def _get_functions(self, name):
+        stats = pstats.Stats(self._get_path(name))
+        return [function for (filename, line, function) in stats.stats]
+
+    def test_stage_files(self):
+        self.assertTrue(self.profiler.run("agg", burn_cpu, 0.3) > 0)
+
+        self.assertTrue("burn_cpu" in self._get_functions("agg.pstats"))
+        f = open(self._get_path("agg.collapsed"))
+        lines = f.read().splitlines()
+        f.close()
+        self.assertTrue(len(lines) > 0)
+        samples = 0
+        for line in lines:
+            (stack, count) = line.rsplit(" ", 1)
+            samples += int(count)
+            self.assertTrue("test_stage_profiler.py:burn_cpu" in stack)
+        self.assertTrue(samples > 10)
+        # The sampler is stopped after the stage
+        self.assertEqual((0.0, 0.0), signal.getitimer(signal.ITIMER_PROF))
+
+    def test_nested_stages(self):
+        self.profiler.run("filters", filters_stage, self.profiler)
+
+        rows = self.profiler.read_memory_table()
+        self.assertEqual(["scm filter repository", "filters"],
+                         [row["stage"] for row in rows])
+        self.assertTrue(float(rows[1]["wall_s"]) >= float(rows[0]["wall_s"]))
+        self.assertTrue("filters_stage" in self._get_functions("filters.pstats"))
+        # Nested stage stats are only in its own files
+        stats = pstats.Stats(self._get_path("filters.pstats"))
+        for ((filename, line, function), values) in stats.stats.items():
+            if function == "burn_cpu": self.assertEqual(1, values[1])
+        self.assertTrue(os.path.isfile(self._get_path("scm_filter_repository.collapsed")))
+
+    def test_cpu_and_memory(self):
+        self.profiler.run("db", wait_db, 0.3)
+        self.profiler.run("memory", allocate, 64)
+
+        rows = self.profiler.read_memory_table()
+        # Time waiting for the database is not CPU time
+        self.assertTrue(float(rows[0]["wall_s"]) >= 0.3)
+        self.assertTrue(float(rows[0]["cpu_s"]) < 0.1)
+        self.assertTrue(float(rows[1]["rss_increase_mb"]) > 32)
+
+    def test_stage_peaks(self):
+        self.profiler.run("filters", memory_stage, self.profiler)
+
+        rows = self.profiler.read_memory_table()
+        self.assertEqual(["memory", "cpu", "filters"], [row["stage"] for row in rows])
+        peaks = [float(row["max_rss_mb"]) for row in rows]
+        # The memory of a stage is freed before the next one
+        self.assertTrue(peaks[1] < peaks[0] - 32,
+                        "Peak RSS of memory %.1f MB, cpu %.1f MB" % (peaks[0], peaks[1]))
+        self.assertTrue(float(rows[1]["rss_increase_mb"]) < 32)
+        # Nested stages are included in the peak of the stage running them
+        self.assertTrue(peaks[2] >= peaks[0])
+
+    def test_exception(self):
+        self.assertRaises(ZeroDivisionError, self.profiler.run, "error",
+                          lambda: 1 / 0)
+        self.assertEqual(["error"], [row["stage"] for row in
+                                     self.profiler.read_memory_table()])
+        self.assertEqual(signal.SIG_DFL, signal.getsignal(signal.SIGPROF))
+
+
+if __name__ == '__main__':
+    unittest.main()
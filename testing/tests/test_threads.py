@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details. 
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+"""Tests for the mailing lists threads analysis"""
+
+import random
+import sys
+import time
+import unittest
+
+if not '..' in sys.path:
+    sys.path.insert(0, '../..')
+
+import vizgrimoire.GrimoireSQL as GrimoireSQL
+from vizgrimoire.analysis.threads import Threads
+from utils import FakeCursor
+
+MESSAGES_COLUMNS = ["message_ID", "is_response_of", "length", "upeople_id"]
+EMAILS_COLUMNS = ["message_ID", "subject", "message_body", "first_date",
+                  "initiator_name", "initiator_id", "url"]
+
+
+def legacy_build_threads(list_message_id, list_is_response_of, message_id):
+    """ Previous recursive implementation, used as reference """
+    sons = []
+    messages = []
+    if message_id not in list_is_response_of:
+        return []
+    cont = 0
+    for msg in list_is_response_of:
+        if msg == message_id:
+            sons.append(list_message_id[cont])
+        cont = cont + 1
+    for msg in sons:
+        messages.extend([msg])
+        messages.extend(legacy_build_threads(list_message_id, list_is_response_of, msg))
+    return messages
+
+def synthetic_mailing_list(rnd, nmessages):
+    """ Rows for a mailing list with threads of random shape """
+    rows = []
+    for i in range(0, nmessages):
+        if i == 0 or rnd.random() < 0.1: parent = None
+        else: parent = "<%i@example.com>" % rnd.randint(max(0, i - 50), i - 1)
+        rows.append(("<%i@example.com>" % i, parent, rnd.randint(0, 5000),
+                     "uuid%i" % rnd.randint(0, 1000)))
+    return rows
+
+
+class TestThreads(unittest.TestCase):
+
+    def set_cursor(self, messages, emails = []):
+        self.cursor = FakeCursor([("is_response_of", MESSAGES_COLUMNS, messages),
+                                  ("profiles", EMAILS_COLUMNS, emails)])
+        GrimoireSQL.cursor = self.cursor
+        GrimoireSQL.dbname = "mls"
+
+    def tearDown(self):
+        GrimoireSQL.cursor = None
+        GrimoireSQL.dbname = None
+
+    def test_threads(self):
+        messages = [("a", None, 10, "p1"),
+                    ("b", "a", 20, "p2"),
+                    ("b", "a", 20, "p3"), # two senders
+                    ("c", "b", None, "p1"),
+                    ("d", "a", 5, None),
+                    ("e", None, 100, "p4"),
+                    ("f", "x", 1, "p5")] # father out of the period
+        self.set_cursor(messages)
+        threads = Threads("'2013-01-01'", "'2014-01-01'", "identities")
+        self.assertEqual(1, len(self.cursor.queries))
+        self.assertEqual({"a": ["a", "b", "c", "d"], "e": ["e"]}, threads.threads)
+        self.assertEqual(2, threads.numThreads())
+        self.assertEqual(4, threads.lenThread("a"))
+        self.assertEqual(2, threads.depthThread("a"))
+        self.assertEqual(0, threads.depthThread("e"))
+        self.assertEqual({"a": 3, "e": 1}, threads.threads_people)
+        self.assertEqual({"a": 35, "e": 100}, threads.threads_volume)
+
+    def test_top_threads_emails(self):
+        messages = [("a", None, 10, "p1"), ("b", "a", 20, "p2"), ("e", None, 100, "p4")]
+        emails = [("a", "Subject a", "", None, "P1", "p1", "url"),
+                  ("e", "Subject e", "", None, "P4", "p4", "url")]
+        self.set_cursor(messages, emails)
+        threads = Threads("'2013-01-01'", "'2014-01-01'", "identities")
+
+        top = threads.topLongestThread(2)
+        self.assertEqual(["a", "e"], [email.message_id for email in top])
+        self.assertEqual(["Subject a", "Subject e"], [email.subject for email in top])
+        top = threads.topCrowdedThread(1)
+        self.assertEqual([("a", 2)], [(email.message_id, people) for (email, people) in top])
+        self.assertEqual("e", threads.verboseThread().message_id)
+        # One query for the messages and one for each list of emails
+        self.assertEqual(4, len(self.cursor.queries))
+
+    def test_same_as_legacy(self):
+        rows = synthetic_mailing_list(random.Random(1783), 2000)
+        self.set_cursor(rows)
+        threads = Threads("'2013-01-01'", "'2014-01-01'", "identities")
+        list_message_id = [row[0] for row in rows]
+        list_is_response_of = [row[1] for row in rows]
+        for row in rows:
+            if row[1] is not None: continue
+            expected = [row[0]] + legacy_build_threads(list_message_id,
+                                                        list_is_response_of, row[0])
+            self.assertEqual(expected, threads.threads[row[0]])
+
+    def test_benchmark(self):
+        """ Synthetic mailing list with 500k messages """
+        rows = synthetic_mailing_list(random.Random(2015), 500000)
+        self.set_cursor(rows)
+        start = time.time()
+        threads = Threads("'2013-01-01'", "'2014-01-01'", "identities")
+        elapsed = time.time() - start
+        self.assertEqual(500000, sum([len(thread) for thread in threads.threads.values()]))
+        self.assertTrue(elapsed < 60, "Threads built in %.2fs" % elapsed)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+"""Tests for the time tickets are opened"""
+
+import random
+import re
+import sys
+import unittest
+
+from datetime import datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+
+if not '..' in sys.path:
+    sys.path.insert(0, '../..')
+
+from vizgrimoire.analysis.times_tickets import TimesTickets
+from vizgrimoire.metrics.metrics_filter import MetricFilters
+from vizgrimoire.metrics.query_builder import DSQuery, ITSQuery
+from utils import FakeConnection, FakeCursor, benchmark
+
+CLOSED_CONDITION = "(status = 'RESOLVED' OR status = 'CLOSED' OR status = 'VERIFIED' OR priority = 'Lowest')"
+PRIORITIES = ["Unprioritized", "Low", "Normal", "High", "Highest", "Immediate"]
+SEVERITIES = ["trivial", "minor", "normal", "major", "blocker", "critical", "enhancement"]
+STATUSES = ["NEW", "ASSIGNED", "NEW", "RESOLVED", "CLOSED", "VERIFIED"]
+
+
+class Backend(object):
+    priority = PRIORITIES
+    severity = SEVERITIES
+
+
+def tracker(seed, nissues, days):
+    """Synthetic issues {id: (submitted_on, first_action, first_comment)}
+    and issues log rows (id, issue_id, date, status, priority, type)"""
+    rnd = random.Random(seed)
+    start = datetime(2013, 1, 1)
+    issues = {}
+    log = []
+    for issue_id in range(1, nissues + 1):
+        submitted = start + timedelta(seconds=rnd.randint(-30 * 86400, days * 86400))
+        first = [None, None]
+        for i in range(0, 2):
+            if rnd.random() < 0.6:
+                first[i] = submitted + timedelta(seconds=rnd.randint(0, 200 * 86400))
+        issues[issue_id] = (submitted, first[0], first[1])
+        date = submitted
+        for i in range(0, rnd.randint(1, 4)):
+            log.append([date, issue_id, rnd.choice(STATUSES),
+                        rnd.choice(PRIORITIES + ["Lowest"]), rnd.choice(SEVERITIES)])
+            date += timedelta(seconds=rnd.randint(0, 120 * 86400))
+    # Log ids are in date order
+    log.sort()
+    log = [(i + 1, row[1], row[0], row[2], row[3], row[4]) for (i, row) in enumerate(log)]
+    return (issues, log)
+
+
+def closed(row):
+    return row[3] in ("RESOLVED", "CLOSED", "VERIFIED") or row[4] == "Lowest"
+
+def seconds(date, start):
+    return int((date - start).total_seconds())
+
+
+class TrackerCursor(FakeCursor):
+    """Cursor running the times tickets queries in the synthetic tracker"""
+
+    def __init__(self, issues, log):
+        FakeCursor.__init__(self)
+        self.issues = issues
+        self.log = log
+
+    def _opened_at(self, sql, start, end):
+        """GetIssuesOpenedAt and GetIssuesWithout* queries"""
+        field = re.search("AND (priority|type) = '([^']+)'", sql)
+        view = re.search("NOT IN\s+\(SELECT issue_id\s+FROM (\w+)", sql)
+        last = {}
+        for row in self.log:
+            if start <= row[2] < end: last[row[1]] = row
+        rows = []
+        for (issue_id, row) in sorted(last.items()):
+            if closed(row): continue
+            if field and row[{"priority": 4, "type": 5}[field.group(1)]] != field.group(2):
+                continue
+            if view:
+                first = self.issues[issue_id][{"first_action_per_issue": 1,
+                                               "first_comment_per_issue": 2}[view.group(1)]]
+                if first is not None and start <= first < end: continue
+            age = Decimal(seconds(end, self.issues[issue_id][0])) / Decimal(86400)
+            rows.append((issue_id, age.quantize(Decimal("0.0001"), ROUND_HALF_UP)))
+        return rows
+
+    def execute(self, sql):
+        if not sql.startswith("SELECT"):
+            return FakeCursor.execute(self, sql)
+        (start, end) = [datetime.strptime(d, "%Y-%m-%d") for d in
+                        re.search("date >= '([^']+)' AND date < '([^']+)'", sql).groups()]
+        alias = re.search("/\(24\*3600\) AS (\w+)", sql)
+        if alias:
+            self.responses = [("", ["issue_id", alias.group(1)], self._opened_at(sql, start, end))]
+        elif "AS closed" in sql:
+            rows = [(row[0], row[1], seconds(row[2], start), int(closed(row)), row[4], row[5],
+                     seconds(self.issues[row[1]][0], start))
+                    for row in self.log if start <= row[2] < end]
+            self.responses = [("", ["id", "issue_id", "date", "closed", "priority", "type",
+                                    "submitted_on"], rows)]
+        else:
+            position = {"first_action_per_issue": 1, "first_comment_per_issue": 2}[
+                re.search("FROM (\w+)", sql).group(1)]
+            rows = [(issue_id, seconds(dates[position], start))
+                    for (issue_id, dates) in self.issues.items()
+                    if dates[position] is not None and start <= dates[position] < end]
+            self.responses = [("", ["issue_id", "date"], rows)]
+        FakeCursor.execute(self, sql)
+
+
+def fake_its_query(cursor):
+    class FakeQuery(ITSQuery):
+        def __SetDBChannel__(self, user=None, password=None, database=None,
+                             host="127.0.0.1", port=3306, group=None):
+            return FakeConnection(cursor)
+    return FakeQuery("user", "", "db", "db_identities")
+
+
+def by_month_time_opened(study, period, startdate, enddate):
+    """ticketsTimeOpened with the queries for each month"""
+    evol = {}
+    for result_type in ['action', 'comment', 'open']:
+        evol.update(study.ticketsTimeOpenedByType(period, startdate, enddate,
+                                                  CLOSED_CONDITION, result_type))
+        evol.update(study.ticketsTimeOpenedByField(period, startdate, enddate, CLOSED_CONDITION,
+                                                   'priority', PRIORITIES, result_type))
+        evol.update(study.ticketsTimeOpenedByField(period, startdate, enddate, CLOSED_CONDITION,
+                                                   'type', SEVERITIES, result_type))
+    return evol
+
+
+def no_nan(values):
+    """NaN as None, to compare series"""
+    result = []
+    for value in values:
+        if isinstance(value, (float, Decimal)) and value != value: value = None
+        result.append(value)
+    return result
+
+
+class TestTimesTicketsOpened(unittest.TestCase):
+
+    def setUp(self):
+        DSQuery.db_conn_pool = {}
+
+    def tearDown(self):
+        DSQuery.db_conn_pool = {}
+
+    def _assertSameSeries(self, expected, evol):
+        self.assertEqual(sorted(expected.keys()), sorted(evol.keys()))
+        for key in expected:
+            self.assertEqual(len(expected[key]), len(evol[key]), key)
+            for (value, new_value) in zip(no_nan(expected[key]), no_nan(evol[key])):
+                if isinstance(value, (float, Decimal)):
+                    self.assertAlmostEqual(float(value), new_value, 6, key)
+                else:
+                    self.assertEqual(value, new_value, key)
+
+    def _get_study(self, issues, log, startdate, enddate):
+        self.cursor = TrackerCursor(issues, log)
+        filters = MetricFilters("month", startdate, enddate)
+        study = TimesTickets(fake_its_query(self.cursor), filters)
+        self.cursor.queries = []
+        return study
+
+    def test_same_result(self):
+        (issues, log) = tracker(1, 300, 600)
+        (startdate, enddate) = ("'2013-01-01'", "'2014-07-01'")
+        study = self._get_study(issues, log, startdate, enddate)
+
+        expected = by_month_time_opened(study, "month", startdate, enddate)
+        nqueries = len(self.cursor.queries)
+        self.cursor.queries = []
+        evol = study.ticketsTimeOpened("month", startdate, enddate, None, Backend)
+
+        self.assertEqual(3, len(self.cursor.queries))
+        self.assertEqual(3 * (1 + len(PRIORITIES) + len(SEVERITIES)) * 18, nqueries)
+        self._assertSameSeries(expected, evol)
+        self.assertTrue(max(evol["size_topened"]) > 10)
+        self.assertTrue(max(evol["size_topened_tfa_High"]) > 0)
+
+    def test_later_row_with_lower_id(self):
+        # The state is the row with the max id, not the last by date
+        start = datetime(2013, 1, 1)
+        issues = {1: (start, None, None), 2: (start, None, None)}
+        log = [(1, 1, start + timedelta(days=40), "NEW", "Low", "minor"),
+               (2, 2, start + timedelta(days=1), "NEW", "Low", "minor"),
+               (3, 2, start + timedelta(days=10), "RESOLVED", "Low", "minor"),
+               (4, 1, start + timedelta(days=5), "RESOLVED", "Low", "minor")]
+        (startdate, enddate) = ("'2013-01-01'", "'2013-04-01'")
+        study = self._get_study(issues, log, startdate, enddate)
+        expected = by_month_time_opened(study, "month", startdate, enddate)
+        evol = study.ticketsTimeOpened("month", startdate, enddate, None, Backend)
+        self.assertEqual([0, 0, 0], evol["size_topened"])
+        self._assertSameSeries(expected, evol)
+
+    @benchmark
+    def test_benchmark(self):
+        (issues, log) = tracker(2, 200000, 3650)
+        (startdate, enddate) = ("'2013-01-01'", "'2023-01-01'")
+        study = self._get_study(issues, log, startdate, enddate)
+        evol = study.ticketsTimeOpened("month", startdate, enddate, None, Backend)
+        self.assertEqual(120, len(evol["month"]))
+        self.assertEqual(3, len(self.cursor.queries))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -22,11 +22,20 @@
 
 """Misc functions for testing the library"""
 
+import os
+import re
+import unittest
+
 from csv import DictReader
 
 from vizgrimoire.GrimoireSQL import SetDBChannel
 
 
+# Benchmarks are slow and their times depend on the load of the machine
+benchmark = unittest.skipUnless(os.environ.get("GRIMOIRELIB_BENCHMARKS"),
+                                "GRIMOIRELIB_BENCHMARKS not set")
+
+
 def set_db_channel(user='root', password='', database=None,
                    host="127.0.0.1", port=3306, group=None):
     SetDBChannel(user, password, database, host, port, group)
@@ -42,3 +51,60 @@ def read_dataset(filepath, fieldnames, delimiter):
             for field, value in line.items():
                 data[field].append(value)
     return data
+
+
+class FakeCursor(object):
+    """Cursor returning canned rows and recording the executed queries.
+
+    responses is a list of (regexp, columns, rows). The first regexp
+    found in the query selects the columns and rows returned.
+    """
+
+    def __init__(self, responses=None):
+        self.responses = responses or []
+        self.queries = []
+        self.description = None
+        self.rowcount = 0
+        self._rows = []
+
+    def execute(self, sql):
+        self.queries.append(sql)
+        self.description = None
+        self._rows = []
+        for (pattern, columns, rows) in self.responses:
+            if re.search(pattern, sql, re.IGNORECASE):
+                self.description = [(column, None, None, None, None, None, True)
+                                    for column in columns]
+                self._rows = list(rows)
+                break
+        self.rowcount = len(self._rows)
+
+    def fetchone(self):
+        if len(self._rows) == 0: return None
+        return self._rows.pop(0)
+
+    def fetchall(self):
+        rows = self._rows
+        self._rows = []
+        return rows
+
+    def fetchmany(self, size):
+        rows = self._rows[0:size]
+        self._rows = self._rows[size:]
+        return rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+    """Connection sharing a FakeCursor"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def cursor(self, cursorclass = None):
+        return self._cursor
+
+    def close(self):
+        pass
@@ -111,10 +111,13 @@ def create_reports_filters(period, startdate, enddate, destdir, npeople, identit
             if filter_.get_name() in supported_on[ds.get_name()]:
             # if filter_.get_name() in ["people2","company+country","repository","company"]:
                 logging.info("---> Using new filter API")
-                ds.create_filter_report_all(filter_, period, startdate, enddate,
-                                            destdir, npeople, identities_db)
+                profile_stage(ds.get_name() + " filter " + filter_.get_name(),
+                              ds.create_filter_report_all, filter_, period, startdate,
+                              enddate, destdir, npeople, identities_db)
             else:
-                ds.create_filter_report(filter_, period, startdate, enddate, destdir, npeople, identities_db)
+                profile_stage(ds.get_name() + " filter " + filter_.get_name(),
+                              ds.create_filter_report, filter_, period, startdate,
+                              enddate, destdir, npeople, identities_db)
 
 def create_report_people(startdate, enddate, destdir, npeople, identities_db, people_ids=None):
     for ds in Report.get_data_sources():
@@ -227,16 +230,16 @@ def create_people_identifiers(startdate, enddate, destdir, npeople, identities_d
     # TODO: Identities db is the same than SCM
     Report.connect_ds(ds_scm)
 
-    for upeople_id in people_ids:
-        people_data[upeople_id] = People.GetPersonIdentifiers(identities_db, upeople_id)
+    people_data = People.GetPersonIdentifiersBulk(identities_db, people_ids)
 
     all_top_min_ds = get_top_people(startdate, enddate, identities_db)
 
     db = automator['generic']['db_cvsanaly']
     SetDBChannel (database=db, user=opts.dbuser, password=opts.dbpassword)
 
-    for upeople_id in all_top_min_ds:
-        people_data[upeople_id] = People.GetPersonIdentifiers(identities_db, upeople_id)
+    new_people_ids = [upeople_id for upeople_id in all_top_min_ds
+                      if upeople_id not in people_data]
+    people_data.update(People.GetPersonIdentifiersBulk(identities_db, new_people_ids))
 
     createJSON(people_data, destdir+"/people.json")
 
@@ -263,7 +266,8 @@ def create_reports_studies(period, startdate, enddate, destdir):
             logging.info("Creating report for " + study.id + " for " + ds.get_name())
             try:
                 obj = study(dbcon, metric_filters)
-                obj.create_report(ds, destdir)
+                profile_stage(ds.get_name() + " study " + study.id,
+                              obj.create_report, ds, destdir)
             except TypeError:
                 import traceback
                 logging.info(study.id + " does no support standard API. Not used.")
@@ -277,6 +281,102 @@ def create_events(startdate, enddate, destdir):
         events = ds.get_events()
         createJSON(events, destdir+"/"+ds.get_name()+"-events.json")
 
+def profile_stage(name, function, *args):
+    """ Run function(*args) in the stage profiler when it is active """
+    if profiler is None:
+        return function(*args)
+    return profiler.run(name, function, *args)
+
+def run_stage(name, function, *args):
+    """ Run a report stage registering its wall-clock time """
+    start = time.time()
+    result = profile_stage(name, function, *args)
+    stage_times.append((name, time.time() - start))
+    return result
+
+def create_ds_reports(ds_name):
+    """ All the reports for a data source, run in a worker process.
+
+        Global filters, study and metric options are applied as
+        in the sequential analysis. Returns the name of the data source,
+        the time of its stages, if the reports were created, the
+        query cache stats and the query profile data.
+    """
+    global stage_times
+    stage_times = []
+
+    # The connections of the parent process can not be shared
+    Report.reconnect()
+    Report.set_data_sources([Report.get_data_source(ds_name)])
+    if opts.query_cache:
+        DSQuery.get_query_cache().hits = DSQuery.get_query_cache().misses = 0
+    if opts.query_profile:
+        DSQuery.get_query_profile().reset()
+    logging.info("Creating reports for " + ds_name)
+
+    try:
+        if not opts.filter and not opts.study:
+            run_stage(ds_name + " evol", create_evol_report,
+                      startdate, enddate, opts.destdir, identities_db)
+            run_stage(ds_name + " agg", create_agg_report,
+                      startdate, enddate, opts.destdir, identities_db)
+            if not opts.metric:
+                run_stage(ds_name + " top", create_top_report,
+                          startdate, enddate, opts.destdir, opts.npeople, identities_db)
+        if not opts.study and not opts.no_filters and not opts.metric:
+            run_stage(ds_name + " filters", create_reports_filters,
+                      period, startdate, enddate, opts.destdir, opts.npeople, identities_db)
+        if not opts.filter and not opts.metric and not opts.item:
+            run_stage(ds_name + " studies", create_reports_studies,
+                      period, startdate, enddate, opts.destdir)
+        done = True
+    except:
+        # Also SystemExit, the pool would wait forever for a dead worker
+        logging.exception("Reports for " + ds_name + " failed")
+        done = False
+
+    cache_stats = None
+    if opts.query_cache:
+        cache_stats = DSQuery.get_query_cache().get_stats()
+    profile_data = None
+    if opts.query_profile:
+        profile_data = DSQuery.get_query_profile().get_data()
+    return (ds_name, stage_times, done, cache_stats, profile_data)
+
+def create_reports_parallel(jobs):
+    """ Data sources reports in a pool of processes and then the
+        reports that join data from all data sources """
+    from multiprocessing import Pool
+
+    # A new process for each data source, forked from a clean state
+    pool = Pool(processes=jobs, maxtasksperchild=1)
+    ds_names = [ds.get_name() for ds in Report.get_data_sources()]
+    failed = []
+    # Results in data sources order so the log is deterministic
+    for (ds_name, times, done, cache_stats, profile_data) in pool.imap(create_ds_reports, ds_names):
+        stage_times.extend(times)
+        if not done: failed.append(ds_name)
+        if cache_stats is not None:
+            DSQuery.get_query_cache().hits += cache_stats['hits']
+            DSQuery.get_query_cache().misses += cache_stats['misses']
+        if profile_data is not None:
+            DSQuery.get_query_profile().merge(profile_data)
+    pool.close()
+    pool.join()
+
+    if len(failed) > 0:
+        logging.error("Reports failed for " + ",".join(failed))
+        sys.exit(1)
+
+    if not opts.filter and not opts.study and not opts.metric:
+        people_ids = run_stage("people identifiers", create_people_identifiers,
+                               startdate, enddate, opts.destdir, opts.npeople, identities_db)
+        if (automator['r']['reports'].find('people')>-1):
+            run_stage("people", create_report_people,
+                      startdate, enddate, opts.destdir, opts.npeople, identities_db, people_ids)
+        run_stage("top people", create_top_people_report,
+                  startdate, enddate, opts.destdir, identities_db)
+
 def set_data_source(ds_name):
     ds_ok = False
     dss_active = Report.get_data_sources()
@@ -344,8 +444,44 @@ if __name__ == '__main__':
     logging.info("Starting Report analysis")
     opts = read_options()
 
+    if opts.query_cache:
+        from vizgrimoire.metrics.query_builder import DSQuery
+        from vizgrimoire.query_cache import QueryCache
+        DSQuery.set_query_cache(QueryCache(opts.query_cache))
+
+    if opts.query_profile:
+        from vizgrimoire.metrics.query_builder import DSQuery
+        from vizgrimoire.query_profile import QueryProfile
+        DSQuery.set_query_profile(QueryProfile(opts.explain_threshold))
+
+    if opts.ensure_indexes:
+        from vizgrimoire.metrics.query_builder import DSQuery, IndexManager
+        DSQuery.set_index_manager(IndexManager())
+
+    if opts.activity_cube:
+        from vizgrimoire.metrics.query_builder import DSQuery
+        DSQuery.set_activity_cubes(True)
+
+    if opts.incremental:
+        from vizgrimoire.data_source import DataSource
+        from vizgrimoire.incremental import IncrementalReport
+        DataSource.set_incremental(IncrementalReport(opts.destdir))
+
+    profiler = None
+    if opts.profile:
+        from vizgrimoire.stage_profiler import StageProfiler
+        profiler = StageProfiler(os.path.join(opts.destdir, "profile"))
+
     Report.init(opts.config_file, opts.metrics_path)
 
+    if opts.filter_jobs > 1:
+        from vizgrimoire.items_pool import ItemsPool
+        ItemsPool.set_jobs(opts.filter_jobs)
+
+    if opts.query_jobs > 1:
+        from vizgrimoire.metrics_pool import MetricsPool
+        MetricsPool.set_jobs(opts.query_jobs)
+
     automator = read_main_conf(opts.config_file)
     if 'start_date' not in automator['r']:
         logging.error("start_date (yyyy-mm-dd) not found in " + opts.config_file)
@@ -386,24 +522,62 @@ if __name__ == '__main__':
         logging.info("Events generated OK")
         sys.exit(0)
 
-    if not opts.filter and not opts.study:
-        logging.info("Creating global evolution metrics...")
-        evol = create_evol_report(startdate, enddate, opts.destdir, identities_db)
-        logging.info("Creating global aggregated metrics...")
-        agg = create_agg_report(startdate, enddate, opts.destdir, identities_db)
-        if not opts.metric:
-            people_ids = create_people_identifiers(startdate, enddate, opts.destdir, opts.npeople, identities_db)
-
-            logging.info("Creating global top metrics...")
-            top = create_top_report(startdate, enddate, opts.destdir, opts.npeople, identities_db)
-            if (automator['r']['reports'].find('people')>-1):
-                create_report_people(startdate, enddate, opts.destdir, opts.npeople, identities_db, people_ids)
-            # create_reports_r(end_date, opts.destdir)
-            create_top_people_report(startdate, enddate, opts.destdir, identities_db)
-
-    if not opts.study and not opts.no_filters and not opts.metric:
-        create_reports_filters(period, startdate, enddate, opts.destdir, opts.npeople, identities_db)
-    if not opts.filter and not opts.metric and not opts.item:
-        create_reports_studies(period, startdate, enddate, opts.destdir)
+    stage_times = [] # (stage, seconds)
+    report_start = time.time()
+
+    if opts.jobs > 1:
+        create_reports_parallel(opts.jobs)
+    else:
+        if not opts.filter and not opts.study:
+            logging.info("Creating global evolution metrics...")
+            evol = run_stage("evol", create_evol_report,
+                             startdate, enddate, opts.destdir, identities_db)
+            logging.info("Creating global aggregated metrics...")
+            agg = run_stage("agg", create_agg_report,
+                            startdate, enddate, opts.destdir, identities_db)
+            if not opts.metric:
+                people_ids = run_stage("people identifiers", create_people_identifiers,
+                                       startdate, enddate, opts.destdir, opts.npeople, identities_db)
+
+                logging.info("Creating global top metrics...")
+                top = run_stage("top", create_top_report,
+                                startdate, enddate, opts.destdir, opts.npeople, identities_db)
+                if (automator['r']['reports'].find('people')>-1):
+                    run_stage("people", create_report_people,
+                              startdate, enddate, opts.destdir, opts.npeople, identities_db, people_ids)
+                # create_reports_r(end_date, opts.destdir)
+                run_stage("top people", create_top_people_report,
+                          startdate, enddate, opts.destdir, identities_db)
+
+        if not opts.study and not opts.no_filters and not opts.metric:
+            run_stage("filters", create_reports_filters,
+                      period, startdate, enddate, opts.destdir, opts.npeople, identities_db)
+        if not opts.filter and not opts.metric and not opts.item:
+            run_stage("studies", create_reports_studies,
+                      period, startdate, enddate, opts.destdir)
+
+    for (stage, seconds) in stage_times:
+        logging.info("Stage %s: %.2f s" % (stage, seconds))
+    logging.info("Total: %.2f s" % (time.time() - report_start))
+
+    if opts.query_cache:
+        stats = DSQuery.get_query_cache().get_stats()
+        logging.info("Query cache hits: %i misses: %i" % (stats['hits'], stats['misses']))
+
+    if opts.query_profile:
+        profile_file = os.path.join(opts.destdir, "query-profile.json")
+        DSQuery.get_query_profile().write(profile_file)
+        logging.info("Query profile written to " + profile_file)
+
+    if opts.incremental and opts.jobs == 1:
+        incremental = DataSource.get_incremental()
+        logging.info("Evolutionary files spliced: %i created: %i" %
+                     (incremental.spliced, incremental.full))
+        logging.info("Filter items skipped without changes: %i" % incremental.skipped_items)
+
+    if opts.ensure_indexes:
+        indexes_file = os.path.join(opts.destdir, "indexes.json")
+        DSQuery.get_index_manager().write(indexes_file)
+        logging.info("Indexes report written to " + indexes_file)
 
     logging.info("Report data source analysis OK")
@@ -117,6 +117,58 @@ def read_options():
                       action="store_true",
                       dest="events",
                       help="Generate events.")
+    parser.add_option("--query-cache",
+                      action="store",
+                      dest="query_cache",
+                      help="Directory used to cache query results between runs.")
+    parser.add_option("--query-profile",
+                      action="store_true",
+                      dest="query_profile",
+                      default=False,
+                      help="Write the profile of the SQL queries to query-profile.json.")
+    parser.add_option("--explain-threshold",
+                      action="store",
+                      type="float",
+                      dest="explain_threshold",
+                      help="Capture EXPLAIN for queries slower than these seconds in the query profile.")
+    parser.add_option("--ensure-indexes",
+                      action="store_true",
+                      dest="ensure_indexes",
+                      default=False,
+                      help="Create the missing indexes needed by the queries of each data source.")
+    parser.add_option("--activity-cube",
+                      action="store_true",
+                      dest="activity_cube",
+                      default=False,
+                      help="Refresh the monthly activity cubes and get the metrics they cover from them.")
+    parser.add_option("--incremental",
+                      action="store_true",
+                      dest="incremental",
+                      default=False,
+                      help="Compute only the periods of the evolutionary JSON files with new data.")
+    parser.add_option("--profile",
+                      action="store_true",
+                      dest="profile",
+                      default=False,
+                      help="Write the Python profile of each report stage to the profile dir in destdir.")
+    parser.add_option("--jobs",
+                      action="store",
+                      type="int",
+                      dest="jobs",
+                      default=1,
+                      help="Number of data sources analyzed in parallel.")
+    parser.add_option("--filter-jobs",
+                      action="store",
+                      type="int",
+                      dest="filter_jobs",
+                      default=1,
+                      help="Number of filter items analyzed in parallel.")
+    parser.add_option("--query-jobs",
+                      action="store",
+                      type="int",
+                      dest="query_jobs",
+                      default=1,
+                      help="Number of metric queries of a data source run in parallel.")
 
     (opts, args) = parser.parse_args()
 
@@ -65,11 +65,10 @@ class DownloadsDS(DataSource):
 
         for item in all_metrics:
             if item.id not in metrics_on: continue
-            item.filters = mfilter
             if evol is False:
-                mvalue = item.get_agg()
+                mvalue = item.evaluate(mfilter, "agg")
             else:
-                mvalue = item.get_ts()
+                mvalue = item.evaluate(mfilter, "ts")
             data = dict(data.items() + mvalue.items())
 
             if evol is False:
@@ -26,6 +26,7 @@ import logging, os, re
 from vizgrimoire.data_source import DataSource
 from vizgrimoire.GrimoireUtils import createJSON
 from vizgrimoire.filter import Filter
+from vizgrimoire.items_pool import ItemsPool
 from vizgrimoire.GrimoireUtils import GetPercentageDiff, GetDates, getPeriod, createJSON, completePeriodIds
 from vizgrimoire.metrics.metrics_filter import MetricFilters
 
@@ -172,7 +173,7 @@ class EventsDS(DataSource):
         else:
             items_list = items
 
-        for item in items:
+        def create_item_report(item):
             logging.info(item)
             filter_item = Filter(filter_.get_name(), item)
 
@@ -183,7 +184,9 @@ class EventsDS(DataSource):
             agg = EventsDS.get_agg_data(period, startdate, enddate, identities_db, filter_item)
             fn = os.path.join(destdir, filter_item.get_static_filename(EventsDS()))
             createJSON(agg, fn)
+            return agg
 
+        for (item, agg) in zip(items, ItemsPool.map(create_item_report, items)):
             if filter_name in ("repository"):
                 items_list['name'].append(item.replace('/', '_'))
                 items_list['events_365'].append(agg['events_365'])
@@ -205,40 +208,26 @@ class EventsDS(DataSource):
         attendees = DataSource.get_metrics("rsvps", EventsDS)
         period = attendees.filters.period
         type_analysis = None
-        mfilter = attendees.filters # updated filters
-        filters = None # original filters
+        mfilter = attendees.filters
         if filter_ is not None:
             type_analysis = filter_.get_type_analysis()
             mfilter = MetricFilters(period, startdate, enddate, type_analysis, npeople)
 
-        if filter_ is not None:
-            filters = attendees.filters
-            attendees.filters = mfilter
-        top['rsvps.'] = attendees.get_list(mfilter, 0)
-        top['rsvps.last month'] = attendees.get_list(mfilter, 31)
-        top['rsvps.last year'] = attendees.get_list(mfilter, 365)
-        if filter_ is not None:
-            attendees.filters = filters
+        top['rsvps.'] = attendees.evaluate(mfilter, "list", 0)
+        top['rsvps.last month'] = attendees.evaluate(mfilter, "list", 31)
+        top['rsvps.last year'] = attendees.evaluate(mfilter, "list", 365)
 
         events = DataSource.get_metrics("events", EventsDS)
-        if filter_ is not None:
-            filters = events.filters
-            events.filters = mfilter
-        top['events.'] = events.get_list(mfilter, 0)
-        top['events.last month'] = events.get_list(mfilter,31)
-        top['events.last year'] = events.get_list(mfilter, 365)
-        if filter_ is not None:
-            events.filters = filters
+        top['events.'] = events.evaluate(mfilter, "list", 0)
+        top['events.last month'] = events.evaluate(mfilter, "list", 31)
+        top['events.last year'] = events.evaluate(mfilter, "list", 365)
 
         if filter_ is not None:
             groups = DataSource.get_metrics("groups", EventsDS)
-            filters = groups.filters
-            groups.filters = mfilter
             if filter_.get_name() <> 'repository':
-                top['groups.'] = groups.get_list(mfilter, 0)
-                top['groups.last month'] = groups.get_list(mfilter, 31)
-                top['groups.last year'] = groups.get_list(mfilter, 365)
-                groups.filters = filters
+                top['groups.'] = groups.evaluate(mfilter, "list", 0)
+                top['groups.last month'] = groups.evaluate(mfilter, "list", 31)
+                top['groups.last year'] = groups.evaluate(mfilter, "list", 365)
 
         return top
 
@@ -29,8 +29,12 @@ from vizgrimoire.metrics.query_builder import DSQuery
 
 # global vars to be moved to specific classes
 cursor = None
+# database used by cursor
+dbname = None
 # one connection per database
 dbpool = {}
+# connections from the parent of a forked process
+inherited_dbpool = []
 
 ##
 ## METAQUERIES
@@ -70,6 +74,7 @@ def BuildQuery (period, startdate, enddate, date_field, fields, tables, filters,
 def SetDBChannel (user=None, password=None, database=None,
                   host="127.0.0.1", port=3306, group=None):
     global cursor
+    global dbname
     global dbpool
 
     db = None
@@ -86,23 +91,89 @@ def SetDBChannel (user=None, password=None, database=None,
 
     cursor = db.cursor()
     cursor.execute("SET NAMES 'utf8'")
+    dbname = database
+
+    if DSQuery.get_query_cache() is not None:
+        DSQuery.get_query_cache().register(database)
+
+def ResetDBChannel ():
+    """ Use new connections in a forked process.
+
+        Connections from the parent process are kept but not used, so
+        they are not closed from the child.
+    """
+    global cursor
+    global dbname
+    global dbpool
+
+    inherited_dbpool.extend(dbpool.values())
+    dbpool = {}
+    cursor = None
+    dbname = None
 
 def ExecuteQuery (sql):
-    result = {}
-    cursor.execute(sql)
-    rows = cursor.rowcount
-    columns = cursor.description
-
-    if columns is None: return result
-
-    for column in columns:
-        result[column[0]] = []
-    if rows > 1:
-        for value in cursor.fetchall():
-            for (index,column) in enumerate(value):
-                result[columns[index][0]].append(column)
-    elif rows == 1:
-        value = cursor.fetchone()
-        for i in range (0, len(columns)):
-            result[columns[i][0]] = value[i]
-    return result 
+    return DSQuery.execute_cursor_query(cursor, dbname, sql)
+
+def ExecuteQueryFrame (sql):
+    return DSQuery.execute_cursor_frame(cursor, dbname, sql)
+
+##
+## BULK DELETIONS
+##
+
+# staged ids removed in each transaction
+DELETE_BATCH_SIZE = 5000
+
+def StageIds (stage, query, id_type = "INT"):
+    """ Store the ids returned by query in the temporary table stage
+
+        Ids are numbered from 1 in the pos column so they can be removed
+        in batches. They are numbered in the query, as auto increment
+        values are not consecutive with auto_increment_increment > 1
+        (i.e. in Galera clusters). Returns the number of ids staged.
+    """
+    DropStage(stage)
+    q = """
+        CREATE TEMPORARY TABLE %s (
+            pos INT NOT NULL PRIMARY KEY,
+            id %s NOT NULL,
+            KEY (id))
+        """ % (stage, id_type)
+    ExecuteQuery(q)
+    q = """
+        INSERT INTO %s (pos, id)
+        SELECT @stage_pos := @stage_pos + 1, staged.*
+        FROM (%s) staged, (SELECT @stage_pos := 0) init
+        """ % (stage, query)
+    ExecuteQuery(q)
+    return cursor.rowcount
+
+def DropStage (stage):
+    ExecuteQuery("DROP TEMPORARY TABLE IF EXISTS %s" % (stage))
+
+def DeleteStaged (name, stage, total, deletes, batch_size = None):
+    """ Run the deletes for the staged ids in batches
+
+        deletes are DELETE ... JOIN statements with the stage table
+        aliased as t and a %(batch)s condition in the WHERE clause.
+        Each batch is removed in a transaction. Returns the number of
+        rows removed.
+    """
+    if batch_size is None: batch_size = DELETE_BATCH_SIZE
+    removed = 0
+
+    for start in range(0, total, batch_size):
+        end = min(start + batch_size, total)
+        batch = "t.pos > %i AND t.pos <= %i" % (start, end)
+        ExecuteQuery("START TRANSACTION")
+        try:
+            for delete in deletes:
+                ExecuteQuery(delete % {"batch": batch})
+                removed += max(cursor.rowcount, 0)
+        except:
+            ExecuteQuery("ROLLBACK")
+            raise
+        ExecuteQuery("COMMIT")
+        logging.info("Removing %s: %i/%i" % (name, end, total))
+
+    return removed
@@ -29,6 +29,7 @@
 import calendar
 from ConfigParser import SafeConfigParser
 from datetime import datetime, timedelta
+from decimal import Decimal
 from dateutil.relativedelta import relativedelta
 from dateutil import parser
 import logging
@@ -80,71 +81,92 @@ def cleanNaN(ts_data):
     return ts_data
 
 
-def completePeriodIdsYears(ts_data, start, end):
+# Abbreviated month names, as "%b" in the C locale. Used instead of
+# strftime so labels do not depend on the locale of the process.
+month_abbrs = ["Jan", "Feb", "Mar", "Apr", "May", "Jun",
+               "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+def _periodLabel(date, with_day = False):
+    label = month_abbrs[date.month-1] + " " + str(date.year)
+    if with_day: label = "%02d " % (date.day) + label
+    return label
+
+def _completePeriods(ts_data, period_field, periods):
+    """ Add a time point to ts_data for each period not included in it
+
+        periods is the ordered list of (key, date) for the time series,
+        key is the value of period_field for the period and date its start.
+        The rows of ts_data are indexed once by its period_field values
+        and all the metric columns are filled in the same pass.
+    """
     data_vars = ts_data.keys()
     new_ts_data =  createTimeSeries(ts_data)
     checkListArray(ts_data)
 
-    start_year = start.year * 12
-    years = end.year - start.year
+    # First row for each period, as list.index does
+    rows = {}
+    for (row, key) in enumerate(ts_data[period_field]):
+        if key not in rows: rows[key] = row
 
+    columns = [(new_ts_data[key], ts_data[key]) for key in data_vars]
+    period_column = new_ts_data[period_field]
+    with_day = (period_field == 'unixtime')
 
-    for i in range(0, years+1):
-        if (start_year+(i*12) in ts_data['year']) is False:
+    for (i, (key, current)) in enumerate(periods):
+        row = rows.get(key)
+        if row is None:
             # Add new time point with all vars to zero
-            for key in (data_vars):
-                new_ts_data[key].append(0)
-            new_ts_data['year'].pop()
-            new_ts_data['year'].append(start_year+(i*12))
+            for (new_column, column) in columns: new_column.append(0)
+            period_column[-1] = key
         else:
             # Add already existing data for the time point
-            index = ts_data['year'].index(start_year+(i*12))
-            for key in (data_vars):
-                new_ts_data[key].append(ts_data[key][index])
+            for (new_column, column) in columns: new_column.append(column[row])
 
-        current =  start + relativedelta(years=i)
         timestamp = calendar.timegm(current.timetuple())
-        new_ts_data['unixtime'].append(unicode(timestamp))
-        new_ts_data['id'].append(i)
-        new_ts_data['date'].append(datetime.strftime(current, "%b %Y"))
+        point = {'unixtime': unicode(timestamp), 'id': i,
+                 'date': _periodLabel(current, with_day)}
+        for field in point:
+            if field in ts_data: new_ts_data[field][-1] = point[field]
+            else: new_ts_data[field].append(point[field])
 
     return new_ts_data
 
+def completePeriodIdsDays(ts_data, start, end):
+    # period field is the unix timestamp of the start of the day
+    periods = []
+    current = start
+    while (current <= end):
+        periods.append((calendar.timegm(current.timetuple()), current))
+        current = current + timedelta(days=1)
+    return _completePeriods(ts_data, 'unixtime', periods)
 
-def completePeriodIdsMonths(ts_data, start, end):
-    data_vars = ts_data.keys()
-    new_ts_data =  createTimeSeries(ts_data)
-    checkListArray(ts_data)
+def completePeriodIdsYears(ts_data, start, end):
+    periods = []
+    start_year = start.year * 12
+    years = end.year - start.year
+    for i in range(0, years+1):
+        periods.append((start_year+(i*12), start + relativedelta(years=i)))
+    return _completePeriods(ts_data, 'year', periods)
+
+def completePeriodIdsQuarters(ts_data, start, end):
+    periods = []
+    start_quarter = start.year*4 + (start.month-1)/3 + 1
+    end_quarter = end.year*4 + (end.month-1)/3 + 1
+    for quarter in range(start_quarter, end_quarter+1):
+        year = (quarter-1) / 4
+        month = ((quarter-1) % 4) * 3 + 1
+        periods.append((quarter, datetime(year, month, 1)))
+    return _completePeriods(ts_data, 'quarter', periods)
 
+def completePeriodIdsMonths(ts_data, start, end):
+    periods = []
     start_month = start.year*12 + start.month
     end_month = end.year*12 + end.month
-    months = end_month - start_month
-
     # All data is from the complete month
-    start = start - timedelta(days=(start.day-1))
-
-    for i in range(0, months+1):
-        if (start_month+i in ts_data['month']) is False:
-            # Add new time point with all vars to zero
-            for key in (data_vars):
-                new_ts_data[key].append(0)
-            new_ts_data['month'].pop()
-            new_ts_data['month'].append(start_month+i)
-        else:
-            # Add already existing data for the time point
-            index = ts_data['month'].index(start_month+i)
-            for key in (data_vars):
-                new_ts_data[key].append(ts_data[key][index])
-
-        current =  start + relativedelta(months=i)
-        timestamp = calendar.timegm(current.timetuple())
-        new_ts_data['unixtime'].append(unicode(timestamp))
-        new_ts_data['id'].append(i)
-        import locale
-        locale.setlocale(locale.LC_ALL, "en_US.UTF-8")
-        new_ts_data['date'].append(datetime.strftime(current, "%b %Y"))
-
-    return new_ts_data
+    for month in range(start_month, end_month+1):
+        year = (month-1) / 12
+        periods.append((month, datetime(year, month - year*12, 1)))
+    return _completePeriods(ts_data, 'month', periods)
 
 def date2Week(date):
     # isocalendar: year weeknumber weekday
@@ -153,39 +175,14 @@ def date2Week(date):
     return week
 
 def completePeriodIdsWeeks(ts_data, start, end):
-    data_vars = ts_data.keys()
-    new_ts_data =  createTimeSeries(ts_data)
-    checkListArray(ts_data)
-
+    periods = []
     # Start of the week
     dayweek = start.isocalendar()[2]
-    new_week = start - relativedelta(days=dayweek-1)
-    i = 0 # for ids in time series
-
+    new_week = start - timedelta(days=dayweek-1)
     while (new_week <= end):
-        new_week_txt = date2Week(new_week)
-        if (int(new_week_txt) in ts_data['week']) is False:
-            # Add new time point with all vars to zero
-            for key in (data_vars):
-                new_ts_data[key].append(0)
-            new_ts_data['week'].pop()
-            new_ts_data['week'].append(int(new_week_txt))
-        else:
-            # Add already existing data for the time point
-            index = ts_data['week'].index(int(new_week_txt))
-            for key in (data_vars):
-                new_ts_data[key].append(ts_data[key][index])
-            new_ts_data['week'].pop()
-            new_ts_data['week'].append(ts_data['week'][index])
-
-        timestamp = calendar.timegm(new_week.timetuple())
-        new_ts_data['unixtime'].append(unicode(timestamp))
-        new_ts_data['id'].append(i)
-        i += 1
-        new_ts_data['date'].append(datetime.strftime(new_week, "%b %Y"))
-        new_week = new_week + relativedelta(weeks=1)
-
-    return new_ts_data
+        periods.append((int(date2Week(new_week)), new_week))
+        new_week = new_week + timedelta(weeks=1)
+    return _completePeriods(ts_data, 'week', periods)
 
 def completePeriodIds(ts_data, period, startdate, enddate):
     # If already complete, return
@@ -203,10 +200,14 @@ def completePeriodIds(ts_data, period, startdate, enddate):
     # For this reason, a day is substracted from the end date
     end = end - timedelta(days=1)
 
-    if period == "week":
+    if period == "day":
+        new_ts_data = completePeriodIdsDays(ts_data, start, end)
+    elif period == "week":
         new_ts_data = completePeriodIdsWeeks(ts_data, start, end)
     elif period == "month":
         new_ts_data = completePeriodIdsMonths(ts_data, start, end)
+    elif period == "quarter":
+        new_ts_data = completePeriodIdsQuarters(ts_data, start, end)
     elif period == "year":
         new_ts_data = completePeriodIdsYears(ts_data, start, end)
 
@@ -258,6 +259,9 @@ def getPeriod(granularity, number = None):
     if (granularity == 'years'):
         period = 'year'
         nperiod = 365
+    elif (granularity == 'quarters'):
+        period = 'quarter'
+        nperiod = 92
     elif (granularity == 'months'): 
         period = 'month'
         nperiod = 31
@@ -341,6 +345,126 @@ def convertCombinedFiltersName(data):
             break
     return data
 
+class ReportJSONEncoder(json.JSONEncoder):
+    """ JSON encoder normalizing the data of the reports
+
+        Decimal values are converted to float, floats are rounded to
+        Metrics.max_decimals, datetime values are converted to str and
+        NaN is written as "NA". All of it is done while encoding, so
+        data is walked only once and it is not modified. Lists of numbers,
+        the time series, are encoded in one step.
+    """
+
+    # Number of chunks kept in memory before writing them to the file
+    buffer_chunks = 4096
+    _fp = None
+
+    def default(self, o):
+        if isinstance(o, Decimal): return float(o)
+        if isinstance(o, datetime): return str(o)
+        return json.JSONEncoder.default(self, o)
+
+    def _floatstr(self, o):
+        if o != o: return '"NA"'
+        elif o == self._infinity: return 'Infinity'
+        elif o == -self._infinity: return '-Infinity'
+        return repr(round(o, self._decimals))
+
+    def _key(self, key):
+        if isinstance(key, basestring): return key
+        elif isinstance(key, float): return repr(key)
+        elif key is True: return 'true'
+        elif key is False: return 'false'
+        elif key is None: return 'null'
+        elif isinstance(key, (int, long)): return str(key)
+        raise TypeError("key " + repr(key) + " is not a string")
+
+    def _encode_numbers(self, o):
+        """ JSON for a list of numbers or None if it is not one """
+        floatstr = self._floatstr
+        values = []
+        for value in o:
+            value_type = type(value)
+            if value_type is float: values.append(floatstr(value))
+            elif value_type is int or value_type is long: values.append(str(value))
+            elif value_type is Decimal: values.append(floatstr(float(value)))
+            elif value is None: values.append('null')
+            else: return None
+        return '[' + self.item_separator.join(values) + ']'
+
+    def _encode(self, o, chunks):
+        if isinstance(o, basestring):
+            chunks.append(self._encoder(o))
+        elif o is None:
+            chunks.append('null')
+        elif o is True:
+            chunks.append('true')
+        elif o is False:
+            chunks.append('false')
+        elif isinstance(o, (int, long)):
+            chunks.append(str(o))
+        elif isinstance(o, float):
+            chunks.append(self._floatstr(o))
+        elif isinstance(o, (list, tuple)):
+            numbers = self._encode_numbers(o)
+            if numbers is not None:
+                chunks.append(numbers)
+                return
+            chunks.append('[')
+            first = True
+            for value in o:
+                if first: first = False
+                else: chunks.append(self.item_separator)
+                self._encode(value, chunks)
+            chunks.append(']')
+        elif isinstance(o, dict):
+            items = o.items()
+            if self.sort_keys: items.sort(key=lambda kv: kv[0])
+            chunks.append('{')
+            first = True
+            for (key, value) in items:
+                if self.skipkeys and not isinstance(key, (basestring, float, int, long,
+                                                          bool, type(None))):
+                    continue
+                if first: first = False
+                else: chunks.append(self.item_separator)
+                chunks.append(self._encoder(self._key(key)))
+                chunks.append(self.key_separator)
+                self._encode(value, chunks)
+            chunks.append('}')
+        else:
+            self._encode(self.default(o), chunks)
+        if self._fp is not None and len(chunks) > self.buffer_chunks:
+            self._flush(chunks)
+
+    def _flush(self, chunks):
+        self._fp.write(''.join(chunks))
+        del chunks[:]
+
+    def _init_encode(self):
+        from vizgrimoire.metrics.metrics import Metrics
+        self._decimals = Metrics.max_decimals
+        self._infinity = float('inf')
+        if self.ensure_ascii: self._encoder = json.encoder.encode_basestring_ascii
+        else: self._encoder = json.encoder.encode_basestring
+
+    def dump(self, o, fp):
+        """ Write the JSON for o to fp while it is encoded """
+        self._init_encode()
+        self._fp = fp
+        chunks = []
+        try:
+            self._encode(o, chunks)
+            self._flush(chunks)
+        finally:
+            self._fp = None
+
+    def iterencode(self, o, _one_shot=False):
+        self._init_encode()
+        chunks = []
+        self._encode(o, chunks)
+        return chunks
+
 # Until we use VizPy we will create JSON python files with _py
 def createJSON(data, filepath, check=False, skip_fields = []):
     check = False # for production mode
@@ -348,16 +472,16 @@ def createJSON(data, filepath, check=False, skip_fields = []):
     filepath_py = filepath_tokens[0]+"_py.json"
     filepath_r = filepath_tokens[0]+"_r.json"
 
-    checked_data = convertDatetime(roundDecimals(removeDecimals(data)))
-    checked_data = convertCombinedFiltersName(checked_data)
-    json_data = json.dumps(checked_data, sort_keys=True)
-    json_data = json_data.replace('NaN','"NA"')
+    checked_data = convertCombinedFiltersName(data)
+    encoder = ReportJSONEncoder(sort_keys=True)
     if check == False: #forget about R JSON checking
         jsonfile = open(filepath, 'w')
-        jsonfile.write(json_data)
+        encoder.dump(checked_data, jsonfile)
         jsonfile.close()
         return
 
+    json_data = encoder.encode(checked_data)
+
     # NA as value is not decoded with Python JSON
     # JSON R has "NA" and not NaN
     # JSON R has "NA" and not null
@@ -577,12 +701,52 @@ def get_avg(period_values):
         return period_values
     return average(removeDecimals(period_values))
 
-def medianAndAvgByPeriod(period, dates, values):
+class MedianAvgByPeriod(object):
+    """ medianAndAvgByPeriod for values added one by one
 
-    def get_period(period, date):
-        if period == 'month':
+        Values must be added ordered by period. Only the values of the
+        current period are kept.
+    """
+
+    def __init__(self, period):
+        self.period = period
+        self.result = {period  : [],
+                       'size' : [],
+                       'median' : [],
+                       'avg'    : []}
+        self._current_period = None
+        self._period_values = []
+
+    def _get_period(self, date):
+        if self.period == 'month':
             return date.year * 12 + date.month
 
+    def _close_period(self):
+        self.result[self.period].append(self._current_period)
+        self.result['size'].append(len(self._period_values))
+        self.result['median'].append(get_median(self._period_values))
+        self.result['avg'].append(get_avg(self._period_values))
+
+    def add(self, date, value):
+        date_period = self._get_period(date)
+
+        # Change of period
+        if self._period_values and date_period != self._current_period:
+            self._close_period()
+            self._period_values = []
+
+        self._current_period = date_period
+        self._period_values.append(value)
+
+    def get_result(self):
+        """ Values by period or None if no values were added """
+        if not self._period_values: return None
+        self._close_period()
+        self._period_values = []
+        return self.result
+
+def medianAndAvgByPeriod(period, dates, values):
+
     if len(dates) == 0: return None
     if not values: return None
 
@@ -591,38 +755,81 @@ def medianAndAvgByPeriod(period, dates, values):
 
     if len(dates) != len(values): return None
 
-    result = {period  : [],
-              'size' : [],
-              'median' : [],
-              'avg'    : []}
+    stats = MedianAvgByPeriod(period)
+    for i in range(0, len(dates)):
+        stats.add(dates[i], values[i])
+    return stats.get_result()
 
-    start = dates[0]
-    current_period = get_period(period, start)
-    period_values = []
-    ndates = len(dates)
+class BacklogSweep(object):
+    """ Backlog of keys at several dates replaying their events once
 
-    for i in range(0, ndates):
-        date_period = get_period(period, dates[i])
-
-        # Change of period
-        if date_period != current_period:
-            result[period].append(current_period)
-            result['size'].append(len(period_values))
-            result['median'].append(get_median(period_values))
-            result['avg'].append(get_avg(period_values))
+        Each event sets a field in the state of a key. A key is in the
+        backlog of a counter when counter(key, state) is True. Events are
+        sorted by date, keeping the order in which they were added for the
+        same date, and applied in a single pass over all the dates.
 
-            current_period = date_period
-            period_values = []
-
-        period_values.append(values[i])
+        If groups is given, a dict with the list of groups of each key,
+        backlogs are counted for each group.
+    """
 
-        # End of the list
-        if i == ndates - 1:
-            result[period].append(current_period)
-            result['size'].append(len(period_values))
-            result['median'].append(get_median(period_values))
-            result['avg'].append(get_avg(period_values))                        # Accumulated values
-    return result
+    def __init__(self, counters, groups = None):
+        self.counters = counters
+        self.groups = groups
+        self._events = []
+
+    def add(self, date, key, field, value):
+        if date is None: return
+        self._events.append((date, len(self._events), key, field, value))
+
+    def _get_key_groups(self, key):
+        if self.groups is None: return [None]
+        return self.groups.get(key, [])
+
+    def get_backlog(self, dates, include_date = True):
+        """ Backlog of each counter at each date
+
+            The backlog at a date includes the events in that date
+            if include_date, only the events before it if not. Without
+            groups it is a list with a value for each date, and with
+            groups a dict with that list for each group.
+        """
+        names = self.counters.keys()
+        counts = {}
+        backlog = {}
+        for name in names:
+            counts[name] = {}
+            backlog[name] = {}
+
+        states = {}
+        events = sorted(self._events)
+        pos = 0
+        for ndate in range(0, len(dates)):
+            while pos < len(events):
+                (event_date, order, key, field, value) = events[pos]
+                if event_date > dates[ndate]: break
+                if event_date == dates[ndate] and not include_date: break
+                pos += 1
+                state = states.setdefault(key, {})
+                before = [self.counters[name](key, state) for name in names]
+                state[field] = value
+                for i in range(0, len(names)):
+                    after = self.counters[names[i]](key, state)
+                    if after == before[i]: continue
+                    name_counts = counts[names[i]]
+                    for group in self._get_key_groups(key):
+                        if after: name_counts[group] = name_counts.get(group, 0) + 1
+                        else: name_counts[group] -= 1
+            for name in names:
+                for group in counts[name]:
+                    if group not in backlog[name]:
+                        # Groups are in the backlog since their first event
+                        backlog[name][group] = [0] * ndate
+                    backlog[name][group].append(counts[name][group])
+
+        if self.groups is None:
+            for name in names:
+                backlog[name] = backlog[name].get(None, [0] * len(dates))
+        return backlog
 
 def check_array_value(data):
         if not isinstance(data, list): data = [data]
@@ -649,8 +856,10 @@ def fill_items(items, data, id_field, evol = False,
         logging.info("[fill_items] " + id_field + " not found in " + ",".join(data))
         return data
     fields.remove(id_field)
+    data_items = set(data[id_field])
     for id in items:
-        if id not in data[id_field]:
+        if id not in data_items:
+            data_items.add(id)
             data[id_field].append(id)
             for field in fields:
                 if field in ts_fields: continue
@@ -680,10 +889,15 @@ def order_items(items, data, id_field, evol = False, period = None):
                 fields.remove(evol_field)
                 data_ordered[evol_field] = data[evol_field]
 
+    # Position of the first appearance of each item
+    positions = {}
+    for (pos, id) in enumerate(data[id_field]):
+        if id not in positions: positions[id] = pos
+
     for id in items:
         data_ordered[id_field].append(id)
         try:
-            pos = data[id_field].index(id)
+            pos = positions[id]
         except:
             print items
             print data[id_field]
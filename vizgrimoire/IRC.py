@@ -27,6 +27,7 @@ from vizgrimoire.GrimoireSQL import GetSQLGlobal, GetSQLPeriod, ExecuteQuery, Bu
 from vizgrimoire.GrimoireUtils import GetPercentageDiff, GetDates, getPeriod, createJSON, completePeriodIds
 from vizgrimoire.data_source import DataSource
 from vizgrimoire.filter import Filter
+from vizgrimoire.items_pool import ItemsPool
 from vizgrimoire.metrics.metrics_filter import MetricFilters
 
 
@@ -138,7 +139,7 @@ class IRC(DataSource):
         fn = os.path.join(destdir, filter_.get_filename(IRC()))
         createJSON(items, fn)
 
-        for item in items :
+        def create_item_report(item):
             # item_name = "'"+ item+ "'"
             logging.info (item)
 
@@ -151,6 +152,9 @@ class IRC(DataSource):
             agg = IRC.get_agg_data(period, startdate, enddate, identities_db, filter_item)
             fn = os.path.join(destdir, filter_item.get_static_filename(IRC()))
             createJSON(agg, fn)
+            return agg
+
+        ItemsPool.map(create_item_report, items)
 
     @staticmethod
     def create_filter_report_all(filter_, period, startdate, enddate, destdir, npeople, identities_db):
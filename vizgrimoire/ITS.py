@@ -28,6 +28,7 @@ import logging, os, re
 
 from vizgrimoire.GrimoireSQL import GetSQLGlobal, GetSQLPeriod
 from vizgrimoire.GrimoireSQL import ExecuteQuery, BuildQuery
+from vizgrimoire.GrimoireSQL import StageIds, DeleteStaged, DropStage
 from vizgrimoire.GrimoireUtils import GetPercentageDiff, GetDates, completePeriodIds, getPeriod, check_array_value
 from vizgrimoire.GrimoireUtils import createJSON
 from vizgrimoire.metrics.metrics_filter import MetricFilters
@@ -35,6 +36,7 @@ from vizgrimoire.metrics.metrics_filter import MetricFilters
 from vizgrimoire.metrics.query_builder import ITSQuery
 from vizgrimoire.data_source import DataSource
 from vizgrimoire.filter import Filter
+from vizgrimoire.items_pool import ItemsPool
 
 
 class ITS(DataSource):
@@ -225,6 +227,30 @@ class ITS(DataSource):
         items = metric.get_list()
         return items
 
+    @classmethod
+    def get_items_last_date(cls, filter_, startdate, enddate, identities_db):
+        """Get the date of the last submission or change of the issues of each
+           item of filter_, with one GROUP BY query for each of them"""
+        last_dates = {}
+        metric = cls.get_metrics("last_date", cls)
+        if metric is None: return last_dates
+        mfilter = metric.filters.copy()
+        mfilter.type_analysis = [filter_.get_name(), None]
+        id_field = cls.get_query_builder().get_group_field_alias(filter_.get_name())
+        for query in metric.db.GetSQLItemsLastDate(mfilter):
+            res = metric.db.ExecuteQuery(query)
+            if len(res) == 0: continue
+            items = res[id_field]
+            dates = res['last_date']
+            if not isinstance(items, list):
+                items = [items]
+                dates = [dates]
+            for (item, date) in zip(items, dates):
+                if date is not None: date = str(date)
+                if last_dates.get(item) is None or (date is not None and date > last_dates[item]):
+                    last_dates[item] = date
+        return last_dates
+
     @classmethod
     def get_filter_summary(cls,filter_, period, startdate, enddate, identities_db, limit):
         summary = None
@@ -259,10 +285,16 @@ class ITS(DataSource):
         else:
             items_list = items
 
-        for item in items :
+        unchanged = cls.get_unchanged_items(filter_, period, startdate, enddate, identities_db)
+
+        def create_item_report(item):
             item_name = "'"+ item+ "'"
             logging.info (item_name)
             filter_item = Filter(filter_name, item)
+            fn = os.path.join(destdir, filter_item.get_top_filename(cls()))
+            if item in unchanged and (filter_name not in ["company","domain","repository"]
+                                      or os.path.isfile(fn)):
+                return cls.read_agg_data(destdir, filter_item)
 
             evol_data = cls.get_evolutionary_data(period, startdate, enddate, identities_db, filter_item)
             fn = os.path.join(destdir, filter_item.get_evolutionary_filename(cls()))
@@ -272,18 +304,21 @@ class ITS(DataSource):
             fn = os.path.join(destdir, filter_item.get_static_filename(cls()))
             createJSON(agg, fn)
 
-            if filter_name in ["domain", "company", "repository"]:
-                items_list['name'].append(item.replace('/', '_'))
-                items_list['closed_365'].append(agg['closed_365'])
-                items_list['closers_365'].append(agg['closers_365'])
-
             if filter_name in ["company","domain","repository"]:
                 top = cls.get_top_data(startdate, enddate, identities_db, filter_item, npeople)
                 fn = os.path.join(destdir, filter_item.get_top_filename(cls()))
                 createJSON(top, fn)
+            return agg
+
+        for (item, agg) in zip(items, ItemsPool.map(create_item_report, items)):
+            if filter_name in ["domain", "company", "repository"]:
+                items_list['name'].append(item.replace('/', '_'))
+                items_list['closed_365'].append(agg['closed_365'])
+                items_list['closers_365'].append(agg['closers_365'])
 
         fn = os.path.join(destdir, filter_.get_filename(cls()))
         createJSON(items_list, fn)
+        cls.save_items_activity(filter_)
 
         if (filter_name == "company"):
             ds = ITS
@@ -386,44 +421,40 @@ class ITS(DataSource):
         vizr.ReportMarkovChain(destdir)
 
     @staticmethod
-    def _remove_people(people_id):
+    def _remove_people(stage, total):
         # Remove from people
-        q = "DELETE FROM people_upeople WHERE people_id='%s'" % (people_id)
-        ExecuteQuery(q)
-        q = "DELETE FROM people WHERE id='%s'" % (people_id)
-        ExecuteQuery(q)
+        deletes = ["""
+            DELETE pup FROM people_upeople pup JOIN %s t ON pup.people_id = t.id
+            WHERE %%(batch)s
+            """ % (stage), """
+            DELETE p FROM people p JOIN %s t ON p.id = t.id
+            WHERE %%(batch)s
+            """ % (stage)]
+        return DeleteStaged("people", stage, total, deletes)
 
     @classmethod
-    def _remove_issue(cls, issue_id):
+    def _remove_issues(cls, stage, total):
         # Backend name
         its_type = cls._get_backend().its_type
         db_ext = its_type
         if its_type == "lp": db_ext = "launchpad"
         elif its_type == "bg": db_ext = "bugzilla"
-        # attachments
-        q = "DELETE FROM attachments WHERE issue_id='%s'" % (issue_id)
-        ExecuteQuery(q)
-        # changes
-        q = "DELETE FROM changes WHERE issue_id='%s'" % (issue_id)
-        ExecuteQuery(q)
-        # comments
-        q = "DELETE FROM comments WHERE issue_id='%s'" % (issue_id)
-        ExecuteQuery(q)
-        # related_to
-        q = "DELETE FROM related_to WHERE issue_id='%s'" % (issue_id)
-        ExecuteQuery(q)
-        # issues_ext_bugzilla
-        q = "DELETE FROM issues_ext_%s WHERE issue_id='%s'" % (db_ext, issue_id)
-        ExecuteQuery(q)
-        # issues_log_bugzilla
-        q = "DELETE FROM issues_log_%s WHERE issue_id='%s'" % (db_ext, issue_id)
-        ExecuteQuery(q)
-        # issues_watchers
-        q = "DELETE FROM issues_watchers WHERE issue_id='%s'" % (issue_id)
-        ExecuteQuery(q)
-        # issues
-        q = "DELETE FROM issues WHERE id='%s'" % (issue_id)
-        ExecuteQuery(q)
+        # attachments, changes, comments, related_to, issues_ext_bugzilla,
+        # issues_log_bugzilla, issues_watchers and issues at last
+        tables = ["attachments", "changes", "comments", "related_to",
+                  "issues_ext_" + db_ext, "issues_log_" + db_ext,
+                  "issues_watchers"]
+        deletes = []
+        for table in tables:
+            deletes.append("""
+                DELETE x FROM %s x JOIN %s t ON x.issue_id = t.id
+                WHERE %%(batch)s
+                """ % (table, stage))
+        deletes.append("""
+            DELETE i FROM issues i JOIN %s t ON i.id = t.id
+            WHERE %%(batch)s
+            """ % (stage))
+        return DeleteStaged("issues", stage, total, deletes)
 
     @staticmethod
     def remove_filter_data(filter_):
@@ -431,7 +462,7 @@ class ITS(DataSource):
         logging.info("Removing ITS filter %s %s" % (filter_.get_name(),filter_.get_item()))
         q = "SELECT * from trackers WHERE url='%s'" % (uri)
         repo = ExecuteQuery(q)
-        if 'id' not in repo:
+        if 'id' not in repo or repo['id'] == []:
             logging.error("%s not found" % (uri))
             return
 
@@ -445,29 +476,25 @@ class ITS(DataSource):
 
 
         logging.info("Removing people")
-        ## Remove submitted_by that exists only in this repository
+        ## Remove submitted_by and assigned_to that exist only in this repository
         q = """
             SELECT DISTINCT(submitted_by) from issues
             WHERE tracker_id='%s' AND submitted_by in (%s)
-        """  % (repo['id'],get_people_one_repo("submitted_by"))
-        res = ExecuteQuery(q)
-        for people_id in res['submitted_by']:
-            ITS._remove_people(people_id)
-        ## Remove assigned_to that exists only in this repository
-        q = """
+            UNION
             SELECT DISTINCT(assigned_to) from issues
             WHERE tracker_id='%s' AND assigned_to in (%s)
-        """  % (repo['id'],get_people_one_repo("assigned_to"))
-        res = ExecuteQuery(q)
-        for people_id in res['assigned_to']:
-            ITS._remove_people(people_id)
+        """  % (repo['id'],get_people_one_repo("submitted_by"),
+                repo['id'],get_people_one_repo("assigned_to"))
+        total = StageIds("tmp_remove_people", q)
+        ITS._remove_people("tmp_remove_people", total)
+        DropStage("tmp_remove_people")
 
         # Remove people activity
         logging.info("Removing issues")
         q = "SELECT id from issues WHERE tracker_id='%s'" % (repo['id'])
-        res = ExecuteQuery(q)
-        for issue_id in res['id']:
-            ITS._remove_issue(issue_id)
+        total = StageIds("tmp_remove_issues", q)
+        ITS._remove_issues("tmp_remove_issues", total)
+        DropStage("tmp_remove_issues")
         # Remove filter
         q = "DELETE from trackers WHERE id='%s'" % (repo['id'])
         ExecuteQuery(q)
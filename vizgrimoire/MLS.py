@@ -31,11 +31,13 @@ import datetime
 
 from vizgrimoire.GrimoireSQL import GetSQLGlobal, GetSQLPeriod
 from vizgrimoire.GrimoireSQL import ExecuteQuery, BuildQuery
+from vizgrimoire.GrimoireSQL import StageIds, DeleteStaged, DropStage
 from vizgrimoire.GrimoireUtils import GetPercentageDiff, GetDates, completePeriodIds, getPeriod, createJSON, get_subprojects
 from vizgrimoire.metrics.metrics_filter import MetricFilters
 from vizgrimoire.analysis.threads import Threads
 from vizgrimoire.data_source import DataSource
 from vizgrimoire.filter import Filter
+from vizgrimoire.items_pool import ItemsPool
 
 
 class MLS(DataSource):
@@ -233,11 +235,16 @@ class MLS(DataSource):
         else:
             items_list = items
 
-        for item in items :
-            item = item.replace("'", "\\'")
+        unchanged = MLS.get_unchanged_items(filter_, period, startdate, enddate, identities_db)
+        unchanged = [item.replace("'", "\\'") for item in unchanged]
+
+        def create_item_report(item):
             item_name = "'"+ item+ "'"
             logging.info (item_name)
             filter_item = Filter(filter_.get_name(), item)
+            if item in unchanged and os.path.isfile(os.path.join(destdir,
+                                                    filter_item.get_top_filename(MLS()))):
+                return MLS.read_agg_data(destdir, filter_item)
 
             evol_data = MLS.get_evolutionary_data(period, startdate, enddate, 
                                                   identities_db, filter_item)
@@ -248,16 +255,20 @@ class MLS(DataSource):
             fn = os.path.join(destdir, filter_item.get_static_filename(MLS()))
             createJSON(agg, fn)
 
+            top_senders = MLS.get_top_data(startdate, enddate, identities_db, filter_item, npeople, False)
+            createJSON(top_senders, destdir+"/"+filter_item.get_top_filename(MLS()))
+            return agg
+
+        items_sql = [item.replace("'", "\\'") for item in items]
+        for (item, agg) in zip(items_sql, ItemsPool.map(create_item_report, items_sql)):
             if filter_name in ("domain", "company", "repository"):
                 items_list['name'].append(item.replace('/', '_').replace("<","__").replace(">","___"))
                 items_list['sent_365'].append(agg['sent_365'])
                 items_list['senders_365'].append(agg['senders_365'])
 
-            top_senders = MLS.get_top_data(startdate, enddate, identities_db, filter_item, npeople, False)
-            createJSON(top_senders, destdir+"/"+filter_item.get_top_filename(MLS()))
-
         fn = os.path.join(destdir, filter_.get_filename(MLS()))
         createJSON(items_list, fn)
+        MLS.save_items_activity(filter_)
 
         if (filter_name == "company"):
             ds = MLS
@@ -338,6 +349,66 @@ class MLS(DataSource):
         ## JSON files generated from VizR
         vizr.ReportTimeToAttendMLS(destdir)
 
+    @staticmethod
+    def _remove_people(stage, total):
+        # Remove from people
+        deletes = ["""
+            DELETE pup FROM people_uidentities pup JOIN %s t ON pup.people_id = t.id
+            WHERE %%(batch)s
+            """ % (stage), """
+            DELETE p FROM people p JOIN %s t ON p.email_address = t.id
+            WHERE %%(batch)s
+            """ % (stage)]
+        return DeleteStaged("people", stage, total, deletes)
+
+    @staticmethod
+    def _remove_messages(stage, total, uri):
+        # message_ID is only unique in a mailing list
+        deletes = ["""
+            DELETE mp FROM messages_people mp JOIN %s t ON mp.message_id = t.id
+            WHERE mp.mailing_list_url = '%s' AND %%(batch)s
+            """ % (stage, uri), """
+            DELETE m FROM messages m JOIN %s t ON m.message_ID = t.id
+            WHERE m.mailing_list_url = '%s' AND %%(batch)s
+            """ % (stage, uri)]
+        return DeleteStaged("messages", stage, total, deletes)
+
+    @staticmethod
+    def remove_filter_data(filter_):
+        uri = filter_.get_item()
+        logging.info("Removing MLS filter %s %s" % (filter_.get_name(),filter_.get_item()))
+        q = "SELECT * from mailing_lists WHERE mailing_list_url='%s'" % (uri)
+        repo = ExecuteQuery(q)
+        if 'mailing_list_url' not in repo or repo['mailing_list_url'] == []:
+            logging.error("%s not found" % (uri))
+            return
+
+        logging.info("Removing people")
+        ## Remove senders and receivers that exist only in this mailing list
+        q = """
+            SELECT DISTINCT(email_address) from messages_people
+            WHERE mailing_list_url='%s' AND email_address in (
+                SELECT email_address FROM (
+                    SELECT COUNT(DISTINCT(mailing_list_url)) AS total, email_address
+                    FROM messages_people
+                    GROUP BY email_address
+                    HAVING total=1) t)
+        """  % (uri)
+        total = StageIds("tmp_remove_people", q, "VARCHAR(255)")
+        MLS._remove_people("tmp_remove_people", total)
+        DropStage("tmp_remove_people")
+
+        # Remove people activity
+        logging.info("Removing messages")
+        q = "SELECT message_ID from messages WHERE mailing_list_url='%s'" % (uri)
+        total = StageIds("tmp_remove_messages", q, "VARCHAR(255)")
+        MLS._remove_messages("tmp_remove_messages", total, uri)
+        DropStage("tmp_remove_messages")
+        # Remove filter
+        for table in ["mailing_lists_people", "compressed_files", "mailing_lists"]:
+            q = "DELETE from %s WHERE mailing_list_url='%s'" % (table, uri)
+            ExecuteQuery(q)
+
     @staticmethod
     def get_query_builder():
         from vizgrimoire.metrics.query_builder import MLSQuery
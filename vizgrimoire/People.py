@@ -43,4 +43,68 @@ def GetPersonIdentifiers (identities_db, upeople_id):
             WHERE pro.uuid ='%s'
             """ % (identities_db, identities_db, upeople_id)
         res = ExecuteQuery(q)
-    return res
\ No newline at end of file
+    return res
+# Max number of people included in each query of GetPersonIdentifiersBulk
+BULK_CHUNK_SIZE = 1000
+
+def _GroupPersonIdentifiers (res, upeople_ids, people):
+    """ Split query results by uuid, with the format of GetPersonIdentifiers """
+    columns = res.keys()
+    if not isinstance(res['uuid'], list):
+        # Only one row
+        res = dict([(column, [res[column]]) for column in columns])
+    rows = {}
+    for i in range(0, len(res['uuid'])):
+        uuid = res['uuid'][i]
+        if uuid not in rows: rows[uuid] = []
+        rows[uuid].append(i)
+    for upeople_id in upeople_ids:
+        person_rows = rows.get(upeople_id, [])
+        if len(person_rows) == 1:
+            people[upeople_id] = dict([(column, res[column][person_rows[0]])
+                                       for column in columns])
+        else:
+            people[upeople_id] = dict([(column, [res[column][i] for i in person_rows])
+                                       for column in columns])
+
+def GetPersonIdentifiersBulk (identities_db, upeople_ids, chunk_size = None):
+    """ GetPersonIdentifiers for a list of people, with a query per chunk
+
+        Returns a dict with the data for each upeople_id.
+    """
+    if chunk_size is None: chunk_size = BULK_CHUNK_SIZE
+    people = {}
+    upeople_ids = list(set(upeople_ids))
+    with_orgs = True
+
+    for start in range(0, len(upeople_ids), chunk_size):
+        chunk = upeople_ids[start:start+chunk_size]
+        uuids = ",".join(["'%s'" % (upeople_id) for upeople_id in chunk])
+        res = None
+        if with_orgs:
+            q = """
+                SELECT pro.uuid, pro.name, pro.email, cou.name as country,
+                       org.name as affiliation
+                FROM %s.profiles pro
+                JOIN %s.enrollments enr ON enr.uuid= pro.uuid
+                JOIN %s.organizations org ON org.id = enr.organization_id
+                LEFT JOIN %s.countries cou ON cou.code = pro.country_code
+                WHERE pro.uuid IN (%s)
+                """ % (identities_db, identities_db, identities_db, identities_db,
+                       uuids)
+            try:
+                res = ExecuteQuery(q)
+            except:
+                # No organizations. Just people data and country data.
+                with_orgs = False
+        if not with_orgs:
+            q = """
+                SELECT pro.uuid, pro.name, pro.email, cou.name as country
+                FROM %s.profiles pro
+                LEFT JOIN %s.countries cou ON cou.code = pro.country_code
+                WHERE pro.uuid IN (%s)
+                """ % (identities_db, identities_db, uuids)
+            res = ExecuteQuery(q)
+        _GroupPersonIdentifiers(res, chunk, people)
+
+    return people
@@ -40,6 +40,7 @@ from vizgrimoire.metrics.query_builder import DSQuery
 
 from vizgrimoire.data_source import DataSource
 from vizgrimoire.filter import Filter
+from vizgrimoire.items_pool import ItemsPool
 
 
 class Pullpo(DataSource):
@@ -207,10 +208,7 @@ class Pullpo(DataSource):
 
         items_list = {"name":[],"review_time_days_median":[],"submitted":[]}
 
-        for item in items :
-            item_file = item.replace("/","_")
-            items_list["name"].append(item_file)
-
+        def create_item_report(item):
             logging.info (item)
             filter_item = Filter(filter_name, item)
 
@@ -223,6 +221,12 @@ class Pullpo(DataSource):
             agg = Pullpo.get_agg_data(period, startdate, enddate, identities_db, filter_item)
             fn = os.path.join(destdir, filter_item.get_static_filename(Pullpo()))
             createJSON(agg, fn)
+            return agg
+
+        for (item, agg) in zip(items, ItemsPool.map(create_item_report, items)):
+            item_file = item.replace("/","_")
+            items_list["name"].append(item_file)
+
             if 'submitted' in agg:
                 items_list["submitted"].append(agg["submitted"])
             else: items_list["submitted"].append("NA")
@@ -34,6 +34,7 @@ from vizgrimoire.GrimoireUtils import GetPercentageDiff, GetDates, getPeriod, cr
 from vizgrimoire.data_source import DataSource
 
 from vizgrimoire.filter import Filter
+from vizgrimoire.items_pool import ItemsPool
 
 from vizgrimoire.metrics.metrics_filter import MetricFilters
 
@@ -186,7 +187,8 @@ class QAForums(DataSource):
 
         fn = os.path.join(destdir, filter_.get_filename(QAForums()))
         createJSON(file_items, fn)
-        for item in items:
+
+        def create_item_report(item):
             logging.info(item)
             filter_item = Filter(filter_.get_name(), item)
 
@@ -197,6 +199,9 @@ class QAForums(DataSource):
             agg = QAForums.get_agg_data(period, startdate, enddate, identities_db, filter_item)
             fn = os.path.join(destdir, filter_item.get_static_filename(QAForums()))
             createJSON(agg, fn)
+            return agg
+
+        ItemsPool.map(create_item_report, items)
 
     @staticmethod
     def create_filter_report_all(filter_, period, startdate, enddate, destdir, npeople, identities_db):
@@ -28,10 +28,12 @@ import os, logging
 from vizgrimoire.GrimoireSQL import GetSQLGlobal, GetSQLPeriod
 # TODO integrate: from GrimoireSQL import  GetSQLReportFrom 
 from vizgrimoire.GrimoireSQL import ExecuteQuery, BuildQuery
+from vizgrimoire.GrimoireSQL import StageIds, DeleteStaged, DropStage
 from vizgrimoire.GrimoireUtils import GetPercentageDiff, GetDates, completePeriodIds
 from vizgrimoire.GrimoireUtils import createJSON, getPeriod
 from vizgrimoire.data_source import DataSource
 from vizgrimoire.filter import Filter
+from vizgrimoire.items_pool import ItemsPool
 from vizgrimoire.metrics.metrics_filter import MetricFilters
 from vizgrimoire.metrics.query_builder import DSQuery
 
@@ -128,10 +130,7 @@ class SCM(DataSource):
                 organizations_out = morganizations.filters.organizations_out
                 people_out = None
                 mfilter = MetricFilters(period, startdate, enddate, filter_.get_type_analysis(), npeople, people_out, organizations_out)
-                mfilter_orig = morganizations.filters
-                morganizations.filters = mfilter
-                top = morganizations.get_list()
-                morganizations.filters = mfilter_orig
+                top = morganizations.evaluate(mfilter, "list")
         return top
 
 
@@ -227,7 +226,8 @@ class SCM(DataSource):
         return summary
 
     @staticmethod
-    def create_filter_report_top(filter_, period, startdate, enddate, destdir, npeople, identities_db):
+    def create_filter_report_top(filter_, period, startdate, enddate, destdir, npeople, identities_db,
+                                 unchanged = []):
         from vizgrimoire.report import Report
         items = Report.get_items()
         if items is None:
@@ -247,10 +247,11 @@ class SCM(DataSource):
             item_name = "'"+ item+ "'"
             logging.info (item_name)
             filter_item = Filter(filter_name, item)
+            fn = os.path.join(destdir, filter_item.get_top_filename(SCM()))
+            if item in unchanged and os.path.isfile(fn): continue
 
             if filter_name in ("company","project","repository"):
                 top_authors = SCM.get_top_data(startdate, enddate, identities_db, filter_item, npeople)
-                fn = os.path.join(destdir, filter_item.get_top_filename(SCM()))
                 createJSON(top_authors, fn)
 
     @staticmethod
@@ -275,10 +276,14 @@ class SCM(DataSource):
         else:
             items_list = items
 
-        for item in items :
+        unchanged = SCM.get_unchanged_items(filter_, period, startdate, enddate, identities_db)
+
+        def create_item_report(item):
             item_name = "'"+ item+ "'"
             logging.info (item_name)
             filter_item = Filter(filter_name, item)
+            if item in unchanged:
+                return SCM.read_agg_data(destdir, filter_item)
 
             evol_data = SCM.get_evolutionary_data(period, startdate, enddate, identities_db, filter_item)
             fn = os.path.join(destdir, filter_item.get_evolutionary_filename(SCM()))
@@ -287,16 +292,20 @@ class SCM(DataSource):
             agg = SCM.get_agg_data(period, startdate, enddate, identities_db, filter_item)
             fn = os.path.join(destdir, filter_item.get_static_filename(SCM()))
             createJSON(agg, fn)
+            return agg
 
+        for (item, agg) in zip(items, ItemsPool.map(create_item_report, items)):
             if filter_name in ("domain", "company", "repository"):
                 items_list['name'].append(item.replace('/', '_'))
                 items_list['commits_365'].append(agg['commits_365'])
                 items_list['authors_365'].append(agg['authors_365'])
 
-        SCM.create_filter_report_top(filter_, period, startdate, enddate, destdir, npeople, identities_db)
+        SCM.create_filter_report_top(filter_, period, startdate, enddate, destdir, npeople,
+                                     identities_db, unchanged)
 
         fn = os.path.join(destdir, filter_.get_filename(SCM()))
         createJSON(items_list, fn)
+        SCM.save_items_activity(filter_)
 
         if (filter_name == "company"):
             ds = SCM
@@ -422,42 +431,46 @@ class SCM(DataSource):
         # vizr.ReportDemographicsBirthSCM(enddate, destdir, unique_ids)
 
     @staticmethod
-    def _remove_people(people_id):
+    def _remove_people(stage, total):
         # Remove from people
-        q = "DELETE FROM people_upeople WHERE people_id='%s'" % (people_id)
-        ExecuteQuery(q)
-        q = "DELETE FROM people WHERE id='%s'" % (people_id)
-        ExecuteQuery(q)
-
-    @staticmethod
-    def _remove_scmlog(scmlog_id):
-        # Get actions and remove mappings
-        q = "SELECT * from actions where commit_id='%s'" % (scmlog_id)
-        res = ExecuteQuery(q)
-        if 'id' in res:
-            if not isinstance(res['id'], list): res['id'] = [res['id']]
-            for action_id in res['id']:
-                # action_files is a view
-                # q = "DELETE FROM action_files WHERE action_id='%s'" % (action_id)
-                # ExecuteQuery(q)
-                q = "DELETE FROM file_copies WHERE action_id='%s'" % (action_id)
-                ExecuteQuery(q)
-        # actions_file_names is a VIEW
-        # q = "DELETE FROM actions_file_names WHERE commit_id='%s'" % (scmlog_id)
-        # ExecuteQuery(q)
-        q = "DELETE FROM commits_lines WHERE commit_id='%s'" % (scmlog_id)
-        ExecuteQuery(q)
-        q = "DELETE FROM file_links WHERE commit_id='%s'" % (scmlog_id)
-        ExecuteQuery(q)
-        q = "SELECT tag_id from tag_revisions WHERE commit_id='%s'" % (scmlog_id)
-        res = ExecuteQuery(q)
-        for tag_id in res['tag_id']:
-            q = "DELETE FROM tags WHERE id='%s'" % (tag_id)
-            ExecuteQuery(q)
-            q = "DELETE FROM tag_revisions WHERE tag_id='%s'" % (tag_id)
-            ExecuteQuery(q)
-        q = "DELETE FROM scmlog WHERE id='%s'" % (scmlog_id)
-        ExecuteQuery(q)
+        deletes = ["""
+            DELETE pup FROM people_upeople pup JOIN %s t ON pup.people_id = t.id
+            WHERE %%(batch)s
+            """ % (stage), """
+            DELETE p FROM people p JOIN %s t ON p.id = t.id
+            WHERE %%(batch)s
+            """ % (stage)]
+        return DeleteStaged("people", stage, total, deletes)
+
+    @staticmethod
+    def _remove_scmlog(stage, total):
+        # action_files and actions_file_names are VIEWs
+        deletes = ["""
+            DELETE fc FROM file_copies fc
+            JOIN actions a ON fc.action_id = a.id
+            JOIN %s t ON a.commit_id = t.id
+            WHERE %%(batch)s
+            """, """
+            DELETE a FROM actions a JOIN %s t ON a.commit_id = t.id
+            WHERE %%(batch)s
+            """, """
+            DELETE cl FROM commits_lines cl JOIN %s t ON cl.commit_id = t.id
+            WHERE %%(batch)s
+            """, """
+            DELETE fl FROM file_links fl JOIN %s t ON fl.commit_id = t.id
+            WHERE %%(batch)s
+            """, """
+            DELETE tg, tr_all FROM tag_revisions tr
+            JOIN %s t ON tr.commit_id = t.id
+            JOIN tags tg ON tg.id = tr.tag_id
+            JOIN tag_revisions tr_all ON tr_all.tag_id = tg.id
+            WHERE %%(batch)s
+            """, """
+            DELETE s FROM scmlog s JOIN %s t ON s.id = t.id
+            WHERE %%(batch)s
+            """]
+        deletes = [delete % (stage) for delete in deletes]
+        return DeleteStaged("commits", stage, total, deletes)
 
     @staticmethod
     def remove_filter_data(filter_):
@@ -465,7 +478,7 @@ class SCM(DataSource):
         logging.info("Removing SCM filter %s %s" % (filter_.get_name(),filter_.get_item()))
         q = "SELECT * from repositories WHERE uri='%s'" % (uri)
         repo = ExecuteQuery(q)
-        if 'id' not in repo:
+        if 'id' not in repo or repo['id'] == []:
             logging.error("%s not found" % (uri))
             return
         # Remove people
@@ -476,35 +489,35 @@ class SCM(DataSource):
                 GROUP BY %s
                 HAVING total=1) t
                 """ % (field, field, field)
-        ## Remove committer_id that exists only in this repository
+        ## Remove committer_id and author_id that exist only in this repository
         q = """
             SELECT DISTINCT(committer_id) from scmlog
             WHERE repository_id='%s' AND committer_id in (%s)
-        """  % (repo['id'],get_people_one_repo("committer_id"))
-        res = ExecuteQuery(q)
-        for people_id in res['committer_id']:
-            SCM._remove_people(people_id)
-        ## Remove author_id that exists only in this repository
-        q = """
+            UNION
             SELECT DISTINCT(author_id) from scmlog
             WHERE repository_id='%s' AND author_id in (%s)
-        """  % (repo['id'],get_people_one_repo("author_id"))
-        res = ExecuteQuery(q)
-        for people_id in res['author_id']:
-            SCM._remove_people(people_id)
+        """  % (repo['id'],get_people_one_repo("committer_id"),
+                repo['id'],get_people_one_repo("author_id"))
+        total = StageIds("tmp_remove_people", q)
+        SCM._remove_people("tmp_remove_people", total)
+        DropStage("tmp_remove_people")
         # Remove people activity
         q = "SELECT id from scmlog WHERE repository_id='%s'" % (repo['id'])
-        res = ExecuteQuery(q)
-        for scmlog_id in res['id']:
-            SCM._remove_scmlog(scmlog_id)
+        total = StageIds("tmp_remove_scmlog", q)
+        SCM._remove_scmlog("tmp_remove_scmlog", total)
+        DropStage("tmp_remove_scmlog")
         # Remove files
         q = "SELECT id FROM files WHERE repository_id='%s'" % (repo['id'])
-        res = ExecuteQuery(q)
-        for file_id in res['id']:
-            q = "DELETE FROM file_types WHERE file_id='%s'" % (file_id)
-            ExecuteQuery(q)
-            q = "DELETE FROM files WHERE id='%s'" % (file_id)
-            ExecuteQuery(q)
+        total = StageIds("tmp_remove_files", q)
+        deletes = ["""
+            DELETE ft FROM file_types ft JOIN tmp_remove_files t ON ft.file_id = t.id
+            WHERE %(batch)s
+            """, """
+            DELETE f FROM files f JOIN tmp_remove_files t ON f.id = t.id
+            WHERE %(batch)s
+            """]
+        DeleteStaged("files", "tmp_remove_files", total, deletes)
+        DropStage("tmp_remove_files")
         # Remove filter
         q = "DELETE from repositories WHERE id='%s'" % (repo['id'])
         ExecuteQuery(q)
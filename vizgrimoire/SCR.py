@@ -41,6 +41,7 @@ from vizgrimoire.metrics.query_builder import SCRQuery
 
 from vizgrimoire.data_source import DataSource
 from vizgrimoire.filter import Filter
+from vizgrimoire.items_pool import ItemsPool
 
 
 class SCR(DataSource):
@@ -135,11 +136,9 @@ class SCR(DataSource):
         for item in all_metrics:
             if item.id not in metrics_on: continue
             # logging.info(item.id)
-            mfilter_orig = item.filters
-            mfilter.global_filter = mfilter_orig.global_filter
-            item.filters = mfilter
-            if not evol: mvalue = item.get_agg()
-            else:        mvalue = item.get_ts()
+            mfilter.global_filter = item.filters.global_filter
+            if not evol: mvalue = item.evaluate(mfilter, "agg")
+            else:        mvalue = item.evaluate(mfilter, "ts")
 
             if type_analysis and type_analysis[1] is None:
                 logging.info(item.id)
@@ -148,7 +147,6 @@ class SCR(DataSource):
                 mvalue = fill_and_order_items(items, mvalue, id_field,
                                               evol, period, startdate, enddate)
             data = dict(data.items() + mvalue.items())
-            item.filters = mfilter_orig
 
         # SCR SPECIFIC #
         if evol:
@@ -157,11 +155,8 @@ class SCR(DataSource):
                 metrics_on_changes = ['merged','abandoned','new']
                 for item in all_metrics:
                     if item.id in metrics_on_changes and filter_ is None:
-                        mfilter_orig = item.filters
-                        item.filters = mfilter
-                        mvalue = item.get_ts_changes()
+                        mvalue = item.evaluate(mfilter, "ts_changes")
                         data = dict(data.items() + mvalue.items())
-                        item.filters = mfilter_orig
         # END SCR SPECIFIC #
 
         if not evol:
@@ -188,10 +183,7 @@ class SCR(DataSource):
             for i in [7,30,365]:
                 for item in all_metrics:
                     if item.id not in metrics_trends: continue
-                    mfilter_orig = item.filters
-                    item.filters = mfilter
-                    period_data = item.get_trends(enddate, i)
-                    item.filters = mfilter_orig
+                    period_data = item.evaluate(mfilter, "trends", [i])[0]
 
                     data = dict(data.items() +  period_data.items())
 
@@ -352,10 +344,7 @@ class SCR(DataSource):
         # Include metrics to sort in javascript.
         items_list = {"name":[],"review_time_days_median":[],"submitted":[]}
 
-        for item in items :
-            item_file = item.replace("/","_")
-            items_list["name"].append(item_file)
-
+        def create_item_report(item):
             logging.info (item)
             filter_item = Filter(filter_name, item)
 
@@ -368,6 +357,11 @@ class SCR(DataSource):
             agg = SCR.get_agg_data(period, startdate, enddate, identities_db, filter_item)
             fn = os.path.join(destdir, filter_item.get_static_filename(SCR()))
             createJSON(agg, fn)
+            return agg
+
+        for (item, agg) in zip(items, ItemsPool.map(create_item_report, items)):
+            item_file = item.replace("/","_")
+            items_list["name"].append(item_file)
 
             if 'submitted' in agg:
                 items_list["submitted"].append(agg["submitted"])
@@ -93,10 +93,6 @@ class TicketsStates(Analyses):
             current_status[state] = 0
             data[state] = []
 
-        # Request issues log
-        query = self.__get_sql_issues_states__(backend_type)
-        issues_log = self.db.ExecuteQuery(query)
-
         periods = list(data['unixtime'][1:])
 
         # Add a one period more to avoid problems with
@@ -107,35 +103,38 @@ class TicketsStates(Analyses):
 
         end_period = int(periods.pop(0))
 
-        for i in range(len(issues_log['issue_id'])):
-            issue_id = issues_log['issue_id'][i]
-            issue_state = issues_log['status'][i]
-            issue_date = int(issues_log['udate'][i])
-
-            # Fill periods without changes on issues states
-            while issue_date >= end_period:
-                end_period = int(periods.pop(0))
-                update_backlog_count(current_status, data)
-
-            if issue_id not in tickets_states:
-                # Add ticket to the status dict
-                tickets_states[issue_id] = issue_state
-            elif tickets_states[issue_id] != issue_state:
-                # Decrease the count of tickets with the old state
-                # only for predefined states
-                old_state = tickets_states[issue_id]
-                if old_state in states:
-                    current_status[old_state] -= 1
-
-                # Set new status
-                tickets_states[issue_id] = issue_state
-            else:
-                continue # Ignore equal states
+        # Request issues log, replayed while it is streamed
+        query = self.__get_sql_issues_states__(backend_type)
+        for issues_log in self.db.ExecuteQueryStream(query):
+            for i in range(len(issues_log['issue_id'])):
+                issue_id = issues_log['issue_id'][i]
+                issue_state = issues_log['status'][i]
+                issue_date = int(issues_log['udate'][i])
+
+                # Fill periods without changes on issues states
+                while issue_date >= end_period:
+                    end_period = int(periods.pop(0))
+                    update_backlog_count(current_status, data)
+
+                if issue_id not in tickets_states:
+                    # Add ticket to the status dict
+                    tickets_states[issue_id] = issue_state
+                elif tickets_states[issue_id] != issue_state:
+                    # Decrease the count of tickets with the old state
+                    # only for predefined states
+                    old_state = tickets_states[issue_id]
+                    if old_state in states:
+                        current_status[old_state] -= 1
+
+                    # Set new status
+                    tickets_states[issue_id] = issue_state
+                else:
+                    continue # Ignore equal states
 
-            # Increase the count of tickets with issue_state
-            # only for predefined states
-            if issue_state in states:
-                current_status[issue_state] += 1
+                # Increase the count of tickets with issue_state
+                # only for predefined states
+                if issue_state in states:
+                    current_status[issue_state] += 1
 
         # End of the loop. Add the last period values to the backlog count
         update_backlog_count(current_status, data)
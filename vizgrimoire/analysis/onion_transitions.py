@@ -36,6 +36,8 @@ import logging
 from vizgrimoire.analysis.analyses import Analyses
 from vizgrimoire.metrics.query_builder import DSQuery
 from vizgrimoire.metrics.metrics_filter import MetricFilters
+from vizgrimoire.GrimoireUtils import check_array_values
+from vizgrimoire.People import BULK_CHUNK_SIZE
 
 class OnionTransitions(Analyses):
     # TODO:
@@ -51,37 +53,81 @@ class OnionTransitions(Analyses):
     def get_agg (self, data_source = None):
         """ Returns aggregated data for a data source. """
         data = {}
-        if data_source.get_name() == "scm":
+        if data_source.get_name() in ["scm", "its", "mls", "scr"]:
             data = self.result(data_source)
         return data
 
+    # Activity counted for the data sources using unique identities:
+    # (field, tables, person column, date column, item column, filters)
+    _activity = {
+        "its": ("opened", "issues i", "i.submitted_by", "i.submitted_on",
+                "i.id", []),
+        "scr": ("submitted", "issues i", "i.submitted_by", "i.submitted_on",
+                "i.id", []),
+        "mls": ("sent", "messages m, messages_people mp", "mp.email_address",
+                "m.first_date", "m.message_ID",
+                ["m.message_ID = mp.message_id", "mp.type_of_recipient = 'From'"])
+    }
+
+    def __init__(self, dbcon = None, filters = None):
+        Analyses.__init__(self, dbcon, filters)
+        # people data already retrieved in the study run
+        self._people_info = {}
+
+    def _get_fields(self, data_source):
+        """ Fields exported for each person """
+        if data_source.get_name() == "scm":
+            return ["name", "email", "commits"]
+        elif data_source.get_name() == "qaforums":
+            return ["name", "messages"]
+        else:
+            field = self._activity[data_source.get_name()][0]
+            return ["name", "affiliation", field]
+
+    def _get_rows(self, data, fields):
+        """ Rows from the columns of a ExecuteQuery result """
+        if len(data) == 0: return []
+        data = check_array_values(data)
+        return zip(*[data[field] for field in fields])
+
     def _get_person_info(self, upeople_id, from_date, to_date, data_source = None):
         # gets the person info in two queries, first it obtains the name and later
         # the number of ocurrences if any. If not, it sets ocurrences = 0
-        person_data = {}
+        return self._get_people_info([upeople_id], from_date, to_date, data_source)[upeople_id]
+
+    def _get_people_info(self, people, from_date, to_date, data_source = None):
+        """ Info for a list of people, with two queries per chunk of people
+
+            Returns a dict with the data for each upeople_id. The data
+            is kept for the next calls in the study run.
+        """
+        cache = self._people_info.setdefault((data_source.get_name(), from_date, to_date), {})
+        missing = [p for p in set(people) if p not in cache]
+
+        for start in range(0, len(missing), BULK_CHUNK_SIZE):
+            chunk = missing[start:start+BULK_CHUNK_SIZE]
+            cache.update(self._get_people_info_chunk(chunk, from_date, to_date, data_source))
+
+        people_data = {}
+        for person in people:
+            people_data[person] = cache[person]
+        return people_data
+
+    def _get_people_info_chunk(self, people, from_date, to_date, data_source):
+        fields = self._get_fields(data_source)
+        # ocurrences = 0 for people without activity in the period
+        people_data = {}
+        for person in people:
+            people_data[person] = dict([(field, None) for field in fields])
+            people_data[person][fields[-1]] = 0
+
         if (data_source.get_name() == "scm"):
             logging.info("Warning: current queries are counting merges")
-            # q = " select pup.uuid as uid, p.name, p.email, "+\
-            #     "        (count(distinct(s.id))) as commits "+\
-            #     " from scmlog s, "+\
-            #     "      actions a, "+\
-            #     "      people_uidentities pup, "+\
-            #     "      people p "+\
-            #     " where s.id = a.commit_id and "+\
-            #     "       s.date>="+ from_date+" and "+\
-            #     "       s.date<="+ to_date+" and "+\
-            #     "       s.author_id = pup.people_id and "+\
-            #     "       s.author_id = p.id and "+\
-            #     "       p.email <> '%gerrit@%' and "+\
-            #     "       p.email <> '%jenkins@%' and "+\
-            #     "       pup.uuid = " + str(upeople_id) +\
-            #     " group by pup.uuid "+\
-            #     " order by commits desc; "
-            q0 = "select name, email from people, people_uidentities pup "+\
-                "where people.id = pup.people_id and pup.uuid = '" + str(upeople_id) + "' "+\
-                " LIMIT 1"
+            uuids = ",".join(["'%s'" % (person) for person in people])
+            q0 = "select pup.uuid as uid, name, email from people, people_uidentities pup "+\
+                "where people.id = pup.people_id and pup.uuid IN (" + uuids + ") "
             
-            q1 = " select pup.uuid as uid, p.name, p.email, "+\
+            q1 = " select pup.uuid as uid, "+\
                 "        (count(distinct(s.id))) as commits "+\
                 " from scmlog s, "+\
                 "      people_uidentities pup, "+\
@@ -92,51 +138,63 @@ class OnionTransitions(Analyses):
                 "       s.author_id = p.id and "+\
                 "       p.email <> '%gerrit@%' and "+\
                 "       p.email <> '%jenkins@%' and "+\
-                "       pup.uuid = '" + str(upeople_id) + "' " +\
-                " group by pup.uuid "+\
-                " order by commits desc; "
-
-            aux = self.db.ExecuteQuery(q0)
-            person_data["name"] = aux["name"]
-            person_data["email"] = aux["email"]
-            aux = self.db.ExecuteQuery(q1)
-            if (type(aux["commits"]) == list):
-                person_data["commits"] = 0
-            else:
-                person_data["commits"] = aux["commits"]
+                "       pup.uuid IN (" + uuids + ") " +\
+                " group by pup.uuid "
+            ident = "uid"
 
         elif (data_source.get_name() == "qaforums"):
             logging.info("Warning: qaforums is not using matched identities")
-            q0 = "SELECT username as name from people where identifier = " + str(upeople_id)+ " "+\
-                " LIMIT 1"
+            identifiers = ",".join([str(person) for person in people])
+            q0 = "SELECT identifier, username as name from people "+\
+                "where identifier IN (" + identifiers + ")"
             
-            q1 = "SELECT identifier, username as name, COUNT(*) as messages from ("+\
-                "(select p.identifier as identifier, p.username, q.added_at as date"+\
+            q1 = "SELECT identifier, COUNT(*) as messages from ("+\
+                "(select p.identifier as identifier, q.added_at as date"+\
                 "  from questions q, people p"+\
                 "  where q.author_identifier=p.identifier)"+\
                 "union"+\
-                "(select p.identifier as identifier, p.username, a.submitted_on as date"+\
+                "(select p.identifier as identifier, a.submitted_on as date"+\
                 "  from answers a, people p"+\
                 "  where a.user_identifier=p.identifier)"+\
                 "union"+\
-                "(select p.identifier as identifier, p.username, c.submitted_on as date"+\
+                "(select p.identifier as identifier, c.submitted_on as date"+\
                 "  from comments c, people p"+\
                 "  where c.user_identifier=p.identifier)) t "+\
                 "WHERE date>="+ from_date +" AND date<" + to_date +" "+\
-                " AND identifier = "+ str(upeople_id) + " "+\
+                " AND identifier IN ("+ identifiers + ") "+\
                 "group by identifier"
-            aux = self.db.ExecuteQuery(q0)
-            person_data["name"] = aux["name"]
-            aux = self.db.ExecuteQuery(q1)
-            if (type(aux["messages"]) == list):
-                person_data["messages"] = 0
-            else:
-                person_data["messages"] = aux["messages"]
-        return(person_data)
+            ident = "identifier"
+
+        else:
+            # Name and affiliation from the identities database
+            uuids = ",".join(["'%s'" % (person) for person in people])
+            identities_db = self.db.identities_db
+            q0 = "SELECT pro.uuid as uid, pro.name, org.name as affiliation "+\
+                "FROM " + identities_db + ".profiles pro "+\
+                "LEFT JOIN " + identities_db + ".enrollments enr ON enr.uuid = pro.uuid "+\
+                "LEFT JOIN " + identities_db + ".organizations org ON org.id = enr.organization_id "+\
+                "WHERE pro.uuid IN (" + uuids + ")"
+            q1 = self._get_personal_activity_query(from_date, to_date, data_source,
+                                                   "pup.uuid IN (" + uuids + ")")
+            ident = "uid"
+
+        # Only the first row for people with several identities or enrollments
+        found = set()
+        for row in self._get_rows(self.db.ExecuteQuery(q0), [ident] + fields[0:-1]):
+            if row[0] in found or row[0] not in people_data: continue
+            found.add(row[0])
+            for i in range(0, len(fields) - 1):
+                people_data[row[0]][fields[i]] = row[i + 1]
+        for (person, value) in self._get_rows(self.db.ExecuteQuery(q1), [ident, fields[-1]]):
+            if person in people_data:
+                people_data[person][fields[-1]] = value
+
+        return(people_data)
 
     def result(self, data_source = None, offset_days = None):
         if data_source.get_name() != "scm" \
-            and data_source.get_name() != "qaforums": return None
+            and data_source.get_name() != "qaforums" \
+            and data_source.get_name() not in self._activity: return None
 
         from dateutil import parser
         import datetime
@@ -186,28 +244,24 @@ class OnionTransitions(Analyses):
         groups = {"core":cur_core, "up_core":up_core, "up_reg":up_reg,
                   "down_reg":down_reg, "down_occ":down_occ}
 
-        result = {}
+        # all people data is retrieved at once
+        people = set()
         for g in groups:
-            #here we define what we export in each group
-            if (data_source.get_name() == "scm"):
-                result[g] = {"name":[],"email":[],"commits":[]}
-            elif (data_source.get_name() == "qaforums"):
-                result[g] = {"name":[],"messages":[]}
+            people.update(groups[g])
+        people_data = self._get_people_info(list(people), self.filters.startdate,
+                                            self.filters.enddate, data_source)
 
+        #here we define what we export in each group
+        fields = self._get_fields(data_source)
+        result = {}
+        for g in groups:
+            result[g] = dict([(field, []) for field in fields])
             # and .. we get the data
             for person in groups[g]:
-                user_data = self._get_person_info(person, self.filters.startdate, self.filters.enddate, data_source)
-                result[g]["name"].append(user_data["name"])
-                if (data_source.get_name() == "scm"):
-                    result[g]["email"].append(user_data["email"])
-                    result[g]["commits"].append(user_data["commits"])
-                elif (data_source.get_name() == "qaforums"):
-                    #print(user_data)
-                    result[g]["messages"].append(user_data["messages"])
-                #print user_data
-                #print " --> "+ str(person)
-                #result[g]["uid"].append(user_data["uid"])
-        
+                user_data = people_data[person]
+                for field in fields:
+                    result[g][field].append(user_data[field])
+
         # print("core VVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVV")
         # c_set = []
         # a_set = []
@@ -338,9 +392,31 @@ class OnionTransitions(Analyses):
             " order by commits desc; "
         return(q)
 
+    def _get_total_activity_query(self, from_date, to_date, data_source):
+        (field, tables, person, date, item, filters) = self._activity[data_source.get_name()]
+        q = "SELECT COUNT(DISTINCT(" + item + ")) as total "+\
+            "FROM " + tables + " "+\
+            "WHERE " + " AND ".join(filters + [date + ">=" + from_date,
+                                               date + "<" + to_date])
+        return(q)
+
+    def _get_personal_activity_query(self, from_date, to_date, data_source, people_filter = None):
+        (field, tables, person, date, item, filters) = self._activity[data_source.get_name()]
+        filters = filters + [person + " = pup.people_id",
+                             date + ">=" + from_date,
+                             date + "<" + to_date]
+        if people_filter is not None:
+            filters.append(people_filter)
+        q = "SELECT pup.uuid as uid, COUNT(DISTINCT(" + item + ")) as " + field + " "+\
+            "FROM " + tables + ", people_uidentities pup "+\
+            "WHERE " + " AND ".join(filters) + " "+\
+            "GROUP BY pup.uuid ORDER BY " + field + " desc"
+        return(q)
+
     def _activity_groups(self, from_date, to_date, data_source = None):
         if data_source.get_name() != "scm" and \
-          data_source.get_name() != "qaforums": return None
+          data_source.get_name() != "qaforums" and \
+          data_source.get_name() not in self._activity: return None
 
         groups = {}
 
@@ -370,6 +446,15 @@ class OnionTransitions(Analyses):
                 people['messages'] = [people['messages']]
             # this is a list. Operate over the list
             people['messages'] = [((messages / total_messages) * 100) for messages in people['messages']]
+        else:
+            field = self._activity[data_source.get_name()][0]
+            q = self._get_total_activity_query(from_date, to_date, data_source)
+            total = self.db.ExecuteQuery(q)
+            total_activity = float(total['total'])
+            q = self._get_personal_activity_query(from_date, to_date, data_source)
+            people = check_array_values(self.db.ExecuteQuery(q))
+            if len(people) == 0: people = {field: [], 'uid': []}
+            people[field] = [((value / total_activity) * 100) for value in people[field]]
 
         #print(people)
 
@@ -393,6 +478,9 @@ class OnionTransitions(Analyses):
         elif data_source.get_name() == "qaforums":
             field = 'messages'
             ident = 'identifier'
+        else:
+            field = self._activity[data_source.get_name()][0]
+            ident = 'uid'
         
         #for p in people:
         for value in people[field]:
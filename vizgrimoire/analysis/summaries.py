@@ -45,10 +45,7 @@ def GetCommitsSummaryCompanies (period, startdate, enddate, identities_db, num_o
         type_analysis = ['company', company_name]
         mcommits = DataSource.get_metrics("commits", SCM)
         mfilter = MetricFilters(period, startdate, enddate, type_analysis)
-        mfilter_orig = mcommits.filters
-        mcommits.filters = mfilter
-        commits = mcommits.get_ts()
-        mcommits.filters = mfilter_orig
+        commits = mcommits.evaluate(mfilter, "ts")
         # commits = EvolCommits(period, startdate, enddate, identities_db, ["company", company_name])
         # commits = completePeriodIds(commits, period, startdate, enddate)
         # Rename field commits to company name
@@ -86,8 +83,7 @@ def GetClosedSummaryCompanies (period, startdate, enddate, identities_db, closed
         type_analysis = ["company", "'"+company+"'"]
         filter_com = MetricFilters(period, startdate, enddate, type_analysis)
         mclosed = ITS.get_metrics("closed", ITS)
-        mclosed.filters = filter_com
-        closed = mclosed.get_ts()
+        closed = mclosed.evaluate(filter_com, "ts")
         # Rename field closed to company name
         closed[company] = closed["closed"]
         del closed['closed']
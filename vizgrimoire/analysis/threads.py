@@ -25,24 +25,37 @@
 import vizgrimoire.GrimoireUtils
 import vizgrimoire.GrimoireSQL
 from vizgrimoire.GrimoireSQL import ExecuteQuery
+from vizgrimoire.GrimoireUtils import check_array_values
 
 class Email(object):
     """This class contains the main attributes of an email
     """
 
-    def __init__(self, message_id, i_db):
+    fields = ["subject", "message_body", "first_date",
+              "initiator_name", "initiator_id", "url"]
+
+    def __init__(self, message_id, i_db, results = None):
         self.message_id = message_id
         self.i_db = i_db # Identities database
         self.subject = None # Email subject
         self.body = None # Email body
         self.date = None # Email sending date
         self.url = None # Domain of the archive
-        self._buildEmail() # Constructor
+        if results is None:
+            results = Email._get_emails_data([message_id], i_db)[message_id]
+        self._buildEmail(results) # Constructor
 
-    def _buildEmail(self):
-        # This method retrieves items of information of a given
-        # email, specified by its email id.
+    @staticmethod
+    def _get_emails_data(messages_ids, i_db):
+        # Retrieves in one query the items of information of the emails.
+        # Emails not found get empty lists, as an empty query result.
 
+        emails = {}
+        for message_id in messages_ids:
+            emails[message_id] = dict([(field, []) for field in Email.fields])
+        if len(messages_ids) == 0: return emails
+
+        ids = ",".join(["'%s'" % (message_id) for message_id in messages_ids])
         query = """
                 select distinct m.message_ID,
                        m.subject,
@@ -56,19 +69,37 @@ class Email(object):
                      people_uidentities pup,
                      %s.uidentities u,
                      %s.profiles pro
-                where m.message_ID = '%s' and
+                where m.message_ID IN (%s) and
                       m.message_ID = mp.message_id and
                       mp.type_of_recipient = 'From' and
                       mp.email_address = pup.people_id and
                       pup.uuid = u.uuid and
                       pup.uuid = pro.uuid
-                limit 1
-                """  % (self.i_db, self.i_db, self.message_id)
+                """  % (i_db, i_db, ids)
         # WARNING: There may appear in some cases repeated emails.
         # This may be because the same email was sent to different
-        # mailing lists. Forcing the query to 1 row, allows to 
-        # avoid this issue till we understand why this behaviour
-        results = ExecuteQuery(query)
+        # mailing lists. Only the first row of each email is used
+        # till we understand why this behaviour
+        results = check_array_values(ExecuteQuery(query))
+        found = set([])
+        for i in range(0, len(results.get("message_ID", []))):
+            message_id = results["message_ID"][i]
+            if message_id in found or message_id not in emails: continue
+            found.add(message_id)
+            for field in Email.fields:
+                emails[message_id][field] = results[field][i]
+        return emails
+
+    @staticmethod
+    def build_emails(messages_ids, i_db):
+        """ Email objects for a list of messages using only one query """
+        emails_data = Email._get_emails_data(messages_ids, i_db)
+        return [Email(message_id, i_db, emails_data[message_id])
+                for message_id in messages_ids]
+
+    def _buildEmail(self, results):
+        # This method fills the items of information of a given
+        # email, specified by its email id.
 
         self.subject = results["subject"]
         self.body = results["message_body"]
@@ -92,60 +123,100 @@ class Threads(object):
         self.list_is_response_of = [] #list of 'father' messages
         self.threads = {} # General structure, keys = root message_id,
                           # values = list of messages in that thread
+        self.threads_depth = {} # keys = root message_id, values = depth
+        self.threads_people = {} # keys = root message_id,
+                                 # values = number of different senders
+        self.threads_volume = {} # keys = root message_id,
+                                 # values = length of all of the bodies
         self.crowded = None # the thread with most people participating
         self.longest = None # the thread with the longest queue of emails
         self.verbose = None # the thread with the most verbose emails.
 
         self._init_threads()
 
-    def _build_threads (self, message_id):
-        # Constructor of threads.
+    def _build_threads (self, message_id, children):
+        # Constructor of threads. Returns the messages below message_id
+        # in depth first order and the depth of the thread.
+        # children is the index of messages by their 'father' message.
 
-        sons = []
         messages = []
-        if message_id not in self.list_is_response_of:
-            # this a leaf of the tree!
-            return []
-
-        else:
-            cont = 0
-            for msg in self.list_is_response_of:
-                #Retrieving all of the sons of a given msg
-                if msg == message_id:
-                    sons.append(self.list_message_id[cont])
-                cont = cont + 1
-            for msg in sons:
-                messages.extend([msg])
-                messages.extend(self._build_threads(msg))
-
-
-        return messages
+        depth = 0
+        visited = set([message_id]) # protection against reply loops
+        pending = [(msg, 1) for msg in reversed(children.get(message_id, []))]
+        while len(pending) > 0:
+            (msg, level) = pending.pop()
+            if msg in visited: continue
+            visited.add(msg)
+            messages.append(msg)
+            if level > depth: depth = level
+            for son in reversed(children.get(msg, [])):
+                pending.append((son, level + 1))
+
+        return (messages, depth)
 
     def _init_threads(self):
         # Returns dictionary of message_id threads. Each key contains a list
         # of emails associated to that thread (not ordered).
 
-        # Retrieving all of the messages. 
+        # Retrieving all of the messages with their senders and the
+        # length of their bodies in one query.
         query = """
-                select DISTINCT message_ID, is_response_of
-                from messages
-                where first_date >= %s and first_date < %s
+                select m.message_ID, m.is_response_of,
+                       length(m.message_body) as length,
+                       pup.uuid as upeople_id
+                from messages m
+                left join messages_people mp
+                     on m.message_ID = mp.message_id and
+                        mp.type_of_recipient = 'From'
+                left join people_uidentities pup
+                     on mp.email_address = pup.people_id
+                where m.first_date >= %s and m.first_date < %s
                 """ % (self.initdate, self.enddate)
-        list_messages = ExecuteQuery(query)
-        self.list_message_id = list_messages["message_ID"]
-        self.list_is_response_of = list_messages["is_response_of"]
+        list_messages = check_array_values(ExecuteQuery(query))
+        if len(list_messages) == 0: return
+
+        responses = set([]) # (message_id, is_response_of) already seen
+        children = {} # keys = message_id, values = list of 'son' messages
+        roots = []
+        senders = {} # keys = message_id, values = set of upeople_id
+        lengths = {} # keys = message_id, values = length of the body
+        for i in range(0, len(list_messages["message_ID"])):
+            message_id = list_messages["message_ID"][i]
+            is_response_of = list_messages["is_response_of"][i]
+            if message_id not in senders:
+                senders[message_id] = set([])
+                length = list_messages["length"][i]
+                if length is None: length = 0
+                lengths[message_id] = int(length)
+            if list_messages["upeople_id"][i] is not None:
+                senders[message_id].add(list_messages["upeople_id"][i])
+            if (message_id, is_response_of) in responses: continue
+            responses.add((message_id, is_response_of))
+            self.list_message_id.append(message_id)
+            self.list_is_response_of.append(is_response_of)
+            # Only those whose is_response_of is None are
+            # the message 'root' of each thread.
+            if is_response_of is None:
+                roots.append(message_id)
+            else:
+                if is_response_of not in children:
+                    children[is_response_of] = []
+                children[is_response_of].append(message_id)
 
         messages = {}
-        for message_id in self.list_message_id:
-            # Looking for messages in the thread
-            index = self.list_message_id.index(message_id)
-
-            # Only analyzing those whose is_response_of is None, 
-            # those are the message 'root' of each thread.
-            if self.list_is_response_of[index] is None:
-                messages[message_id] = self._build_threads(message_id)
-                # Adding the root message to the list in first place
-                messages[message_id].insert(0, message_id)
+        for message_id in roots:
+            (thread, depth) = self._build_threads(message_id, children)
+            # Adding the root message to the list in first place
+            thread.insert(0, message_id)
+            messages[message_id] = thread
+            self.threads_depth[message_id] = depth
+            people = set([])
+            volume = 0
+            for msg in thread:
+                people.update(senders[msg])
+                volume += lengths[msg]
+            self.threads_people[message_id] = len(people)
+            self.threads_volume[message_id] = volume
 
         self.threads = messages
 
@@ -158,44 +229,20 @@ class Threads(object):
             pass
 
     def topCrowdedThread(self, numTop):
-        # Returns list ordered by the longest thread
+        # Returns list ordered by the most crowded threads, those with
+        # the highest number of different people
 
         top_threads = [] # [(message_id, number of different upeople_id), (...,...), ...]
 
-        for thread in self.threads.values():
-            # this loop counts number of different people
-            # in each of the threads and provides a 
-            # dictionary with root message_id as each of the keys
-            # and a list of upeople_id as the value.
-            # Sets were considered as an option, but it implies that
-            # we may find with a higher probability equal sets, what
-            # would provide incorrect sets to their correspondant message_id
-            # when ordering them (at least using this algorithm).
-            # So, not using sets, and manual order of the lists is done 
-            people = set([])
-            for message in thread:
-                query = """
-                        select distinct pup.uuid as upeople_id
-                        from messages m,
-                             messages_people mp,
-                             people_uidentities pup
-                        where m.message_ID = '%s' and
-                              m.message_ID = mp.message_id and
-                              mp.type_of_recipient = 'From' and
-                              mp.email_address = pup.people_id
-                        """ % (message)
-                result = ExecuteQuery(query)
-                upeople_id = result["upeople_id"]
-                people.add(upeople_id)
-            top_threads.append((message, len(people)))
+        for message_id in self.threads.keys():
+            top_threads.append((message_id, self.threads_people[message_id]))
 
         sorted_threads = sorted(top_threads, key=lambda thread: thread[1], reverse = True)
+        sorted_threads = sorted_threads[:numTop]
 
+        emails = Email.build_emails([top[0] for top in sorted_threads], self.i_db)
         top_threads_emails = []
-        for top in sorted_threads[:numTop]:
-            # Create a list of emails
-            message_id = top[0]
-            email = Email(message_id, self.i_db)
+        for (email, top) in zip(emails, sorted_threads):
             top_threads_emails.append((email, top[1]))
         return top_threads_emails
 
@@ -217,7 +264,6 @@ class Threads(object):
         # Returns list ordered by the longest threads
         top_threads = []
         top_root_msgs = []
-        top_threads_emails = []
 
         # Retrieving the lists of threads
         values = self.threads.values()
@@ -235,16 +281,10 @@ class Threads(object):
             # (the rest of them are not ordered)
             top_root_msgs.append(thread[0])
 
-        for message_id in top_root_msgs:
-            # Create a list of emails
-            email = Email(message_id, self.i_db)
-            top_threads_emails.append(email)
-
-        return top_threads_emails
+        # Create a list of emails
+        return Email.build_emails(top_root_msgs, self.i_db)
 
     def verboseThread (self):
-        # TODO: at some point these numbers should be calculated when
-        # retrieving the initial list of message_id, is_response_of values
         # Returns the most verbose thread (the biggest emails)
         if self.verbose == None:
             # variable was not initialize
@@ -252,21 +292,10 @@ class Threads(object):
             current_len = 0
             # iterating through the root messages
             for message_id in self.threads.keys():
-                total_len_bodies = 0 # len of all of the body messages
-                # iterating through each of the messages of the thread
-                for msg in self.threads[message_id]:
-                    query = """
-                            select length(message_body) as length
-                            from messages
-                            where message_ID = '%s'
-                            """ % (msg)
-                    result = ExecuteQuery(query)
-                    length = int(result["length"])
-                    total_len_bodies = total_len_bodies + length
-                    if total_len_bodies > current_len:
-                        # New bigger thread found
-                        self.verbose = message_id
-                        current_len = total_len_bodies
+                if self.threads_volume[message_id] > current_len:
+                    # New bigger thread found
+                    self.verbose = message_id
+                    current_len = self.threads_volume[message_id]
         return Email(self.verbose, self.i_db)
 
     def threads (self):
@@ -283,6 +312,11 @@ class Threads(object):
         # root message
         return len(self.threads[message_id])
 
+    def depthThread(self, message_id):
+        # Returns the length of the longest chain of replies
+        # in a given thread
+        return self.threads_depth[message_id]
+
 if __name__ == '__main__':
     GrimoireSQL.SetDBChannel (database = "openstack_mls", user="root", password="")
     main_topics = Threads("'2012-01-01'", "'2014-01-01'", "openstack_scm")
@@ -24,7 +24,12 @@
 
 """ People and Companies evolution per quarters """
 
+from datetime import datetime
+
+import numpy as np
+
 from vizgrimoire.analysis.analyses import Analyses
+from vizgrimoire.datahandlers.data_handler import DHESAPeriods
 from vizgrimoire.GrimoireUtils import completePeriodIds, medianAndAvgByPeriod, get_median, get_avg
 from vizgrimoire.metrics.query_builder import DSQuery
 from vizgrimoire.metrics.metrics_filter import MetricFilters
@@ -205,6 +210,40 @@ class TimesTickets(Analyses):
         return (data)
 
 
+    def GetIssuesLogStatesQuery (self, startdate, enddate, closed_condition, fields):
+        """ Rows of the issues log between the dates with their fields
+            and closed state, dates as seconds from startdate
+        """
+        q = """SELECT log.id, log.issue_id, log.date, log.closed, %(fields)s,
+                 TIMESTAMPDIFF(SECOND, %(startdate)s, i.submitted_on) AS submitted_on
+               FROM issues i,
+                 (SELECT id, issue_id, %(fields)s,
+                    TIMESTAMPDIFF(SECOND, %(startdate)s, date) AS date,
+                    """
+        q += closed_condition
+        q += """ AS closed
+                  FROM issues_log_bugzilla
+                  WHERE date >= %(startdate)s AND date < %(enddate)s) log
+               WHERE i.id = log.issue_id"""
+
+        params = {'fields' : ", ".join(fields),
+                  'startdate' : startdate,
+                  'enddate' : enddate}
+        return q % params
+
+    def GetFirstDateQuery (self, view, startdate, enddate):
+        """ Date of the first action or comment of the issues from
+            first_action_per_issue or first_comment_per_issue views
+        """
+        q = """SELECT issue_id, TIMESTAMPDIFF(SECOND, %(startdate)s, date) AS date
+               FROM %(view)s
+               WHERE date >= %(startdate)s AND date < %(enddate)s"""
+
+        params = {'view' : view,
+                  'startdate' : startdate,
+                  'enddate' : enddate}
+        return q % params
+
     def ticketsTimeToResponse(self, period, startdate, enddate, identities_db, backend):
         time_to_response_priority = self.ticketsTimeToResponseByField(period, startdate, enddate,
                                                                       backend.closed_condition,
@@ -219,6 +258,11 @@ class TimesTickets(Analyses):
     def ticketsTimeOpened(self, period, startdate, enddate, identities_db, backend):
         log_close_condition_mediawiki = "(status = 'RESOLVED' OR status = 'CLOSED' OR status = 'VERIFIED' OR priority = 'Lowest')"
 
+        fields = {'priority' : backend.priority, 'type' : backend.severity}
+        evol = self.ticketsTimeOpenedAll(period, startdate, enddate,
+                                         log_close_condition_mediawiki, fields)
+        if evol is not None: return evol
+
         evol = {}
 
         for result_type in ['action', 'comment', 'open']:
@@ -233,6 +277,170 @@ class TimesTickets(Analyses):
             evol = dict(evol.items() + time_opened.items() + time_opened_priority.items() + time_opened_severity.items())
         return evol
 
+    def ticketsTimeOpenedAll(self, period, startdate, enddate, closed_condition, fields):
+        """ ticketsTimeOpened for all the result types and field values
+            reading the issues log once
+
+            The state of each issue at the start of each month is its last
+            log row before it, the one with the max id. The periods in
+            which each issue is open with each field value are found in
+            the log sorted by issue and date, and the age of the open
+            issues in every month is summarized at once with DHESAPeriods.
+            Returns None for periods other than month.
+        """
+        if period != 'month': return None
+
+        # Build a set of dates
+        dates = completePeriodIds({period : []}, period, startdate, enddate)[period]
+        dates.append(dates[-1] + 1) # add one more month
+
+        # Start of the months after the first one, as in getTicketsTimeOpened
+        start = datetime.strptime(self.filters.startdate, "'%Y-%m-%d'")
+        limits = []
+        for dt in dates[1:]:
+            limit = datetime((dt - 1) / 12, (dt - 1) % 12 + 1, 1)
+            limits.append(int((limit - start).total_seconds()))
+        limits = np.array(limits, dtype=np.int64)
+        log_enddate = "'" + datetime((dates[-1] - 1) / 12, (dates[-1] - 1) % 12 + 1, 1).strftime("%Y-%m-%d") + "'"
+
+        field_names = sorted(fields.keys())
+        segments = self._getOpenSegments(closed_condition, field_names,
+                                         self.filters.startdate, log_enddate)
+
+        evol = {}
+        for result_type in ['action', 'comment', 'open']:
+            if result_type == 'action':
+                prefix = "topened_tfa"
+                view = "first_action_per_issue"
+            elif result_type == 'comment':
+                prefix = "topened_tfc"
+                view = "first_comment_per_issue"
+            else:
+                prefix = "topened"
+                view = None
+
+            (months, ages, segment) = self._getOpenAges(segments, limits, view, log_enddate)
+            nmonths = len(limits)
+
+            stats_data = DHESAPeriods(months, ages, nmonths)
+            evol.update(self._getTimeOpened(period, startdate, enddate, dates,
+                                            prefix, stats_data, 0))
+            for field in field_names:
+                values = [str(value).lower() for value in fields[field]]
+                codes = self._getValueCodes(segments[field], values)[segment]
+                selected = codes >= 0
+                # A period for each value and month
+                stats_data = DHESAPeriods(codes[selected] * nmonths + months[selected],
+                                          ages[selected], len(values) * nmonths)
+                for (i, value) in enumerate(fields[field]):
+                    alias = "%s_%s" % (prefix, value)
+                    evol.update(self._getTimeOpened(period, startdate, enddate, dates,
+                                                    alias, stats_data, i * nmonths))
+        return evol
+
+    @staticmethod
+    def _getTimeOpened(period, startdate, enddate, dates, alias, stats_data, first):
+        """ getTicketsTimeOpened result from the DHESAPeriods periods
+            starting in first
+        """
+        size = stats_data.data["count"][first:first + len(dates) - 1]
+        median = stats_data.data["median"][first:first + len(size)]
+        avg = stats_data.data["mean"][first:first + len(size)]
+        for i in range(0, len(size)):
+            if size[i] == 0:
+                # get_median and get_avg for no data
+                median[i] = float('nan')
+                avg[i] = float('nan')
+        time_opened = {period : dates[:-1],
+                       'size_' + alias : size,
+                       'median_' + alias : median,
+                       'avg_' + alias : avg}
+        return completePeriodIds(time_opened, period, startdate, enddate)
+
+    @staticmethod
+    def _getValueCodes(issue_values, values):
+        """ Position of each value in values, -1 if it is not included """
+        codes = np.empty(len(issue_values), dtype=np.int64)
+        positions = dict([(value, i) for (i, value) in enumerate(values)])
+        for i in range(0, len(issue_values)):
+            codes[i] = positions.get(issue_values[i], -1)
+        return codes
+
+    def _getOpenSegments(self, closed_condition, field_names, startdate, enddate):
+        """ Intervals (start, end] of the dates in which each issue is
+            open, with its submission date and field values in them
+        """
+        columns = ['id', 'issue_id', 'date', 'closed', 'submitted_on'] + field_names
+        rows = dict([(column, []) for column in columns])
+        q = self.GetIssuesLogStatesQuery(startdate, enddate, closed_condition, field_names)
+        for chunk in self.db.ExecuteQueryStream(q):
+            for column in columns:
+                rows[column].extend(chunk[column])
+
+        issue = np.array(rows['issue_id'], dtype=np.int64)
+        date = np.array(rows['date'], dtype=np.int64)
+        log_id = np.array(rows['id'], dtype=np.int64)
+
+        # Log by issue and date. A row is the state of its issue from its
+        # date until a later row with a greater id, as MAX(id) in the query
+        order = np.lexsort((log_id, date, issue))
+        issue = issue[order]
+        date = date[order]
+        log_id = log_id[order]
+        issue_rank = np.cumsum(np.concatenate(([0], issue[1:] != issue[:-1])))
+        ranked_id = log_id + issue_rank * (log_id.max() + 1 if len(log_id) else 1)
+        is_state = ranked_id == np.maximum.accumulate(ranked_id)
+        state = np.maximum.accumulate(np.where(is_state, np.arange(len(order)), 0))
+        state = order[state]
+
+        last = np.concatenate((issue[1:] != issue[:-1], [True]))
+        end = np.where(last, np.iinfo(np.int64).max, np.concatenate((date[1:], [0])))
+
+        # NOT NULL is not true in SQL, so NULL is not open
+        closed = np.array([rows['closed'][i] is None or bool(rows['closed'][i])
+                           for i in state], dtype=bool)
+        segments = {'issue_id' : issue[~closed],
+                    'start' : date[~closed],
+                    'end' : end[~closed],
+                    'submitted_on' : np.array(rows['submitted_on'], dtype=np.int64)[state][~closed]}
+        state = state[~closed]
+        for field in field_names:
+            segments[field] = [str(rows[field][i]).lower() for i in state]
+        return segments
+
+    def _getOpenAges(self, segments, limits, view, enddate):
+        """ Month, age in days and segment of each open issue in each month
+
+            Issues with a first action or comment, if view is given, are
+            not open after it.
+        """
+        end = segments['end']
+        if view is not None:
+            first_dates = {}
+            q = self.GetFirstDateQuery(view, self.filters.startdate, enddate)
+            for chunk in self.db.ExecuteQueryStream(q):
+                first_dates.update(zip(chunk['issue_id'], chunk['date']))
+            max_date = np.iinfo(np.int64).max
+            first = np.array([first_dates.get(issue, max_date)
+                              for issue in segments['issue_id']], dtype=np.int64)
+            end = np.minimum(end, first)
+
+        # Months with its start in (start, end]
+        low = np.searchsorted(limits, segments['start'], side='right')
+        high = np.searchsorted(limits, end, side='right')
+        nmonths = np.maximum(high - low, 0)
+        segment = np.repeat(np.arange(len(nmonths)), nmonths)
+        months = np.arange(nmonths.sum()) - np.repeat(np.cumsum(nmonths) - nmonths, nmonths)
+        months += low[segment]
+
+        # TIMESTAMPDIFF(SECOND, ...)/(24*3600) is a MySQL DECIMAL with
+        # 4 digits, rounded half away from zero
+        seconds = limits[months] - segments['submitted_on'][segment]
+        units = np.where(seconds >= 0, (seconds * 50 + 216) // 432,
+                         -((-seconds * 50 + 216) // 432))
+        ages = units / 10000.0
+        return (months, ages, segment)
+
     def ticketsTimeToResponseByField(self, period, startdate, enddate, closed_condition, field, values_set):
         condition = "AND i." + field + " = '%s'"
         evol = {}
@@ -0,0 +1,542 @@
+## Copyright (C) 2015 Bitergia
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+##
+## This file is a part of GrimoireLib
+##  (an Python library for the MetricsGrimoire and vizGrimoire systems)
+##
+
+""" Monthly activity cubes of the data sources.
+
+    A cube is a table in the database of a data source with the additive
+    counts of its activity (commits, lines, tickets opened and closed,
+    emails sent, reviews submitted) for each month, person (uuid),
+    organization and repository. It is refreshed incrementally: only the
+    months with new rows in the source tables are computed again, and all
+    of them if rows were removed from the source tables. The
+    query builders answer the metrics covered by the cube from it,
+    instead of from the raw tables.
+"""
+
+import hashlib
+import json
+import logging
+import re
+from datetime import datetime
+from sets import Set
+
+from vizgrimoire.metrics.metrics_filter import MetricFilters
+
+
+class CubeMeasure(object):
+    """ Column of a cube with the value of a metric for each group """
+
+    def __init__(self, column, alias, value, tables, filters, date_field,
+                 repository_field, source, person_field = None,
+                 org_date_field = None, aggregate = "count",
+                 analyses = ["repository", "company", "project"], additive = True):
+        # column in the cube and alias of the metric field
+        self.column = column
+        self.alias = alias
+        # count(distinct(value)) or sum(value) of the rows of tables
+        self.value = value
+        self.aggregate = aggregate
+        self.tables = tables
+        self.filters = filters
+        self.date_field = date_field
+        self.repository_field = repository_field
+        # people id of the activity and date of the enrollment with the
+        # organization, groups are not by person without them
+        self.person_field = person_field
+        self.org_date_field = org_date_field
+        # (tables, filters, id field) to find the new rows of the source,
+        # without id field the rows of each month are counted
+        self.source = source
+        # type of analysis of the filters covered
+        self.analyses = analyses
+        # the value for several months is the sum of the months
+        self.additive = additive
+
+    def get_type(self):
+        if self.aggregate == "count": return "INT"
+        return "BIGINT"
+
+
+class ActivityCube(object):
+    """ Monthly activity of a data source by person, organization and
+        repository """
+
+    table = None
+    # alias of the raw activity table, used also for the cube table, so
+    # the repository and project conditions of the query builder work
+    alias = None
+    repository_column = None
+    repository_type = "INT"
+    measures = []
+
+    state_table = "cube_state"
+    periods = ["month", "quarter", "year"]
+    # tables used to get people and organizations from the raw tables
+    people_aliases = ["pup", "enr", "mp"]
+
+    def __init__(self, dsquery):
+        self.db = dsquery
+        # organizations are covered only if each activity has one
+        self.company = False
+        # dates of the first and last activity in the source tables
+        self.first_date = None
+        self.last_date = None
+
+    def get_name(self):
+        return self.table
+
+    def get_measures(self):
+        return self.measures
+
+    def _execute(self, sql):
+        # The state of the cube is never read from the query cache
+        from vizgrimoire.metrics.query_builder import DSQuery
+        return DSQuery._fetch_result(self.db.cursor, sql)
+
+    @staticmethod
+    def _as_list(value):
+        if isinstance(value, list): return value
+        return [value]
+
+    @staticmethod
+    def get_month_sql(date_field):
+        return "YEAR(" + date_field + ")*12+MONTH(" + date_field + ")"
+
+    def _create_tables(self, drop = False):
+        q = "CREATE TABLE IF NOT EXISTS " + self.state_table + " (" + \
+            "cube VARCHAR(32) NOT NULL, name VARCHAR(200) NOT NULL, " + \
+            "value MEDIUMTEXT, PRIMARY KEY (cube, name)) DEFAULT CHARSET=utf8"
+        self._execute(q)
+        if drop: self._execute("DROP TABLE IF EXISTS " + self.table)
+        columns = ["month_id INT NOT NULL", "date DATE NOT NULL",
+                   "uuid VARCHAR(128) NOT NULL", "org_id INT NOT NULL",
+                   self.repository_column + " " + self.repository_type]
+        for measure in self.get_measures():
+            columns.append(measure.column + " " + measure.get_type())
+        q = "CREATE TABLE IF NOT EXISTS " + self.table + " (" + ", ".join(columns) + \
+            ", KEY " + self.table + "_month (month_id)" + \
+            ", KEY " + self.table + "_date (date)) DEFAULT CHARSET=utf8"
+        self._execute(q)
+
+    def _read_state(self):
+        q = "SELECT name, value FROM " + self.state_table + \
+            " WHERE cube = '" + self.get_name() + "'"
+        res = self._execute(q)
+        if len(res) == 0: return {}
+        return dict(zip(ActivityCube._as_list(res['name']),
+                        ActivityCube._as_list(res['value'])))
+
+    def _write_state(self, state):
+        for (name, value) in state.items():
+            q = "REPLACE INTO " + self.state_table + " (cube, name, value) " + \
+                "VALUES ('" + self.get_name() + "', '" + name + "', '" + str(value) + "')"
+            self._execute(q)
+
+    def _get_enrollments_overlaps(self):
+        enrollments = self.db.identities_db + ".enrollments"
+        q = "SELECT COUNT(*) AS overlaps FROM " + enrollments + " e1, " + enrollments + " e2 " + \
+            "WHERE e1.uuid = e2.uuid AND e1.id < e2.id AND " + \
+            "e1.start < e2.end AND e2.start < e1.end"
+        return self._execute(q)['overlaps']
+
+    def _get_signature(self, measures):
+        """ Hash of the definition of the cube and the identities used """
+        definition = [self.table, self.repository_column, self.db.identities_db,
+                      self.db.get_identities_checksum()]
+        for measure in measures:
+            definition.append(self._get_measure_sql(measure, measures, None))
+        return hashlib.md5(json.dumps(definition)).hexdigest()
+
+    def _get_where(self, filters):
+        if len(filters) == 0: return ""
+        return " WHERE " + " AND ".join(filters)
+
+    def _get_new_months(self, measure, state, full):
+        """ Months with new rows in the source of measure since the last
+            refresh, None if rows were removed, and the new state of the
+            source """
+        (tables, filters, id_field) = measure.source
+        tables = ", ".join(tables)
+        month_sql = ActivityCube.get_month_sql(measure.date_field)
+        q = "SELECT MIN(" + measure.date_field + ") AS first_date, " + \
+            "MAX(" + measure.date_field + ") AS last_date FROM " + tables + \
+            self._get_where(filters)
+        dates = self._execute(q)
+        for date in [dates['first_date'], dates['last_date']]:
+            if date is None: continue
+            if self.first_date is None or date < self.first_date: self.first_date = date
+            if self.last_date is None or date > self.last_date: self.last_date = date
+
+        if id_field is not None:
+            name = measure.column + ":last_id"
+            total_name = measure.column + ":total"
+            q = "SELECT COUNT(*) AS total, MAX(" + id_field + ") AS last_id FROM " + \
+                tables + self._get_where(filters)
+            res = self._execute(q)
+            last_id = res['last_id']
+            if last_id is None: last_id = 0
+            total = int(res['total'])
+            new_state = {name: last_id, total_name: total}
+            if full: return ([], new_state)
+
+            months = []
+            new_rows = 0
+            previous = int(state.get(name, 0))
+            if last_id > previous:
+                new_filters = filters + [id_field + " > " + str(previous),
+                                         id_field + " <= " + str(last_id)]
+                q = "SELECT " + month_sql + " AS month_id, COUNT(*) AS total FROM " + tables + \
+                    self._get_where(new_filters) + " GROUP BY " + month_sql
+                res = self._execute(q)
+                if len(res) > 0:
+                    months = ActivityCube._as_list(res['month_id'])
+                    new_rows = sum([int(rows) for rows in ActivityCube._as_list(res['total'])])
+            previous_total = state.get(total_name)
+            if previous_total is None or int(previous_total) + new_rows != total:
+                # Rows removed, their months are not known
+                return (None, new_state)
+            return (months, new_state)
+
+        # Without ids, the months with a different number of rows
+        name = measure.column + ":months"
+        q = "SELECT " + month_sql + " AS month_id, COUNT(*) AS total FROM " + tables + \
+            self._get_where(filters) + " GROUP BY " + month_sql
+        res = self._execute(q)
+        counts = {}
+        if len(res) > 0:
+            for (month, total) in zip(ActivityCube._as_list(res['month_id']),
+                                      ActivityCube._as_list(res['total'])):
+                if month is not None: counts[str(month)] = int(total)
+        previous = json.loads(state.get(name, "{}"))
+        months = [int(month) for month in Set(counts.keys()) | Set(previous.keys())
+                  if counts.get(month) != previous.get(month)]
+        if full: months = []
+        return (months, {name: json.dumps(counts, sort_keys=True)})
+
+    def _get_measure_sql(self, measure, measures, months):
+        """ Groups of the cube with the value of measure, NULL for the
+            other measures """
+        filters = measure.filters + [measure.date_field + " IS NOT NULL"]
+        if months is not None:
+            month_list = ",".join([str(month) for month in sorted(months)])
+            filters.append(ActivityCube.get_month_sql(measure.date_field) +
+                           " IN (" + month_list + ")")
+        person = "NULL"
+        org_date = "NULL"
+        if measure.person_field is not None:
+            person = measure.person_field
+            org_date = measure.org_date_field
+        activity = "SELECT " + measure.date_field + " AS activity_date, " + \
+            person + " AS person_id, " + org_date + " AS org_date, " + \
+            measure.repository_field + " AS repository, " + \
+            measure.value + " AS item FROM " + ", ".join(measure.tables) + \
+            self._get_where(filters)
+
+        fields = [ActivityCube.get_month_sql("a.activity_date") + " AS month_id",
+                  "DATE_FORMAT(a.activity_date,'%Y-%m-01') AS cube_date"]
+        joins = ""
+        if measure.person_field is not None:
+            fields += ["IFNULL(pup.uuid,'') AS cube_uuid",
+                       "IFNULL(enr.organization_id,0) AS cube_org_id"]
+            joins = " LEFT JOIN people_uidentities pup ON pup.people_id = a.person_id" + \
+                " LEFT JOIN " + self.db.identities_db + ".enrollments enr" + \
+                " ON enr.uuid = pup.uuid AND a.org_date >= enr.start AND a.org_date < enr.end"
+        else:
+            fields += ["'' AS cube_uuid", "0 AS cube_org_id"]
+        fields.append("a.repository AS cube_repository")
+        for other in measures:
+            if other is not measure:
+                fields.append("NULL AS " + other.column)
+            elif measure.aggregate == "count":
+                fields.append("COUNT(DISTINCT a.item) AS " + other.column)
+            else:
+                fields.append("SUM(a.item) AS " + other.column)
+
+        q = "SELECT " + ", ".join(fields) + " FROM (" + activity + ") a" + joins + \
+            " GROUP BY month_id, cube_date, cube_uuid, cube_org_id, cube_repository"
+        return q
+
+    def _compute(self, measures, months):
+        """ Compute the groups of months, all of them if months is None """
+        q = "DELETE FROM " + self.table
+        if months is not None:
+            q += " WHERE month_id IN (" + ",".join([str(month) for month in sorted(months)]) + ")"
+        self._execute(q)
+
+        columns = [measure.column for measure in measures]
+        groups = [self._get_measure_sql(measure, measures, months) for measure in measures]
+        q = "INSERT INTO " + self.table + " (month_id, date, uuid, org_id, " + \
+            self.repository_column + ", " + ", ".join(columns) + ") " + \
+            "SELECT month_id, cube_date, cube_uuid, cube_org_id, cube_repository, " + \
+            ", ".join(["SUM(" + column + ")" for column in columns]) + \
+            " FROM (" + " UNION ALL ".join(groups) + ") cube_groups" + \
+            " GROUP BY month_id, cube_date, cube_uuid, cube_org_id, cube_repository"
+        self._execute(q)
+
+    def refresh(self):
+        """ Compute the months with new activity since the last refresh, or
+            all of them if the definition of the cube or the identities
+            changed or rows were removed from the sources. Returns the
+            months computed, None if all of them. """
+        measures = self.get_measures()
+        self._create_tables()
+        state = self._read_state()
+        signature = self._get_signature(measures)
+        full = state.get("signature") != signature
+        if full: self._create_tables(drop = True)
+        self.company = (self._get_enrollments_overlaps() == 0)
+
+        months = Set([])
+        new_state = {}
+        removed = False
+        for measure in measures:
+            (measure_months, measure_state) = self._get_new_months(measure, state, full)
+            if measure_months is None: removed = True
+            else: months.union_update(measure_months)
+            new_state.update(measure_state)
+
+        if full or removed:
+            if full: logging.info("Building activity cube " + self.table)
+            else: logging.info("Rebuilding activity cube " + self.table + ": rows removed")
+            self._compute(measures, None)
+            months = None
+        elif len(months) > 0:
+            logging.info("Refreshing %i months in activity cube %s" % (len(months), self.table))
+            self._compute(measures, months)
+        new_state["signature"] = signature
+        self._write_state(new_state)
+        return months
+
+    def _covers(self, mfilter, evolutionary):
+        if evolutionary and mfilter.period not in self.periods: return False
+        if mfilter.people_out is not None or mfilter.companies_out is not None:
+            return False
+        if mfilter.global_filter is not None: return False
+        return True
+
+    def _get_measure(self, alias, mfilter, evolutionary):
+        analysis = None
+        if mfilter.type_analysis is not None:
+            if len(mfilter.type_analysis) != 2: return None
+            analysis = mfilter.type_analysis[0]
+            if MetricFilters.DELIMITER in analysis: return None
+            if analysis == "company" and not self.company: return None
+        for measure in self.get_measures():
+            if measure.alias != alias: continue
+            # Not added for several months, only monthly time series
+            if not measure.additive and (not evolutionary or mfilter.period != "month"):
+                continue
+            if analysis is None or analysis in measure.analyses:
+                return measure
+        return None
+
+    @staticmethod
+    def _parse_date(date):
+        try:
+            return datetime.strptime(date.strip("'"), "%Y-%m-%d")
+        except ValueError:
+            return None
+
+    def _get_months_dates(self, startdate, enddate):
+        """ Dates of the whole months with the same activity as the dates,
+            or None if the activity in the months is different """
+        start = ActivityCube._parse_date(startdate)
+        end = ActivityCube._parse_date(enddate)
+        if start is None or end is None: return None
+        if start.day != 1:
+            # No activity in the month before startdate
+            if self.first_date is None or start > self.first_date: return None
+            start = start.replace(day = 1)
+        if end.day != 1:
+            # No activity in the month after enddate
+            if self.last_date is None or end <= self.last_date: return None
+            end = datetime(end.year + end.month / 12, end.month % 12 + 1, 1)
+        return (start.strftime("'%Y-%m-%d'"), end.strftime("'%Y-%m-%d'"))
+
+    def _get_dimension_filters(self, dsquery, mfilter, columns):
+        """ Tables and conditions of the query builder for the type of
+            analysis, without the raw tables, or None if not supported """
+        tables = Set([self.table + " " + self.alias])
+        aliases = Set([self.alias])
+        for table in dsquery.GetSQLReportFrom(mfilter):
+            alias = table.split()[-1]
+            if alias == self.alias or alias in self.people_aliases: continue
+            tables.add(table)
+            aliases.add(alias)
+
+        filters = Set([])
+        field = re.compile(r"\b([A-Za-z_]\w*)\.([A-Za-z_]\w*)")
+        literal = re.compile(r"'(?:[^'\\]|\\.)*'")
+        for condition in dsquery.GetSQLReportWhere(mfilter):
+            fields = field.findall(literal.sub("''", condition))
+            used = Set([alias for (alias, column) in fields])
+            if len(used & Set(self.people_aliases)) > 0:
+                # people and organizations of the raw activity
+                continue
+            if not used <= aliases: return None
+            for (alias, column) in fields:
+                if alias == self.alias and column not in columns: return None
+            filters.add(condition)
+        if mfilter.type_analysis is not None and mfilter.type_analysis[0] == "company":
+            filters.add("org.id = " + self.alias + ".org_id")
+        return (tables, filters)
+
+    def get_sql(self, dsquery, aliases, mfilter, evolutionary):
+        """ Query for the fields aliases of a metric with mfilter from the
+            cube, None if the cube does not cover them """
+        if not self._covers(mfilter, evolutionary): return None
+        measures = []
+        for alias in aliases:
+            measure = self._get_measure(alias, mfilter, evolutionary)
+            if measure is None: return None
+            measures.append(measure)
+        dates = self._get_months_dates(mfilter.startdate, mfilter.enddate)
+        if dates is None: return None
+
+        columns = ["month_id", "date", "uuid", "org_id", self.repository_column]
+        columns += [measure.column for measure in self.get_measures()]
+        dimension = self._get_dimension_filters(dsquery, mfilter, columns)
+        if dimension is None: return None
+        (tables, filters) = dimension
+
+        fields = Set([])
+        for measure in measures:
+            column = self.alias + "." + measure.column
+            if measure.aggregate == "count":
+                # SUM of integers is DECIMAL
+                fields.add("CONVERT(sum(" + column + "),SIGNED) as " + measure.alias)
+            else:
+                fields.add("sum(" + column + ") as " + measure.alias)
+            filters.add(column + " IS NOT NULL")
+
+        return dsquery.BuildQuery(mfilter.period, dates[0], dates[1], self.alias + ".date",
+                                  fields, tables, filters, evolutionary,
+                                  mfilter.type_analysis)
+
+
+class SCMActivityCube(ActivityCube):
+    """ Commits and lines by month """
+
+    table = "cube_scm_activity"
+    alias = "s"
+    repository_column = "repository_id"
+
+    # The same revision in several repositories (forks, mirrors) is one
+    # commit in the whole activity but one for each repository in the
+    # activity of the repositories. Projects could have both.
+    measures = [
+        CubeMeasure("commits", "commits", "s.rev",
+                    ["scmlog s", "(select distinct(a.commit_id) as id from actions a) nomergers"],
+                    ["s.id = nomergers.id"], "s.author_date", "NULL",
+                    (["scmlog s"], [], "s.id"), "s.author_id", "s.author_date",
+                    analyses = ["company"]),
+        CubeMeasure("commits_by_repository", "commits", "s.rev",
+                    ["scmlog s", "(select distinct(a.commit_id) as id from actions a) nomergers"],
+                    ["s.id = nomergers.id"], "s.author_date", "s.repository_id",
+                    (["scmlog s"], [], "s.id"), analyses = ["repository"]),
+        CubeMeasure("added_lines", "added_lines", "cl.added",
+                    ["scmlog s", "commits_lines cl"],
+                    ["cl.commit_id = s.id", "s.message not like '%cvs2svn%'"],
+                    "s.author_date", "s.repository_id",
+                    (["commits_lines cl", "scmlog s"], ["cl.commit_id = s.id"], "cl.id"),
+                    "s.author_id", "s.author_date", aggregate = "sum"),
+        CubeMeasure("removed_lines", "removed_lines", "cl.removed",
+                    ["scmlog s", "commits_lines cl"],
+                    ["cl.commit_id = s.id", "s.message not like '%cvs2svn%'"],
+                    "s.author_date", "s.repository_id",
+                    (["commits_lines cl", "scmlog s"], ["cl.commit_id = s.id"], "cl.id"),
+                    "s.author_id", "s.author_date", aggregate = "sum")
+    ]
+
+
+class ITSActivityCube(ActivityCube):
+    """ Tickets opened and closed by month """
+
+    table = "cube_its_activity"
+    alias = "i"
+    repository_column = "tracker_id"
+
+    def get_closed_condition(self):
+        from vizgrimoire.ITS import ITS
+        return ITS._get_closed_condition()
+
+    def get_measures(self):
+        # Tickets closed in each month are distinct tickets, so they are
+        # not added for several months, and they are counted for the
+        # people closing them, so they are not by organization
+        return [
+            CubeMeasure("opened", "opened", "i.id", ["issues i"], [],
+                        "i.submitted_on", "i.tracker_id",
+                        (["issues i"], [], "i.id"), "i.submitted_by", "i.submitted_on"),
+            CubeMeasure("closed", "closed", "i.id", ["issues i", "changes ch"],
+                        ["i.id = ch.issue_id", self.get_closed_condition()],
+                        "ch.changed_on", "i.tracker_id",
+                        (["changes ch"], [], "ch.id"),
+                        analyses = ["repository", "project"], additive = False)
+        ]
+
+    def _covers(self, mfilter, evolutionary):
+        if mfilter.closed_condition is not None and \
+            mfilter.closed_condition != self.get_closed_condition():
+            return False
+        return ActivityCube._covers(self, mfilter, evolutionary)
+
+
+class MLSActivityCube(ActivityCube):
+    """ Emails sent by month """
+
+    table = "cube_mls_activity"
+    alias = "m"
+    repository_column = "mailing_list_url"
+    repository_type = "VARCHAR(255)"
+
+    # Sender of each message, as the first one if there are several
+    senders = "(SELECT message_id, MIN(email_address) AS email_address " + \
+        "FROM messages_people WHERE type_of_recipient = 'From' " + \
+        "GROUP BY message_id) sender"
+
+    # Messages sent to several lists are once in the whole activity
+    # but once for each list in the activity of the lists
+    measures = [
+        CubeMeasure("sent", "sent", "m.message_ID",
+                    ["messages m LEFT JOIN " + senders + " ON sender.message_id = m.message_ID"],
+                    [], "m.first_date", "''", (["messages m"], [], None),
+                    "sender.email_address", "m.first_date", analyses = ["company"]),
+        CubeMeasure("sent_by_list", "sent", "m.message_ID", ["messages m"], [],
+                    "m.first_date", "m.mailing_list_url", (["messages m"], [], None),
+                    analyses = ["repository"])
+    ]
+
+
+class SCRActivityCube(ActivityCube):
+    """ Reviews submitted by month """
+
+    table = "cube_scr_activity"
+    alias = "i"
+    repository_column = "tracker_id"
+
+    measures = [
+        CubeMeasure("submitted", "submitted", "i.issue",
+                    ["issues i", "issues_ext_gerrit ie", "changes ch"],
+                    ["i.id = ie.issue_id", "ch.issue_id = i.id", "ch.field = 'Upload'",
+                     "ch.old_value = 1"],
+                    "ch.changed_on", "i.tracker_id", (["changes ch"], [], "ch.id"),
+                    "i.submitted_by", "i.submitted_on")
+    ]
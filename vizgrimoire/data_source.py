@@ -24,16 +24,22 @@
 """ DataSource offers the API to get aggregated, evolutionary and top data with filter 
     support for Grimoire supported data sources """ 
 
-import logging, os
+import copy, json, logging, os
+from functools import partial
 from vizgrimoire.metrics.query_builder import DSQuery, ITSQuery, MLSQuery
 from vizgrimoire.GrimoireUtils import createJSON
 from vizgrimoire.metrics.metrics_filter import MetricFilters
+from vizgrimoire.metrics_pool import MetricsPool
 from vizgrimoire.filter import Filter
 
 class DataSource(object):
     _bots = []
     _metrics_set = []
     _global_filter = None
+    _incremental = None
+    # get_agg values from the ROLLUP of the last time series, by
+    # (database, query), for the next aggregated data
+    _rollup_aggs = {}
 
     @staticmethod
     def get_name():
@@ -51,6 +57,16 @@ class DataSource(object):
         DataSource._bots = ds_bots
 
 
+    @staticmethod
+    def get_incremental():
+        """Get the IncrementalReport used for the evolutionary data"""
+        return DataSource._incremental
+
+    @staticmethod
+    def set_incremental(incremental):
+        """Regenerate only the last periods of the evolutionary data"""
+        DataSource._incremental = incremental
+
     @staticmethod
     def get_global_filter(ds):
         """Get the global filter to be applied to all metrics"""
@@ -82,10 +98,10 @@ class DataSource(object):
         dinit = None
         first_date = cls.get_metrics("first_date", cls)
         if first_date is not None:
-            type_analysis_orig = first_date.filters.type_analysis
-            first_date.filters.type_analysis = type_analysis
-            dinit = first_date.get_agg()
-            first_date.filters.type_analysis = type_analysis_orig
+            # All the filters of the metric but type_analysis
+            mfilter = copy.copy(first_date.filters)
+            mfilter.type_analysis = type_analysis
+            dinit = first_date.evaluate(mfilter, "agg")
         return dinit
 
     @classmethod
@@ -94,12 +110,58 @@ class DataSource(object):
         dlast = None
         last_date = cls.get_metrics("last_date", cls)
         if last_date is not None:
-            type_analysis_orig = last_date.filters.type_analysis
-            last_date.filters.type_analysis = type_analysis
-            dlast = last_date.get_agg()
-            last_date.filters.type_analysis = type_analysis_orig
+            # All the filters of the metric but type_analysis
+            mfilter = copy.copy(last_date.filters)
+            mfilter.type_analysis = type_analysis
+            dlast = last_date.evaluate(mfilter, "agg")
         return dlast
 
+    @classmethod
+    def get_items_last_date(cls, filter_, startdate, enddate, identities_db):
+        """Get the date of the last activity of each item of filter_ with one GROUP BY query"""
+        last_dates = {}
+        type_analysis = [filter_.get_name(), None]
+        dlast = cls.get_date_end(startdate, enddate, identities_db, type_analysis)
+        if dlast is None or len(dlast) == 0: return last_dates
+        id_field = cls.get_query_builder().get_group_field_alias(filter_.get_name())
+        items = dlast[id_field]
+        dates = dlast['last_date']
+        if not isinstance(items, list):
+            items = [items]
+            dates = [dates]
+        for (item, date) in zip(items, dates):
+            if date is not None: date = str(date)
+            last_dates[item] = date
+        return last_dates
+
+    @classmethod
+    def get_unchanged_items(cls, filter_, period, startdate, enddate, identities_db):
+        """Get the items of filter_ whose files would not change, without new activity
+           and identities changes since the last incremental run"""
+        incremental = DataSource.get_incremental()
+        if incremental is None or len(cls.get_metrics_set(cls)) == 0: return []
+        last_dates = cls.get_items_last_date(filter_, startdate, enddate, identities_db)
+        unchanged = incremental.get_unchanged_items(cls, filter_, period, startdate, enddate,
+                                                    last_dates)
+        logging.info("%s %s: %i of %i items without changes" %
+                     (cls.get_name(), filter_.get_name(), len(unchanged), len(last_dates)))
+        return unchanged
+
+    @classmethod
+    def save_items_activity(cls, filter_):
+        """Save the last activity of the items of filter_ once their files are created"""
+        incremental = DataSource.get_incremental()
+        if incremental is not None: incremental.save_items(cls, filter_)
+
+    @classmethod
+    def read_agg_data(cls, destdir, filter_):
+        """Get the aggregated data already created for filter_"""
+        fn = os.path.join(destdir, filter_.get_static_filename(cls()))
+        agg_file = open(fn)
+        agg = json.load(agg_file)
+        agg_file.close()
+        return agg
+
     @staticmethod
     def get_url():
         """Get the URL from which the data source was gathered"""
@@ -350,9 +412,40 @@ class DataSource(object):
     def get_metrics_data(DS, period, startdate, enddate, identities_db,
                          filter_ = None, evol = False):
         """ Get basic data from all core metrics """
+        incremental = DataSource.get_incremental()
+        if evol and incremental is not None:
+            return incremental.get_evolutionary_data(DS, period, startdate, enddate,
+                                                     identities_db, filter_)
+        return DS._get_metrics_data(period, startdate, enddate, identities_db, filter_, evol)
+
+    @classmethod
+    def get_dates(DS, startdate, enddate):
+        """ Dates of the analysis, changed for the data source in the config """
+        from vizgrimoire.report import Report
+        if DS.get_name()+"_startdate" in Report.get_config()['r']:
+            startdate = Report.get_config()['r'][DS.get_name()+"_startdate"]
+        if DS.get_name()+"_enddate" in Report.get_config()['r']:
+            enddate = Report.get_config()['r'][DS.get_name()+"_enddate"]
+        return (startdate, enddate)
+
+    @staticmethod
+    def is_by_period(metric):
+        """ The time series of metric has a value computed for each period """
+        return metric._uses_default("get_ts")
+
+    @classmethod
+    def _get_metrics_data(DS, period, startdate, enddate, identities_db,
+                          filter_ = None, evol = False, since = None, by_period = None):
+        """ Get basic data from all core metrics
+
+            With by_period True or False, only the metrics whose time series
+            are or are not computed by period. The time series of the
+            metrics computed by period start in since, if it is not None.
+        """
         from vizgrimoire.GrimoireUtils import fill_and_order_items
         from vizgrimoire.ITS import ITS
         from vizgrimoire.MLS import MLS
+        from vizgrimoire.metrics.metrics import Metrics
         data = {}
         dsquery = DSQuery
         if DS == ITS: dsquery = ITSQuery
@@ -387,10 +480,7 @@ class DataSource(object):
             if items is None: return data
             items = items.pop('name')
 
-        if DS.get_name()+"_startdate" in Report.get_config()['r']:
-            startdate = Report.get_config()['r'][DS.get_name()+"_startdate"]
-        if DS.get_name()+"_enddate" in Report.get_config()['r']:
-            enddate = Report.get_config()['r'][DS.get_name()+"_enddate"]
+        (startdate, enddate) = DS.get_dates(startdate, enddate)
         # TODO: the hardcoded 10 should be removed, and use instead the npeople provided
         #       in the config file.
         mfilter = MetricFilters(period, startdate, enddate, type_analysis, 10, people_out, None)
@@ -404,15 +494,44 @@ class DataSource(object):
             for r in metrics_reports:
                 if r in reports_on: metrics_on += [r]
 
-        for item in all_metrics:
+        metrics = [item for item in all_metrics if item.id in metrics_on]
+        if by_period is not None:
+            metrics = [item for item in metrics if DS.is_by_period(item) == by_period]
+        metrics_filters = [] # filters of the metrics in this call
+        for item in metrics:
+            item_filter = mfilter.copy()
+            if since is not None and DS.is_by_period(item):
+                item_filter.since = since
+            item_filter.global_filter = item.filters.global_filter
+            item_filter.set_closed_condition(item.filters.closed_condition)
+            metrics_filters.append(item_filter)
+
+        # One query for the metrics using the same tables and conditions.
+        # Time series queries also get the aggregated values, used later
+        # in the aggregated data.
+        rollup_aggs = DataSource._rollup_aggs
+        if evol:
+            # Only the values of the last time series are kept
+            DataSource._rollup_aggs = {}
+            rollup_aggs = None
+            # The ROLLUP of a part of the time series is not the aggregated value
+            if since is None: rollup_aggs = DataSource._rollup_aggs
+        fused = Metrics.get_fused_data([item.with_filters(item_filter) for (item, item_filter)
+                                        in zip(metrics, metrics_filters)],
+                                       evol, rollup_aggs)
+
+        # The queries of the other metrics are independent
+        kind = "agg"
+        if evol: kind = "ts"
+        calls = [partial(item.evaluate, item_filter, kind)
+                 for (item, item_filter) in zip(metrics, metrics_filters)
+                 if item.id not in fused]
+        values = iter(MetricsPool.map(calls, DS))
+
+        for item in metrics:
             # print item
-            if item.id not in metrics_on: continue
-            mfilter_orig = item.filters
-            mfilter.global_filter = mfilter_orig.global_filter
-            mfilter.set_closed_condition(mfilter_orig.closed_condition)
-            item.filters = mfilter
-            if evol: mvalue = item.get_ts()
-            else:    mvalue = item.get_agg()
+            if item.id in fused: mvalue = fused[item.id]
+            else: mvalue = values.next()
 
             if type_analysis and type_analysis[1] is None and mvalue:
                 logging.info(item.id)
@@ -428,8 +547,6 @@ class DataSource(object):
                                               evol, period, startdate, enddate)
             data = dict(data.items() + mvalue.items())
 
-            item.filters = mfilter_orig
-
         if not evol:
             init_date = DS.get_date_init(startdate, enddate, identities_db, type_analysis)
             end_date = DS.get_date_end(startdate, enddate, identities_db, type_analysis)
@@ -452,14 +569,12 @@ class DataSource(object):
             if automator_metrics in automator['r']:
                 metrics_trends = automator['r'][automator_metrics].split(",")
 
-            for i in [7,30,365]:
-                for item in all_metrics:
-                    if item.id not in metrics_trends: continue
-                    mfilter_orig = item.filters
-                    item.filters = mfilter
-                    period_data = item.get_trends(enddate, i)
-                    item.filters = mfilter_orig
-
+            # Metrics using other metrics of DS, as pending, use copies of
+            # them, so they can run at the same time than the metrics used
+            calls = [partial(item.evaluate, mfilter, "trends")
+                     for item in all_metrics if item.id in metrics_trends]
+            for trends in MetricsPool.map(calls, DS):
+                for period_data in trends:
                     if type_analysis and type_analysis[1] is None:
                         group_field = dsquery.get_group_field_alias(type_analysis[0])
                         period_data = fill_and_order_items(items, period_data, group_field)
@@ -100,6 +100,83 @@ class DHESA(DataHandler):
             self.data["percentile75"] = np.percentile(dataset, 75)
 
 
+class DHESAPeriods(DataHandler):
+    """Data Handler Early Statistical Approach by period
+
+    DHESA analysis for the elements of each period, computed for all the
+    periods at once: elements are sorted by period and value and split
+    in the sorted array. Percentiles are interpolated as in numpy.
+
+    Analysis performed: number of elements, min value, max value,
+                        mean value, median value, first quartile,
+                        third quartile. Each one is a list with a
+                        value for each period, 0 for empty periods.
+
+    """
+
+    def __init__(self, periods, dataset, nperiods, filters = None):
+        """DHESAPeriods builder class
+
+        Parameters
+        ----------
+
+        periods: list with the period, from 0 to nperiods - 1, of each element
+        dataset: list of elements
+        nperiods: number of periods
+        filters: MetricFilters object
+
+        """
+
+        self.filters = filters
+        self.data = {}
+
+        periods = np.asarray(periods, dtype=np.int64)
+        values = np.asarray(dataset, dtype=np.float64)
+        if len(periods) != len(values):
+            raise Exception("__init__ periods and dataset should have the same length")
+
+        # Sort by period and value with a single integer key: the period
+        # and the rank of the value, faster than lexsort with floats
+        ranks = np.empty(len(values), dtype=np.int64)
+        ranks[np.argsort(values)] = np.arange(len(values))
+        values = values[np.argsort(periods * len(values) + ranks)]
+        counts = np.bincount(periods, minlength=nperiods)[0:nperiods]
+        starts = np.cumsum(counts) - counts
+        full = counts > 0
+
+        self.data["count"] = counts.tolist()
+        self.data["min"] = self._by_period(full, values, starts)
+        self.data["max"] = self._by_period(full, values, starts + counts - 1)
+        sums = np.zeros(nperiods)
+        if len(values) > 0:
+            sums[full] = np.add.reduceat(values, starts[full])
+        self.data["mean"] = np.where(full, sums / np.maximum(counts, 1), 0).tolist()
+        self.data["median"] = self._percentile(full, values, starts, counts, 50)
+        self.data["percentile25"] = self._percentile(full, values, starts, counts, 25)
+        self.data["percentile75"] = self._percentile(full, values, starts, counts, 75)
+
+    @staticmethod
+    def _by_period(full, values, positions):
+        result = np.zeros(len(full))
+        result[full] = values[positions[full]]
+        return result.tolist()
+
+    @staticmethod
+    def _percentile(full, values, starts, counts, q):
+        result = np.zeros(len(full))
+        pos = (counts[full] - 1) * (q / 100.0)
+        low = np.floor(pos).astype(np.int64)
+        high = np.ceil(pos).astype(np.int64)
+        low_values = values[starts[full] + low]
+        high_values = values[starts[full] + high]
+        if q == 50:
+            # Mean of the middle elements, as numpy median
+            result[full] = (low_values + high_values) / 2.0
+        else:
+            result[full] = low_values + (high_values - low_values) * (pos - low)
+        return result.tolist()
+
+
 if __name__ == '__main__':
     data = DHESA([1,2,3,4])
     print data.data
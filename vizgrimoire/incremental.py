@@ -0,0 +1,336 @@
+## Copyright (C) 2015 Bitergia
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+##
+## This file is a part of GrimoireLib
+##  (an Python library for the MetricsGrimoire and vizGrimoire systems)
+##
+
+""" Incremental regeneration of the evolutionary JSON files.
+
+    The time series of the metrics computed by period are only queried
+    from the first period that can have changed since the last run, and
+    spliced in the arrays of the evolutionary JSON file already written.
+    A manifest for each file keeps the dates, the filter item, the
+    watermarks of the sources and the identities checksum of the run that
+    created it. When it is missing or something else than new rows
+    changed, the file is created from scratch. It is always created from
+    scratch for the data sources whose rows are updated in place.
+"""
+
+import calendar
+import json
+import logging
+import os
+
+from datetime import datetime, timedelta
+
+from vizgrimoire.GrimoireUtils import completePeriodIds
+from vizgrimoire.metrics.query_builder import DSQuery
+
+
+class IncrementalReport(object):
+    """ Manifests of the evolutionary JSON files in destdir """
+
+    # Periods with the same dates whatever the startdate is
+    periods = ["day", "week", "month", "quarter"]
+
+    def __init__(self, destdir):
+        self.destdir = destdir
+        self.manifest_dir = os.path.join(destdir, "incremental")
+        self.full = 0
+        self.spliced = 0
+        # The sources of a database are checked once for all the files
+        self._watermarks = {}
+        self._new_rows = {}
+        self._checksums = {}
+        # filter filename -> (unchanged items, manifest to save)
+        self._items = {}
+        self.skipped_items = 0
+        if not os.path.isdir(self.manifest_dir):
+            os.makedirs(self.manifest_dir)
+
+    # Items without activity in the trends windows (365 days and the 365
+    # days before them) have always the same aggregated values
+    dormant_days = 2 * 365
+
+    @staticmethod
+    def _parse_date(date):
+        return datetime.strptime(date.replace("'", "")[0:10], "%Y-%m-%d")
+
+    @staticmethod
+    def _format_date(date):
+        return "'" + date.strftime("%Y-%m-%d") + "'"
+
+    @staticmethod
+    def get_period_start(date, period):
+        """ Start of the period of the time series including date """
+        date = datetime(date.year, date.month, date.day)
+        if period == "week":
+            date = date - timedelta(days=date.isocalendar()[2]-1)
+        elif period == "month":
+            date = date.replace(day=1)
+        elif period == "quarter":
+            date = date.replace(month=((date.month-1)/3)*3+1, day=1)
+        return date
+
+    @staticmethod
+    def _get_watermark_name(watermark):
+        (tables, filters, id_field, date_fields) = watermark
+        return ",".join(tables) + ":" + id_field
+
+    def _execute(self, dbcon, sql):
+        # The sources must be read always from the database
+        return DSQuery._fetch_result(dbcon.cursor, sql)
+
+    def _get_where(self, filters):
+        if len(filters) == 0: return ""
+        return " WHERE " + " AND ".join(filters)
+
+    def get_watermarks(self, dbcon):
+        """ Total rows and last id of the sources of the database """
+        if dbcon.database in self._watermarks:
+            return self._watermarks[dbcon.database]
+        watermarks = {}
+        for watermark in dbcon.watermarks:
+            (tables, filters, id_field, date_fields) = watermark
+            q = "SELECT COUNT(*) AS total, MAX(" + id_field + ") AS last_id " + \
+                "FROM " + ", ".join(tables) + self._get_where(filters)
+            try:
+                res = self._execute(dbcon, q)
+            except Exception, e:
+                # Tables not found in a database are ignored
+                logging.debug("Watermark not available: " + str(e))
+                continue
+            watermarks[self._get_watermark_name(watermark)] = [res['total'], res['last_id']]
+        self._watermarks[dbcon.database] = watermarks
+        return watermarks
+
+    def _get_new_rows(self, dbcon, watermark, last_id):
+        """ Number of rows after last_id and date of the first of them """
+        key = (dbcon.database, self._get_watermark_name(watermark), last_id)
+        if key in self._new_rows: return self._new_rows[key]
+        (tables, filters, id_field, date_fields) = watermark
+        filters = filters + [id_field + " > " + str(last_id)]
+        if last_id is None: filters = filters[0:-1]
+        dates = ["MIN(" + date_field + ")" for date_field in date_fields]
+        first_date = dates[0]
+        if len(dates) > 1: first_date = "LEAST(" + ", ".join(dates) + ")"
+        q = "SELECT COUNT(*) AS total, " + first_date + " AS first_date " + \
+            "FROM " + ", ".join(tables) + self._get_where(filters)
+        res = self._execute(dbcon, q)
+        self._new_rows[key] = (res['total'], res['first_date'])
+        return self._new_rows[key]
+
+    def get_identities_checksum(self, dbcon):
+        if dbcon.database not in self._checksums:
+            self._checksums[dbcon.database] = dbcon.get_identities_checksum()
+        return self._checksums[dbcon.database]
+
+    def _get_manifest_file(self, filename):
+        return os.path.join(self.manifest_dir, filename)
+
+    def read_manifest(self, filename):
+        try:
+            manifest_file = open(self._get_manifest_file(filename))
+            manifest = json.load(manifest_file)
+            manifest_file.close()
+        except (IOError, ValueError):
+            return None
+        return manifest
+
+    def write_manifest(self, filename, manifest):
+        manifest_file = self._get_manifest_file(filename)
+        # Never a half written manifest for the file
+        tmp_file = open(manifest_file + ".tmp", "w")
+        json.dump(manifest, tmp_file, sort_keys=True)
+        tmp_file.close()
+        os.rename(manifest_file + ".tmp", manifest_file)
+
+    def read_json(self, filename):
+        """ JSON file of destdir, None if it is not available """
+        try:
+            evol_file = open(os.path.join(self.destdir, filename))
+            data = json.load(evol_file)
+            evol_file.close()
+        except (IOError, ValueError):
+            return None
+        return data
+
+    def _get_first_new_date(self, dbcon, manifest, previous):
+        """ (True, date of the first row added to the sources since the
+            previous run or None) or (False, None) if rows were removed """
+        first_date = None
+        for watermark in dbcon.watermarks:
+            name = self._get_watermark_name(watermark)
+            if name not in manifest["watermarks"]: continue
+            (total, last_id) = previous["watermarks"][name]
+            (new_rows, date) = self._get_new_rows(dbcon, watermark, last_id)
+            if total + new_rows != manifest["watermarks"][name][0]:
+                # Rows removed or with lower ids
+                return (False, None)
+            if date is not None and (first_date is None or date < first_date):
+                first_date = date
+        return (True, first_date)
+
+    def get_since(self, dbcon, manifest, previous):
+        """ Start of the first period of the time series that can have
+            changed since the previous run, None if all of them can """
+        if previous is None or not dbcon.incremental_ts: return None
+        period = manifest["period"]
+        if period not in IncrementalReport.periods: return None
+        for field in ["period", "startdate", "item", "identities"]:
+            if previous.get(field) != manifest[field]: return None
+        if len(manifest["watermarks"]) == 0: return None
+        if sorted(previous["watermarks"].keys()) != sorted(manifest["watermarks"].keys()):
+            return None
+        previous_end = self._parse_date(previous["enddate"])
+        if self._parse_date(manifest["enddate"]) < previous_end: return None
+
+        (same_rows, first_date) = self._get_first_new_date(dbcon, manifest, previous)
+        if not same_rows: return None
+        # The last period of the previous run could be incomplete
+        since = self.get_period_start(previous_end - timedelta(days=1), period)
+        if first_date is not None:
+            since = min(since, self.get_period_start(first_date, period))
+
+        if since <= self.get_period_start(self._parse_date(manifest["startdate"]), period):
+            return None
+        return since
+
+    def splice(self, previous_data, data, keys, period, since, enddate):
+        """ Time series of previous_data before since followed by the ones
+            in data from since, None if they can not be joined """
+        if previous_data is None or "unixtime" not in previous_data: return None
+        timestamp = unicode(calendar.timegm(since.timetuple()))
+        if timestamp not in previous_data["unixtime"]: return None
+        nkeep = previous_data["unixtime"].index(timestamp)
+
+        # Periods from since, also for metrics without values in them
+        dates = completePeriodIds({period: []}, period, self._format_date(since), enddate)
+        nperiods = len(dates[period])
+        spliced = {}
+        for key in set(keys) | set(data.keys()):
+            if key not in previous_data: return None
+            if key in data: values = data[key]
+            elif key in dates: values = dates[key]
+            else: values = [0] * nperiods
+            if len(values) != nperiods: return None
+            spliced[key] = previous_data[key][0:nkeep] + values
+        spliced["id"] = range(0, nkeep + nperiods)
+        return spliced
+
+    def get_evolutionary_data(self, DS, period, startdate, enddate, identities_db, filter_ = None):
+        """ Time series of the metrics of DS, only computing the periods
+            that can have changed since the last run """
+        type_analysis = None
+        if filter_ is not None: type_analysis = filter_.get_type_analysis()
+        metrics = DS.get_metrics_set(DS)
+        if (type_analysis is not None and type_analysis[1] is None) or len(metrics) == 0:
+            # All items time series are not stored by item
+            return DS._get_metrics_data(period, startdate, enddate, identities_db, filter_, True)
+
+        dbcon = metrics[0].db
+        filename = DS().get_evolutionary_filename(filter_)
+        (ds_startdate, ds_enddate) = DS.get_dates(startdate, enddate)
+        manifest = {"period": period, "startdate": ds_startdate, "enddate": ds_enddate,
+                    "item": type_analysis,
+                    "identities": self.get_identities_checksum(dbcon),
+                    "watermarks": self.get_watermarks(dbcon)}
+        # As it is read from the file
+        manifest = json.loads(json.dumps(manifest))
+        previous = self.read_manifest(filename)
+        since = self.get_since(dbcon, manifest, previous)
+
+        data = None
+        if since is not None:
+            data = DS._get_metrics_data(period, startdate, enddate, identities_db,
+                                        filter_, True, self._format_date(since), True)
+            data = self.splice(self.read_json(filename), data, previous["keys"],
+                               period, since, ds_enddate)
+        if data is not None:
+            logging.info("Incremental " + filename + " from " + since.strftime("%Y-%m-%d"))
+            self.spliced += 1
+        else:
+            data = DS._get_metrics_data(period, startdate, enddate, identities_db,
+                                        filter_, True, None, True)
+            self.full += 1
+        manifest["keys"] = sorted(data.keys())
+        others = DS._get_metrics_data(period, startdate, enddate, identities_db,
+                                      filter_, True, None, False)
+        self.write_manifest(filename, manifest)
+        return dict(data.items() + others.items())
+
+    def _same_items_files(self, dbcon, manifest, previous):
+        """ The files of the items without new activity are the same """
+        if previous is None: return False
+        period = manifest["period"]
+        if period not in IncrementalReport.periods: return False
+        for field in ["period", "startdate", "identities"]:
+            if previous.get(field) != manifest[field]: return False
+        if len(manifest["watermarks"]) == 0: return False
+        if sorted(previous["watermarks"].keys()) != sorted(manifest["watermarks"].keys()):
+            return False
+        # Time series with the same periods
+        previous_end = self._parse_date(previous["enddate"])
+        enddate = self._parse_date(manifest["enddate"])
+        if enddate < previous_end: return False
+        if (self.get_period_start(previous_end - timedelta(days=1), period) !=
+            self.get_period_start(enddate - timedelta(days=1), period)):
+            return False
+        # New rows are activity after the previous run
+        (same_rows, first_date) = self._get_first_new_date(dbcon, manifest, previous)
+        if not same_rows: return False
+        return first_date is None or first_date >= previous_end
+
+    def get_unchanged_items(self, DS, filter_, period, startdate, enddate, last_dates):
+        """ Items of filter_ whose files are the same than in the previous
+            run, from the date of the last activity of each item """
+        from vizgrimoire.filter import Filter
+        name = filter_.get_filename(DS())
+        if name in self._items: return self._items[name][0]
+        dbcon = DS.get_metrics_set(DS)[0].db
+        (startdate, enddate) = DS.get_dates(startdate, enddate)
+        manifest = {"period": period, "startdate": startdate, "enddate": enddate,
+                    "identities": self.get_identities_checksum(dbcon),
+                    "watermarks": self.get_watermarks(dbcon),
+                    "items": last_dates}
+        manifest = json.loads(json.dumps(manifest))
+        previous = self.read_manifest(name)
+
+        unchanged = []
+        if self._same_items_files(dbcon, manifest, previous):
+            dormant = self._parse_date(previous["enddate"]) - \
+                timedelta(days=IncrementalReport.dormant_days)
+            for (item, last_date) in manifest["items"].items():
+                if item not in previous["items"] or previous["items"][item] != last_date:
+                    continue
+                if last_date is not None and self._parse_date(last_date) >= dormant: continue
+                filter_item = Filter(filter_.get_name(), item)
+                files = [filter_item.get_evolutionary_filename(DS()),
+                         filter_item.get_static_filename(DS())]
+                if False in [os.path.isfile(os.path.join(self.destdir, filename))
+                             for filename in files]:
+                    continue
+                unchanged.append(item)
+        self._items[name] = (unchanged, manifest)
+        self.skipped_items += len(unchanged)
+        return unchanged
+
+    def save_items(self, DS, filter_):
+        """ Save the activity of the items once their files are created """
+        name = filter_.get_filename(DS())
+        if name in self._items:
+            self.write_manifest(name, self._items[name][1])
@@ -0,0 +1,120 @@
+## Copyright (C) 2015 Bitergia
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+##
+## This file is a part of GrimoireLib
+##  (an Python library for the MetricsGrimoire and vizGrimoire systems)
+##
+
+""" Pool of processes to create the reports of the items of a filter """
+
+import logging
+import multiprocessing
+
+
+class ItemsPool(object):
+    """ Run a function for all the items of a filter in worker processes.
+
+        Workers are forked when the items are processed, so the function
+        can be a closure. Each worker opens its own db connections, one
+        per database. Results are returned in the items order. Without
+        workers errors are raised as usual. With workers the items that
+        failed are logged and an error listing them is raised once all
+        the items are processed. The query profile of the workers is
+        added to the one of the calling process.
+    """
+
+    jobs = 1 # number of worker processes
+
+    # (function, items) shared with the forked workers
+    _task = None
+
+    @staticmethod
+    def set_jobs(jobs):
+        ItemsPool.jobs = jobs
+
+    @staticmethod
+    def get_jobs():
+        return ItemsPool.jobs
+
+    @staticmethod
+    def _init_worker():
+        from vizgrimoire.report import Report
+        Report.reconnect()
+
+    @staticmethod
+    def _run_item(index):
+        (function, items) = ItemsPool._task
+        return function(items[index])
+
+    @staticmethod
+    def _run_item_safe(index):
+        """ (True, result) or (False, None) if the item failed """
+        try:
+            return (True, ItemsPool._run_item(index))
+        except (Exception, SystemExit):
+            # Also SystemExit, a dead worker would block the pool
+            item = ItemsPool._task[1][index]
+            logging.exception("Report for item " + unicode(item) + " failed")
+            return (False, None)
+
+    @staticmethod
+    def _run_item_worker(index):
+        from vizgrimoire.metrics.query_builder import DSQuery
+        profile = DSQuery.get_query_profile()
+        if profile is None:
+            return ItemsPool._run_item_safe(index) + (None,)
+        # Only the queries of this item are sent back
+        profile.reset()
+        result = ItemsPool._run_item_safe(index)
+        return result + (profile.get_data(),)
+
+    @staticmethod
+    def map(function, items, jobs = None):
+        """ Results of function for all items """
+        if jobs is None: jobs = ItemsPool.jobs
+        if jobs > len(items): jobs = len(items)
+
+        ItemsPool._task = (function, items)
+        try:
+            if jobs <= 1 or multiprocessing.current_process().daemon:
+                # Daemonic processes, like the data sources workers,
+                # can not have children
+                return [ItemsPool._run_item(i) for i in range(0, len(items))]
+
+            pool = multiprocessing.Pool(processes=jobs,
+                                        initializer=ItemsPool._init_worker)
+            try:
+                results = pool.map(_run_item, range(0, len(items)), chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+            from vizgrimoire.metrics.query_builder import DSQuery
+            for (done, result, profile_data) in results:
+                if profile_data is not None:
+                    DSQuery.get_query_profile().merge(profile_data)
+            failed = [unicode(item) for (item, (done, result, profile_data))
+                      in zip(items, results) if not done]
+            if len(failed) > 0:
+                raise Exception("Reports for %i items failed: %s" %
+                                (len(failed), ", ".join(failed)))
+            return [result for (done, result, profile_data) in results]
+        finally:
+            ItemsPool._task = None
+
+
+def _run_item(index):
+    # Module level function so it can be sent to the workers
+    return ItemsPool._run_item_worker(index)
@@ -49,6 +49,9 @@ class Opened(Metrics):
     data_source = ITS
 
     def _get_sql(self, evolutionary):
+        query = self.db.GetSQLCube(["opened"], self.filters, evolutionary)
+        if query is not None: return query
+
         fields = Set([])
         tables = Set([])
         filters = Set([])
@@ -247,6 +250,9 @@ class Closed(Metrics):
 
     def _get_sql(self, evolutionary):
         """ Implemented using Changed """
+        query = self.db.GetSQLCube(["closed"], self.filters, evolutionary)
+        if query is not None: return query
+
         close = True
         changed = ITS.get_metrics("changed", ITS)
         if changed is None:
@@ -254,10 +260,7 @@ class Closed(Metrics):
             changed = Changed(self.db, self.filters)
             q = changed._get_sql(evolutionary, close)
         else:
-            cfilters = changed.filters
-            changed.filters = self.filters
-            q = changed._get_sql(evolutionary, close)
-            changed.filters = cfilters
+            q = changed.with_filters(self.filters)._get_sql(evolutionary, close)
         return q
 
 
@@ -302,7 +305,13 @@ class TimeToClose(Metrics):
         query = query + " from " + self.db._get_tables_query(tables)
         query = query + " where " + self.db._get_filters_query(filters)
 
-        return self.db.ExecuteQuery(query)
+        # Rows are streamed, only the time frames are kept
+        timeto = []
+        for chunk in self.db.ExecuteQueryStream(query):
+            timeto.extend(chunk["timeto"])
+
+        if len(timeto) == 1: timeto = timeto[0]
+        return {"timeto": timeto}
 
 
 #closers
@@ -380,10 +389,7 @@ class Closers(Metrics):
             changers = Changers(self.db, self.filters)
             q = changers._get_sql(evolutionary, close)
         else:
-            cfilters = changers.filters
-            changers.filters = self.filters
-            q = changers._get_sql(evolutionary, close)
-            changers.filters = cfilters
+            q = changers.with_filters(self.filters)._get_sql(evolutionary, close)
         return q
 
 class BMIIndex(Metrics):
@@ -695,10 +701,7 @@ class People(Metrics):
             closers = Closers(self.db, self.filters)
             top = closers._get_top(days, metric_filters)
         else:
-            afilters = closers.filters
-            closers.filters = self.filters
-            top = closers._get_top(days, metric_filters)
-            closers.filters = afilters
+            top = closers.with_filters(self.filters)._get_top(days, metric_filters)
 
         top['name'] = top.pop('closers')
         return top
@@ -241,10 +241,7 @@ class People(Metrics):
             openers = StoriesOpeners(self.db, self.filters)
             top = openers._get_top(days, metric_filters)
         else:
-            afilters = openers.filters
-            openers.filters = self.filters
-            top = openers._get_top(days, metric_filters)
-            openers.filters = afilters
+            top = openers.with_filters(self.filters)._get_top(days, metric_filters)
 
         top['name'] = top.pop('openers')
         return top
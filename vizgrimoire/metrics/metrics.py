@@ -23,11 +23,17 @@
 ##   Alvaro del Castillo <acs@bitergia.com>
 
 
+import copy
 import logging
+import numpy
+
+from functools import partial
 
 from vizgrimoire.GrimoireUtils import completePeriodIds, GetDates, GetPercentageDiff, check_array_values
 from vizgrimoire.metrics.query_builder import DSQuery
+from vizgrimoire.result_frame import ResultFrame
 from vizgrimoire.metrics.metrics_filter import MetricFilters
+from vizgrimoire.metrics_pool import MetricsPool
 
 class Metrics(object):
     """Root of hierarchy of Entities (Metrics)
@@ -81,6 +87,36 @@ class Metrics(object):
         """ Returns the family of the instance """
         return Metrics.data_source
 
+    def with_filters(self, filters):
+        """ Copy of the metric using filters
+
+            The copy shares the db connection and the rest of the state,
+            and it can change its own filters while it is evaluated.
+        """
+        metric = copy.copy(self)
+        metric.filters = filters
+        return metric
+
+    def evaluate(self, filters, kind, days = None):
+        """ Value of the metric with filters, without changing the metric
+
+            kind is "ts", "agg", "list", "ts_changes" or "trends". days is
+            the days of the list, or the list of days of the trends, by
+            default [7,30,365]. The metric objects of the data sources are
+            shared, so they can be evaluated from several threads. Threads
+            other than the main one use their own db connections.
+        """
+        DSQuery.check_thread_connections()
+        metric = self.with_filters(filters)
+        if kind == "trends":
+            if days is None: days = [7,30,365]
+            return metric.get_trends_days(filters.enddate, days)
+        elif kind == "list" and days is not None:
+            return metric.get_list(filters, days)
+        elif kind in ["ts", "agg", "list", "ts_changes"]:
+            return getattr(metric, "get_" + kind)()
+        raise ValueError("Unknown kind of metric evaluation: " + str(kind))
+
     def _get_sql(self, evolutionary):
         """Private method that returns a valid SQL query
 
@@ -113,6 +149,8 @@ class Metrics(object):
     @staticmethod
     def _convert_group_to_ts(data, id_field):
         """ Convert a dict with mixed ts to individual ts """
+        if isinstance(data, ResultFrame):
+            return Metrics._convert_frame_to_ts(data, id_field)
         data = check_array_values(data)
         ts = {}
         if id_field not in data:
@@ -123,8 +161,13 @@ class Metrics(object):
 
         # Create a unique ts for each id_field
 
-        # Create empty structure
-        id_fields = list(set(data[id_field]))
+        # Create empty structure, items in order of appearance
+        id_fields = []
+        positions = {}
+        for item in data[id_field]:
+            if item not in positions:
+                positions[item] = len(id_fields)
+                id_fields.append(item)
         ts[id_field] = id_fields
         for field in fields: 
             ts[field]  = []
@@ -133,12 +176,45 @@ class Metrics(object):
 
         # Fill items data
         for i in range(0, len(data[id_field])):
-            item = data[id_field][i]
-            pos = id_fields.index(item)
+            pos = positions[data[id_field][i]]
             for field in fields:
                 ts[field][pos].append(data[field][i])
         return ts
 
+    @staticmethod
+    def _convert_frame_to_ts(frame, id_field):
+        """ _convert_group_to_ts for a ResultFrame, working on the arrays """
+        ts = {}
+        if id_field not in frame:
+            raise Exception(id_field + " not in " + str(frame.keys()))
+
+        fields = frame.keys()
+        fields.remove(id_field)
+
+        ids = frame.array(id_field)
+        if len(ids) == 0:
+            ts[id_field] = []
+            for field in fields: ts[field] = []
+            return ts
+
+        # Position of each row item, items in order of appearance
+        positions = {}
+        pos = numpy.fromiter((positions.setdefault(item, len(positions)) for item in ids),
+                             numpy.int64, len(ids))
+        items = [None] * len(positions)
+        for (item, item_pos) in positions.iteritems():
+            items[item_pos] = item
+
+        # Rows sorted by item keeping the rows order for each item
+        rows = numpy.argsort(pos, kind='mergesort')
+        bounds = numpy.cumsum(numpy.bincount(pos))[:-1]
+
+        ts[id_field] = items
+        for field in fields:
+            ts[field] = [values.tolist() for values in
+                         numpy.split(frame.array(field)[rows], bounds)]
+        return ts
+
     @staticmethod
     def _complete_period_ids_items(data, id_field, period, startdate, enddate):
         ts = {}
@@ -178,16 +254,40 @@ class Metrics(object):
 
         """
 
-        query = self._get_sql(True)
-        ts = self.db.ExecuteQuery(query)
-        if self.filters.type_analysis and self.filters.type_analysis[1] is None:
+        query = self._get_ts_sql()
+        return self._complete_ts(self._execute_ts_query(query))
+
+    def _get_ts_sql(self):
+        """ get_ts query, only for the periods from filters.since if the
+            dates range can be changed in it """
+        sql = self._get_sql(True)
+        if self.filters.since is not None:
+            since_sql = self.db.GetSQLPeriodSince(sql, self.filters.startdate,
+                                                  self.filters.enddate, self.filters.since)
+            if since_sql is not None: sql = since_sql
+        return sql
+
+    def _is_all_items(self):
+        return self.filters.type_analysis and self.filters.type_analysis[1] is None
+
+    def _execute_ts_query(self, query):
+        if self._is_all_items():
+            # Results for all items are usually big
+            return self.db.ExecuteQueryFrame(query)
+        return self.db.ExecuteQuery(query)
+
+    def _complete_ts(self, ts):
+        """ Time series from the result of the get_ts query """
+        if self._is_all_items():
             id_field = self.db.get_group_field_alias(self.filters.type_analysis[0])
             ts = Metrics._convert_group_to_ts(ts, id_field)
             ts = Metrics._complete_period_ids_items(ts, id_field, self.filters.period,
                                                     self.filters.startdate, self.filters.enddate)
         else:
-            ts = completePeriodIds(ts, self.filters.period, 
-                                   self.filters.startdate, self.filters.enddate)
+            # Periods before since are not included, also if they are in ts
+            startdate = self.filters.startdate
+            if self.filters.since is not None: startdate = self.filters.since
+            ts = completePeriodIds(ts, self.filters.period, startdate, self.filters.enddate)
         return ts
 
     def get_agg(self):
@@ -195,6 +295,135 @@ class Metrics(object):
         q = self._get_sql(False)
         return self.db.ExecuteQuery(q)
 
+    def _uses_default(self, method):
+        return getattr(type(self), method).__func__ is getattr(Metrics, method).__func__
+
+    def _get_fusion_sql(self, evolutionary):
+        """ get_ts or get_agg query, or None if the metric does not use the
+            default get_ts or get_agg """
+        method = "get_agg"
+        if evolutionary: method = "get_ts"
+        if not self._uses_default(method): return None
+        try:
+            if evolutionary: sql = self._get_ts_sql()
+            else: sql = self._get_sql(evolutionary)
+        except NotImplementedError:
+            return None
+        return sql
+
+    def _get_rollup_agg_sql(self, sql):
+        """ get_agg query for the total row of the ROLLUP of the get_ts
+            query sql, or None if they do not use the same data """
+        if not self._uses_default("get_agg") or self._is_all_items(): return None
+        if self.db.GetSQLRollup(sql) is None: return None
+        agg_sql = self._get_sql(False)
+        total = self.db.GetSQLFusionParts(self.db.GetSQLRollupTotal(sql))
+        agg = self.db.GetSQLFusionParts(agg_sql)
+        if total is None or agg is None: return None
+        if total[0] != agg[0] or sorted(total[1]) != sorted(agg[1]): return None
+        return agg_sql
+
+    @staticmethod
+    def get_fused_data(metrics, evolutionary, rollup_aggs = None):
+        """ get_ts or get_agg values for metrics, with one query for all
+            the metrics with the same FROM, WHERE and GROUP BY.
+
+            Returns a dict with the values for each metric id. Metrics that
+            can not be fused with others are not included. Aggregated
+            values for all items are not sorted by the metric value.
+
+            With rollup_aggs, a dict by (database, get_agg query), time
+            series queries are run WITH ROLLUP, also for metrics not fused,
+            and the total rows are added to it. Aggregated values found in
+            rollup_aggs are taken from it and included in the result.
+
+            The queries of the groups are run in the MetricsPool.
+        """
+        data = {}
+        groups = {}
+        keys = [] # groups in metrics order
+        for metric in metrics:
+            sql = metric._get_fusion_sql(evolutionary)
+            if sql is None: continue
+            if not evolutionary and rollup_aggs is not None:
+                agg = rollup_aggs.pop((metric.db.database, sql), None)
+                if agg is not None:
+                    # Already computed with the time series
+                    data[metric.id] = agg
+                    continue
+            parts = metric.db.GetSQLFusionParts(sql)
+            if parts is None: continue
+            (signature, fields, rest, order) = parts
+            aliases = set([metric.db.GetSQLFieldAlias(field) for field in fields])
+            agg_sql = None
+            if rollup_aggs is not None and evolutionary:
+                agg_sql = metric._get_rollup_agg_sql(sql)
+            # The same db connection and filters are needed to share the result
+            key = (id(metric.db), metric._is_all_items(), signature)
+            for group in groups.get(key, []):
+                # Columns of each metric must be different
+                if len(group["aliases"] & aliases) == 0: break
+            else:
+                group = {"metrics": [], "aliases": set([]), "fields": [],
+                         "rest": rest, "orders": set([])}
+                if key not in groups:
+                    groups[key] = []
+                    keys.append(key)
+                groups[key].append(group)
+            group["metrics"].append((metric, aliases, agg_sql))
+            group["aliases"] |= aliases
+            group["fields"] += fields
+            group["orders"].add(order)
+
+        fused = [] # groups with their query
+        calls = []
+        for key in keys:
+            for group in groups[key]:
+                # ORDER BY of all items queries uses the metric field
+                order = None
+                if len(group["orders"]) == 1: order = list(group["orders"])[0]
+                first = group["metrics"][0][0]
+                sql = first.db.GetSQLFused(key[2], group["fields"], group["rest"], order)
+
+                rollup_sql = None
+                if None not in [agg_sql for (m, a, agg_sql) in group["metrics"]]:
+                    rollup_sql = first.db.GetSQLRollup(sql)
+                if len(group["metrics"]) < 2 and rollup_sql is None: continue
+
+                fused.append(group)
+                calls.append(partial(Metrics._execute_fused_query, first, sql,
+                                     rollup_sql, evolutionary))
+
+        data_source = None
+        if len(metrics) > 0: data_source = metrics[0].data_source
+        results = MetricsPool.map(calls, data_source)
+        for (group, (result, total)) in zip(fused, results):
+            for (metric, aliases, agg_sql) in group["metrics"]:
+                # Not aggregated columns and the columns of the metric
+                columns = [column for column in result.keys()
+                           if column in aliases or column not in group["aliases"]]
+                if isinstance(result, ResultFrame):
+                    value = result.select(columns)
+                else:
+                    value = dict([(column, result[column]) for column in columns])
+                if evolutionary: value = metric._complete_ts(value)
+                data[metric.id] = value
+                if total is not None:
+                    agg = dict([(column, total[column]) for column in aliases])
+                    rollup_aggs[(metric.db.database, agg_sql)] = agg
+        return data
+
+    @staticmethod
+    def _execute_fused_query(metric, sql, rollup_sql, evolutionary):
+        """ (result, ROLLUP total row) of a fused query run with metric db """
+        total = None
+        if rollup_sql is not None:
+            (rollup_sql, period) = rollup_sql
+            result = metric.db.ExecuteQuery(rollup_sql)
+            (result, total) = DSQuery.split_rollup(result, period)
+        elif evolutionary: result = metric._execute_ts_query(sql)
+        else: result = metric.db.ExecuteQuery(sql)
+        return (result, total)
 
     def get_trends(self, date, days):
         """ Returns the trend metrics between now and now-days values """
@@ -232,6 +461,84 @@ class Metrics(object):
         self.filters = filters
         return (data)
 
+    def get_trends_days(self, date, days_list):
+        """ Returns a list with the trend metrics for each days in days_list
+
+        All the trends are computed with just one query when the metric
+        uses the default get_agg and its query can be converted to
+        conditional aggregation. Otherwise get_trends is used.
+        """
+
+        data = self._get_trends_one_query(date, days_list)
+        if data is None:
+            data = [self.get_trends(date, days) for days in days_list]
+        return data
+
+    def _get_trends_one_query(self, date, days_list):
+        """ Trends for all days in days_list using one query, or None """
+
+        for method in ["get_trends", "get_agg", "_get_trends_all_items"]:
+            if not self._uses_default(method):
+                return None
+
+        all_items = self.filters.type_analysis and self.filters.type_analysis[1] is None
+        # metrics not supported in group_by queries
+        if all_items and self.id in ['bmitickets']:
+            return None
+
+        # Windows: last [start, end) and prev [prev, start) for each days
+        windows = []
+        startdate = None
+        for days in days_list:
+            chardates = GetDates(date, days)
+            windows.append(("last_" + str(days), chardates[1], chardates[0]))
+            windows.append(("prev_" + str(days), chardates[2], chardates[1]))
+            if startdate is None or chardates[2] < startdate:
+                startdate = chardates[2]
+        enddate = GetDates(date, 0)[0]
+
+        # Keeping state of origin filters
+        filters = self.filters
+        self.filters = MetricFilters(filters.period, startdate, enddate,
+                                     filters.type_analysis)
+        self.filters.global_filter = filters.global_filter
+        self.filters.closed_condition = filters.closed_condition
+        try:
+            sql = self._get_sql(False)
+        finally:
+            self.filters = filters
+
+        sql = self.db.GetSQLTrends(sql, startdate, enddate, self.id, windows)
+        if sql is None: return None
+        res = check_array_values(self.db.ExecuteQuery(sql))
+
+        group_field = None
+        if all_items:
+            group_field = self.db.get_group_field_alias(self.filters.type_analysis[0])
+            if group_field not in res: return None
+
+        data = []
+        for days in days_list:
+            last = [value or 0 for value in res["last_" + str(days)]]
+            prev = [value or 0 for value in res["prev_" + str(days)]]
+            if not all_items:
+                last = [int(value) for value in last]
+                prev = [int(value) for value in prev]
+            diff = [last[i] - prev[i] for i in range(0, len(last))]
+            percentage = [GetPercentageDiff(prev[i], last[i]) for i in range(0, len(last))]
+
+            trends = {}
+            if all_items:
+                trends[group_field] = list(res[group_field])
+            else:
+                last, diff, percentage = last[0], diff[0], percentage[0]
+            trends['diff_net'+self.id+'_'+str(days)] = diff
+            trends['percentage_'+self.id+'_'+str(days)] = percentage
+            trends[self.id+'_'+str(days)] = last
+            data.append(trends)
+
+        return data
+
     def _get_trends_all_items(self, date, days):
         """ Returns the trend metrics between now and now-days values """
         from vizgrimoire.GrimoireUtils import check_array_values
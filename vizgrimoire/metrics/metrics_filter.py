@@ -128,6 +128,9 @@ class MetricFilters(object):
         self.organizations_out = None
         self.global_filter = global_filter
         self.closed_condition = None
+        # First date of the periods of the time series. The other
+        # conditions of the queries still use startdate.
+        self.since = None
 
     def add_filter(self, typeof_analysis, value):
         """This function adds a new type of analysis to the type_analysis
@@ -176,5 +179,6 @@ class MetricFilters(object):
                                 self.people_out,
                                 self.companies_out,
                                 self.global_filter)
+        newcopy.since = self.since
         return newcopy
 
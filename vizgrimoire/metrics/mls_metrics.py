@@ -102,6 +102,9 @@ class EmailsSent(Metrics):
     data_source = MLS
 
     def _get_sql(self, evolutionary):
+        query = self.db.GetSQLCube(["sent"], self.filters, evolutionary)
+        if query is not None: return query
+
         fields = Set([])
         tables = Set([])
         filters = Set([])
@@ -227,10 +230,7 @@ class People(Metrics):
             senders = EmailsSenders(self.db, self.filters)
             top = senders._get_top_global(days, metric_filters)
         else:
-            afilters = senders.filters
-            senders.filters = self.filters
-            top = senders._get_top_global(days, metric_filters)
-            senders.filters = afilters
+            top = senders.with_filters(self.filters)._get_top_global(days, metric_filters)
 
         top['name'] = top.pop('senders')
         return top
@@ -318,9 +318,13 @@ class TimeToFirstReply(Metrics):
 
         query = fields_str + tables_str + filters_str
 
-        timeframes = self.db.ExecuteQuery(query)
+        # Rows are streamed, only the time frames are kept
+        timeframes = []
+        for chunk in self.db.ExecuteQueryStream(query):
+            timeframes.extend(chunk["diffdate"])
 
-        return timeframes["diffdate"]
+        if len(timeframes) == 1: return timeframes[0]
+        return timeframes
 
 
 class SendersInit(Metrics):
@@ -24,6 +24,7 @@
 
 """ Metrics for the source code review system based in the pullpo data model """
 
+import copy
 import logging
 import MySQLdb
 import numpy
@@ -432,10 +433,7 @@ class People(Metrics):
             submitters = Submitters(self.db, self.filters)
             top = submitters._get_top_global(days, metric_filters)
         else:
-            afilters = submitters.filters
-            submitters.filters = self.filters
-            top = submitters._get_top_global(days, metric_filters)
-            submitters.filters = afilters
+            top = submitters.with_filters(self.filters)._get_top_global(days, metric_filters)
 
         top['name'] = top.pop('openers')
         return top
@@ -986,10 +984,9 @@ class Projects(Metrics):
             type_analysis = ['project', project]
 
             metric = Pullpo.get_metrics("submitted", Pullpo)
-            type_analysis_orig = metric.filters.type_analysis
-            metric.filters.type_analysis = type_analysis
-            reviews = metric.get_agg()
-            metric.filters.type_analysis = type_analysis_orig
+            mfilter = copy.copy(metric.filters)
+            mfilter.type_analysis = type_analysis
+            reviews = metric.evaluate(mfilter, "agg")
 
             reviews = reviews['submitted']
             if (reviews >= 0):
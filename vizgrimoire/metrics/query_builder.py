@@ -21,22 +21,160 @@
 ##   Daniel Izquierdo-Cortazar <dizquierdo@bitergia.com>
 ##   Alvaro del Castillo <acs@bitergia.com>
 
+import json
 import logging
 import MySQLdb
+import MySQLdb.cursors
 import re
 import sys
+import threading
 from sets import Set
 import datetime
 import time
+import numpy as np
 
 from vizgrimoire.metrics.metrics_filter import MetricFilters
 from vizgrimoire.GrimoireUtils import genDates
-from vizgrimoire.datahandlers.data_handler import DHESA
+from vizgrimoire.datahandlers.data_handler import DHESA, DHESAPeriods
+from vizgrimoire.cube.activity_cube import SCMActivityCube, ITSActivityCube, \
+    MLSActivityCube, SCRActivityCube
+
+class IndexManager(object):
+    """ Indexes needed by the queries of each data source
+
+        Each DSQuery class declares in indexes the (table, columns) of
+        the indexes its hot queries need. The existing indexes of each
+        database are read from information_schema once, and only the
+        missing ones are created, with the plans of a query using the
+        columns before and after creating them.
+    """
+
+    # Max length of MySQL identifiers
+    max_name_length = 64
+
+    def __init__(self, create = True):
+        # without create, missing indexes are only reported
+        self.create = create
+        # database -> {table: {column: True}}
+        self._columns = {}
+        # database -> {table: [columns of each index]}
+        self._indexes = {}
+        # (database, DSQuery class) already checked
+        self._checked = []
+        self._report = []
+
+    @staticmethod
+    def get_index_name(table, columns):
+        name = table + "_" + "_".join(columns) + "_idx"
+        return name[0:IndexManager.max_name_length]
+
+    @staticmethod
+    def get_plan_query(table, columns):
+        """ Query reading the columns in index order """
+        columns = ", ".join(columns)
+        return "SELECT %s FROM %s ORDER BY %s" % (columns, table, columns)
+
+    def _read_schema(self, cursor, database):
+        # Not in the query cache: the schema changes when indexes are created
+        q = "SELECT table_name, column_name FROM information_schema.columns " + \
+            "WHERE table_schema = '%s'" % (database)
+        cursor.execute(q)
+        columns = {}
+        for (table, column) in cursor.fetchall():
+            columns.setdefault(table.lower(), {})[column.lower()] = True
+        q = "SELECT table_name, index_name, column_name " + \
+            "FROM information_schema.statistics WHERE table_schema = '%s' " % (database) + \
+            "ORDER BY table_name, index_name, seq_in_index"
+        cursor.execute(q)
+        indexes = {}
+        for (table, index, column) in cursor.fetchall():
+            indexes.setdefault((table.lower(), index), []).append(column.lower())
+        self._columns[database] = columns
+        self._indexes[database] = {}
+        for ((table, index), index_columns) in sorted(indexes.items()):
+            self._indexes[database].setdefault(table, []).append(index_columns)
+
+    def _is_indexed(self, database, table, columns):
+        """ columns are the leftmost columns of an existing index """
+        for index_columns in self._indexes[database].get(table, []):
+            if index_columns[0:len(columns)] == columns: return True
+        return False
+
+    def _explain(self, cursor, sql):
+        try:
+            cursor.execute("EXPLAIN " + sql)
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        except Exception, e:
+            logging.warning("Can not explain query: " + str(e))
+            return None
+
+    def ensure(self, dsquery):
+        """ Check and create the indexes of the class of dsquery in its database """
+        database = dsquery.database
+        if (database, type(dsquery)) in self._checked: return
+        self._checked.append((database, type(dsquery)))
+        if database not in self._columns:
+            self._read_schema(dsquery.cursor, database)
+
+        for (table, columns) in dsquery.indexes:
+            columns = [column.lower() for column in columns]
+            index = {"database": database, "table": table, "columns": columns,
+                     "name": IndexManager.get_index_name(table, columns)}
+            self._report.append(index)
+            table_columns = self._columns[database].get(table.lower())
+            if table_columns is None or \
+                len([c for c in columns if c not in table_columns]) > 0:
+                index["status"] = "not found"
+                continue
+            if self._is_indexed(database, table.lower(), columns):
+                index["status"] = "present"
+                continue
+            if not self.create:
+                index["status"] = "missing"
+                continue
+            plan_query = IndexManager.get_plan_query(table, columns)
+            index["plan_before"] = self._explain(dsquery.cursor, plan_query)
+            q = "CREATE INDEX %s ON %s (%s)" % (index["name"], table, ", ".join(columns))
+            logging.info("Creating index in %s: %s" % (database, q))
+            try:
+                dsquery.cursor.execute(q)
+            except Exception, e:
+                logging.warning("Can not create index %s: %s" % (index["name"], str(e)))
+                index["status"] = "error"
+                continue
+            self._indexes[database].setdefault(table.lower(), []).append(columns)
+            index["status"] = "created"
+            index["plan_after"] = self._explain(dsquery.cursor, plan_query)
+
+    def get_report(self):
+        """ Declared indexes with their status: not found, present, missing,
+            created or error """
+        return self._report
+
+    def write(self, path):
+        """ Write the report to path in JSON format """
+        f = open(path, "w")
+        f.write(json.dumps(self.get_report(), indent=1, sort_keys=True,
+                           default=str))
+        f.close()
+
 
 class DSQuery(object):
     """ Generic methods to control access to db """
 
     db_conn_pool = {} # one connection per database
+    query_cache = None # persistent cache for query results
+    query_profile = None # statistics of the executed queries
+    stream_chunk_size = 10000 # rows in each chunk of ExecuteQueryStream
+    inherited_conns = [] # connections from the parent of a forked process
+    index_manager = None # IndexManager checking the indexes of each database
+    indexes = [] # (table, columns) of the indexes needed by the queries
+    activity_cube = None # ActivityCube class of the data source
+    activity_cubes = None # database -> refreshed ActivityCube, if cubes are used
+    watermarks = [] # (tables, filters, id_field, date_fields) of the rows added to the sources
+    incremental_ts = True # only the periods of the rows added change in the time series
+    _local = threading.local() # db connections of the threads, like the MetricsPool ones
 
     def __init__(self, user, password, database,
                  identities_db = None, projects_db = None,
@@ -49,21 +187,127 @@ class DSQuery(object):
         self.host = host
         self.port = port
         self.group = group
-        if database in DSQuery.db_conn_pool:
-            db = DSQuery.db_conn_pool[database]
+        self.reconnect()
+
+        db = self.__SetDBChannel__(user, password, database, host, port, group)
+
+        if DSQuery.query_cache is not None:
+            for dbname in [database, identities_db, projects_db]:
+                DSQuery.query_cache.register(dbname)
+
+        self.create_indexes()
+        self.refresh_activity_cube()
+
+    def reconnect(self):
+        """ Get the cursor from the connection to the database in the pool """
+        if self.database in DSQuery.db_conn_pool:
+            db = DSQuery.db_conn_pool[self.database]
         else:
-            db = self.__SetDBChannel__(user, password, database, host, port, group)
-            DSQuery.db_conn_pool[database] = db
+            db = self.__SetDBChannel__(self.user, self.password, self.database,
+                                       self.host, self.port, self.group)
+            DSQuery.db_conn_pool[self.database] = db
         self.cursor = db.cursor()
         self.cursor.execute("SET NAMES 'utf8'")
 
-        db = self.__SetDBChannel__(user, password, database, host, port, group)
+    @property
+    def cursor(self):
+        """ Cursor of the connection to the database of the current thread """
+        conns = getattr(DSQuery._local, "conns", None)
+        if conns is None: return self._cursor
+        return self._get_thread_connection(conns)[1]
+
+    @cursor.setter
+    def cursor(self, cursor):
+        self._cursor = cursor
+
+    def get_connection(self):
+        """ Connection to the database used in the current thread """
+        conns = getattr(DSQuery._local, "conns", None)
+        if conns is None: return DSQuery.db_conn_pool[self.database]
+        return self._get_thread_connection(conns)[0]
+
+    def _get_thread_connection(self, conns):
+        """ (connection, cursor) of the current thread, opened the first time """
+        if self.database not in conns:
+            db = self.__SetDBChannel__(self.user, self.password, self.database,
+                                       self.host, self.port, self.group)
+            cursor = db.cursor()
+            cursor.execute("SET NAMES 'utf8'")
+            conns[self.database] = (db, cursor)
+        return conns[self.database]
 
-        self.create_indexes()
+    @staticmethod
+    def use_thread_connections():
+        """ Use own connections in the current thread, not the pool ones """
+        DSQuery._local.conns = {}
+
+    @staticmethod
+    def uses_thread_connections():
+        return getattr(DSQuery._local, "conns", None) is not None
+
+    @staticmethod
+    def check_thread_connections():
+        """ Use own connections in the threads other than the main one """
+        if DSQuery.uses_thread_connections(): return
+        if threading.current_thread().name != "MainThread":
+            DSQuery.use_thread_connections()
+
+    @staticmethod
+    def reset_db_conn_pool():
+        """ Use new connections in a forked process
+
+            The connections of the parent are kept referenced but never
+            used, so they are not closed from the child process.
+        """
+        DSQuery.inherited_conns += DSQuery.db_conn_pool.values()
+        DSQuery.db_conn_pool = {}
 
     def create_indexes(self):
         """ Basic indexes used in each data source """
-        pass
+        if DSQuery.index_manager is not None:
+            DSQuery.index_manager.ensure(self)
+
+    def get_identities_checksum(self):
+        """ Checksum of the tables with the uuid and organizations of people """
+        q = "CHECKSUM TABLE people_uidentities, " + self.identities_db + ".enrollments"
+        checksum = DSQuery._fetch_result(self.cursor, q)['Checksum']
+        if not isinstance(checksum, list): checksum = [checksum]
+        return str(checksum)
+
+    @staticmethod
+    def set_activity_cubes(active):
+        """ Answer the metrics covered by the activity cubes from them """
+        if active: DSQuery.activity_cubes = {}
+        else: DSQuery.activity_cubes = None
+
+    def refresh_activity_cube(self):
+        """ Refresh the activity cube of the database, once per run """
+        if DSQuery.activity_cubes is None or self.activity_cube is None: return
+        if self.database in DSQuery.activity_cubes: return
+        cube = self.activity_cube(self)
+        try:
+            cube.refresh()
+        except Exception, e:
+            logging.warning("Can not refresh the activity cube of %s: %s" % (self.database, str(e)))
+            cube = None
+        DSQuery.activity_cubes[self.database] = cube
+
+    def GetSQLCube(self, aliases, mfilter, evolutionary):
+        """ Query for the fields aliases of a metric from the activity cube,
+            or None if the cube does not cover it """
+        if DSQuery.activity_cubes is None: return None
+        cube = DSQuery.activity_cubes.get(self.database)
+        if cube is None: return None
+        return cube.get_sql(self, aliases, mfilter, evolutionary)
+
+    @staticmethod
+    def set_index_manager(manager):
+        """ Activate an IndexManager for the indexes of all data sources """
+        DSQuery.index_manager = manager
+
+    @staticmethod
+    def get_index_manager():
+        return DSQuery.index_manager
 
     @classmethod
     def GetSQLGlobal(cls, date, fields, tables, filters, start, end, all_items = None):
@@ -101,12 +345,15 @@ class DSQuery(object):
 
         iso_8601_mode = 3
         if (period == 'day'):
-            # Remove time so unix timestamp is start of day    
-            fields = 'UNIX_TIMESTAMP(DATE('+date+')) AS unixtime'
+            # Start of the day in UTC, as the completed periods, whatever the
+            # time zone of the session
+            fields = "TIMESTAMPDIFF(SECOND,'1970-01-01',DATE("+date+")) AS unixtime"
         elif (period == 'week'):
             fields = 'YEARWEEK('+date+','+str(iso_8601_mode)+') AS week'
         elif (period == 'month'):
             fields = 'YEAR('+date+')*12+MONTH('+date+') AS month'
+        elif (period == 'quarter'):
+            fields = 'YEAR('+date+')*4+QUARTER('+date+') AS quarter'
         elif (period == 'year'):
             fields = 'YEAR('+date+')*12 AS year'
         else:
@@ -143,6 +390,9 @@ class DSQuery(object):
         elif (period == 'month'):
             sql += group_by + ' YEAR('+date+'),MONTH('+date+')'
             sql += ' ORDER BY YEAR('+date+'),MONTH('+date+')'
+        elif (period == 'quarter'):
+            sql += group_by + ' YEAR('+date+'),QUARTER('+date+')'
+            sql += ' ORDER BY YEAR('+date+'),QUARTER('+date+')'
         elif (period == 'week'):
             sql += group_by + ' YEARWEEK('+date+','+str(iso_8601_mode)+')'
             sql += ' ORDER BY YEARWEEK('+date+','+str(iso_8601_mode)+')'
@@ -155,6 +405,224 @@ class DSQuery(object):
 
         return(sql)
 
+    @staticmethod
+    def _split_top_level(text, separator):
+        """ Split text using separator only outside parenthesis """
+        items = []
+        depth = 0
+        quote = None
+        last = 0
+        i = 0
+        while i < len(text):
+            char = text[i]
+            if quote is not None:
+                if char == quote: quote = None
+            elif char in ("'", '"'): quote = char
+            elif char == '(': depth += 1
+            elif char == ')': depth -= 1
+            elif depth == 0 and text[i:i+len(separator)].upper() == separator:
+                items.append(text[last:i])
+                last = i + len(separator)
+                i = last
+                continue
+            i += 1
+        items.append(text[last:])
+        return items
+
+    @staticmethod
+    def _split_select(sql):
+        """ Split a SELECT query in the list of fields and the rest of it.
+            The rest starts in the FROM clause. Returns None if not supported """
+        sql = sql.strip()
+        if not sql.upper().startswith("SELECT "): return None
+        parts = DSQuery._split_top_level(sql[len("SELECT "):], " FROM ")
+        if len(parts) < 2: return None
+        fields = [field.strip() for field in DSQuery._split_top_level(parts[0], ",")]
+        rest = " FROM " + " FROM ".join(parts[1:])
+        return (fields, rest)
+
+    @staticmethod
+    def GetSQLTrends(sql, startdate, enddate, field, windows):
+        """ Convert an aggregated query for field between startdate and enddate
+            in a conditional aggregation query with a column per window.
+
+            windows is a list of (alias, start, end), all of them inside
+            startdate and enddate. Only queries with one COUNT or SUM field
+            built with GetSQLGlobal are supported. None is returned otherwise.
+        """
+        if sql.count(startdate) != 1 or sql.count(enddate) != 1: return None
+        select = DSQuery._split_select(sql)
+        if select is None: return None
+        (fields, rest) = select
+
+        # Date window added by GetSQLGlobal
+        window = re.search(" WHERE ([^<>=]+)>=" + re.escape(startdate) +
+                           " AND \\1<" + re.escape(enddate), rest)
+        if window is None: return None
+        date = window.group(1)
+
+        # GROUP BY queries for all items order by the metric field
+        tail = DSQuery._split_top_level(rest, " ORDER BY ")
+        if len(tail) > 2: return None
+        rest = tail[0]
+        if re.search(" (LIMIT|HAVING) ", rest, re.IGNORECASE): return None
+
+        agg_re = re.compile("^(count|sum)\\s*\\((\\s*distinct(?=[\\s(])\\s*)?(.*)\\)\\s+as\\s+" +
+                            re.escape(field) + "$", re.IGNORECASE | re.DOTALL)
+        metric = [f for f in fields if agg_re.match(f)]
+        others = [f for f in fields if not agg_re.match(f)]
+        if len(metric) != 1: return None
+        if len(others) > 0 and " GROUP BY " not in rest: return None
+        if len(others) > 1: return None
+
+        (func, distinct, expr) = agg_re.match(metric[0]).groups()
+        if len(DSQuery._split_top_level(expr, ",")) > 1: return None
+        # The aggregate function must be the whole field
+        depth = 0
+        for char in expr:
+            if char == '(': depth += 1
+            elif char == ')': depth -= 1
+            if depth < 0: return None
+        if depth != 0: return None
+        if expr.strip() == "*": expr = "1"
+        if distinct is None: distinct = ""
+        else: distinct = "DISTINCT "
+
+        trend_fields = others
+        for (alias, start, end) in windows:
+            condition = date + ">=" + start + " AND " + date + "<" + end
+            trend_fields.append("%s(%sCASE WHEN %s THEN %s END) AS %s" %
+                                (func, distinct, condition, expr, alias))
+
+        return "SELECT " + ", ".join(trend_fields) + rest
+
+    _aggregate_field = re.compile("^(count|sum|avg|min|max)\\s*\\(.*\\)\\s+as\\s+(\\w+)$",
+                                  re.IGNORECASE | re.DOTALL)
+
+    @staticmethod
+    def _get_sql_signature(rest):
+        """ FROM, WHERE and GROUP BY of rest without the order of the
+            tables and of the AND conditions """
+        group = DSQuery._split_top_level(rest, " GROUP BY ")
+        if len(group) > 2: return None
+        where = DSQuery._split_top_level(group[0], " WHERE ")
+        if len(where) > 2: return None
+        tables = DSQuery._split_top_level(where[0].strip()[len("FROM "):], ",")
+        signature = [tuple(sorted([table.strip() for table in tables]))]
+        if len(where) == 2:
+            conditions = [where[1]]
+            if len(DSQuery._split_top_level(where[1], " OR ")) == 1:
+                conditions = DSQuery._split_top_level(where[1], " AND ")
+            signature.append(tuple(sorted([c.strip() for c in conditions])))
+        signature.append(tuple([g.strip() for g in group[1:]]))
+        return tuple(signature)
+
+    @staticmethod
+    def GetSQLFusionParts(sql):
+        """ Parts of sql used to fuse it with queries with the same
+            FROM, WHERE and GROUP BY: (signature, fields, rest, order).
+            fields are the aggregate fields, with an alias, of the query,
+            the signature includes the rest of fields and rest is the
+            query from the FROM clause without the ORDER BY. None is
+            returned if the query can not be fused.
+        """
+        select = DSQuery._split_select(sql)
+        if select is None: return None
+        (fields, rest) = select
+        if re.search(" (LIMIT|HAVING|UNION|INTO) ", rest, re.IGNORECASE): return None
+
+        tail = DSQuery._split_top_level(rest, " ORDER BY ")
+        if len(tail) > 2: return None
+        order = None
+        if len(tail) == 2: order = tail[1].strip()
+
+        metric = [f for f in fields if DSQuery._aggregate_field.match(f)]
+        others = [f for f in fields if not DSQuery._aggregate_field.match(f)]
+        if len(metric) == 0: return None
+        if len(others) > 0 and " GROUP BY " not in rest.upper(): return None
+
+        signature = DSQuery._get_sql_signature(tail[0])
+        if signature is None: return None
+        return ((tuple(others), signature), metric, tail[0], order)
+
+    @staticmethod
+    def GetSQLFieldAlias(field):
+        """ Alias of an aggregate field from GetSQLFusionParts """
+        return DSQuery._aggregate_field.match(field).group(2)
+
+    @staticmethod
+    def GetSQLFused(signature, fields, rest, order):
+        """ Query with the fields of several queries with the same
+            signature from GetSQLFusionParts """
+        sql = "SELECT " + ", ".join(list(signature[0]) + fields) + rest
+        if order is not None: sql += " ORDER BY " + order
+        return sql
+
+    @staticmethod
+    def GetSQLRollup(sql):
+        """ Convert an evolutionary query built with GetSQLPeriod, without
+            all items, in a WITH ROLLUP query. The last row of its results
+            has a NULL period and the values for the whole time range.
+
+            Returns (rollup_sql, period alias) or None if not supported.
+        """
+        select = DSQuery._split_select(sql)
+        if select is None: return None
+        (fields, rest) = select
+        if re.search(" (LIMIT|HAVING|UNION|INTO|ROLLUP) ", rest + " ", re.IGNORECASE):
+            return None
+        period = re.match("^(.*)\s+as\s+(\w+)$", fields[0], re.IGNORECASE | re.DOTALL)
+        if period is None or DSQuery._aggregate_field.match(fields[0]): return None
+        if len(fields) < 2: return None
+        for field in fields[1:]:
+            if not DSQuery._aggregate_field.match(field): return None
+        parts = DSQuery._split_top_level(rest, " GROUP BY ")
+        if len(parts) != 2: return None
+
+        # The expression, a GROUP BY alias could be resolved to a column
+        sql = "SELECT " + ", ".join(fields) + parts[0]
+        sql += " GROUP BY " + period.group(1).strip() + " WITH ROLLUP"
+        return (sql, period.group(2))
+
+    @staticmethod
+    def GetSQLPeriodSince(sql, startdate, enddate, since):
+        """ Query built with GetSQLPeriod for startdate and enddate only
+            for the periods from since. The dates range is the only
+            condition changed, startdate is kept in the other ones.
+
+            Returns None if the dates range is not found in sql.
+        """
+        dates = re.compile(" WHERE (.+?)>=" + re.escape(startdate) +
+                           " AND \\1<" + re.escape(enddate), re.DOTALL)
+        if len(dates.findall(sql)) != 1: return None
+        return dates.sub(lambda m: " WHERE " + m.group(1) + ">=" + startdate + " AND " +
+                         m.group(1) + ">=" + since + " AND " + m.group(1) + "<" + enddate,
+                         sql)
+
+    @staticmethod
+    def GetSQLRollupTotal(sql):
+        """ Aggregated query for the total row of GetSQLRollup(sql) """
+        (fields, rest) = DSQuery._split_select(sql)
+        return "SELECT " + ", ".join(fields[1:]) + DSQuery._split_top_level(rest, " GROUP BY ")[0]
+
+    @staticmethod
+    def split_rollup(result, period):
+        """ Results of a GetSQLRollup query as the results of the original
+            query and of its total query, the latter None if not available """
+        if (len(result) == 0 or not isinstance(result[period], list) or
+            len(result[period]) == 0 or result[period][-1] is not None):
+            # Without rows there is no total row
+            return (result, None)
+        ts = {}
+        total = {}
+        for (column, values) in result.items():
+            ts[column] = values[0:-1]
+            if column != period: total[column] = values[-1]
+        if len(ts[period]) == 1:
+            # ExecuteQuery returns values for only one row
+            for column in ts: ts[column] = ts[column][0]
+        return (ts, total)
+
     def _get_fields_query(self, fields):
         # Returns a string with fields separated by ","
         fields_str = ""
@@ -222,30 +690,155 @@ class DSQuery(object):
 
         return db
 
-    def ExecuteQuery (self, sql):
-        if sql is None: return {}
-        # print sql
+    @staticmethod
+    def set_query_cache(cache):
+        """ Activate a QueryCache for the results of all queries """
+        DSQuery.query_cache = cache
+
+    @staticmethod
+    def get_query_cache():
+        return DSQuery.query_cache
+
+    @staticmethod
+    def set_query_profile(profile):
+        """ Activate a QueryProfile recording all queries """
+        DSQuery.query_profile = profile
+
+    @staticmethod
+    def get_query_profile():
+        return DSQuery.query_profile
+
+    @staticmethod
+    def _count_rows(result):
+        if len(result) == 0: return 0
+        value = result.values()[0]
+        if isinstance(value, list): return len(value)
+        return 1
+
+    @staticmethod
+    def execute_cursor_query(cursor, database, sql):
+        """ Execute sql in cursor and return a dict with the columns values """
+        start = time.time()
+        cache = DSQuery.query_cache
+        result = None
+        if cache is not None:
+            result = cache.get(cursor, database, sql)
+        cached = result is not None
+
+        if not cached:
+            result = DSQuery._fetch_result(cursor, sql)
+            if cache is not None:
+                cache.put(cursor, database, sql, result)
+
+        if DSQuery.query_profile is not None:
+            DSQuery.query_profile.record(cursor, database, sql, time.time() - start,
+                                         DSQuery._count_rows(result), cached)
+        return result
+
+    @staticmethod
+    def _fetch_result(cursor, sql):
         result = {}
-        self.cursor.execute(sql)
-        rows = self.cursor.rowcount
-        columns = self.cursor.description
+        cursor.execute(sql)
+        rows = cursor.rowcount
+        columns = cursor.description
 
         if columns is None: return result
 
         for column in columns:
             result[column[0]] = []
         if rows > 1:
-            for value in self.cursor.fetchall():
-                for (index,column) in enumerate(value):
-                    result[columns[index][0]].append(column)
+            # Transpose the rows to get the columns values
+            values = zip(*cursor.fetchall())
+            for (index, column) in enumerate(columns):
+                result[column[0]] = list(values[index])
         elif rows == 1:
-            value = self.cursor.fetchone()
+            value = cursor.fetchone()
             for i in range (0, len(columns)):
                 result[columns[i][0]] = value[i]
         return result
 
+    @staticmethod
+    def execute_cursor_frame(cursor, database, sql):
+        """ Execute sql in cursor and return a ResultFrame with the columns """
+        from vizgrimoire.result_frame import ResultFrame
+
+        if sql is None: return ResultFrame([], {})
+        start = time.time()
+        cache = DSQuery.query_cache
+        # Frames and dicts are different entries in the cache
+        cache_sql = sql + " /* frame */"
+        result = None
+        if cache is not None:
+            result = cache.get(cursor, database, cache_sql)
+        cached = result is not None
+
+        if not cached:
+            cursor.execute(sql)
+            if cursor.description is None:
+                result = ResultFrame([], {})
+            else:
+                result = ResultFrame.from_rows(cursor.description, cursor.fetchall())
+            if cache is not None:
+                cache.put(cursor, database, cache_sql, result)
+
+        if DSQuery.query_profile is not None:
+            DSQuery.query_profile.record(cursor, database, sql, time.time() - start,
+                                         len(result), cached)
+        return result
+
+    def ExecuteQuery (self, sql):
+        if sql is None: return {}
+        # print sql
+        return DSQuery.execute_cursor_query(self.cursor, self.database, sql)
+
+    def ExecuteQueryFrame (self, sql):
+        """ ExecuteQuery returning a ResultFrame """
+        return DSQuery.execute_cursor_frame(self.cursor, self.database, sql)
+
+    def ExecuteQueryStream (self, sql, chunk_size = None):
+        """ Execute sql in a server side cursor and yield the rows in chunks
+
+            Each chunk is a dict with the list of values of each column,
+            with chunk_size rows at most. Results are not cached. Other
+            queries can not be executed in the same database until all
+            chunks are read.
+        """
+        if sql is None: return
+        if chunk_size is None: chunk_size = DSQuery.stream_chunk_size
+
+        start = time.time()
+        nrows = 0
+        db = self.get_connection()
+        cursor = db.cursor(MySQLdb.cursors.SSCursor)
+        try:
+            cursor.execute(sql)
+            if cursor.description is None: return
+            columns = [column[0] for column in cursor.description]
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows: break
+                nrows += len(rows)
+                values = zip(*rows)
+                chunk = {}
+                for (index, column) in enumerate(columns):
+                    chunk[column] = list(values[index])
+                yield chunk
+        finally:
+            # Pending rows are read and discarded
+            cursor.close()
+            if DSQuery.query_profile is not None:
+                # Time includes the processing of the chunks
+                DSQuery.query_profile.record(self.cursor, self.database, sql,
+                                             time.time() - start, nrows)
+
     def ExecuteViewQuery(self, sql):
+        start = time.time()
         self.cursor.execute(sql)
+        if DSQuery.query_cache is not None:
+            DSQuery.query_cache.invalidate(self.database)
+        if DSQuery.query_profile is not None:
+            DSQuery.query_profile.record(self.cursor, self.database, sql,
+                                         time.time() - start, 0)
 
     def get_subprojects(self, project):
         """ Return all subprojects ids for a project in a string join by comma """
@@ -429,6 +1022,17 @@ class DSQuery(object):
 class SCMQuery(DSQuery):
     """ Specific query builders for source code management system data source """
 
+    indexes = [("scmlog", ["author_date", "author_id"]),
+               ("actions", ["commit_id"]),
+               ("commits_lines", ["commit_id"]),
+               ("people_uidentities", ["people_id"])]
+    activity_cube = SCMActivityCube
+    watermarks = [(["scmlog s"], [], "s.id", ["s.date", "s.author_date"]),
+                  (["actions a", "scmlog s"], ["a.commit_id = s.id"], "a.id",
+                   ["s.date", "s.author_date"]),
+                  (["commits_lines cl", "scmlog s"], ["cl.commit_id = s.id"], "cl.id",
+                   ["s.date", "s.author_date"])]
+
     def GetSQLRepositoriesFrom (self):
         """ Tables needed for repository studies
 
@@ -944,6 +1548,16 @@ class SCMQuery(DSQuery):
 
 class ITSQuery(DSQuery):
     """ Specific query builders for issue tracking system data source """
+
+    indexes = [("issues", ["submitted_on"]),
+               ("changes", ["issue_id", "field", "changed_on"]),
+               ("changes", ["changed_on"]),
+               ("people_uidentities", ["people_id"])]
+    activity_cube = ITSActivityCube
+    watermarks = [(["issues i"], [], "i.id", ["i.submitted_on"]),
+                  (["changes ch"], [], "ch.id", ["ch.changed_on"]),
+                  (["comments c"], [], "c.id", ["c.submitted_on"])]
+
     def GetSQLRepositoriesFrom (self):
         # tables necessary for repositories 
         tables = Set([])
@@ -1194,6 +1808,29 @@ class ITSQuery(DSQuery):
 
         return where
 
+    def GetSQLItemsLastDate (self, mfilters):
+        """ Queries for the date of the last submission and of the last
+            change of the issues of each item of mfilters.type_analysis """
+        fields = Set(["DATE_FORMAT(MAX(i.submitted_on),'%Y-%m-%d') as last_date"])
+        tables = Set(["issues i"])
+        tables.union_update(self.GetSQLReportFrom(mfilters))
+        filters = self.GetSQLReportWhere(mfilters, "issues")
+        submitted = self.BuildQuery(mfilters.period, mfilters.startdate, mfilters.enddate,
+                                    " i.submitted_on ", fields, tables, filters, False,
+                                    mfilters.type_analysis)
+
+        # Changes as in the changed metric
+        fields = Set(["DATE_FORMAT(MAX(ch.changed_on),'%Y-%m-%d') as last_date"])
+        tables = Set(["issues i", "changes ch"])
+        tables.union_update(self.GetSQLReportFrom(mfilters))
+        filters = Set(["i.id = ch.issue_id"])
+        filters.union_update(self.GetSQLReportWhere(mfilters))
+        changed = self.BuildQuery(mfilters.period, mfilters.startdate, mfilters.enddate,
+                                  " ch.changed_on ", fields, tables, filters, False,
+                                  mfilters.type_analysis)
+        changed = changed.replace("i.submitted", "ch.changed")
+        return [submitted, changed]
+
     def GetSQLIssuesStudies (self, mfilters, type_analysis, evolutionary, study):
 
         period = mfilters.period
@@ -1294,6 +1931,13 @@ class ITSQuery(DSQuery):
 
 class MLSQuery(DSQuery):
     """ Specific query builders for mailing lists data source """
+
+    indexes = [("messages", ["first_date", "is_response_of"]),
+               ("messages", ["mailing_list_url"]),
+               ("messages_people", ["message_id"]),
+               ("people_uidentities", ["people_id"])]
+    activity_cube = MLSActivityCube
+
     def GetSQLRepositoriesFrom (self):
         # tables necessary for repositories
         #return (" messages m ") 
@@ -1592,6 +2236,19 @@ class MLSQuery(DSQuery):
 class SCRQuery(DSQuery):
     """ Specific query builders for source code review source"""
 
+    indexes = [("issues", ["submitted_on"]),
+               ("changes", ["issue_id", "field", "changed_on"]),
+               ("changes", ["changed_on"]),
+               ("issues_ext_gerrit", ["issue_id"]),
+               ("people_uidentities", ["people_id"])]
+    activity_cube = SCRActivityCube
+    watermarks = [(["issues i"], [], "i.id", ["i.submitted_on"]),
+                  (["changes ch"], [], "ch.id", ["ch.changed_on"]),
+                  (["comments c"], [], "c.id", ["c.submitted_on"])]
+    # The status of the reviews is updated in place, and the time series
+    # filtered by status change in the periods of their submission
+    incremental_ts = False
+
     def GetSQLRepositoriesFrom (self):
         #tables necessaries for repositories
         tables = Set([])
@@ -2254,6 +2911,98 @@ class SCRQuery(DSQuery):
 
         return sql_reviews_closed
 
+    def GetReviewsBacklogSQL (self, mfilter):
+        """ Reviews submitted between the dates of mfilter, to replay
+            their events in a backlog. All items queries also return the
+            item of each review.
+        """
+        fields = Set([])
+        tables = Set([])
+        filters = Set([])
+
+        fields.add("i.id as issue_id")
+        fields.add("i.submitted_on as submitted_on")
+        fields = self._get_fields_query(fields)
+        all_items = self.get_all_items(mfilter.type_analysis)
+        if all_items:
+            fields = self.get_group_field(all_items) + ", " + fields
+
+        tables.add("issues i")
+        tables.union_update(self.GetSQLReportFrom(mfilter))
+
+        filters.add("i.submitted_on >= " + mfilter.startdate)
+        filters.add("i.submitted_on < " + mfilter.enddate)
+        filters.union_update(self.GetSQLReportWhere(mfilter,"issues"))
+
+        q = "SELECT " + fields
+        q += " FROM " + self._get_tables_query(tables)
+        q += " WHERE " + self._get_filters_query(filters)
+        return q
+
+    def GetReviewsBacklogClosedSQL (self, mfilter):
+        """ Closing date of the merged and abandoned reviews submitted
+            between the dates of mfilter, as in get_sql_reviews_closed
+        """
+        q = """
+            SELECT i.id as issue_id, MIN(ie.mod_date) as closed_on
+            FROM issues i, issues_ext_gerrit ie
+            WHERE i.submitted_on >= %s AND i.submitted_on < %s
+            AND i.id = ie.issue_id
+            AND (status='MERGED' OR status='ABANDONED')
+            GROUP BY i.id
+        """ % (mfilter.startdate, mfilter.enddate)
+        return q
+
+    def GetReviewsBacklogPatchsetsSQL (self, mfilter):
+        """ Date of the first change of each patchset of the reviews
+            submitted between the dates of mfilter, and whether it has a
+            negative review as in get_sql_reviews_reviewed
+        """
+        q = """
+            SELECT c.issue_id as issue_id,
+                   CAST(c.old_value as UNSIGNED) as patchset,
+                   MIN(c.changed_on) as changed_on,
+                   MAX((c.field = 'Code-Review' OR c.field = 'Verified')
+                       AND (c.new_value = -1 OR c.new_value = -2)) as reviewed
+            FROM changes c, issues i
+            WHERE c.issue_id = i.id
+            AND i.submitted_on >= %s AND i.submitted_on < %s
+            AND c.old_value<>'' AND c.old_value<>'None'
+            GROUP BY c.issue_id, patchset
+        """ % (mfilter.startdate, mfilter.enddate)
+        return q
+
+    def GetWaiting4ReviewerChangesSQL (self, mfilter):
+        """ Changes of the patchsets of new reviews until the end date of
+            mfilter, in the order used to get their last change in
+            GetWaiting4ReviewerSQL
+        """
+        fields = Set([])
+        tables = Set([])
+        filters = Set([])
+
+        fields.add("c.id as id")
+        fields.add("c.issue_id as issue_id")
+        fields.add("c.old_value as patchset")
+        fields.add("c.changed_on as changed_on")
+        fields.add("""((c.field='CRVW' or c.field='Code-Review' or c.field='Verified' or c.field='VRIF')
+                       and (c.new_value=1 or c.new_value=2)) as waiting""")
+
+        tables.add("changes c")
+        tables.add("issues i")
+        tables.union_update(self.GetSQLReportFrom(mfilter))
+
+        filters.add("i.id = c.issue_id")
+        filters.add("i.status='NEW'")
+        filters.add("c.changed_on < " + mfilter.enddate)
+        filters.union_update(self.GetSQLReportWhere(mfilter,"issues"))
+
+        q = "SELECT " + self._get_fields_query(fields)
+        q += " FROM " + self._get_tables_query(tables)
+        q += " WHERE " + self._get_filters_query(filters)
+        q += " ORDER BY c.id"
+        return q
+
     def GetPeopleQuerySubmissions (self, developer_id, period, startdate, enddate, evol):
         fields = "COUNT(i.id) AS submissions"
         tables = self._get_tables_query(self.GetTablesOwnUniqueIds('issues'))
@@ -2407,6 +3156,9 @@ class SCRQuery(DSQuery):
         return filters
 
 class IRCQuery(DSQuery):
+    indexes = [("irclog", ["date"]),
+               ("irclog", ["channel_id"])]
+    watermarks = [(["irclog i"], [], "i.id", ["i.date"])]
 
     def GetSQLRepositoriesFrom (self):
         # tables necessary for repositories
@@ -2609,6 +3361,8 @@ class IRCQuery(DSQuery):
         return where
 
 class MediawikiQuery(DSQuery):
+    indexes = [("wiki_pages_revs", ["date"])]
+    watermarks = [(["wiki_pages_revs pr"], [], "pr.id", ["pr.date"])]
 
     def GetSQLPeople2Where(self, name = None):
         # filters necessary to organizations analysis
@@ -2669,30 +3423,11 @@ class MediawikiQuery(DSQuery):
 class QAForumsQuery(DSQuery):
     """ Specific query builders for question and answer platforms """
 
-    def create_indexes(self):
-        try:
-            q = "create index q_id_a_idx on answers (question_identifier)"
-            self.ExecuteQuery(q)
-        except Exception:
-            pass
-            # logging.info("Indexes for QAForums already created")
-            # import traceback
-            # traceback.print_exc(file=sys.stdout)
-        try:
-            q = "create index q_id_qt_idx on questionstags (question_identifier)"
-            self.ExecuteQuery(q)
-        except:
-            pass
-        try:
-            q = "create index tag_id_qt_idx on questionstags (question_identifier)"
-            self.ExecuteQuery(q)
-        except:
-            pass
-        try:
-            q = "create index tag_idx_t on tags (tag)"
-            self.ExecuteQuery(q)
-        except:
-            pass
+    indexes = [("answers", ["question_identifier"]),
+               ("questions", ["added_at"]),
+               ("questionstags", ["question_identifier"]),
+               ("questionstags", ["tag_id"]),
+               ("tags", ["tag"])]
 
     def GetSQLReportFrom(self, type_analysis):
         # generic function to generate "from" clauses
@@ -2974,6 +3709,9 @@ class ReleasesDSQuery(DSQuery):
 
 
 class PullpoQuery(DSQuery):
+    indexes = [("pull_requests", ["created_at"]),
+               ("pull_requests", ["closed_at"]),
+               ("people_uidentities", ["people_id"])]
 
     def GetSQLRepositoriesFrom (self):
         # tables necessary for repositories
@@ -3130,9 +3868,12 @@ class PullpoQuery(DSQuery):
                             filters, evolutionary, type_analysis)
         return q
 
-    def GetTimeToSQL(self, metric_filters, closed_field, metric_name):
+    def GetTimeToSQL(self, metric_filters, closed_field, metric_name, date_alias = None):
         """ This function returns the query to count "time to" a specific state
             from the moment where the pull request was uploaded to GitHub
+
+            If date_alias is given, the date of the state is also returned
+            in that column as a 'YYYY-MM-DD hh:mm:ss' string.
         """
 
         fields = Set([])
@@ -3140,6 +3881,8 @@ class PullpoQuery(DSQuery):
         filters = Set([])
 
         fields.add("TIMESTAMPDIFF(SECOND, created_at, "+ closed_field  +") as " + metric_name)
+        if date_alias is not None:
+            fields.add("DATE_FORMAT(" + closed_field + ", '%Y-%m-%d %H:%i:%s') as " + date_alias)
 
         tables.add("pull_requests pr")
         tables.union_update(self.GetSQLReportFrom(metric_filters.type_analysis))
@@ -3151,20 +3894,20 @@ class PullpoQuery(DSQuery):
                                 tables, filters, False)
         return query
 
+    @staticmethod
+    def _get_timeto_fields(actionto):
+        """ Date field, metric name and metric value for actionto """
+        if actionto == "closed":
+            return ("closed_at", "closedtime", "close")
+        elif actionto == "merged":
+            return ("merged_at", "mergedtime", "merge")
+        raise Exception("'actionto' not supported")
+
     def GetTimeToAgg(self, metric_filters, actionto):
         """ This function provides final aggregated data based on actionto value
         """
 
-        if actionto == "closed":
-            closed_field = "closed_at"
-            metric_name = "closedtime"
-            value = "close"
-        elif actionto == "merged":
-            closed_field = "merged_at"
-            metric_name = "mergedtime"
-            value = "merge"
-        else:
-            raise Exception("'actionto' not supported")
+        (closed_field, metric_name, value) = self._get_timeto_fields(actionto)
 
         #Building the query
         timeto_sql = self.GetTimeToSQL(metric_filters, closed_field, metric_name)
@@ -3186,20 +3929,9 @@ class PullpoQuery(DSQuery):
         return agg_data
 
 
-    def GetTimeToTimeSeriesData(self, metric_filters, actionto):
-        """ This function provides final time serie about a final 'actionto' value
-
-            Pull Requests typically are either merged or closed. This function simply
-            allows to avoid repeating the same code for the classes TimeToMerge and
-            TimeToClose
-        """
-        #TODO: this function is not exactly a query builder. This should be moved to
-        #      some other place to deal with data handler generators.
-
-        fields = Set([])
-        tables = Set([])
-        filters = Set([])
-
+    @staticmethod
+    def _get_timeto_periods(metric_filters):
+        """ Time series dates and the limits of its periods as SQL dates """
         data = genDates(metric_filters.period,
                         metric_filters.startdate,
                         metric_filters.enddate)
@@ -3211,9 +3943,72 @@ class PullpoQuery(DSQuery):
         periods = list(data['unixtime'])
         periods.append(last_date)
 
-        startdate = "'" + datetime.datetime.fromtimestamp(int(periods[0])).strftime('%Y-%m-%d %H:%M:%S') + "'"
-        for p in periods[1:]:
-            enddate = "'" + datetime.datetime.fromtimestamp(int(p)).strftime('%Y-%m-%d %H:%M:%S') + "'"
+        limits = [datetime.datetime.fromtimestamp(int(p)).strftime('%Y-%m-%d %H:%M:%S')
+                  for p in periods]
+        return (data, limits)
+
+    def GetTimeToTimeSeriesData(self, metric_filters, actionto):
+        """ This function provides final time serie about a final 'actionto' value
+
+            Pull Requests typically are either merged or closed. This function simply
+            allows to avoid repeating the same code for the classes TimeToMerge and
+            TimeToClose
+
+            The times of all the periods are read in a single query and the
+            statistics of each period are computed at once with DHESAPeriods.
+            The result is the same as GetTimeToTimeSeriesDataByPeriod.
+        """
+        (data, limits) = PullpoQuery._get_timeto_periods(metric_filters)
+        if len(limits) < 2: return data
+        if limits != sorted(limits) or self.get_all_items(metric_filters.type_analysis):
+            return self.GetTimeToTimeSeriesDataByPeriod(metric_filters, actionto)
+
+        (closed_field, metric_name, value) = self._get_timeto_fields(actionto)
+        date_alias = metric_name + "_date"
+        mfilters = metric_filters.copy()
+        mfilters.startdate = "'" + limits[0] + "'"
+        mfilters.enddate = "'" + limits[-1] + "'"
+        timeto_sql = self.GetTimeToSQL(mfilters, closed_field, metric_name, date_alias)
+        times = self.ExecuteQuery(timeto_sql)
+
+        dates = times.get(date_alias, [])
+        values = times.get(metric_name, [])
+        if not isinstance(values, list):
+            dates = [dates]
+            values = [values]
+        # Period of each pull request: the last limit not after its date
+        nperiods = len(limits) - 1
+        periods = np.searchsorted(np.array(limits, dtype='S19'),
+                                  np.array(dates, dtype='S19'), side = 'right') - 1
+        stats_data = DHESAPeriods(periods, values, nperiods)
+
+        to_days = 3600*24
+        median = []
+        mean = []
+        for i in range(0, nperiods):
+            # GetTimeToAgg does not compute statistics for a single pull request
+            if stats_data.data["count"][i] < 2:
+                median.append(0.0)
+                mean.append(0.0)
+            else:
+                median.append(round(stats_data.data["median"][i] / to_days, 2))
+                mean.append(round(stats_data.data["mean"][i] / to_days, 2))
+        data["timeto_"+value+"_median"] = median
+        data["timeto_"+value+"_avg"] = mean
+
+        return data
+
+    def GetTimeToTimeSeriesDataByPeriod(self, metric_filters, actionto):
+        """ GetTimeToTimeSeriesData with a GetTimeToAgg query for each period
+        """
+        #TODO: this function is not exactly a query builder. This should be moved to
+        #      some other place to deal with data handler generators.
+
+        (data, limits) = PullpoQuery._get_timeto_periods(metric_filters)
+
+        startdate = "'" + limits[0] + "'"
+        for limit in limits[1:]:
+            enddate = "'" + limit + "'"
             mfilters = metric_filters.copy()
             mfilters.startdate = startdate
             mfilters.enddate = enddate
@@ -3233,6 +4028,7 @@ class PullpoQuery(DSQuery):
 
 
 class EventizerQuery(DSQuery):
+    indexes = [("events", ["local_time"])]
 
     # Groups conditions
     def GetSQLGroupsFrom(self):
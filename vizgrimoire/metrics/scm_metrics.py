@@ -108,6 +108,9 @@ class Commits(Metrics):
     data_source = SCM
 
     def _get_sql(self, evolutionary):
+        query = self.db.GetSQLCube(["commits"], self.filters, evolutionary)
+        if query is not None: return query
+
         fields = Set([])
         tables = Set([])
         filters = Set([])
@@ -402,10 +405,7 @@ class People(Metrics):
             authors = Authors(self.db, self.filters)
             q = authors._get_sql(evolutionary)
         else:
-            afilters = authors.filters
-            authors.filters = self.filters
-            q = authors._get_sql(evolutionary)
-            authors.filters = afilters
+            q = authors.with_filters(self.filters)._get_sql(evolutionary)
         return q
 
     def _get_top_global (self, days = 0, metric_filters = None):
@@ -416,10 +416,7 @@ class People(Metrics):
             authors = Authors(self.db, self.filters)
             top = authors._get_top_global(days, metric_filters)
         else:
-            afilters = authors.filters
-            authors.filters = self.filters
-            top = authors._get_top_global(days, metric_filters)
-            authors.filters = afilters
+            top = authors.with_filters(self.filters)._get_top_global(days, metric_filters)
         top['name'] = top.pop('authors')
         return top
 
@@ -505,6 +502,9 @@ class Lines(Metrics):
     data_source = SCM
 
     def _get_sql(self, evolutionary):
+        query = self.db.GetSQLCube(["added_lines", "removed_lines"], self.filters, evolutionary)
+        if query is not None: return query
+
         # This function contains basic parts of the query to count added and removed lines
         fields = Set([])
         tables = Set([])
@@ -30,6 +30,7 @@ import MySQLdb
 import numpy
 
 from vizgrimoire.GrimoireUtils import completePeriodIds, checkListArray, medianAndAvgByPeriod, check_array_values
+from vizgrimoire.GrimoireUtils import MedianAvgByPeriod, BacklogSweep, genDates
 from vizgrimoire.metrics.query_builder import DSQuery
 
 from vizgrimoire.metrics.metrics import Metrics
@@ -44,6 +45,74 @@ from vizgrimoire.SCR import SCR
 
 from sets import Set
 
+
+def _get_period_ends(mfilter):
+    """ Periods of the time series of mfilter and the date when each
+        period ends
+    """
+    periods = genDates(mfilter.period, mfilter.startdate, mfilter.enddate)
+    if len(periods['unixtime']) == 0: return (periods, [])
+    ends = [datetime.utcfromtimestamp(int(date)) for date in periods['unixtime'][1:]]
+    ends.append(datetime.strptime(mfilter.enddate, "'%Y-%m-%d'"))
+    return (periods, ends)
+
+def _get_reviews_backlog(db, mfilter, dates, include_date = True):
+    """ Reviews pending, and pending for a reviewer, at each date
+
+        Reviews are pending from their submission until they are merged or
+        abandoned, and pending for a reviewer until their last patchset
+        gets a negative review. These events are read once and replayed
+        in a BacklogSweep. For all items queries the backlogs are by item.
+    """
+    all_items = db.get_all_items(mfilter.type_analysis)
+    groups = None
+    if all_items:
+        groups = {}
+        id_field = db.get_group_field_alias(all_items)
+
+    counters = {
+        "pending": lambda issue, state: \
+            bool(state.get("submitted") and not state.get("closed")),
+        "reviewer": lambda issue, state: \
+            bool(state.get("submitted") and not state.get("closed") \
+                 and not state.get("reviewed"))
+    }
+    sweep = BacklogSweep(counters, groups)
+
+    issues = Set([])
+    for chunk in db.ExecuteQueryStream(db.GetReviewsBacklogSQL(mfilter)):
+        for i in range(0, len(chunk['issue_id'])):
+            issue = chunk['issue_id'][i]
+            if issue not in issues:
+                issues.add(issue)
+                sweep.add(chunk['submitted_on'][i], issue, "submitted", True)
+            if groups is not None:
+                issue_groups = groups.setdefault(issue, [])
+                if chunk[id_field][i] not in issue_groups:
+                    issue_groups.append(chunk[id_field][i])
+
+    for chunk in db.ExecuteQueryStream(db.GetReviewsBacklogClosedSQL(mfilter)):
+        for i in range(0, len(chunk['issue_id'])):
+            if chunk['issue_id'][i] not in issues: continue
+            sweep.add(chunk['closed_on'][i], chunk['issue_id'][i], "closed", True)
+
+    patchsets = {}
+    for chunk in db.ExecuteQueryStream(db.GetReviewsBacklogPatchsetsSQL(mfilter)):
+        for i in range(0, len(chunk['issue_id'])):
+            if chunk['issue_id'][i] not in issues: continue
+            if chunk['changed_on'][i] is None: continue
+            patchsets.setdefault(chunk['issue_id'][i], []).append(
+                (chunk['changed_on'][i], chunk['patchset'][i], bool(chunk['reviewed'][i])))
+    # A review is reviewed while its max patchset has a negative review
+    for (issue, issue_patchsets) in patchsets.items():
+        max_patchset = None
+        for (changed_on, patchset, reviewed) in sorted(issue_patchsets):
+            if max_patchset is not None and patchset <= max_patchset: continue
+            max_patchset = patchset
+            sweep.add(changed_on, issue, "reviewed", reviewed)
+
+    return sweep.get_backlog(dates, include_date)
+
 class InitialActivity(Metrics):
     """ For the given dates of activity, this returns the first trace found
     """
@@ -107,6 +176,9 @@ class Submitted(Metrics):
     data_source = SCR
 
     def _get_sql(self, evolutionary):
+        query = self.db.GetSQLCube(["submitted"], self.filters, evolutionary)
+        if query is not None: return query
+
         q = self.db.GetReviewsSQL("submitted", self.filters, evolutionary)
         return q
 
@@ -242,19 +314,22 @@ class Pending(Metrics):
         metric = SCR.get_metrics("submitted", SCR)
         if metric is None:
             metric = Submitted(self.db, self.filters)
-        metric.filters = self.filters
+        else:
+            metric = metric.with_filters(self.filters)
         metrics_for_pendig['submitted'] = metric
 
         metric = SCR.get_metrics("merged", SCR)
         if metric is None:
             metric = Merged(self.db, self.filters)
-        metric.filters = self.filters
+        else:
+            metric = metric.with_filters(self.filters)
         metrics_for_pendig['merged'] = metric
 
         metric = SCR.get_metrics("abandoned", SCR)
         if metric is None:
             metric = Abandoned(self.db, self.filters)
-        metric.filters = self.filters
+        else:
+            metric = metric.with_filters(self.filters)
         metrics_for_pendig['abandoned'] = metric
 
         return metrics_for_pendig
@@ -358,6 +433,22 @@ class Pending(Metrics):
             pending[self.filters.period] = evol[self.filters.period]
         return pending
 
+    def get_ts_backlog(self):
+        """ Reviews pending at the end of each period
+
+            A review is pending from its submission until it is merged
+            or abandoned, as in ReviewsWaitingForReviewerTS.
+        """
+        (pending, ends) = _get_period_ends(self.filters)
+        backlog = _get_reviews_backlog(self.db, self.filters, ends, False)
+        if self.filters.type_analysis and self.filters.type_analysis[1] is None:
+            id_field = SCRQuery.get_group_field_alias(self.filters.type_analysis[0])
+            pending[id_field] = sorted(backlog["pending"].keys())
+            pending["pending"] = [backlog["pending"][item] for item in pending[id_field]]
+        else:
+            pending["pending"] = backlog["pending"]
+        return pending
+
 class Opened(Metrics):
     id = "opened"
     name = "Opened reviews"
@@ -783,6 +874,25 @@ class PatchesWaitingForReviewer(Metrics):
         q = self.db.GetWaiting4ReviewerSQL(self.filters, evolutionary)
         return q
 
+    def get_ts_backlog(self):
+        """ Patches waiting for reviewer at the end of each period
+
+            A patchset of a new review is waiting for reviewer while its
+            last change is a positive review. The changes are read once
+            and replayed in date order.
+        """
+        (waiting, ends) = _get_period_ends(self.filters)
+        counters = {"waiting": lambda patchset, state: bool(state.get("waiting"))}
+        sweep = BacklogSweep(counters)
+        query = self.db.GetWaiting4ReviewerChangesSQL(self.filters)
+        for chunk in self.db.ExecuteQueryStream(query):
+            for i in range(0, len(chunk['id'])):
+                patchset = (chunk['issue_id'][i], chunk['patchset'][i])
+                sweep.add(chunk['changed_on'][i], patchset, "waiting",
+                          bool(chunk['waiting'][i]))
+        waiting["WaitingForReviewer"] = sweep.get_backlog(ends, False)["waiting"]
+        return waiting
+
 class PatchesWaitingForSubmitter(Metrics):
     id = "WaitingForSubmitter"
     name = "Waiting for submitter patches"
@@ -929,6 +1039,42 @@ class ReviewsWaitingForReviewerTS(Metrics):
         return pending
 
     def get_ts(self):
+        """ Backlogs at the end of each month from a single replay of the
+            reviews events. Same results as get_ts_by_month.
+        """
+        start = datetime.strptime(self.filters.startdate, "'%Y-%m-%d'")
+        end = datetime.strptime(self.filters.enddate, "'%Y-%m-%d'")
+
+        if (self.filters.period != "month"):
+            logging.error("Period not supported in " + self.id  + " " + self.filters.period)
+            return {}
+
+        months = range(start.year*12 + start.month, end.year*12 + end.month + 1)
+        dates = [datetime.strptime(self._get_date_from_month(month), "%Y-%m-%d")
+                 for month in months]
+        backlog = _get_reviews_backlog(self.db, self.filters, dates)
+
+        if not (self.filters.type_analysis and self.filters.type_analysis[1] is None):
+            return {"month": months,
+                    "ReviewsWaiting_ts": backlog["pending"],
+                    "ReviewsWaitingForReviewer_ts": backlog["reviewer"]}
+
+        # Items with pending reviews in some month
+        all_items = self.db.get_all_items(self.filters.type_analysis)
+        id_field = self.db.get_group_field(all_items).split('.')[1]
+        items = [item for item in sorted(backlog["pending"].keys())
+                 if max(backlog["pending"][item]) > 0]
+        pending = {"month": months}
+        pending = completePeriodIds(pending, self.filters.period,
+                                    self.filters.startdate, self.filters.enddate)
+        pending["ReviewsWaiting_ts"] = [backlog["pending"][item] for item in items]
+        pending["ReviewsWaitingForReviewer_ts"] = \
+            [backlog["reviewer"].get(item, [0] * len(months)) for item in items]
+        pending[id_field] = items
+        return pending
+
+    def get_ts_by_month(self):
+        """ Backlogs at the end of each month with queries for each month """
 
         if self.filters.type_analysis and self.filters.type_analysis[1] is None:
             # Support for GROUP BY queries
@@ -1223,10 +1369,7 @@ class People(Metrics):
             submitters = EmailsSenders(self.db, self.filters)
             top = submitters._get_top_global(days, metric_filters)
         else:
-            afilters = submitters.filters
-            submitters.filters = self.filters
-            top = submitters._get_top_global(days, metric_filters)
-            submitters.filters = afilters
+            top = submitters.with_filters(self.filters)._get_top_global(days, metric_filters)
 
         top['name'] = top.pop('openers')
         return top
@@ -1636,9 +1779,20 @@ class TimeToReview(Metrics):
         q = self.db.GetTimeToReviewQuerySQL (self.filters, bots)
         return q
 
-    def _get_agg_all(self, data):
+    def _get_median_avg(self, revtimes):
         from numpy import median, average
-        from vizgrimoire.GrimoireUtils import removeDecimals
+
+        # ttr_median = sorted(data)[len(data)//2]
+        if (len(revtimes) == 0):
+            ttr_median = float("nan")
+            ttr_avg = float("nan")
+        else:
+            ttr_median = float(median(revtimes))
+            ttr_avg = float(average(revtimes))
+        return (ttr_median, ttr_avg)
+
+    def _get_agg_all(self, q):
+        from array import array
 
         data_all = {}
 
@@ -1646,91 +1800,82 @@ class TimeToReview(Metrics):
         all_items = self.db.get_all_items(self.filters.type_analysis)
         id_field = self.db.get_group_field_alias(all_items)
 
-        items =  list(Set(data[id_field]))
+        # Review times of each item, as compact arrays of floats
+        items = []
+        items_revtimes = {}
+        for chunk in self.db.ExecuteQueryStream(q):
+            for (item, revtime) in zip(chunk[id_field], chunk['revtime']):
+                if item not in items_revtimes:
+                    items.append(item)
+                    items_revtimes[item] = array('d')
+                items_revtimes[item].append(float(revtime))
+
         data_all[id_field] = items
         for id in ["review_time_days_median", "review_time_days_avg"]:
             data_all[id] = []
 
         for item in items:
-            # First, extract the data for the item
-            data_item = {"changed_on":[],"revtime":[]}
-            for i in range(0,len(data[id_field])):
-                if data[id_field][i] == item:
-                    data_item["changed_on"].append(data["changed_on"][i])
-                    data_item["revtime"].append(data["revtime"][i])
-            data_revtime = data_item['revtime']
-            if (isinstance(data, list) == False): data_revtime = [data_revtime]
-            # ttr_median = sorted(data)[len(data)//2]
-            if (len(data_revtime) == 0):
-                ttr_median = float("nan")
-                ttr_avg = float("nan")
-            else:
-                ttr_median = float(median(removeDecimals(data_revtime)))
-                ttr_avg = float(average(removeDecimals(data_revtime)))
+            (ttr_median, ttr_avg) = self._get_median_avg(items_revtimes[item])
             data_all["review_time_days_median"].append(ttr_median)
             data_all["review_time_days_avg"].append(ttr_avg)
         return data_all
 
     def get_agg(self):
-        from numpy import median, average
-        from vizgrimoire.GrimoireUtils import removeDecimals
+        from array import array
 
         q = self._get_sql()
         if q is None: return {}
-        data = self.db.ExecuteQuery(q)
 
         if self.filters.type_analysis and self.filters.type_analysis[1] is None:
             # Support for GROUP BY queries
-            return self._get_agg_all(data)
+            return self._get_agg_all(q)
 
-        data = data['revtime']
-        if (isinstance(data, list) == False): data = [data]
-        # ttr_median = sorted(data)[len(data)//2]
-        if (len(data) == 0):
-            ttr_median = float("nan")
-            ttr_avg = float("nan")
-        else:
-            ttr_median = float(median(removeDecimals(data)))
-            ttr_avg = float(average(removeDecimals(data)))
+        revtimes = array('d')
+        for chunk in self.db.ExecuteQueryStream(q):
+            revtimes.extend([float(revtime) for revtime in chunk['revtime']])
+
+        (ttr_median, ttr_avg) = self._get_median_avg(revtimes)
         return {"review_time_days_median":ttr_median, "review_time_days_avg":ttr_avg}
 
-    def _get_ts_all(self, data):
-        from numpy import median, average
-        from vizgrimoire.GrimoireUtils import removeDecimals
+    def _get_metrics_list(self, med_avg_list):
+        metrics_list = {}
+        if (med_avg_list != None):
+            metrics_list['review_time_days_median'] = med_avg_list['median']
+            metrics_list['review_time_days_avg'] = med_avg_list['avg']
+            metrics_list['month'] = med_avg_list['month']
+        else:
+            metrics_list['review_time_days_median'] = []
+            metrics_list['review_time_days_avg'] = []
+            metrics_list['month'] = []
+
+        metrics_list = completePeriodIds(metrics_list, self.filters.period,
+                                         self.filters.startdate, self.filters.enddate)
+        return metrics_list
 
+    def _get_ts_all(self, q):
         data_all = {}
 
         # First, we need to group by the filter field the data
         all_items = self.db.get_all_items(self.filters.type_analysis)
         id_field = self.db.get_group_field_alias(all_items)
 
-        items =  list(Set(data[id_field]))
+        # Only the review times of the current period are kept for each item
+        items = []
+        items_stats = {}
+        for chunk in self.db.ExecuteQueryStream(q):
+            for (item, changed_on, revtime) in zip(chunk[id_field], chunk['changed_on'],
+                                                   chunk['revtime']):
+                if item not in items_stats:
+                    items.append(item)
+                    items_stats[item] = MedianAvgByPeriod(self.filters.period)
+                items_stats[item].add(changed_on, float(revtime))
+
         data_all[id_field] = items
         for id in ["review_time_days_median", "review_time_days_avg"]:
             data_all[id] = []
 
         for item in items:
-            # First, extract the data for the item
-            data_item = {"changed_on":[],"revtime":[]}
-            for i in range(0,len(data[id_field])):
-                if data[id_field][i] == item:
-                    data_item["changed_on"].append(data["changed_on"][i])
-                    data_item["revtime"].append(data["revtime"][i])
-
-            med_avg_list = medianAndAvgByPeriod(self.filters.period,
-                                                data_item['changed_on'], data_item['revtime'])
-            metrics_list = {}
-            if (med_avg_list != None):
-                metrics_list['review_time_days_median'] = med_avg_list['median']
-                metrics_list['review_time_days_avg'] = med_avg_list['avg']
-                metrics_list['month'] = med_avg_list['month']
-            else:
-                metrics_list['review_time_days_median'] = []
-                metrics_list['review_time_days_avg'] = []
-                metrics_list['month'] = []
-
-            metrics_list = completePeriodIds(metrics_list, self.filters.period,
-                                             self.filters.startdate, self.filters.enddate)
+            metrics_list = self._get_metrics_list(items_stats[item].get_result())
 
             data_all['review_time_days_median'].append(metrics_list['review_time_days_median'])
             data_all['review_time_days_avg'].append(metrics_list['review_time_days_avg'])
@@ -1743,28 +1888,17 @@ class TimeToReview(Metrics):
     def get_ts(self):
         q = self._get_sql()
         if q is None: return {}
-        review_list = self.db.ExecuteQuery(q)
-        checkListArray(review_list)
 
         if self.filters.type_analysis and self.filters.type_analysis[1] is None:
             # Support for GROUP BY queries
-            return self._get_ts_all(review_list)
+            return self._get_ts_all(q)
 
-        metrics_list = {}
-        med_avg_list = medianAndAvgByPeriod(self.filters.period, review_list['changed_on'], review_list['revtime'])
-        if (med_avg_list != None):
-            metrics_list['review_time_days_median'] = med_avg_list['median']
-            metrics_list['review_time_days_avg'] = med_avg_list['avg']
-            metrics_list['month'] = med_avg_list['month']
-        else:
-            metrics_list['review_time_days_median'] = []
-            metrics_list['review_time_days_avg'] = []
-            metrics_list['month'] = []
-
-        metrics_list = completePeriodIds(metrics_list, self.filters.period,
-                          self.filters.startdate, self.filters.enddate)
+        stats = MedianAvgByPeriod(self.filters.period)
+        for chunk in self.db.ExecuteQueryStream(q):
+            for (changed_on, revtime) in zip(chunk['changed_on'], chunk['revtime']):
+                stats.add(changed_on, float(revtime))
 
-        return metrics_list
+        return self._get_metrics_list(stats.get_result())
 
 
 class TimeToReviewPatch(Metrics):
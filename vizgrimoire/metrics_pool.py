@@ -0,0 +1,106 @@
+## Copyright (C) 2015 Bitergia
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+##
+## This file is a part of GrimoireLib
+##  (an Python library for the MetricsGrimoire and vizGrimoire systems)
+##
+
+""" Pool of threads to run the queries of the metrics of a data source """
+
+import os
+
+from multiprocessing.pool import ThreadPool
+
+from vizgrimoire.query_profile import QueryProfile
+
+
+class MetricsPool(object):
+    """ Run independent metric calls of a data source in worker threads.
+
+        MySQLdb releases the GIL while waiting for the server, so the
+        queries of the calls run concurrently. Each worker thread opens its
+        own db connections, one per database, kept for the next calls.
+        Results are returned in the calls order. The first exception of a
+        call is raised in the calling thread.
+
+        Calls running at the same time must not use the same metric object,
+        because its filters are changed during the call.
+    """
+
+    jobs = 1 # number of worker threads
+
+    _pool = None
+    _pool_jobs = None
+    _pid = None # process owning the pool threads
+
+    @staticmethod
+    def set_jobs(jobs):
+        MetricsPool.jobs = jobs
+
+    @staticmethod
+    def get_jobs():
+        return MetricsPool.jobs
+
+    @staticmethod
+    def reset():
+        """ Stop the worker threads, releasing their connections """
+        if MetricsPool._pool is not None and MetricsPool._pid == os.getpid():
+            MetricsPool._pool.close()
+            MetricsPool._pool.join()
+        MetricsPool._pool = None
+
+    @staticmethod
+    def _init_worker():
+        from vizgrimoire.metrics.query_builder import DSQuery
+        DSQuery.use_thread_connections()
+
+    @staticmethod
+    def _get_pool(jobs):
+        # Threads are not copied in forked processes, so the workers of
+        # the data sources and items create their own pool
+        if (MetricsPool._pool is None or MetricsPool._pid != os.getpid() or
+            MetricsPool._pool_jobs != jobs):
+            MetricsPool.reset()
+            MetricsPool._pool = ThreadPool(processes=jobs,
+                                           initializer=MetricsPool._init_worker)
+            MetricsPool._pool_jobs = jobs
+            MetricsPool._pid = os.getpid()
+        return MetricsPool._pool
+
+    @staticmethod
+    def map(calls, data_source = None, jobs = None):
+        """ Results of calls, functions without arguments
+
+            data_source is the DataSource class of the calls, used to
+            assign their queries in the query profile.
+        """
+        from vizgrimoire.metrics.query_builder import DSQuery
+        if jobs is None: jobs = MetricsPool.jobs
+        if jobs <= 1 or len(calls) <= 1 or DSQuery.uses_thread_connections():
+            # Calls from the workers waiting for the pool could block it
+            return [call() for call in calls]
+        pool = MetricsPool._get_pool(jobs)
+        return pool.map(_run_call, [(call, data_source) for call in calls],
+                        chunksize=1)
+
+
+def _run_call(task):
+    (call, data_source) = task
+    QueryProfile.set_data_source(data_source)
+    try:
+        return call()
+    finally:
+        QueryProfile.set_data_source(None)
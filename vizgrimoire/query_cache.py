@@ -0,0 +1,205 @@
+## Copyright (C) 2015 Bitergia
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+##
+## This file is a part of GrimoireLib
+##  (an Python library for the MetricsGrimoire and vizGrimoire systems)
+##
+
+""" Persistent on disk cache for the results of the SQL queries.
+
+    Entries are addressed by the database name and the normalized SQL text.
+    Each entry stores the watermarks of the databases used by the query
+    when it was executed, so it is only served while those databases
+    have not received new data. Queries using tables whose changes can
+    not be detected are not cached.
+"""
+
+import cPickle
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+import zlib
+
+
+class QueryCache(object):
+    """ Content addressed cache for ExecuteQuery results """
+
+    # Monotonic columns used to detect new data in the databases, with
+    # the total rows to detect the removed ones. Tables not found in a
+    # database are ignored.
+    watermarks = {
+        "scmlog" : "id",
+        "actions" : "id",
+        "commits_lines" : "id",
+        "issues" : "id",
+        "changes" : "id",
+        "messages" : "arrival_date",
+        "irclog" : "id",
+        "identities" : "last_modified",
+        "enrollments" : "id"
+    }
+
+    # Tables updated in place, checksummed to detect their changes
+    checksums = ["people_uidentities", "enrollments"]
+
+    # Results depending on the time of the execution can not be cached
+    _volatile = re.compile("NOW\(|CURDATE\(|CURTIME\(|SYSDATE\(|RAND\(|UNIX_TIMESTAMP\(\)",
+                           re.IGNORECASE)
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self._databases = set([])
+        self._db_watermarks = {}
+        # entries are read and written from the MetricsPool threads
+        self._lock = threading.Lock()
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    @staticmethod
+    def normalize(sql):
+        """ Remove formatting differences from the sql text """
+        return " ".join(sql.split())
+
+    def register(self, database):
+        """ Database that can be referenced from queries as database.table """
+        if database is not None:
+            self._databases.add(database)
+
+    def is_cacheable(self, sql):
+        sql = QueryCache.normalize(sql)
+        if not sql.upper().startswith("SELECT"): return False
+        if self._volatile.search(sql) is not None: return False
+        return True
+
+    def invalidate(self, database = None):
+        """ Force watermarks to be read again, i.e. after modifying data """
+        if database is None:
+            self._db_watermarks = {}
+        elif database in self._db_watermarks:
+            self._db_watermarks.pop(database)
+
+    def _get_key(self, database, sql):
+        return hashlib.sha1(str(database) + "\n" + QueryCache.normalize(sql)).hexdigest()
+
+    def _get_path(self, key):
+        return os.path.join(self.cache_dir, key[0:2], key)
+
+    def _get_db_watermark(self, cursor, database):
+        """ Watermark for a database and its tables whose changes can not
+            be detected, read only once per run """
+        if database in self._db_watermarks:
+            return self._db_watermarks[database]
+
+        watermark = []
+        unknown = []
+        q = """
+            SELECT table_name, update_time FROM information_schema.tables
+            WHERE table_schema = '%s' ORDER BY table_name
+            """ % (database)
+        cursor.execute(q)
+        tables = cursor.fetchall()
+        for (table, update_time) in tables:
+            watermark.append((table, str(update_time)))
+            # update_time is not available for InnoDB tables in MySQL 5.x
+            if update_time is None and table not in QueryCache.watermarks and \
+                table not in QueryCache.checksums:
+                unknown.append(table)
+        for (table, update_time) in tables:
+            if table not in QueryCache.watermarks: continue
+            q = "SELECT COUNT(*), MAX(%s) FROM %s.%s" % (QueryCache.watermarks[table],
+                                                          database, table)
+            cursor.execute(q)
+            (total, last) = cursor.fetchone()
+            watermark.append((table, str(total), str(last)))
+        checksums = [database + "." + table for (table, update_time) in tables
+                     if table in QueryCache.checksums]
+        if len(checksums) > 0:
+            cursor.execute("CHECKSUM TABLE " + ", ".join(checksums))
+            for (table, checksum) in cursor.fetchall():
+                watermark.append((table, str(checksum)))
+
+        self._db_watermarks[database] = (tuple(watermark), unknown)
+        return self._db_watermarks[database]
+
+    def _get_signature(self, cursor, database, sql):
+        """ Watermarks of all databases used in sql, None if sql uses
+            tables whose changes can not be detected """
+        databases = set([database])
+        for db in self._databases:
+            if db + "." in sql: databases.add(db)
+        signature = []
+        for db in sorted(databases):
+            (watermark, unknown) = self._get_db_watermark(cursor, db)
+            for table in unknown:
+                if re.search(r"\b" + re.escape(table) + r"\b", sql): return None
+            signature.append((db, watermark))
+        return tuple(signature)
+
+    def get(self, cursor, database, sql):
+        """ Returns the cached result for sql or None if not available """
+        if not self.is_cacheable(sql):
+            return None
+
+        signature = self._get_signature(cursor, database, sql)
+        if signature is None: return None
+        path = self._get_path(self._get_key(database, sql))
+        result = None
+        if os.path.isfile(path):
+            try:
+                f = open(path, 'rb')
+                (stored, data) = cPickle.loads(zlib.decompress(f.read()))
+                f.close()
+                if stored == signature: result = data
+            except Exception, e:
+                logging.warning("Wrong query cache entry " + path + ": " + str(e))
+
+        self._lock.acquire()
+        if result is None: self.misses += 1
+        else: self.hits += 1
+        self._lock.release()
+        return result
+
+    def put(self, cursor, database, sql, result):
+        """ Store the result for sql """
+        if not self.is_cacheable(sql):
+            # Data could be modified by the query
+            self.invalidate()
+            return
+
+        signature = self._get_signature(cursor, database, sql)
+        if signature is None: return
+        path = self._get_path(self._get_key(database, sql))
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError:
+            # Already created, maybe from other thread
+            if not os.path.isdir(os.path.dirname(path)): raise
+        data = zlib.compress(cPickle.dumps((signature, result),
+                                           cPickle.HIGHEST_PROTOCOL))
+        # Write and rename so readers never get a partial entry
+        (fd, tmp_path) = tempfile.mkstemp(dir=os.path.dirname(path))
+        f = os.fdopen(fd, 'wb')
+        f.write(data)
+        f.close()
+        os.rename(tmp_path, path)
+
+    def get_stats(self):
+        return {"hits": self.hits, "misses": self.misses}
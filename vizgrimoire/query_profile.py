@@ -0,0 +1,241 @@
+## Copyright (C) 2015 Bitergia
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+##
+## This file is a part of GrimoireLib
+##  (an Python library for the MetricsGrimoire and vizGrimoire systems)
+##
+
+""" Profile of the SQL queries executed during a report.
+
+    Each statement is recorded with the metric or study class that
+    executed it, the type_analysis of its filters, the elapsed time, the
+    number of rows and a fingerprint of the SQL text, which is the same
+    for queries that differ only in their literal values.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import threading
+
+
+class QueryProfile(object):
+    """ Statistics of the queries executed with DSQuery """
+
+    _strings = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"")
+    _numbers = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+    _lists = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+    # Frames inspected to find the caller of a query
+    max_depth = 30
+    # Modules executing the queries, never the caller
+    _skip_files = ["query_profile.py", "query_builder.py", "GrimoireSQL.py"]
+    # data source of the calls run in each MetricsPool thread
+    _local = threading.local()
+
+    def __init__(self, explain_threshold = None):
+        # seconds above which EXPLAIN is captured, once per fingerprint
+        self.explain_threshold = explain_threshold
+        # (fingerprint, data source, class, type_analysis) -> stats
+        self._stats = {}
+        self._samples = {}
+        self._explains = {}
+        # queries are recorded from the MetricsPool threads
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def fingerprint(sql):
+        """ sql text with the literals replaced and normalized whitespace """
+        sql = QueryProfile._strings.sub("?", sql)
+        sql = QueryProfile._numbers.sub("?", sql)
+        sql = " ".join(sql.split())
+        return QueryProfile._lists.sub("(?+)", sql)
+
+    @staticmethod
+    def get_fingerprint_id(fingerprint):
+        return hashlib.md5(fingerprint).hexdigest()[0:16]
+
+    @staticmethod
+    def set_data_source(data_source):
+        """ DataSource class of the queries run from this thread when it
+            is not found in the stack, None to remove it """
+        QueryProfile._local.data_source = data_source
+
+    @staticmethod
+    def get_caller():
+        """ (class, type_analysis, data source) of the metric or study
+            running the query. The class is module:function if the query
+            is not executed from a metric or study. """
+        name = type_analysis = ds_name = None
+        function = None
+        frame = sys._getframe(1)
+        depth = 0
+        while frame is not None and depth < QueryProfile.max_depth:
+            code = frame.f_code
+            if (function is None and
+                os.path.basename(code.co_filename) not in QueryProfile._skip_files):
+                module = frame.f_globals.get("__name__", "")
+                function = module + ":" + code.co_name
+            f_locals = frame.f_locals
+            obj = f_locals.get("self")
+            if name is None and hasattr(obj, "filters") and hasattr(obj, "db"):
+                name = obj.__class__.__name__
+                if obj.filters is not None:
+                    type_analysis = obj.filters.type_analysis
+                data_source = getattr(obj, "data_source", None)
+                if data_source is not None:
+                    ds_name = data_source.get_name()
+            cls = f_locals.get("cls")
+            if ds_name is None and hasattr(cls, "get_name"):
+                try:
+                    ds_name = cls.get_name()
+                except TypeError:
+                    pass
+            if name is not None and ds_name is not None: break
+            frame = frame.f_back
+            depth += 1
+        data_source = getattr(QueryProfile._local, "data_source", None)
+        if ds_name is None and data_source is not None:
+            ds_name = data_source.get_name()
+        if name is None: name = function
+        if type_analysis is not None:
+            type_analysis = ",".join([unicode(value) for value in type_analysis])
+        return (name, type_analysis, ds_name)
+
+    def record(self, cursor, database, sql, elapsed, rows, cached = False):
+        """ Register the execution of sql in database """
+        (name, type_analysis, ds_name) = QueryProfile.get_caller()
+        if ds_name is None: ds_name = database
+        fingerprint = QueryProfile.fingerprint(sql)
+        key = (fingerprint, ds_name, name, type_analysis)
+        explain = False
+        self._lock.acquire()
+        try:
+            if key not in self._stats:
+                self._stats[key] = {"count": 0, "cached": 0, "time": 0.0,
+                                    "max_time": 0.0, "rows": 0}
+            stats = self._stats[key]
+            stats["count"] += 1
+            if cached: stats["cached"] += 1
+            stats["time"] += elapsed
+            stats["max_time"] = max(stats["max_time"], elapsed)
+            stats["rows"] += rows
+            if fingerprint not in self._samples:
+                self._samples[fingerprint] = sql
+
+            if (self.explain_threshold is not None and not cached and
+                elapsed >= self.explain_threshold and
+                fingerprint not in self._explains):
+                self._explains[fingerprint] = None
+                explain = True
+        finally:
+            self._lock.release()
+
+        if explain:
+            self._explains[fingerprint] = self._explain(cursor, sql)
+
+    def _explain(self, cursor, sql):
+        if not sql.strip().upper().startswith("SELECT"): return None
+        try:
+            cursor.execute("EXPLAIN " + sql)
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        except Exception, e:
+            logging.warning("Can not explain query: " + str(e))
+            return None
+
+    def reset(self):
+        self._stats = {}
+        self._samples = {}
+        self._explains = {}
+
+    def get_data(self):
+        """ Raw statistics, to be merged in other profile """
+        return (self._stats, self._samples, self._explains)
+
+    def merge(self, data):
+        """ Add the statistics from get_data() of other profile """
+        (stats, samples, explains) = data
+        for (key, other) in stats.items():
+            if key not in self._stats:
+                self._stats[key] = dict(other)
+                continue
+            current = self._stats[key]
+            for field in ["count", "cached", "time", "rows"]:
+                current[field] += other[field]
+            current["max_time"] = max(current["max_time"], other["max_time"])
+        for (fingerprint, sql) in samples.items():
+            self._samples.setdefault(fingerprint, sql)
+        for (fingerprint, explain) in explains.items():
+            self._explains.setdefault(fingerprint, explain)
+
+    @staticmethod
+    def _add(total, stats):
+        for field in ["count", "cached", "time", "rows"]:
+            total[field] = total.get(field, 0) + stats[field]
+        total["max_time"] = max(total.get("max_time", 0.0), stats["max_time"])
+
+    @staticmethod
+    def _sorted(groups):
+        return sorted(groups.values(), key=lambda group: -group["time"])
+
+    def get_report(self):
+        """ Statistics by fingerprint, data source and class, sorted by time """
+        by_fingerprint = {}
+        by_data_source = {}
+        by_class = {}
+        total = {}
+        for ((fingerprint, ds_name, name, type_analysis), stats) in self._stats.items():
+            if fingerprint not in by_fingerprint:
+                by_fingerprint[fingerprint] = {
+                    "id": QueryProfile.get_fingerprint_id(fingerprint),
+                    "fingerprint": fingerprint,
+                    "sample": self._samples.get(fingerprint),
+                    "explain": self._explains.get(fingerprint),
+                    "data_sources": [], "classes": [], "type_analysis": []
+                }
+            group = by_fingerprint[fingerprint]
+            QueryProfile._add(group, stats)
+            for (field, value) in [("data_sources", ds_name), ("classes", name),
+                                   ("type_analysis", type_analysis)]:
+                if value not in group[field]: group[field].append(value)
+
+            if ds_name not in by_data_source:
+                by_data_source[ds_name] = {"data_source": ds_name, "fingerprints": 0}
+            QueryProfile._add(by_data_source[ds_name], stats)
+            if name not in by_class:
+                by_class[name] = {"class": name, "data_source": ds_name}
+            QueryProfile._add(by_class[name], stats)
+            QueryProfile._add(total, stats)
+
+        for fingerprint in by_fingerprint.values():
+            for ds_name in fingerprint["data_sources"]:
+                by_data_source[ds_name]["fingerprints"] += 1
+
+        return {"total": total,
+                "by_fingerprint": QueryProfile._sorted(by_fingerprint),
+                "by_data_source": QueryProfile._sorted(by_data_source),
+                "by_class": QueryProfile._sorted(by_class)}
+
+    def write(self, path):
+        """ Write the report to path in JSON format """
+        f = open(path, "w")
+        f.write(json.dumps(self.get_report(), indent=1, sort_keys=True,
+                           default=str))
+        f.close()
@@ -19,7 +19,7 @@
 ##   Alvaro del Castillo <acs@bitergia.com>
 
 
-from vizgrimoire.GrimoireSQL import SetDBChannel
+from vizgrimoire.GrimoireSQL import SetDBChannel, ResetDBChannel
 from vizgrimoire.GrimoireUtils import read_main_conf
 import logging, time, sys
 import vizgrimoire.SCM as SCM
@@ -268,6 +268,15 @@ class Report(object):
         dbpassword = Report._automator['generic']['db_password']
         SetDBChannel (database=db, user=dbuser, password=dbpassword)
 
+    @staticmethod
+    def reconnect():
+        """ Open new db connections for all metrics, i.e. in a worker process """
+        ResetDBChannel()
+        DSQuery.reset_db_conn_pool()
+        for ds in Report._all_data_sources:
+            for metrics in ds.get_metrics_set(ds):
+                if metrics.db is not None: metrics.db.reconnect()
+
     @staticmethod
     def get_data_sources():
 
@@ -0,0 +1,106 @@
+## Copyright (C) 2015 Bitergia
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+##
+## This file is a part of GrimoireLib
+##  (an Python library for the MetricsGrimoire and vizGrimoire systems)
+##
+
+""" Columnar results for the SQL queries """
+
+import numpy
+
+
+class ResultFrame(object):
+    """ Query result with a numpy array for each column
+
+        Arrays are typed using the column types from the cursor
+        description. Columns with NULL values or without an integer or
+        float type, DECIMAL included, are object arrays. The classic dict
+        of lists is available with tolist() and frame[column] returns the
+        column as a list. Lists are created only when used.
+    """
+
+    # MySQL field types: FLOAT, DOUBLE
+    _float_types = [4, 5]
+    # MySQL field types: TINY, SHORT, LONG, LONGLONG, INT24, YEAR
+    _int_types = [1, 2, 3, 8, 9, 13]
+
+    def __init__(self, columns, arrays):
+        self.columns = columns
+        self._arrays = arrays
+        self._lists = {}
+
+    @staticmethod
+    def _get_dtype(type_code):
+        if type_code in ResultFrame._int_types: return numpy.int64
+        if type_code in ResultFrame._float_types: return numpy.float64
+        return object
+
+    @staticmethod
+    def _get_array(rows, index, dtype):
+        nrows = len(rows)
+        if dtype is not object:
+            try:
+                return numpy.fromiter((row[index] for row in rows), dtype, nrows)
+            except (TypeError, ValueError, OverflowError):
+                # NULL values or unsigned BIGINT values out of range
+                pass
+        array = numpy.empty(nrows, dtype=object)
+        array[:] = [row[index] for row in rows]
+        return array
+
+    @staticmethod
+    def from_rows(description, rows):
+        """ Frame for the rows fetched from a cursor with description """
+        columns = []
+        arrays = {}
+        for (index, column) in enumerate(description):
+            name = column[0]
+            columns.append(name)
+            arrays[name] = ResultFrame._get_array(rows, index,
+                                                  ResultFrame._get_dtype(column[1]))
+        return ResultFrame(columns, arrays)
+
+    def __len__(self):
+        if len(self.columns) == 0: return 0
+        return len(self._arrays[self.columns[0]])
+
+    def __contains__(self, column):
+        return column in self._arrays
+
+    def __getitem__(self, column):
+        if column not in self._lists:
+            self._lists[column] = self._arrays[column].tolist()
+        return self._lists[column]
+
+    def keys(self):
+        return list(self.columns)
+
+    def array(self, column):
+        return self._arrays[column]
+
+    def select(self, columns):
+        """ Frame with only columns, sharing the arrays """
+        return ResultFrame(list(columns),
+                           dict([(column, self._arrays[column]) for column in columns]))
+
+    def tolist(self):
+        """ Dict of lists, as returned by ExecuteQuery """
+        result = {}
+        for column in self.columns:
+            if len(self) == 1: result[column] = self[column][0]
+            else: result[column] = list(self[column])
+        return result
@@ -0,0 +1,184 @@
+## Copyright (C) 2015 Bitergia
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+##
+## This file is a part of GrimoireLib
+##  (an Python library for the MetricsGrimoire and vizGrimoire systems)
+##
+
+""" Python profile of the stages of a report.
+
+    For each stage the profiler writes in its directory:
+
+    - stage.pstats: cProfile stats, to be read with the pstats module.
+    - stage.collapsed: stacks sampled every interval seconds of CPU time,
+      one "frame;frame;frame count" line per stack, the input format
+      of flamegraph.pl.
+
+    and adds a row to stages-memory.tsv with the wall and CPU time, the
+    peak RSS of the process during the stage and its increase over the
+    RSS at the start of the stage. CPU time is spent in Python, so the
+    difference with the wall time is mostly the time waiting for the
+    database.
+
+    The current RSS is read from /proc/self/statm at the start and end of
+    the stages and in each stack sample, so peaks shorter than the
+    sampling interval can be missed. Without /proc the max RSS of
+    getrusage is used: it is the peak of the whole process, so a stage
+    only shows a peak higher than the ones of the previous stages.
+"""
+
+import cProfile
+import logging
+import os
+import re
+import resource
+import signal
+import time
+
+
+class StageProfiler(object):
+    """ cProfile, stack sampling and memory of report stages """
+
+    memory_file = "stages-memory.tsv"
+    _columns = ["stage", "wall_s", "cpu_s", "samples", "max_rss_mb", "rss_increase_mb"]
+    _page_size = resource.getpagesize()
+
+    def __init__(self, profile_dir, interval = 0.005):
+        self.profile_dir = profile_dir
+        self.interval = interval
+        # Stages being profiled, the last one is the running one
+        self._stages = []
+        if not os.path.isdir(profile_dir):
+            os.makedirs(profile_dir)
+        f = open(self._get_memory_path(), "w")
+        f.write("\t".join(StageProfiler._columns) + "\n")
+        f.close()
+
+    def _get_memory_path(self):
+        return os.path.join(self.profile_dir, StageProfiler.memory_file)
+
+    def _get_path(self, name, extension):
+        name = re.sub("[^\w.+-]", "_", name)
+        return os.path.join(self.profile_dir, name + "." + extension)
+
+    @staticmethod
+    def _get_cpu_time():
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_utime + usage.ru_stime
+
+    @staticmethod
+    def _get_rss():
+        """ Current RSS in KB """
+        try:
+            # Opened each time, the stages can run in forked processes
+            f = open("/proc/self/statm")
+            resident = int(f.read().split()[1])
+            f.close()
+            return resident * StageProfiler._page_size / 1024
+        except (IOError, IndexError, ValueError):
+            # Max RSS of the process, KB in Linux
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    def _update_peak(self):
+        rss = StageProfiler._get_rss()
+        # Running stages, nested ones included
+        for stage in self._stages:
+            stage["peak"] = max(stage["peak"], rss)
+
+    @staticmethod
+    def _get_stack(frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append("%s:%s" % (os.path.basename(code.co_filename), code.co_name))
+            frame = frame.f_back
+        stack.reverse()
+        return ";".join(stack)
+
+    def _sample(self, signum, frame):
+        if len(self._stages) == 0: return
+        stacks = self._stages[-1]["stacks"]
+        stack = StageProfiler._get_stack(frame)
+        stacks[stack] = stacks.get(stack, 0) + 1
+        self._update_peak()
+
+    def _start_sampler(self):
+        signal.signal(signal.SIGPROF, self._sample)
+        # Do not interrupt the system calls, i.e. reading from MySQL
+        signal.siginterrupt(signal.SIGPROF, False)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def _stop_sampler(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+
+    def run(self, name, function, *args):
+        """ Run function(*args) as the stage name, returning its result
+
+            Stages can be nested. The stats of a nested stage are not
+            included in the files of the stage running it.
+        """
+        if len(self._stages) == 0:
+            self._start_sampler()
+        else:
+            self._stages[-1]["profile"].disable()
+
+        rss = StageProfiler._get_rss()
+        stage = {"name": name, "profile": cProfile.Profile(), "stacks": {},
+                 "start": time.time(), "cpu": StageProfiler._get_cpu_time(),
+                 "rss": rss, "peak": rss}
+        self._stages.append(stage)
+        stage["profile"].enable()
+        try:
+            return function(*args)
+        finally:
+            stage["profile"].disable()
+            self._update_peak()
+            self._stages.pop()
+            if len(self._stages) == 0:
+                self._stop_sampler()
+            else:
+                self._stages[-1]["profile"].enable()
+            self._write_stage(stage)
+
+    def _write_stage(self, stage):
+        wall = time.time() - stage["start"]
+        cpu = StageProfiler._get_cpu_time() - stage["cpu"]
+        rss = stage["peak"]
+        stage["profile"].dump_stats(self._get_path(stage["name"], "pstats"))
+
+        f = open(self._get_path(stage["name"], "collapsed"), "w")
+        for (stack, count) in sorted(stage["stacks"].items()):
+            f.write("%s %i\n" % (stack, count))
+        f.close()
+
+        row = [stage["name"], "%.2f" % wall, "%.2f" % cpu,
+               str(sum(stage["stacks"].values())),
+               "%.1f" % (rss / 1024.0), "%.1f" % ((rss - stage["rss"]) / 1024.0)]
+        # Single write in append mode, stages can end in several processes
+        f = open(self._get_memory_path(), "a")
+        f.write("\t".join(row) + "\n")
+        f.close()
+        logging.info("Profile %s: %.2f s wall, %.2f s cpu, %.1f MB peak RSS" %
+                     (stage["name"], wall, cpu, rss / 1024.0))
+
+    def read_memory_table(self):
+        """ Rows of the memory table as dicts """
+        f = open(self._get_memory_path())
+        lines = f.read().splitlines()
+        f.close()
+        columns = lines[0].split("\t")
+        return [dict(zip(columns, line.split("\t"))) for line in lines[1:]]